@@ -419,9 +419,13 @@ def acl():
     table.oacl.represent = lambda val: acl_represent(val,
                                                      auth.permission.PERMISSION_OPTS)
 
+    # Users must not keep their permissions until the cache expires
+    clear_cache = lambda *args: auth.permission.clear_cache()
     s3mgr.configure(tablename,
         create_next = URL(r=request),
-        update_next = URL(r=request))
+        update_next = URL(r=request),
+        onaccept = clear_cache,
+        ondelete = clear_cache)
 
     if "_next" in request.vars:
         next = request.vars._next
@@ -518,54 +518,28 @@ def location_duplicates():
     # @ToDo: Set this via the UI & pass in as a var
     dupe_distance = 50 # km
 
-    # Shortcut
-    locations = s3db.gis_location
-
     table_header = THEAD(TR(TH(T("Location 1")),
                             TH(T("Location 2")),
                             TH(T("Distance(Kms)")),
                             TH(T("Resolve"))))
 
-    # Calculate max possible combinations of records
-    # To handle the AJAX requests by the dataTables jQuery plugin.
-    totalLocations = db(locations.id > 0).count()
-
     item_list = []
     if request.vars.iDisplayStart:
-        end = int(request.vars.iDisplayLength) + int(request.vars.iDisplayStart)
-        locations = db((locations.id > 0) & \
-                       (locations.deleted == False) & \
-                       (locations.lat != None) & \
-                       (locations.lon != None)).select(locations.id,
-                                                       locations.name,
-                                                       locations.level,
-                                                       locations.lat,
-                                                       locations.lon)
-        # Calculate the Great Circle distance
-        count = 0
-        for oneLocation in locations[:len(locations) / 2]:
-            for anotherLocation in locations[len(locations) / 2:]:
-                if count > end and request.vars.max != "undefined":
-                    count = int(request.vars.max)
-                    break
-                if oneLocation.id == anotherLocation.id:
-                    continue
-                else:
-                    dist = gis.greatCircleDistance(oneLocation.lat,
-                                                   oneLocation.lon,
-                                                   anotherLocation.lat,
-                                                   anotherLocation.lon)
-                    if dist < dupe_distance:
-                        count = count + 1
-                        item_list.append([oneLocation.name,
-                                          anotherLocation.name,
-                                          dist,
-                                          "<a href=\"../gis/location_resolve?locID1=%i&locID2=%i\", class=\"action-btn\">Resolve</a>" % (oneLocation.id, anotherLocation.id)
-                                         ])
-                    else:
-                        continue
+        start = int(request.vars.iDisplayStart)
+        limit = int(request.vars.iDisplayLength)
+
+        # Candidate pairs from the location grid (cached until the
+        # locations get modified)
+        count, pairs = gis.get_location_duplicates(distance=dupe_distance,
+                                                   start=start,
+                                                   limit=limit)
+        for id1, name1, id2, name2, dist in pairs:
+            item_list.append([name1,
+                              name2,
+                              dist,
+                              "<a href=\"../gis/location_resolve?locID1=%i&locID2=%i\", class=\"action-btn\">Resolve</a>" % (id1, id2)
+                             ])
 
-        item_list = item_list[int(request.vars.iDisplayStart):end]
         # Convert data to JSON
         result  = []
         result.append({
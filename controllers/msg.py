@@ -153,7 +153,7 @@ def tropo():
             #t.message(say_obj={"say":{"value":row.message}},to=row.recipient,network=row.network)
             t.call(to=row.recipient, network=row.network)
             t.say(row.message)
-            # Update status to sent in Outbox
+            # Update status to sent in Outbox (from handed over)
             outbox = s3db.msg_outbox
             db(outbox.id == row.row_id).update(status=2)
             # Set message log to actioned
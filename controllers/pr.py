@@ -453,131 +453,42 @@ def person_duplicates():
 
     """ Handle De-duplication of People
 
-        @todo: permissions, audit, update super entity, PEP8, optimization?
+        @todo: permissions, audit, update super entity, PEP8
         @todo: check for component data!
         @todo: user accounts, subscriptions?
     """
 
-    # Shortcut
-    persons = s3db.pr_person
-
     table_header = THEAD(TR(TH(T("Person 1")),
                             TH(T("Person 2")),
                             TH(T("Match Percentage")),
                             TH(T("Resolve"))))
 
-    # Calculate max possible combinations of records
-    # To handle the AJAX requests by the dataTables jQuery plugin.
-    totalRecords = db(persons.id > 0).count()
-
     item_list = []
     if request.vars.iDisplayStart:
-        end = int(request.vars.iDisplayLength) + int(request.vars.iDisplayStart)
-        records = db((persons.id > 0) & \
-                     (persons.deleted == False) & \
-                     (persons.first_name != None)).select(persons.id,         # Should this be persons.ALL?
-                                                          persons.pe_label,
-                                                          persons.missing,
-                                                          persons.first_name,
-                                                          persons.middle_name,
-                                                          persons.last_name,
-                                                          persons.preferred_name,
-                                                          persons.local_name,
-                                                          persons.age_group,
-                                                          persons.gender,
-                                                          persons.date_of_birth,
-                                                          persons.nationality,
-                                                          persons.country,
-                                                          persons.religion,
-                                                          persons.marital_status,
-                                                          persons.occupation,
-                                                          persons.tags,
-                                                          persons.comments)
-
-        # Calculate the match percentage using Jaro wrinkler Algorithm
-        count = 1
-        i = 0
-        for onePerson in records: #[:len(records)/2]:
-            soundex1= soundex(onePerson.first_name)
-            array1 = []
-            array1.append(onePerson.pe_label)
-            array1.append(str(onePerson.missing))
-            array1.append(onePerson.first_name)
-            array1.append(onePerson.middle_name)
-            array1.append(onePerson.last_name)
-            array1.append(onePerson.preferred_name)
-            array1.append(onePerson.local_name)
-            array1.append(pr_age_group_opts.get(onePerson.age_group, T("None")))
-            array1.append(pr_gender_opts.get(onePerson.gender, T("None")))
-            array1.append(str(onePerson.date_of_birth))
-            array1.append(pr_nations.get(onePerson.nationality, T("None")))
-            array1.append(pr_nations.get(onePerson.country, T("None")))
-            array1.append(pr_religion_opts.get(onePerson.religion, T("None")))
-            array1.append(pr_marital_status_opts.get(onePerson.marital_status, T("None")))
-            array1.append(onePerson.occupation)
-
-            # Format tags into an array
-            if onePerson.tags != None:
-                tagname = []
-                for item in onePerson.tags:
-                    tagname.append(pr_impact_tags.get(item, T("None")))
-                array1.append(tagname)
+        start = int(request.vars.iDisplayStart)
+        limit = int(request.vars.iDisplayLength)
+
+        # Candidate pairs from the person matcher
+        matcher = s3db.pr_person_matcher()
+        count, pairs = matcher.pairs(start=start, limit=limit)
+
+        # Names of the persons in this page
+        person_ids = set()
+        for person_id1, person_id2, mpercent in pairs:
+            person_ids.add(person_id1)
+            person_ids.add(person_id2)
+        if person_ids:
+            names = s3base.s3_fullname(list(person_ids))
+        else:
+            names = {}
+
+        for person_id1, person_id2, mpercent in pairs:
+            item_list.append([names.get(person_id1, ""),
+                              names.get(person_id2, ""),
+                              mpercent,
+                              "<a href=\"../pr/person_resolve?perID1=%i&perID2=%i\", class=\"action-btn\">Resolve</a>" % (person_id1, person_id2)
+                             ])
 
-            else:
-                array1.append(onePerson.tags)
-
-            array1.append(onePerson.comments)
-            i = i + 1
-            j = 0
-            for anotherPerson in records: #[len(records)/2:]:
-                soundex2 = soundex(anotherPerson.first_name)
-                if j >= i:
-                    array2 =[]
-                    array2.append(anotherPerson.pe_label)
-                    array2.append(str(anotherPerson.missing))
-                    array2.append(anotherPerson.first_name)
-                    array2.append(anotherPerson.middle_name)
-                    array2.append(anotherPerson.last_name)
-                    array2.append(anotherPerson.preferred_name)
-                    array2.append(anotherPerson.local_name)
-                    array2.append(pr_age_group_opts.get(anotherPerson.age_group, T("None")))
-                    array2.append(pr_gender_opts.get(anotherPerson.gender, T("None")))
-                    array2.append(str(anotherPerson.date_of_birth))
-                    array2.append(pr_nations.get(anotherPerson.nationality, T("None")))
-                    array2.append(pr_nations.get(anotherPerson.country, T("None")))
-                    array2.append(pr_religion_opts.get(anotherPerson.religion, T("None")))
-                    array2.append(pr_marital_status_opts.get(anotherPerson.marital_status, T("None")))
-                    array2.append(anotherPerson.occupation)
-
-                    # Format tags into an array
-                    if anotherPerson.tags != None:
-                        tagname = []
-                        for item in anotherPerson.tags:
-                            tagname.append(pr_impact_tags.get(item, T("None")))
-                        array2.append(tagname)
-                    else:
-                        array2.append(anotherPerson.tags)
-
-                    array2.append(anotherPerson.comments)
-                    if count > end and request.vars.max != "undefined":
-                        count = int(request.vars.max)
-                        break;
-                    if onePerson.id == anotherPerson.id:
-                        continue
-                    else:
-                        mpercent = jaro_winkler_distance_row(array1, array2)
-                        # Pick all records with match percentage is >50 or whose soundex values of first name are equal
-                        if int(mpercent) > 50 or (soundex1 == soundex2):
-                            count = count + 1
-                            item_list.append([onePerson.first_name,
-                                              anotherPerson.first_name,
-                                              mpercent,
-                                              "<a href=\"../pr/person_resolve?perID1=%i&perID2=%i\", class=\"action-btn\">Resolve</a>" % (onePerson.id, anotherPerson.id)
-                                             ])
-                        else:
-                            continue
-                j = j + 1
-        item_list = item_list[int(request.vars.iDisplayStart):end]
         # Convert data to JSON
         result  = []
         result.append({
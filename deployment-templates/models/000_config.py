@@ -100,6 +100,15 @@ deployment_settings.base.migrate = True
 # In Production, prepopulate = 0 (to save 1x DAL hit every page)
 deployment_settings.base.prepopulate = 1
 
+# Set this to True to commit prepopulate and CSV imports in bulk mode
+# (batch inserts on PostgreSQL, onaccept deferred until after each batch)
+# NB Duplicates within the same batch are only detected by UID
+#deployment_settings.base.bulk_import = True
+
+# Number of records per page when streaming native XML/JSON exports
+# (without XSLT), 0 to build the complete element tree in memory instead
+#deployment_settings.base.xml_export_page_size = 500
+
 # Set this to True to use Content Delivery Networks to speed up Internet-facing sites
 deployment_settings.base.cdn = False
 
@@ -125,6 +134,14 @@ deployment_settings.mail.sender = "'Sahana' <sahana@your.org>"
 deployment_settings.mail.approver = "useradmin@your.org"
 # Daily Limit on Sending of emails
 #deployment_settings.mail.limit = 1000
+# Uncomment to send the messages from the Outbox with several threads per
+# contact method, optionally with a maximum number of messages per second
+#deployment_settings.msg.dispatch_workers = {"EMAIL": 4, "SMS": 2}
+#deployment_settings.msg.dispatch_rate = {"SMS": 5}
+# Retries for messages which could not be sent, and seconds to wait before
+# the first retry (doubled for each further retry)
+#deployment_settings.msg.dispatch_retries = 2
+#deployment_settings.msg.dispatch_backoff = 1.0
 
 #Enable session store in Memcache
 #deployment_settings.base.session_memcache = '127.0.0.1:11211'
@@ -237,6 +254,15 @@ deployment_settings.gis.display_L0 = False
 #deployment_settings.gis.duplicate_features = True
 # Mouse Position: 'normal', 'mgrs' or 'off'
 #deployment_settings.gis.mouse_position = "mgrs"
+# Feature Layers with more features than cluster_threshold in the map viewport
+# are sent as grid clusters below cluster_zoom (None to disable)
+#deployment_settings.gis.cluster_zoom = 8
+#deployment_settings.gis.cluster_threshold = 500
+# Cache the output of Feature Layers on disk (in cache/layers) until the data change
+#deployment_settings.gis.layer_cache = True
+# Treat imported locations with a similar name within this distance (in km)
+# as duplicates (only matched by name otherwise)
+#deployment_settings.gis.import_duplicate_distance = 1
 # Print Service URL: http://eden.sahanafoundation.org/wiki/BluePrintGISPrinting
 #deployment_settings.gis.print_service = "/geoserver/pdf/"
 # Do we have a spatial DB available? (currently supports PostGIS. Spatialite to come.)
@@ -298,6 +324,9 @@ deployment_settings.gis.display_L0 = False
 # NB Auditing (especially Reads) slows system down & consumes diskspace
 #deployment_settings.security.audit_write = False
 #deployment_settings.security.audit_read = False
+# Share ACLs and realms across requests
+# - with multiple server processes, this requires base.session_memcache
+#deployment_settings.security.acl_cache = True
 
 # UI/Workflow options
 # Should user be prompted to save before navigating away?
@@ -307,6 +336,12 @@ deployment_settings.gis.display_L0 = False
 # Should potentially large dropdowns be turned into autocompletes?
 # (unused currently)
 #deployment_settings.ui.autocomplete = True
+# Use an in-memory name index for the location, organisation and person
+# autocompletes rather than LIKE queries (for large databases)
+#deployment_settings.ui.autocomplete_index = True
+# Cache the option labels for the list filter of foreign keys which can not
+# be searched in the referenced table (time in seconds)
+#deployment_settings.ui.ssp_label_cache = 300
 #deployment_settings.ui.update_label = "Edit"
 # Enable this for a UN-style deployment
 #deployment_settings.ui.cluster = True
@@ -404,6 +439,11 @@ deployment_settings.gis.display_L0 = False
 # Set the length of the auto-generated org/site code the default is 10
 #deployment_settings.org.site_code_len = 3
 
+# Person Registry
+# Uncomment to also match people by similarity (name, date of birth etc.)
+# during imports, with a minimum match percentage
+#deployment_settings.pr.import_match_threshold = 90
+
 # Human Resource Management
 # Uncomment to allow Staff & Volunteers to be registered without an email address
 #deployment_settings.hrm.email_required = False
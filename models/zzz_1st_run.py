@@ -67,6 +67,12 @@ if len(pop_list) > 0:
     field = "last_name"
     db.executesql("CREATE INDEX %s__idx on %s(%s);" % (field, tablename, field))
 
+    # Messaging
+    tablename = "msg_name_key"
+    table = s3db[tablename]
+    field = "phonetic_key"
+    db.executesql("CREATE INDEX %s__idx on %s(tablename, %s);" % (field, tablename, field))
+
     # Synchronisation
     table = db.sync_config
     if not db(table.id > 0).select(table.id, limitby=(0, 1)).first():
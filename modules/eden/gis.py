@@ -402,7 +402,15 @@ class S3LocationModel(S3Model):
 
         # Update the Path
         vars = form.vars
-        current.gis.update_location_tree(vars.id, vars.parent)
+        gis = current.gis
+        gis.update_location_tree(vars.id, vars.parent)
+
+        # Rebuild the spatial index with the next lookup, and add the
+        # location to the location grid
+        gis.update_spatial_index(vars.id)
+
+        # Update the autocomplete name index
+        S3NameIndex.update("gis_location", vars.id)
         return
 
     # -------------------------------------------------------------------------
@@ -682,6 +690,9 @@ class S3LocationModel(S3Model):
            - Else, Look for a record with the same name, ignoring case
                 and, if level exists in the import, the same level
                 and, if parent exists in the import, the same parent
+           - Else, if lat/lon are present in the import and
+             deployment_settings.gis.import_duplicate_distance is set,
+                Look for a record with a similar name within that distance
         """
 
         db = current.db
@@ -731,6 +742,19 @@ class S3LocationModel(S3Model):
 
             _duplicate = db(query).select(table.id,
                                           limitby=(0, 1)).first()
+            if not _duplicate:
+                # Try the nearby locations
+                distance = current.deployment_settings \
+                                  .get_gis_import_duplicate_distance()
+                lat = job.data.get("lat", None)
+                lon = job.data.get("lon", None)
+                if distance and lat is not None and lon is not None:
+                    location_id = current.gis.get_location_duplicate(name,
+                                                                     lat,
+                                                                     lon,
+                                                                     distance=distance)
+                    if location_id:
+                        _duplicate = Storage(id=location_id)
             if _duplicate:
                 job.id = _duplicate.id
                 job.data.id = _duplicate.id
@@ -390,6 +390,7 @@ class HospitalDataModel(S3Model):
         # Resource configuration
         configure(tablename,
                   super_entity=("org_site", "doc_entity", "pr_pentity"),
+                  onaccept=self.hms_hospital_onaccept,
                   search_method=hms_hospital_search,
                   list_fields=["id",
                                "gov_uuid",
@@ -861,6 +862,13 @@ class HospitalDataModel(S3Model):
 
         return Storage(hms_hospital_id=hospital_id)
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def hms_hospital_onaccept(form):
+        """ Updates the phonetic name keys of a hospital """
+
+        current.msg.update_name_keys("hms_hospital", form.vars.id)
+
     # -------------------------------------------------------------------------
     @staticmethod
     def hms_bed_capacity_onvalidation(form):
@@ -30,6 +30,7 @@
 __all__ = ["S3MessagingModel",
            "S3CAPModel",
            "S3InboundEmailModel",
+           "S3NameKeyModel",
            "S3SMSModel",
            "S3SubscriptionModel",
            "S3TropoModel",
@@ -169,7 +170,10 @@ class S3MessagingModel(S3Model):
             1:T("Unsent"),
             2:T("Sent"),
             3:T("Draft"),
-            4:T("Invalid")
+            4:T("Invalid"),
+            5:T("Sending"),
+            6:T("Failed"),
+            7:T("Handed over"),
             }
 
         opt_msg_status = S3ReusableField("status", "integer",
@@ -198,6 +202,13 @@ class S3MessagingModel(S3Model):
                                   opt_msg_status(),
                                   Field("system_generated", "boolean", default = False),
                                   Field("log"),
+                                  # The dispatcher sending the message (see S3MsgDispatcher)
+                                  Field("claimed_by", length=64,
+                                        readable=False,
+                                        writable=False),
+                                  Field("claimed_on", "datetime",
+                                        readable=False,
+                                        writable=False),
                                   *s3.meta_fields())
 
         self.configure(tablename,
@@ -258,6 +269,29 @@ class S3MessagingModel(S3Model):
         else:
             return "%s..." % text[:76]
 
+# =============================================================================
+class S3NameKeyModel(S3Model):
+    """
+        Phonetic keys of person, organisation and hospital names, for
+        the lookup of names in inbound messages (see S3Msg.parse_message)
+    """
+
+    names = ["msg_name_key"]
+
+    def model(self):
+
+        # ---------------------------------------------------------------------
+        # Maintained by S3Msg.update_name_keys, indexed by zzz_1st_run
+        tablename = "msg_name_key"
+        table = self.define_table(tablename,
+                                  Field("tablename", length=64),
+                                  Field("record_id", "integer"),
+                                  Field("phonetic_key", length=16),
+                                  )
+
+        # ---------------------------------------------------------------------
+        return Storage()
+
 # =============================================================================
 class S3CAPModel(S3Model):
     """
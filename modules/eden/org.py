@@ -565,8 +565,13 @@ class S3OrganisationModel(S3Model):
     def org_organisation_onaccept(form):
         """
             If a logo was uploaded then create the extra versions.
+            Update the autocomplete name index and the phonetic name keys.
         """
 
+        organisation_id = form.vars.id
+        S3NameIndex.update("org_organisation", organisation_id)
+        current.msg.update_name_keys("org_organisation", organisation_id)
+
         newfilename = form.vars.logo_newfilename
         if newfilename:
             s3db = current.s3db
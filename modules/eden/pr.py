@@ -48,6 +48,8 @@ __all__ = ["S3PersonEntity",
            "pr_image_represent",
            "pr_url_represent",
            "pr_rheader",
+           # Duplicate Detection
+           "pr_person_matcher",
            # Custom Resource Methods
            "pr_contacts",
            "pr_profile",
@@ -72,9 +74,11 @@ __all__ = ["S3PersonEntity",
            "pr_get_descendants",
            "pr_ancestors",
            "pr_descendants",
+           "pr_affiliation_closure",
            # Internal Path Tools
            "pr_rebuild_path",
            "pr_role_rebuild_path",
+           "pr_update_affiliation_closure",
            # Helpers for ImageLibrary
            "pr_image_modify",
            "pr_image_resize",
@@ -83,6 +87,9 @@ __all__ = ["S3PersonEntity",
 
 import re
 import os
+import threading
+
+from datetime import timedelta
 
 import gluon.contrib.simplejson as json
 
@@ -97,6 +104,19 @@ from eden.layouts import S3AddResourceLink
 OU = 1 # role type which indicates hierarchy, see role_types
 OTHER_ROLE = 9
 
+# Process-wide OU hierarchy (see pr_affiliation_closure)
+OU_CLOSURE = Storage(version=None,
+                     parents=None,
+                     children=None,
+                     persons=None,
+                     descendants=None)
+# Guards OU_CLOSURE against concurrent requests
+OU_CLOSURE_LOCK = threading.RLock()
+
+# Process-wide person matcher (see pr_person_matcher)
+PERSON_MATCHER = None
+PERSON_MATCHER_LOCK = threading.Lock()
+
 # =============================================================================
 class S3PersonEntity(S3Model):
     """ Person Super-Entity """
@@ -753,6 +773,7 @@ class S3PersonModel(S3Model):
                                       (T("Organization"), "hrm_human_resource:organisation_id$name")
                                      ],
                        onvalidation=self.pr_person_onvalidation,
+                       onaccept=self.pr_person_onaccept,
                        search_method=pr_person_search,
                        deduplicate=self.person_deduplicate,
                        main="first_name",
@@ -848,6 +869,23 @@ class S3PersonModel(S3Model):
 
         return True
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def pr_person_onaccept(form):
+        """
+            Onaccept callback: update the autocomplete name index, the
+            phonetic name keys and the person matcher
+        """
+
+        person_id = form.vars.id
+        S3NameIndex.update("pr_person", person_id)
+        current.msg.update_name_keys("pr_person", person_id)
+
+        matcher = PERSON_MATCHER
+        if matcher is not None and person_id:
+            matcher.update(person_id)
+        return
+
     # -------------------------------------------------------------------------
     @staticmethod
     def person_deduplicate(item):
@@ -914,6 +952,16 @@ class S3PersonModel(S3Model):
             # Look for details on the database
             _duplicate = db(query).select(ptable.id,
                                           limitby=(0, 1)).first()
+            if not _duplicate and fname:
+                # Try matching by similarity
+                threshold = current.deployment_settings \
+                                   .get_pr_import_match_threshold()
+                if threshold:
+                    # No need to score the pairs for every import item
+                    match = pr_person_matcher(score=False).match(item.data,
+                                                                 threshold=threshold)
+                    if match:
+                        _duplicate = Storage(id=match[0])
             if _duplicate:
                 item.id = _duplicate.id
                 item.data.id = _duplicate.id
@@ -3364,6 +3412,460 @@ def pr_profile(r, **attr):
             form = form,
         )
 
+# =============================================================================
+# Duplicate Detection
+# =============================================================================
+#
+class S3PersonMatcher(object):
+    """
+        Person matching engine for duplicate detection
+
+        Records are only compared with other records in the same blocks
+        (soundex of the last name with the first initial or the year of
+        birth, soundex of the first name with the year of birth), using
+        field vectors which are computed once per record. Changed records
+        are loaded onaccept or with the next sync, and re-scored
+        incrementally when the pairs are needed (not for imports, which
+        only need match()).
+
+        Imports call match() while onaccept loads the changed records into
+        the same matcher, so sync, update, match and pairs hold the lock to
+        keep the vectors and scores consistent.
+    """
+
+    # Name fields (compared by Jaro-Winkler similarity)
+    NAMES = ("first_name",
+             "middle_name",
+             "last_name",
+             "preferred_name",
+             "local_name",
+             )
+
+    # Other fields (compared by equality, ignored if unknown)
+    ATTRIBUTES = ("pe_label",
+                  "date_of_birth",
+                  "gender",
+                  "age_group",
+                  "nationality",
+                  "country",
+                  )
+
+    # Option values representing "unknown"
+    UNKNOWN = {"gender": 1,
+               "age_group": 1,
+               }
+
+    THRESHOLD = 50      # minimum match percentage for duplicates
+    MAX_BLOCK = 1000    # larger blocks are too generic to compare
+    BATCH_SIZE = 10000  # records per query when loading
+    SYNC_OVERLAP = 300  # seconds overlap of delta syncs
+
+    def __init__(self, threshold=None):
+        """
+            Constructor
+
+            @param threshold: the minimum match percentage for duplicates
+        """
+
+        if threshold is None:
+            threshold = self.THRESHOLD
+        self.threshold = threshold
+
+        # {person_id: vector}
+        self.vectors = {}
+        # {block key: set of person_ids}
+        self.blocks = {}
+        # {(person_id, person_id): match percentage}
+        self.matches = {}
+        # {person_id: set of person_ids in matches}
+        self.partners = {}
+        self.ranking = None
+
+        # {person_id: modified_on} of the loaded records
+        self.modified = {}
+        # Loaded records which have not been scored yet
+        self.unscored = set()
+
+        self.version = None
+        self.synced = None
+
+        self._lock = threading.Lock()
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def get_version():
+        """
+            Get the current version of the person registry
+
+            @returns: tuple of row count and last modification date
+        """
+
+        return s3_table_version(current.s3db.pr_person)
+
+    # -------------------------------------------------------------------------
+    def sync(self, score=True):
+        """
+            Load all person records, or the records changed since the
+            last sync, and score the changed records
+
+            @param score: score the changed records (can be skipped
+                          if only match() is needed, e.g. for imports)
+        """
+
+        with self._lock:
+            version = self.get_version()
+            if version != self.version:
+                table = current.s3db.pr_person
+                synced = current.request.utcnow
+                if self.synced is None or version[0] < self.version[0]:
+                    # Initial load, or records have been removed => reload
+                    self.vectors = {}
+                    self.blocks = {}
+                    self.matches = {}
+                    self.partners = {}
+                    self.modified = {}
+                    self.unscored = set()
+                    self.ranking = None
+                    query = (table.deleted != True)
+                else:
+                    since = self.synced - timedelta(seconds=self.SYNC_OVERLAP)
+                    query = (table.modified_on >= since)
+
+                self.unscored.update(self.load(query))
+                self.version = version
+                self.synced = synced
+
+            if score and self.unscored:
+                self.score(self.unscored)
+                self.unscored = set()
+        return
+
+    # -------------------------------------------------------------------------
+    def update(self, person_id):
+        """
+            Load a record which has been created or updated by this
+            request, to be called onaccept. If other records have also
+            been changed, then they are left to the next sync instead.
+
+            @param person_id: the person record ID
+        """
+
+        with self._lock:
+            if self.synced is None:
+                # Not loaded yet
+                return
+            table = current.s3db.pr_person
+            version = self.get_version()
+            if version == self.version or \
+               not s3_table_changed_only(table, self.version, version,
+                                         lambda row: row.id == person_id):
+                return
+
+            self.unscored.update(self.load(table.id == person_id))
+            self.version = version
+        return
+
+    # -------------------------------------------------------------------------
+    def load(self, query):
+        """
+            Load the person records matching a query, skipping those
+            which have not changed since they have been loaded (e.g.
+            in the overlap of delta syncs)
+
+            @param query: the query
+            @returns: list of the IDs of the changed records
+        """
+
+        db = current.db
+        table = current.s3db.pr_person
+
+        fields = [table.id, table.deleted, table.modified_on] + \
+                 [table[f] for f in self.NAMES + self.ATTRIBUTES]
+
+        modified = self.modified
+        changed = []
+        last = 0
+        while True:
+            rows = db(query & (table.id > last)).select(orderby=table.id,
+                                                        limitby=(0, self.BATCH_SIZE),
+                                                        *fields)
+            for row in rows:
+                person_id = row.id
+                modified_on = row.modified_on
+                if modified_on is not None and \
+                   modified.get(person_id) == modified_on:
+                    continue
+                modified[person_id] = modified_on
+                self.remove(person_id)
+                if not row.deleted:
+                    self.add(person_id, self.vector(row))
+                changed.append(person_id)
+            if len(rows) < self.BATCH_SIZE:
+                break
+            last = rows.last().id
+        return changed
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def vector(cls, record):
+        """
+            Compute the field vector of a record
+
+            @param record: the record (Row or dict)
+            @returns: tuple (names, attributes, block keys)
+        """
+
+        def normalize(value):
+            if not value:
+                return None
+            if not isinstance(value, unicode):
+                value = unicode(str(value), "utf-8", "ignore")
+            return value.lower().strip() or None
+
+        names = tuple([normalize(record.get(f)) for f in cls.NAMES])
+
+        attributes = []
+        for f in cls.ATTRIBUTES:
+            value = record.get(f)
+            if f == "pe_label":
+                value = normalize(value)
+            elif value == cls.UNKNOWN.get(f, None):
+                value = None
+            attributes.append(value)
+        attributes = tuple(attributes)
+
+        # Block keys
+        first, last = names[0], names[2]
+        dob = attributes[1]
+        year = dob and hasattr(dob, "year") and dob.year or None
+        keys = []
+        if last:
+            lkey = cls.soundex(last)
+            keys.append(("L", lkey, first and first[0] or None))
+            if year:
+                keys.append(("Y", lkey, year))
+        if first:
+            fkey = cls.soundex(first)
+            if year:
+                keys.append(("F", fkey, year))
+            if not last:
+                keys.append(("F", fkey, None))
+
+        return (names, attributes, tuple(keys))
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def soundex(name):
+        """
+            Soundex of a name, ignoring non-ASCII characters
+
+            @param name: the name (unicode)
+        """
+
+        value = name.encode("ascii", "ignore")
+        if not re.search("[A-Za-z]", value):
+            # Soundex not applicable
+            return name[:4]
+        return soundex(value)
+
+    # -------------------------------------------------------------------------
+    def add(self, person_id, vector):
+        """
+            Add a record to the blocks
+
+            @param person_id: the person record ID
+            @param vector: the field vector of the record
+        """
+
+        self.vectors[person_id] = vector
+        blocks = self.blocks
+        for key in vector[2]:
+            if key not in blocks:
+                blocks[key] = set()
+            blocks[key].add(person_id)
+        return
+
+    # -------------------------------------------------------------------------
+    def remove(self, person_id):
+        """
+            Remove a record from the blocks
+
+            @param person_id: the person record ID
+        """
+
+        vector = self.vectors.pop(person_id, None)
+        if vector is None:
+            return
+        blocks = self.blocks
+        for key in vector[2]:
+            block = blocks.get(key)
+            if block is not None:
+                block.discard(person_id)
+                if not block:
+                    del blocks[key]
+        return
+
+    # -------------------------------------------------------------------------
+    def candidates(self, vector):
+        """
+            Find all records in the same blocks as a field vector
+
+            @param vector: the field vector
+            @returns: set of person record IDs
+        """
+
+        result = set()
+        blocks = self.blocks
+        for key in vector[2]:
+            block = blocks.get(key)
+            if block and len(block) <= self.MAX_BLOCK:
+                result |= block
+        return result
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def compare(vector1, vector2):
+        """
+            Compare two field vectors
+
+            @returns: the match percentage (0..100)
+        """
+
+        total = 0.0
+        count = 0
+        for name1, name2 in zip(vector1[0], vector2[0]):
+            if name1 or name2:
+                total += s3_jaro_winkler(name1, name2)
+                count += 1
+        for value1, value2 in zip(vector1[1], vector2[1]):
+            if value1 is not None and value2 is not None:
+                if value1 == value2:
+                    total += 1
+                count += 1
+        if not count:
+            return 0.0
+        return total / count * 100
+
+    # -------------------------------------------------------------------------
+    def score(self, person_ids):
+        """
+            (Re-)score the records with the given IDs against all
+            candidates
+
+            @param person_ids: list of person record IDs
+        """
+
+        if not person_ids:
+            return
+
+        matches = self.matches
+        partners = self.partners
+        vectors = self.vectors
+        threshold = self.threshold
+        compare = self.compare
+
+        # Drop the previous matches of the records
+        person_ids = set(person_ids)
+        for person_id in person_ids:
+            for other in partners.pop(person_id, ()):
+                matches.pop((min(person_id, other), max(person_id, other)), None)
+                if other not in person_ids:
+                    partners[other].discard(person_id)
+
+        for person_id in person_ids:
+            vector = vectors.get(person_id)
+            if vector is None:
+                continue
+            for candidate in self.candidates(vector):
+                if candidate == person_id or \
+                   candidate in person_ids and candidate < person_id:
+                    # Same record, or pair scored from the other side
+                    continue
+                pair = (min(person_id, candidate), max(person_id, candidate))
+                if pair in matches:
+                    continue
+                percent = compare(vector, vectors[candidate])
+                if percent >= threshold:
+                    matches[pair] = percent
+                    for a, b in (pair, pair[::-1]):
+                        if a not in partners:
+                            partners[a] = set()
+                        partners[a].add(b)
+
+        self.ranking = None
+        return
+
+    # -------------------------------------------------------------------------
+    def pairs(self, start=0, limit=None):
+        """
+            Get the duplicate candidates, best matches first
+
+            @param start: index of the first pair to return
+            @param limit: maximum number of pairs to return
+
+            @returns: tuple (total number of pairs,
+                             list of tuples (person_id, person_id, percent))
+        """
+
+        with self._lock:
+            ranking = self.ranking
+            if ranking is None:
+                ranking = [(pair[0], pair[1], percent)
+                           for pair, percent in self.matches.items()]
+                ranking.sort(key=lambda item: (-item[2], item[0], item[1]))
+                self.ranking = ranking
+        if limit is None:
+            return (len(ranking), ranking[start:])
+        else:
+            return (len(ranking), ranking[start:start + limit])
+
+    # -------------------------------------------------------------------------
+    def match(self, record, threshold=None):
+        """
+            Find the best match for a (new) record
+
+            @param record: the record data (dict)
+            @param threshold: the minimum match percentage
+
+            @returns: tuple (person_id, percent), or None if no record
+                      matches
+        """
+
+        if threshold is None:
+            threshold = self.threshold
+
+        vector = self.vector(record)
+        compare = self.compare
+
+        best = None
+        with self._lock:
+            vectors = self.vectors
+            for candidate in self.candidates(vector):
+                if candidate == record.get("id"):
+                    continue
+                percent = compare(vector, vectors[candidate])
+                if percent >= threshold and (best is None or percent > best[1]):
+                    best = (candidate, percent)
+        return best
+
+# =============================================================================
+def pr_person_matcher(score=True):
+    """
+        Get the (synchronized) person matcher for this process
+
+        @param score: score the changed records (not needed for match())
+        @returns: the S3PersonMatcher
+    """
+
+    global PERSON_MATCHER
+
+    with PERSON_MATCHER_LOCK:
+        matcher = PERSON_MATCHER
+        if matcher is None:
+            matcher = PERSON_MATCHER = S3PersonMatcher()
+    matcher.sync(score=score)
+    return matcher
+
 # =============================================================================
 # Hierarchy Manipulation
 # =============================================================================
@@ -4306,62 +4808,137 @@ def pr_ancestors(entities):
 # =============================================================================
 def pr_descendants(pe_ids, skip=[]):
     """
-    """
+        Find all descendant entities (except persons) of the given
+        entities in the OU hierarchy (performs a closure lookup)
 
-    db = current.db
-    s3db = current.s3db
+        @param pe_ids: list of person entity IDs
+        @param skip: list of person entity IDs to skip
+
+        @returns: Storage {pe_id: [descendant PE-IDs]} for all entities
+                  which have descendants
+    """
 
     pe_ids = [i for i in pe_ids if i not in skip]
     if not pe_ids:
         return []
 
-    etable = s3db.pr_pentity
-    rtable = s3db.pr_role
-    atable = s3db.pr_affiliation
+    with OU_CLOSURE_LOCK:
+        return _pr_descendants(pr_affiliation_closure(), pe_ids)
 
-    query = (rtable.deleted != True) & \
-            (rtable.pe_id.belongs(pe_ids)) & \
-            (rtable.role_type == OU) & \
-            (atable.role_id == rtable.id) & \
-            (atable.deleted != True) & \
-            (etable.pe_id == atable.pe_id)
+# -----------------------------------------------------------------------------
+def _pr_descendants(closure, pe_ids):
+    """ Closure lookup for pr_descendants, call with OU_CLOSURE_LOCK """
 
-    rows = db(query).select(rtable.pe_id,
-                            atable.pe_id,
-                            etable.instance_type)
-    r = rtable._tablename
-    e = etable._tablename
-    a = atable._tablename
+    descendants = closure.descendants
+    children = closure.children
+    persons = closure.persons
 
-    nodes = []
     result = Storage()
-    for row in rows:
-        parent = row[r].pe_id
-        child = row[a].pe_id
-        if row[e].instance_type != "pr_person":
-            if parent not in result:
-                result[parent] = [child]
-            else:
-                result[parent].append(child)
-        if child not in nodes:
-            nodes.append(child)
-
-    skip = skip + pe_ids
-    descendants = pr_descendants(nodes, skip=skip)
-
-    for child in descendants:
-        for parent in result:
-            if child in result[parent]:
-                for node in descendants[child]:
-                    if node not in result[parent]:
-                        result[parent].append(node)
-    for x in result:
-        for y in result:
-            if x in result[y]:
-                result[y].extend([i for i in result[x] if i not in result[y] and i != y])
+    for pe_id in pe_ids:
+        pe_id = long(pe_id)
+        if pe_id not in descendants:
+            # Walk down the hierarchy, excluding persons (and their
+            # subtrees) as well as the entity itself (for circular
+            # affiliations)
+            nodes = set()
+            queue = [pe_id]
+            while queue:
+                node = queue.pop()
+                for child in children.get(node, ()):
+                    if child in persons or \
+                       child in nodes or child == pe_id:
+                        continue
+                    nodes.add(child)
+                    queue.append(child)
+            descendants[pe_id] = list(nodes)
+        if descendants[pe_id]:
+            result[pe_id] = list(descendants[pe_id])
 
     return result
 
+# =============================================================================
+def pr_affiliation_closure():
+    """
+        Get the OU hierarchy of all person entities. This is kept per
+        process, and rebuilt (with a single query) if the affiliations
+        or roles have been changed by another process.
+
+        @returns: Storage with
+                  - parents: {pe_id: set of parent pe_ids}
+                  - children: {pe_id: set of child pe_ids}
+                  - persons: set of pe_ids of persons
+                  - descendants: {pe_id: list of descendant pe_ids}, filled
+                    in lazily by pr_descendants
+
+        @note: the closure gets updated in place, so callers must hold
+               OU_CLOSURE_LOCK while using it
+    """
+
+    with OU_CLOSURE_LOCK:
+        return _pr_affiliation_closure()
+
+# -----------------------------------------------------------------------------
+def _pr_affiliation_closure():
+    """ Load the OU hierarchy if needed, call with OU_CLOSURE_LOCK """
+
+    closure = OU_CLOSURE
+    version = pr_affiliation_version()
+    if closure.version != version or closure.parents is None:
+
+        db = current.db
+        s3db = current.s3db
+
+        etable = s3db.pr_pentity
+        rtable = s3db.pr_role
+        atable = s3db.pr_affiliation
+
+        query = (rtable.deleted != True) & \
+                (rtable.role_type == OU) & \
+                (atable.role_id == rtable.id) & \
+                (atable.deleted != True) & \
+                (etable.pe_id == atable.pe_id)
+        rows = db(query).select(rtable.pe_id,
+                                atable.pe_id,
+                                etable.instance_type)
+        r = rtable._tablename
+        a = atable._tablename
+        e = etable._tablename
+
+        parents = {}
+        children = {}
+        persons = set()
+        for row in rows:
+            parent = row[r].pe_id
+            child = row[a].pe_id
+            if child not in parents:
+                parents[child] = set()
+            parents[child].add(parent)
+            if parent not in children:
+                children[parent] = set()
+            children[parent].add(child)
+            if row[e].instance_type == "pr_person":
+                persons.add(child)
+
+        closure.update(version=version,
+                       parents=parents,
+                       children=children,
+                       persons=persons,
+                       descendants={})
+    return closure
+
+# =============================================================================
+def pr_affiliation_version():
+    """
+        Get the current version of the OU hierarchy
+
+        @returns: tuple of row counts and last modification dates of
+                  pr_affiliation and pr_role
+    """
+
+    s3db = current.s3db
+    return s3_table_version(s3db.pr_affiliation) + \
+           s3_table_version(s3db.pr_role)
+
 # =============================================================================
 def pr_get_descendants(pe_ids, skip=[], entity_type=None, ids=True):
     """
@@ -4446,6 +5023,120 @@ def pr_rebuild_path(pe_id, clear=False):
     for role in roles:
         if role.path is None:
             pr_role_rebuild_path(role, clear=clear)
+
+    # Update the OU hierarchy
+    pr_update_affiliation_closure(pe_id)
+
+    # Realms depend on the hierarchy
+    auth = current.auth
+    if auth is not None:
+        auth.permission.clear_cache()
+    return
+
+# =============================================================================
+def pr_update_affiliation_closure(pe_id):
+    """
+        Update the OU hierarchy after the affiliations of a person entity
+        have changed, called from pr_rebuild_path. If the hierarchy has
+        been changed for other entities too since it has been loaded (e.g.
+        by another process), it gets reloaded completely instead.
+
+        @param pe_id: the person entity ID
+    """
+
+    with OU_CLOSURE_LOCK:
+        closure = OU_CLOSURE
+        if closure.parents is None:
+            # Not loaded yet
+            return
+        pe_id = long(pe_id)
+        version = pr_affiliation_version()
+        if not pr_affiliation_changed_only(closure.version, version, pe_id):
+            # Force a full reload
+            closure.version = None
+            return
+        _pr_update_affiliation_closure(closure, pe_id)
+        closure.version = version
+    return
+
+# =============================================================================
+def pr_affiliation_changed_only(old_version, new_version, pe_id):
+    """
+        Check whether all changes of the OU hierarchy between two versions
+        concern the affiliations of one person entity
+
+        @param old_version: the version of the loaded hierarchy
+        @param new_version: the current version
+        @param pe_id: the person entity ID
+    """
+
+    if old_version is None:
+        return False
+    if old_version[2:] != new_version[2:]:
+        # Roles have been changed
+        return False
+
+    def explained(row):
+        affiliate = row.pe_id
+        if affiliate is None and row.deleted_fk:
+            # Removed affiliation
+            affiliate = json.loads(row.deleted_fk).get("pe_id")
+        return affiliate is not None and long(affiliate) == pe_id
+
+    atable = current.s3db.pr_affiliation
+    return s3_table_changed_only(atable,
+                                 old_version[:2],
+                                 new_version[:2],
+                                 explained,
+                                 fields=[atable.pe_id, atable.deleted_fk])
+
+# =============================================================================
+def _pr_update_affiliation_closure(closure, pe_id):
+    """
+        Replace the parents of a person entity in the OU hierarchy,
+        call with OU_CLOSURE_LOCK
+
+        @param closure: the OU hierarchy
+        @param pe_id: the person entity ID
+    """
+
+    db = current.db
+    s3db = current.s3db
+
+    etable = s3db.pr_pentity
+    rtable = s3db.pr_role
+    atable = s3db.pr_affiliation
+
+    query = (rtable.deleted != True) & \
+            (rtable.role_type == OU) & \
+            (atable.role_id == rtable.id) & \
+            (atable.deleted != True) & \
+            (atable.pe_id == pe_id)
+    rows = db(query).select(rtable.pe_id)
+    new_parents = set([row.pe_id for row in rows])
+
+    parents = closure.parents
+    children = closure.children
+    for parent in parents.get(pe_id, ()):
+        if parent in children:
+            children[parent].discard(pe_id)
+    for parent in new_parents:
+        if parent not in children:
+            children[parent] = set()
+        children[parent].add(pe_id)
+    if new_parents:
+        parents[pe_id] = new_parents
+        if pe_id not in closure.persons:
+            query = (etable.pe_id == pe_id)
+            row = db(query).select(etable.instance_type,
+                                   limitby=(0, 1)).first()
+            if row and row.instance_type == "pr_person":
+                closure.persons.add(pe_id)
+    else:
+        parents.pop(pe_id, None)
+
+    # Descendants get re-computed from the updated graph
+    closure.descendants = {}
     return
 
 # =============================================================================
@@ -39,7 +39,9 @@ __all__ = ["AuthS3",
            "S3PersonRoleManager"
           ]
 
+import copy
 import datetime
+import hashlib
 import re
 import time
 import uuid
@@ -97,6 +99,8 @@ class AuthS3(Auth):
             - profile
             - has_membership
             - requires_membership
+            - add_membership
+            - del_membership
 
         - S3 extension for user registration:
 
@@ -1450,6 +1454,10 @@ class AuthS3(Auth):
                     if self.user and self.user.id == user.id:
                         self.user.pe_id = pe_id
 
+        if person_ids:
+            # The realms of the linked users have changed
+            self.permission.clear_cache()
+
         if len(person_ids) == 1:
             return person_ids[0]
         else:
@@ -1691,184 +1699,229 @@ class AuthS3(Auth):
             session.s3.roles = []
 
         if self.user:
-            db = current.db
-            s3db = current.s3db
+            user = self.user
 
-            user_id = self.user.id
+            # Roles and realms are shared across requests until the
+            # next change of memberships, ACLs, delegations or affiliations
+            data = self.permission.cached("roles/%s" % user.id,
+                                          self.s3_get_realms)
 
-            # Set pe_id for current user
-            ltable = s3db.table("pr_person_user")
-            if ltable is not None:
-                query = (ltable.user_id == user_id)
-                row = db(query).select(ltable.pe_id,
-                                       limitby=(0, 1),
-                                       cache=s3db.cache).first()
-                if row:
-                    self.user["pe_id"] = row.pe_id
-            else:
-                self.user["pe_id"] = None
+            user["pe_id"] = data.pe_id
+            session.s3.roles.extend(data.roles)
+            user["realms"] = Storage(data.realms)
+            user["delegations"] = data.delegations
 
-            # Get all current auth_memberships of the user
-            mtable = self.settings.table_membership
-            query = (mtable.deleted != True) & \
-                    (mtable.user_id == user_id) & \
-                    (mtable.group_id != None)
-            rows = db(query).select(mtable.group_id, mtable.pe_id)
+            if ANONYMOUS:
+                # Anonymous role has no realm
+                user["realms"][ANONYMOUS] = None
 
-            # Add all group_ids to session.s3.roles
-            session.s3.roles.extend(list(set([row.group_id for row in rows])))
+        return
 
-            # Realms:
-            # Permissions of a group apply only for records owned by any of
-            # the entities which belong to the realm of the group membership
+    # -------------------------------------------------------------------------
+    def s3_get_realms(self):
+        """
+            Lookup pe_id, roles, realms and delegations of the current user
 
-            if not self.permission.entity_realm:
-                # Group memberships have no realms (policy 5 and below)
-                self.user["realms"] = Storage([(row.group_id, None) for row in rows])
-                self.user["delegations"] = Storage()
+            @returns: Storage(pe_id, roles, realms, delegations)
+        """
 
-            else:
-                # Group memberships are limited to realms (policy 6 and above)
-                realms = {}
-                delegations = {}
+        system_roles = self.get_system_roles()
 
-                # These roles can't be realm-restricted:
-                unrestrictable = [system_roles.ADMIN,
-                                  system_roles.ANONYMOUS,
-                                  system_roles.AUTHENTICATED]
+        db = current.db
+        s3db = current.s3db
 
-                default_realm = s3db.pr_realm(self.user["pe_id"])
+        user_id = self.user.id
+
+        # Set pe_id for current user
+        ltable = s3db.table("pr_person_user")
+        if ltable is not None:
+            query = (ltable.user_id == user_id)
+            row = db(query).select(ltable.pe_id,
+                                   limitby=(0, 1),
+                                   cache=s3db.cache).first()
+            if row:
+                self.user["pe_id"] = row.pe_id
+        else:
+            self.user["pe_id"] = None
 
-                # Store the realms:
-                for row in rows:
-                    group_id = row.group_id
-                    if group_id in realms and realms[group_id] is None:
-                        continue
-                    if group_id in unrestrictable:
-                        realms[group_id] = None
-                        continue
-                    if group_id not in realms:
-                        realms[group_id] = []
+        # Get all current auth_memberships of the user
+        mtable = self.settings.table_membership
+        query = (mtable.deleted != True) & \
+                (mtable.user_id == user_id) & \
+                (mtable.group_id != None)
+        rows = db(query).select(mtable.group_id, mtable.pe_id)
+
+        roles = list(set([row.group_id for row in rows]))
+
+        # Realms:
+        # Permissions of a group apply only for records owned by any of
+        # the entities which belong to the realm of the group membership
+
+        if not self.permission.entity_realm:
+            # Group memberships have no realms (policy 5 and below)
+            realms = Storage([(row.group_id, None) for row in rows])
+            delegations = Storage()
+
+        else:
+            # Group memberships are limited to realms (policy 6 and above)
+            realms = {}
+            delegations = {}
+
+            # These roles can't be realm-restricted:
+            unrestrictable = [system_roles.ADMIN,
+                              system_roles.ANONYMOUS,
+                              system_roles.AUTHENTICATED]
+
+            default_realm = s3db.pr_realm(self.user["pe_id"])
+
+            # Store the realms:
+            for row in rows:
+                group_id = row.group_id
+                if group_id in realms and realms[group_id] is None:
+                    continue
+                if group_id in unrestrictable:
+                    realms[group_id] = None
+                    continue
+                if group_id not in realms:
+                    realms[group_id] = []
+                realm = realms[group_id]
+                pe_id = row.pe_id
+                if pe_id is None:
+                    if default_realm:
+                        realm.extend([e for e in default_realm
+                                        if e not in realm])
+                    if not realm:
+                        del realms[group_id]
+                elif pe_id is 0:
+                    # Site-wide
+                    realms[group_id] = None
+                elif pe_id not in realm:
+                    realms[group_id].append(pe_id)
+
+            if self.permission.entity_hierarchy:
+                # Realms include subsidiaries of the realm entities
+
+                # Get all entities in realms
+                all_entities = []
+                append = all_entities.append
+                for realm in realms.values():
+                    if realm is not None:
+                        for entity in realm:
+                            if entity not in all_entities:
+                                append(entity)
+
+                # Lookup all delegations to any OU ancestor of the user
+                if self.permission.delegations and self.user.pe_id:
+
+                    ancestors = s3db.pr_get_ancestors(self.user.pe_id)
+
+                    dtable = s3db.pr_delegation
+                    rtable = s3db.pr_role
+                    atable = s3db.pr_affiliation
+
+                    dn = dtable._tablename
+                    rn = rtable._tablename
+                    an = atable._tablename
+
+                    query = (dtable.deleted != True) & \
+                            (atable.role_id == dtable.role_id) & \
+                            (atable.pe_id.belongs(ancestors)) & \
+                            (rtable.id == dtable.role_id)
+                    rows = db(query).select(rtable.pe_id,
+                                            dtable.group_id,
+                                            atable.pe_id)
+
+                    extensions = []
+                    partners = []
+                    for row in rows:
+                        extensions.append(row[rn].pe_id)
+                        partners.append(row[an].pe_id)
+                else:
+                    rows = []
+                    extensions = []
+                    partners = []
+
+                # Lookup the subsidiaries of all realms and extensions
+                entities = all_entities + extensions + partners
+                descendants = s3db.pr_descendants(entities)
+
+                pmap = {}
+                for p in partners:
+                    if p in all_entities:
+                        pmap[p] = [p]
+                    elif p in descendants:
+                        d = descendants[p]
+                        pmap[p] = [e for e in all_entities if e in d] or [p]
+
+                # Add the subsidiaries to the realms
+                for group_id in realms:
                     realm = realms[group_id]
-                    pe_id = row.pe_id
-                    if pe_id is None:
-                        if default_realm:
-                            realm.extend([e for e in default_realm
-                                            if e not in realm])
-                        if not realm:
-                            del realms[group_id]
-                    elif pe_id is 0:
-                        # Site-wide
-                        realms[group_id] = None
-                    elif pe_id not in realm:
-                        realms[group_id].append(pe_id)
-
-                if self.permission.entity_hierarchy:
-                    # Realms include subsidiaries of the realm entities
-
-                    # Get all entities in realms
-                    all_entities = []
-                    append = all_entities.append
-                    for realm in realms.values():
-                        if realm is not None:
-                            for entity in realm:
-                                if entity not in all_entities:
-                                    append(entity)
-
-                    # Lookup all delegations to any OU ancestor of the user
-                    if self.permission.delegations and self.user.pe_id:
-
-                        ancestors = s3db.pr_get_ancestors(self.user.pe_id)
-
-                        dtable = s3db.pr_delegation
-                        rtable = s3db.pr_role
-                        atable = s3db.pr_affiliation
-
-                        dn = dtable._tablename
-                        rn = rtable._tablename
-                        an = atable._tablename
-
-                        query = (dtable.deleted != True) & \
-                                (atable.role_id == dtable.role_id) & \
-                                (atable.pe_id.belongs(ancestors)) & \
-                                (rtable.id == dtable.role_id)
-                        rows = db(query).select(rtable.pe_id,
-                                                dtable.group_id,
-                                                atable.pe_id)
-
-                        extensions = []
-                        partners = []
-                        for row in rows:
-                            extensions.append(row[rn].pe_id)
-                            partners.append(row[an].pe_id)
-                    else:
-                        rows = []
-                        extensions = []
-                        partners = []
-
-                    # Lookup the subsidiaries of all realms and extensions
-                    entities = all_entities + extensions + partners
-                    descendants = s3db.pr_descendants(entities)
-
-                    pmap = {}
-                    for p in partners:
-                        if p in all_entities:
-                            pmap[p] = [p]
-                        elif p in descendants:
-                            d = descendants[p]
-                            pmap[p] = [e for e in all_entities if e in d] or [p]
-
-                    # Add the subsidiaries to the realms
-                    for group_id in realms:
-                        realm = realms[group_id]
-                        if realm is None:
+                    if realm is None:
+                        continue
+                    append = realm.append
+                    for entity in list(realm):
+                        if entity in descendants:
+                            for subsidiary in descendants[entity]:
+                                if subsidiary not in realm:
+                                    append(subsidiary)
+
+                # Process the delegations
+                if self.permission.delegations:
+                    for row in rows:
+
+                        # owner == delegates group_id to ==> partner
+                        owner = row[rn].pe_id
+                        partner = row[an].pe_id
+                        group_id = row[dn].group_id
+
+                        if group_id in delegations and \
+                           owner in delegations[group_id]:
+                            # Duplicate
+                            continue
+                        if partner not in pmap:
                             continue
-                        append = realm.append
-                        for entity in list(realm):
-                            if entity in descendants:
-                                for subsidiary in descendants[entity]:
-                                    if subsidiary not in realm:
-                                        append(subsidiary)
-
-                    # Process the delegations
-                    if self.permission.delegations:
-                        for row in rows:
-
-                            # owner == delegates group_id to ==> partner
-                            owner = row[rn].pe_id
-                            partner = row[an].pe_id
-                            group_id = row[dn].group_id
-
-                            if group_id in delegations and \
-                               owner in delegations[group_id]:
-                                # Duplicate
-                                continue
-                            if partner not in pmap:
-                                continue
-
-                            # Find the realm
-                            if group_id not in delegations:
-                                delegations[group_id] = Storage()
-                            groups = delegations[group_id]
-
-                            r = [owner]
-                            if owner in descendants:
-                                r.extend(descendants[owner])
-
-                            for p in pmap[partner]:
-                                if p not in groups:
-                                    groups[p] = []
-                                realm = groups[p]
-                                realm.extend(r)
-
-                self.user["realms"] = realms
-                self.user["delegations"] = delegations
 
-            if ANONYMOUS:
-                # Anonymous role has no realm
-                self.user["realms"][ANONYMOUS] = None
+                        # Find the realm
+                        if group_id not in delegations:
+                            delegations[group_id] = Storage()
+                        groups = delegations[group_id]
 
-        return
+                        r = [owner]
+                        if owner in descendants:
+                            r.extend(descendants[owner])
+
+                        for p in pmap[partner]:
+                            if p not in groups:
+                                groups[p] = []
+                            realm = groups[p]
+                            realm.extend(r)
+
+        return Storage(pe_id=self.user["pe_id"],
+                       roles=roles,
+                       realms=realms,
+                       delegations=delegations)
+
+    # -------------------------------------------------------------------------
+    def add_membership(self, *args, **kwargs):
+        """
+            Adds a user to a group, extends Auth.add_membership
+            to invalidate the permission cache
+        """
+
+        result = Auth.add_membership(self, *args, **kwargs)
+        self.permission.clear_cache()
+        return result
+
+    # -------------------------------------------------------------------------
+    def del_membership(self, *args, **kwargs):
+        """
+            Removes a user from a group, extends Auth.del_membership
+            to invalidate the permission cache
+        """
+
+        result = Auth.del_membership(self, *args, **kwargs)
+        self.permission.clear_cache()
+        return result
 
     # -------------------------------------------------------------------------
     def s3_create_role(self, role, description=None, *acls, **args):
@@ -1959,6 +2012,7 @@ class AuthS3(Auth):
             db(pquery).update(deleted=True)
             # Remove the role
             db(gquery).update(role=None, deleted=True)
+            self.permission.clear_cache()
 
     # -------------------------------------------------------------------------
     def s3_assign_role(self, user_id, group_id, for_pe=None):
@@ -2030,6 +2084,7 @@ class AuthS3(Auth):
                 if for_pe is not None and str(group_id) not in unrestrictable:
                     membership["pe_id"] = for_pe
                 membership_id = mtable.insert(**membership)
+        self.permission.clear_cache()
 
         # Update roles for current user if required
         if self.user and str(user_id) == str(self.user.id):
@@ -2106,6 +2161,8 @@ class AuthS3(Auth):
                             deleted_fk=deleted_fk,
                             user_id=None,
                             group_id=None)
+        if memberships:
+            self.permission.clear_cache()
 
         # Update roles for current user if required
         if self.user and str(user_id) == str(self.user.id):
@@ -2349,6 +2406,7 @@ class AuthS3(Auth):
         for role_id in roles:
             for group_id in group_ids:
                 dtable.insert(role_id=role_id, group_id=group_id)
+        self.permission.clear_cache()
 
         # Update roles for current user if required
         self.s3_set_roles()
@@ -2446,6 +2504,7 @@ class AuthS3(Auth):
 
         # Maybe update the current user's delegations?
         if len(rmv):
+            self.permission.clear_cache()
             self.s3_set_roles()
         return True
 
@@ -3229,6 +3288,10 @@ class S3Permission(object):
         "update": UPDATE,
         "delete": DELETE})
 
+    # Lifetime of shared ACL cache entries (seconds)
+    CACHE_EXPIRE = 3600
+    CACHE_VERSION = "s3_permission_version"
+
     # Lambda expressions for ACL handling
     required_acl = lambda self, methods: \
                           reduce(lambda a, b: a | b,
@@ -3275,6 +3338,9 @@ class S3Permission(object):
         self.entity_hierarchy = self.policy in (7, 8)
         # Permission sets can be delegated:
         self.delegations = self.policy == 8
+        # Share ACLs and realms across requests:
+        self.use_cache = settings.get_security_acl_cache()
+        self._version = None
 
         # Permissions table
         self.tablename = tablename or self.TABLENAME
@@ -3396,8 +3462,7 @@ class S3Permission(object):
             # ACLs not relevant to this security policy
             return None
 
-        if "permissions" in current.response.s3:
-            del current.response.s3["permissions"]
+        self.clear_cache()
 
         if c is None and f is None and t is None:
             return None
@@ -3484,6 +3549,80 @@ class S3Permission(object):
                                entity=entity,
                                delete=True)
 
+    # -------------------------------------------------------------------------
+    # ACL Cache
+    # -------------------------------------------------------------------------
+    def _cache(self):
+        """ The cache to share ACLs across requests (None if disabled) """
+
+        if not self.use_cache:
+            return None
+        cache = current.cache
+        # Memcache is shared between processes, so prefer it if configured
+        return getattr(cache, "memcache", None) or cache.ram
+
+    # -------------------------------------------------------------------------
+    def version(self):
+        """
+            The current version of memberships, ACLs, delegations and
+            affiliations, as counted by clear_cache()
+
+            @returns: the version number, or None if caching is disabled
+        """
+
+        if self._version is None:
+            cache = self._cache()
+            if cache is None:
+                return None
+            # Initialize with a timestamp, so that a counter which has
+            # been evicted does not restart at a previously used version
+            self._version = cache(self.CACHE_VERSION,
+                                  lambda: int(time.time() * 1000),
+                                  time_expire=self.CACHE_EXPIRE)
+        return self._version
+
+    # -------------------------------------------------------------------------
+    def cached(self, key, f):
+        """
+            Get a value from the shared ACL cache, computing it with
+            f if not cached for the current version
+
+            @param key: the key (string)
+            @param f: the function to compute the value
+
+            @returns: a copy of the cached value, which the caller
+                      may modify without affecting other requests
+        """
+
+        cache = self._cache()
+        if cache is None:
+            return f()
+        key = "%s/%s/%s" % (self.version(), self.policy, key)
+        key = "s3_permission_%s" % hashlib.md5(key).hexdigest()
+        value = cache(key, f, time_expire=self.CACHE_EXPIRE)
+        if cache is current.cache.ram:
+            # cache.ram returns the stored object itself
+            value = copy.deepcopy(value)
+        return value
+
+    # -------------------------------------------------------------------------
+    def clear_cache(self):
+        """
+            Invalidate all cached ACLs and realms, to be called after
+            any change of memberships, ACLs, delegations or affiliations
+        """
+
+        if "permissions" in current.response.s3:
+            del current.response.s3["permissions"]
+
+        cache = self._cache()
+        if cache is None:
+            return
+        self.version()
+        cache.increment(self.CACHE_VERSION)
+        self._version = None
+        return
+
     # -------------------------------------------------------------------------
     # Record Ownership
     # -------------------------------------------------------------------------
@@ -4115,6 +4254,58 @@ class S3Permission(object):
                         f=None,
                         t=None,
                         entity=[]):
+        """
+            Find all applicable ACLs for the specified situation for
+            the specified realms and delegations (cached)
+
+            @param racl: the required ACL
+            @param realms: the realms
+            @param delegations: the delegations
+            @param c: the controller name, falls back to current request
+            @param f: the function name, falls back to current request
+            @param t: the tablename
+            @param entity: the owner entity
+
+            @returns: None for no ACLs defined (allow),
+                      [] for no ACLs applicable (deny),
+                      or list of applicable ACLs
+        """
+
+        if not self.use_cacls:
+            # We do not use ACLs at all (allow all)
+            return None
+
+        c = c or self.controller
+        f = f or self.function
+
+        if realms:
+            r = sorted(realms.items())
+        else:
+            r = None
+        if delegations:
+            d = sorted([(group_id, sorted(delegations[group_id].items()))
+                        for group_id in delegations])
+        else:
+            d = None
+        key = repr((racl, c, f, t and str(t) or None, entity, r, d))
+
+        return self.cached("acls/%s" % key,
+                           lambda: self._applicable_acls(racl,
+                                                         realms=realms,
+                                                         delegations=delegations,
+                                                         c=c,
+                                                         f=f,
+                                                         t=t,
+                                                         entity=entity))
+
+    # -------------------------------------------------------------------------
+    def _applicable_acls(self, racl,
+                         realms=None,
+                         delegations=None,
+                         c=None,
+                         f=None,
+                         t=None,
+                         entity=[]):
         """
             Find all applicable ACLs for the specified situation for
             the specified realms and delegations
@@ -5288,6 +5479,7 @@ class S3RoleManager(S3Method):
                             db(query).update(**acl)
                         elif acl.oacl or acl.uacl:
                             _id = acl_table.insert(**acl)
+                    auth.permission.clear_cache()
 
                 redirect(URL(f="role", vars=request.get_vars))
 
@@ -5352,6 +5544,7 @@ class S3RoleManager(S3Method):
                             (self.table.id == role_id)
                     db(query).update(role=None,
                                      deleted=True)
+                    auth.permission.clear_cache()
                     # Confirmation:
                     session.confirmation = '%s "%s" %s' % (T("Role"),
                                                            role_name,
@@ -2029,16 +2029,18 @@ class S3CRUD(S3Method):
                     r = requires[0]
                     if isinstance(r, IS_EMPTY_OR):
                         r = r.other
-                    try:
-                        options = r.options()
-                    except:
-                        continue
-                    vlist = []
-                    for (value, text) in options:
-                        if str(text).lower().find(context) != -1:
-                            vlist.append(value)
-                    if vlist:
-                        query = field.belongs(vlist)
+                    query = self.ssp_reference_query(field, r, context)
+                    if query is None:
+                        # Match the option labels
+                        options = self.ssp_label_index(field, r)
+                        if options is None:
+                            continue
+                        vlist = []
+                        for (value, text) in options:
+                            if text.find(context) != -1:
+                                vlist.append(value)
+                        if vlist:
+                            query = field.belongs(vlist)
                 else:
                     continue
             elif str(field.type) in ("string", "text"):
@@ -2057,6 +2059,128 @@ class S3CRUD(S3Method):
 
         return searchq
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def ssp_reference_query(field, requires, context):
+        """
+            Build a query for the SSPag filter of a foreign key field
+            which matches the label fields in the referenced table
+            (rather than the labels of all options). Labels can be
+            composed of multiple fields, so every word of the search
+            string must be found in any of the fields.
+
+            @param field: the foreign key field
+            @param requires: the IS_ONE_OF (or IS_IN_DB) validator
+            @param context: the search string (lower-case)
+
+            @returns: the query, or None if the label fields can not
+                      be determined from the validator
+        """
+
+        ktablename = getattr(requires, "ktable", None)
+        kfieldname = getattr(requires, "kfield", None)
+        if not ktablename or not kfieldname:
+            return None
+        dbset = requires.dbset
+        db = dbset._db
+        if ktablename not in db:
+            return None
+        ktable = db[ktablename]
+
+        # Label fields
+        if isinstance(requires.label, basestring):
+            fieldnames = requires.ks
+        else:
+            # Represent function => use the main name fields
+            sortby = field.sortby if hasattr(field, "sortby") else None
+            if sortby:
+                fieldnames = sortby
+            else:
+                get_config = current.s3db.get_config
+                fieldnames = [get_config(ktablename, "main"),
+                              get_config(ktablename, "extra")]
+                if not fieldnames[0] and "name" in ktable.fields:
+                    fieldnames[0] = "name"
+            if not isinstance(fieldnames, (list, tuple)):
+                fieldnames = [fieldnames]
+        fields = [ktable[fn] for fn in fieldnames
+                  if fn and fn in ktable.fields and
+                     str(ktable[fn].type) in ("string", "text")]
+        if not fields:
+            return None
+
+        query = None
+        for word in context.split() or [""]:
+            wildcard = "%%%s%%" % word
+            wquery = None
+            for f in fields:
+                q = f.lower().like(wildcard)
+                wquery = q if wquery is None else wquery | q
+            query = wquery if query is None else query & wquery
+        if "deleted" in ktable.fields:
+            query &= (ktable.deleted != True)
+
+        # Only records the user can read (as in IS_ONE_OF.build_set)
+        query &= current.auth.s3_accessible_query("read", ktable)
+
+        # Option filters of the validator
+        filterby = getattr(requires, "filterby", None)
+        if filterby and filterby in ktable.fields:
+            filter_opts = requires.filter_opts
+            if filter_opts:
+                query &= (ktable[filterby].belongs(filter_opts))
+        not_filterby = getattr(requires, "not_filterby", None)
+        if not_filterby and not_filterby in ktable.fields:
+            not_filter_opts = requires.not_filter_opts
+            if not_filter_opts:
+                query &= (~(ktable[not_filterby].belongs(not_filter_opts)))
+
+        kfield = ktable[kfieldname]
+        if str(field.type).startswith("list:"):
+            rows = dbset(query).select(kfield)
+            vlist = [row[kfieldname] for row in rows]
+            if vlist:
+                return field.belongs(vlist)
+            else:
+                # No match, but no need to try the options either
+                return field.belongs([None])
+        else:
+            return field.belongs(dbset(query)._select(kfield))
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def ssp_label_index(field, requires):
+        """
+            Get the options of a field for the SSPag filter, with the
+            lower-case option labels. Cached per field (and user) if
+            configured in deployment_settings.ui.ssp_label_cache.
+
+            @param field: the field
+            @param requires: the validator
+
+            @returns: list of tuples (value, lower-case label), or
+                      None if the validator has no options
+        """
+
+        def options():
+            try:
+                options = requires.options()
+            except:
+                return None
+            return [(value, str(text).lower())
+                    for (value, text) in options]
+
+        expire = current.deployment_settings.get_ui_ssp_label_cache()
+        if not expire:
+            return options()
+
+        auth = current.auth
+        user_id = auth.user.id if auth.user else None
+        key = "ssp_labels/%s/%s/%s" % (field,
+                                       user_id,
+                                       current.T.accepted_language)
+        return current.cache.ram(key, options, time_expire=expire)
+
     # -------------------------------------------------------------------------
     def ssp_orderby(self, resource, fields, left=[]):
         """
@@ -33,23 +33,29 @@
     OTHER DEALINGS IN THE SOFTWARE.
 """
 
-__all__ = ["GIS", "GoogleGeocoder", "YahooGeocoder"]
+__all__ = ["GIS", "S3SpatialIndex", "S3PointGrid", "S3LayerCache", "GoogleGeocoder", "YahooGeocoder"]
 
 import os
 import re
 import sys
 import copy
+import datetime
+import hashlib          # Needed for the Layer Cache keys
 #import logging
 import math             # Needed for greatCircleDistance
 #import random          # Needed when feature_queries are passed in without a name
 import urllib           # Needed for urlencoding
 import urllib2          # Needed for quoting & error handling on fetch
 import Cookie           # Needed for Sessions on Internal KML feeds
+import heapq            # Needed to rank the location duplicates
+import threading        # Needed to lock the location grid
 try:
     from cStringIO import StringIO    # Faster, where available
 except:
     from StringIO import StringIO
 from datetime import timedelta  # Needed for Feed Refresh checks
+from email.utils import parsedate # Needed for If-Modified-Since
+import time
 import zipfile          # Needed to unzip KMZ files
 
 try:
@@ -69,20 +75,21 @@ from gluon.contrib.simplejson.ordered_dict import OrderedDict
 
 from s3method import S3Method
 from s3track import S3Trackable
-from s3utils import s3_debug, s3_fullname
+from s3utils import s3_debug, s3_fullname, s3_jaro_winkler
+from s3utils import s3_table_version, s3_table_changed_only
 
 SHAPELY = False
 try:
     import shapely
     import shapely.geometry
     from shapely.wkt import loads as wkt_loads
+    from shapely.prepared import prep
     SHAPELY = True
 except ImportError:
     s3_debug("WARNING: %s: Shapely GIS library not installed" % __name__)
 
 DEBUG = False
 if DEBUG:
-    import datetime
     print >> sys.stderr, "S3GIS: DEBUG MODE"
     def _debug(m):
         print >> sys.stderr, m
@@ -234,6 +241,33 @@ class GIS(object):
         GIS functions
     """
 
+    # Spatial index of gis_location, shared by all requests in this
+    # process, see get_spatial_index()
+    SPATIAL_INDEX = Storage(index=None, version=None, shapes={})
+
+    # Maximum number of prepared geometries to keep with the index
+    SPATIAL_INDEX_SHAPES = 5000
+
+    # Seconds between checks of the spatial index against gis_location
+    SPATIAL_INDEX_CHECK = 60
+
+    # Grid of all gis_location points and the duplicate candidates, shared
+    # by all requests in this process, see get_location_duplicates()
+    LOCATION_GRID = Storage(grid=None, version=None, duplicates={})
+    LOCATION_GRID_LOCK = threading.RLock()
+
+    # Maximum number of duplicate candidates to rank
+    LOCATION_DUPLICATES = 1000
+
+    # Number of locations per INSERT statement in the bulk importers
+    IMPORT_BATCH_SIZE = 250
+
+    # Number of locations per UPDATE statement in rebuild_location_tree()
+    REBUILD_BATCH_SIZE = 500
+
+    # Size of the grid cells for server-side clustering, in pixels
+    CLUSTER_CELL_SIZE = 64
+
     def __init__(self):
         settings = current.deployment_settings
         if not current.db is not None:
@@ -1568,6 +1602,18 @@ class GIS(object):
             query = query & (table.deleted == False)
         # @ToDo: Check AAA (do this as a resource filter?)
 
+        if not current.deployment_settings.get_gis_spatialdb():
+            # Find the intersecting locations with the spatial index,
+            # and then only select the features at these locations
+            location_ids = self.get_location_ids_by_shape(polygon)
+            if not location_ids:
+                return Rows()
+            query = query & (locations.id.belongs(location_ids))
+            return db(query).select(locations.wkt,
+                                    locations.lat,
+                                    locations.lon,
+                                    table.ALL)
+
         features = db(query).select(locations.wkt,
                                     locations.lat,
                                     locations.lon,
@@ -1884,6 +1930,231 @@ class GIS(object):
 
         return Marker().as_dict()
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def parse_bbox(bbox):
+        """
+            Parse a bounding box URL parameter (as sent by the
+            OpenLayers BBOX strategy)
+
+            @param bbox: the bbox as string "lon_min,lat_min,lon_max,lat_max"
+            @returns: tuple (lon_min, lat_min, lon_max, lat_max) of floats,
+                      or None if the bbox is invalid
+        """
+
+        if not bbox or not isinstance(bbox, basestring):
+            return None
+        try:
+            lon_min, lat_min, lon_max, lat_max = [float(v)
+                                                  for v in bbox.split(",")]
+        except ValueError:
+            return None
+        if lon_min > lon_max or lat_min > lat_max:
+            return None
+        return (lon_min, lat_min, lon_max, lat_max)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def snap_bbox(bbox):
+        """
+            Expand a bounding box to the boundaries of a grid of tiles
+            (with a tile size of the power of 2 degrees next below the
+            size of the bbox), so that the Feature Layer exports for
+            slightly different viewports can be cached as one
+
+            @param bbox: tuple (lon_min, lat_min, lon_max, lat_max)
+            @returns: the expanded bbox
+        """
+
+        lon_min, lat_min, lon_max, lat_max = bbox
+        span = max(lon_max - lon_min, lat_max - lat_min)
+        if span <= 0:
+            return bbox
+        size = 2.0 ** math.floor(math.log(span, 2))
+        floor = math.floor
+        ceil = math.ceil
+        return (floor(lon_min / size) * size,
+                max(floor(lat_min / size) * size, -90.0),
+                ceil(lon_max / size) * size,
+                min(ceil(lat_max / size) * size, 90.0))
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def get_feature_layer_query(resource, layer_id, bbox):
+        """
+            Get a filter query for a Feature Layer export which restricts
+            the resource to the features inside the map viewport
+
+            @param resource: the S3Resource
+            @param layer_id: the gis_layer_feature record ID
+            @param bbox: the viewport as tuple
+                         (lon_min, lat_min, lon_max, lat_max)
+            @returns: the query, or None if the layer's features can't be
+                      filtered by their location
+        """
+
+        db = current.db
+        s3db = current.s3db
+        table = resource.table
+
+        ftable = s3db.gis_layer_feature
+        layer = db(ftable.id == layer_id).select(ftable.trackable,
+                                                 limitby=(0, 1)).first()
+        if layer and layer.trackable:
+            # Location is determined by S3Track
+            return None
+
+        gtable = s3db.gis_location
+        lon_min, lat_min, lon_max, lat_max = bbox
+        query = (gtable.lat >= lat_min) & \
+                (gtable.lat <= lat_max)
+        if lon_max - lon_min < 360:
+            # Shift the viewport into -180..180 (the map can be wrapped
+            # around the Date Line)
+            shift = math.floor((lon_min + 180) / 360) * 360
+            lon_min -= shift
+            lon_max -= shift
+            if lon_max <= 180:
+                query &= (gtable.lon >= lon_min) & \
+                         (gtable.lon <= lon_max)
+            else:
+                # Viewport crosses the Date Line => two longitude ranges
+                query &= (gtable.lon >= lon_min) | \
+                         (gtable.lon <= lon_max - 360)
+        locations = db(query)._select(gtable.id)
+
+        if "location_id" in table.fields:
+            return table.location_id.belongs(locations)
+        elif "site_id" in table.fields:
+            stable = s3db.org_site
+            sites = db(stable.location_id.belongs(locations))._select(stable.site_id)
+            return table.site_id.belongs(sites)
+        else:
+            return None
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def get_feature_clusters(resource, layer_id, zoom):
+        """
+            Aggregate the features of a Feature Layer export into the
+            cells of a grid, if the map is zoomed out far enough and
+            there are too many features to show them individually
+
+            @param resource: the S3Resource (filtered to the viewport)
+            @param layer_id: the gis_layer_feature record ID
+            @param zoom: the zoom level of the map
+            @returns: list of Storage(lat, lon, count, id) with the
+                      centroid and the number of features per cell, and
+                      the ID of the first feature, or None to not cluster
+        """
+
+        settings = current.deployment_settings
+        cluster_zoom = settings.get_gis_cluster_zoom()
+        if cluster_zoom is None:
+            return None
+        try:
+            zoom = int(zoom)
+        except (ValueError, TypeError):
+            return None
+        if zoom >= cluster_zoom:
+            return None
+
+        db = current.db
+        s3db = current.s3db
+        table = resource.table
+        gtable = s3db.gis_location
+
+        query = resource.get_query()
+        if "location_id" in table.fields:
+            query &= (table.location_id == gtable.id)
+        elif "site_id" in table.fields:
+            stable = s3db.org_site
+            query &= (table.site_id == stable.site_id) & \
+                     (stable.location_id == gtable.id)
+        else:
+            return None
+        query &= (gtable.lat != None) & (gtable.lon != None)
+
+        # Only the coordinates: no representations, tooltips or markers
+        rows = db(query).select(table.id, gtable.lat, gtable.lon)
+        if len(rows) < settings.get_gis_cluster_threshold():
+            return None
+
+        # Size of a grid cell in degrees (256 pixels per tile)
+        size = 360.0 / (2 ** zoom) * GIS.CLUSTER_CELL_SIZE / 256
+
+        floor = math.floor
+        cells = {}
+        for row in rows:
+            location = row.gis_location
+            lat = location.lat
+            lon = location.lon
+            key = (floor(lon / size), floor(lat / size))
+            cell = cells.get(key)
+            if cell is None:
+                cells[key] = [1, lat, lon, row[table].id]
+            else:
+                cell[0] += 1
+                cell[1] += lat
+                cell[2] += lon
+
+        clusters = []
+        for key in sorted(cells):
+            count, lat, lon, record_id = cells[key]
+            clusters.append(Storage(lat=lat / count,
+                                    lon=lon / count,
+                                    count=count,
+                                    id=record_id))
+        return clusters
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def get_layer_marker(layer_id, resource):
+        """
+            Get the marker image and popup URL of a Feature Layer (without
+            the tooltips and coordinates from get_marker_and_popup)
+
+            @param layer_id: the gis_layer_feature record ID
+            @param resource: the S3Resource
+            @returns: tuple (marker image, popup URL)
+        """
+
+        db = current.db
+        s3db = current.s3db
+
+        ftable = s3db.gis_layer_feature
+        ltable = s3db.gis_layer_symbology
+        mtable = s3db.gis_marker
+
+        try:
+            symbology_id = current.response.s3.gis.config.symbology_id
+        except:
+            # Config not initialised yet
+            config = current.gis.get_config()
+            symbology_id = config.symbology_id
+
+        query = (ftable.id == layer_id) & \
+                (ftable.layer_id == ltable.layer_id) & \
+                (ltable.marker_id == mtable.id) & \
+                (ltable.symbology_id == symbology_id)
+        layer = db(query).select(mtable.image,
+                                 ftable.controller,
+                                 ftable.function,
+                                 limitby=(0, 1)).first()
+        if layer:
+            marker = layer.gis_marker.image
+            frow = layer.gis_layer_feature
+            controller = frow.controller or resource.prefix
+            function = frow.function or resource.name
+        else:
+            marker = None
+            controller = resource.prefix
+            function = resource.name
+        if not marker:
+            marker = GIS.get_marker().image
+        popup_url = URL(controller, function).split(".", 1)[0]
+        return marker, popup_url
+
     # -------------------------------------------------------------------------
     @staticmethod
     def get_marker_and_popup(layer_id=None, # Used by S3REST: S3Resource.export_tree()
@@ -2028,7 +2299,8 @@ class GIS(object):
                 else:
                     gtable = s3db.gis_location
                     _latlons = tracker.get_location(_fields=[gtable.lat,
-                                                             gtable.lon])
+                                                             gtable.lon],
+                                                    as_rows=True)
                     index = 0
                     for id in ids:
                         latlons[id] = (_latlons[index].lat, _latlons[index].lon)
@@ -2535,7 +2807,6 @@ class GIS(object):
 
         db = current.db
         s3db = current.s3db
-        cache = s3db.cache
         table = s3db.gis_location
 
         if level == "L1":
@@ -2787,18 +3058,30 @@ class GIS(object):
         code2Field = layer["code2field"]
         parentLevel = layer["parent"]
         parentCodeField = table[layer["parentCode"]]
+
+        # Load all potential parents once, by their code
+        query = (table.level == parentLevel) & \
+                (table.deleted != True)
+        parents = {}
+        for parent in db(query).select(table.id,
+                                       table.code,
+                                       parentCodeField):
+            code2 = parent[parentCodeField]
+            if code2 not in parents:
+                parents[code2] = parent
+        parent_countries = {}
+
+        # Batches of new locations (points and polygons separately,
+        # as they have different fields)
+        records = []
+        polygons = []
         count = 0
         for row in rows:
             # Read Attributes
             feat = lyr[count]
 
             code2 = feat.GetField(code2Field)
-            query = (table.level == parentLevel) & \
-                    (parentCodeField == code2)
-            parent = db(query).select(table.id,
-                                      table.code,
-                                      limitby=(0, 1),
-                                      cache=cache).first()
+            parent = parents.get(code2)
             if not parent:
                 # Skip locations for which we don't have a valid parent
                 #s3_debug("Skipping - cannot find parent with code2: %s" % code2)
@@ -2814,7 +3097,12 @@ class GIS(object):
                         continue
                 else:
                     # Check grandparent
-                    country = self.get_parent_country(parent.id, key_type="code")
+                    if parent.id in parent_countries:
+                        country = parent_countries[parent.id]
+                    else:
+                        country = self.get_parent_country(parent.id,
+                                                          key_type="code")
+                        parent_countries[parent.id] = country
                     if country not in countries:
                         count += 1
                         continue
@@ -2831,14 +3119,17 @@ class GIS(object):
                 if geom.GetGeometryType() == ogr.wkbPoint:
                     lat = geom.GetX()
                     lon = geom.GetY()
-                    table.insert(name=name,
-                                 level=level,
-                                 gis_feature_type=1,
-                                 lat=lat,
-                                 lon=lon,
-                                 parent=parent.id,
-                                 code=code,
-                                 area=area)
+                    records.append(dict(name=name,
+                                        level=level,
+                                        gis_feature_type=1,
+                                        lat=lat,
+                                        lon=lon,
+                                        parent=parent.id,
+                                        code=code,
+                                        area=area))
+                    if len(records) >= self.IMPORT_BATCH_SIZE:
+                        self._insert_locations(records)
+                        records = []
                 else:
                     wkt = geom.ExportToWkt()
                     if wkt.startswith("LINESTRING"):
@@ -2853,17 +3144,32 @@ class GIS(object):
                         gis_feature_type = 6
                     elif wkt.startswith("GEOMETRYCOLLECTION"):
                         gis_feature_type = 7
-                    table.insert(name=name,
-                                 level=level,
-                                 gis_feature_type=gis_feature_type,
-                                 wkt=wkt,
-                                 parent=parent.id,
-                                 code=code,
-                                 area=area)
+                    # Centroid and bounds (these used to be set by the
+                    # full update_location_tree() after the import)
+                    centroid = geom.Centroid()
+                    lon_min, lon_max, lat_min, lat_max = geom.GetEnvelope()
+                    polygons.append(dict(name=name,
+                                         level=level,
+                                         gis_feature_type=gis_feature_type,
+                                         wkt=wkt,
+                                         lat=centroid.GetY(),
+                                         lon=centroid.GetX(),
+                                         lon_min=lon_min,
+                                         lon_max=lon_max,
+                                         lat_min=lat_min,
+                                         lat_max=lat_max,
+                                         parent=parent.id,
+                                         code=code,
+                                         area=area))
+                    if len(polygons) >= self.IMPORT_BATCH_SIZE:
+                        self._insert_locations(polygons)
+                        polygons = []
             else:
                 s3_debug("No geometry\n")
 
             count += 1
+        self._insert_locations(records)
+        self._insert_locations(polygons)
 
         # Close the shapefile
         ds.Destroy()
@@ -2871,11 +3177,7 @@ class GIS(object):
         db.commit()
 
         s3_debug("Updating Location Tree...")
-        try:
-            self.update_location_tree()
-        except MemoryError:
-            # If doing all L2s, it can break memory limits - how can we avoid this?
-            s3_debug("Memory error when trying to update_location_tree()!")
+        self._update_location_paths(level)
 
         db.commit()
 
@@ -2984,10 +3286,6 @@ class GIS(object):
         query = deleted & (table.level == parent_level)
         # Do the DB query once (outside loop)
         all_parents = db(query).select(table.wkt,
-                                       table.lon_min,
-                                       table.lon_max,
-                                       table.lat_min,
-                                       table.lat_max,
                                        table.id)
         if not all_parents:
             # No locations in the parent level found
@@ -2995,96 +3293,210 @@ class GIS(object):
             parent_level = "L" + str(int(parent_level[1:]) + 1)
             query = deleted & (table.level == parent_level)
             all_parents = db(query).select(table.wkt,
-                                           table.lon_min,
-                                           table.lon_max,
-                                           table.lat_min,
-                                           table.lat_max,
                                            table.id)
 
-        # Parse File
-        current_row = 0
-        for line in f:
-            current_row += 1
-            # Format of file: http://download.geonames.org/export/dump/readme.txt
-            geonameid,
-            name,
-            asciiname,
-            alternatenames,
-            lat,
-            lon,
-            feature_class,
-            feature_code,
-            country_code,
-            cc2,
-            admin1_code,
-            admin2_code,
-            admin3_code,
-            admin4_code,
-            population,
-            elevation,
-            gtopo30,
-            timezone,
-            modification_date = line.split("\t")
-
-            if feature_code == fc:
-                # @ToDo: Agree on a global repository for UUIDs:
-                # http://eden.sahanafoundation.org/wiki/UserGuidelinesGISData#UUIDs
-                import uuid
-                uuid = "geo.sahanafoundation.org/" + uuid.uuid4()
-
-                # Add WKT
-                lat = float(lat)
-                lon = float(lon)
-                wkt = self.latlon_to_wkt(lat, lon)
-
-                shape = shapely.geometry.point.Point(lon, lat)
-
-                # Add Bounds
-                lon_min = lon_max = lon
-                lat_min = lat_max = lat
-
-                # Locate Parent
-                parent = ""
-                # 1st check for Parents whose bounds include this location (faster)
-                def in_bbox(row):
-                    return (row.lon_min < lon_min) & \
-                           (row.lon_max > lon_max) & \
-                           (row.lat_min < lat_min) & \
-                           (row.lat_max > lat_max)
-                for row in all_parents.find(lambda row: in_bbox(row)):
-                    # Search within this subset with a full geometry check
-                    # Uses Shapely.
+        # Parse the parent polygons once into prepared geometries,
+        # and index them by their bounds
+        parents = {}
+        items = []
+        for row in all_parents:
+            if not row.wkt:
+                continue
+            try:
+                parent_shape = wkt_loads(row.wkt)
+            except shapely.geos.ReadingError:
+                s3_debug("Error reading wkt of location with id", row.id)
+                continue
+            parents[row.id] = prep(parent_shape)
+            items.append(parent_shape.bounds + (row.id,))
+        index = S3SpatialIndex(items)
+
+        Point = shapely.geometry.point.Point
+        def locate_parents(batch):
+            """
+                Locate the parents for a batch of points
+                - neighbouring points mostly share the parent, so try
+                  the previous parent first
+            """
+            last = None
+            for record in batch:
+                lon = record["lon"]
+                lat = record["lat"]
+                shape = Point(lon, lat)
+                parent = None
+                if last is not None and parents[last].intersects(shape):
+                    parent = last
+                else:
                     # @ToDo provide option to use PostGIS/Spatialite
-                    try:
-                        parent_shape = wkt_loads(row.wkt)
-                        if parent_shape.intersects(shape):
-                            parent = row.id
+                    for parent_id in index.query(lon, lat, lon, lat):
+                        if parents[parent_id].intersects(shape):
+                            parent = parent_id
                             # Should be just a single parent
                             break
-                    except shapely.geos.ReadingError:
-                        s3_debug("Error reading wkt of location with id", row.id)
-
-                # Add entry to database
-                table.insert(uuid=uuid,
-                             geonames_id=geonames_id,
-                             source="geonames",
-                             name=name,
-                             level=level,
-                             parent=parent,
-                             lat=lat,
-                             lon=lon,
-                             wkt=wkt,
-                             lon_min=lon_min,
-                             lon_max=lon_max,
-                             lat_min=lat_min,
-                             lat_max=lat_max)
+                record["parent"] = last = parent
+            self._insert_locations(batch)
 
-            else:
+        # Skip locations which have been imported before
+        query = (table.geonames_id != None)
+        existing = set([row.geonames_id
+                        for row in db(query).select(table.geonames_id)])
+
+        import uuid
+
+        # Parse File
+        batch = []
+        for line in f:
+            # Format of file: http://download.geonames.org/export/dump/readme.txt
+            fields = line.split("\t")
+            if len(fields) < 19:
                 continue
+            feature_code = fields[7]
+            if feature_code != fc:
+                continue
+            try:
+                geonames_id = int(fields[0])
+                lat = float(fields[4])
+                lon = float(fields[5])
+            except ValueError:
+                continue
+            if geonames_id in existing:
+                continue
+            existing.add(geonames_id)
+
+            # @ToDo: Agree on a global repository for UUIDs:
+            # http://eden.sahanafoundation.org/wiki/UserGuidelinesGISData#UUIDs
+            batch.append(dict(uuid="geo.sahanafoundation.org/%s" % uuid.uuid4(),
+                              geonames_id=geonames_id,
+                              source="geonames",
+                              name=fields[1],
+                              level=level,
+                              gis_feature_type=1,
+                              lat=lat,
+                              lon=lon,
+                              # Add WKT
+                              wkt=self.latlon_to_wkt(lat, lon),
+                              # Add Bounds
+                              lon_min=lon,
+                              lon_max=lon,
+                              lat_min=lat,
+                              lat_max=lat))
+            if len(batch) >= self.IMPORT_BATCH_SIZE:
+                locate_parents(batch)
+                batch = []
+        if batch:
+            locate_parents(batch)
+        f.close()
+
+        s3_debug("Updating Location Tree...")
+        self._update_location_paths(level)
+        db.commit()
 
         s3_debug("All done!")
         return
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _insert_locations(records):
+        """
+            Insert a batch of gis_location records with one multi-row
+            INSERT statement, falling back to one insert per record if
+            the backend doesn't support it. The records bypass onaccept,
+            so the caller must update the location tree afterwards.
+
+            @param records: list of dicts with the record data, all with
+                            the same keys
+        """
+
+        if not records:
+            return
+
+        db = current.db
+        table = current.s3db.gis_location
+
+        if len(records) > 1:
+            represent = db._adapter.represent
+            columns = None
+            values = []
+            try:
+                for record in records:
+                    fields = table._listify(record)
+                    if columns is None:
+                        columns = [f.name for f, v in fields]
+                    # Evaluate callable defaults (e.g. UUIDs)
+                    values.append("(%s)" % ", ".join([
+                        represent(v() if callable(v) else v, f.type)
+                        for f, v in fields]))
+            except:
+                columns = None
+            keys = set([tuple(sorted(record.keys())) for record in records])
+            if columns and len(keys) == 1:
+                sql = "INSERT INTO %s(%s) VALUES %s;" % \
+                      (table._tablename, ", ".join(columns), ", ".join(values))
+                savepoint = db._dbname == "postgres"
+                if savepoint:
+                    db.executesql("SAVEPOINT gis_insert_locations;")
+                try:
+                    db.executesql(sql)
+                except:
+                    # Multi-row INSERT not supported => insert one by one
+                    if savepoint:
+                        db.executesql("ROLLBACK TO SAVEPOINT gis_insert_locations;")
+                else:
+                    if savepoint:
+                        db.executesql("RELEASE SAVEPOINT gis_insert_locations;")
+                    return
+
+        for record in records:
+            table.insert(**record)
+        return
+
+    # -------------------------------------------------------------------------
+    def _update_location_paths(self, level):
+        """
+            Set the materialized paths of all locations in a level which
+            don't have one yet (e.g. after a bulk import), computing them
+            from the paths of their parents
+
+            @param level: the location level
+        """
+
+        db = current.db
+        table = current.s3db.gis_location
+
+        query = (table.level == level) & \
+                (table.path == None) & \
+                (table.deleted != True)
+        rows = db(query).select(table.id, table.parent)
+        if not rows:
+            return
+
+        # Look up the parent paths once
+        parent_ids = list(set([row.parent for row in rows if row.parent]))
+        paths = {}
+        if parent_ids:
+            query = (table.id.belongs(parent_ids))
+            for parent in db(query).select(table.id,
+                                           table.parent,
+                                           table.path):
+                path = parent.path
+                if not path:
+                    path = self.update_location_tree(parent.id, parent.parent)
+                paths[parent.id] = path
+
+        updates = []
+        for row in rows:
+            parent_path = paths.get(row.parent)
+            if parent_path:
+                path = "%s/%s" % (parent_path, row.id)
+            else:
+                path = str(row.id)
+            updates.append((row.id, {"path": path}))
+
+        batch_size = self.REBUILD_BATCH_SIZE
+        for i in xrange(0, len(updates), batch_size):
+            self._update_locations(("path",), updates[i:i + batch_size])
+        return
+
     # -------------------------------------------------------------------------
     @staticmethod
     def latlon_to_wkt(lat, lon):
@@ -3158,6 +3570,9 @@ class GIS(object):
             http://eden.sahanafoundation.org/wiki/HaitiGISToDo#HierarchicalTrees
             Do a lazy update of a database that does not have location paths.
             For convenience of get_parents, return the path.
+
+            Without location_id, the whole table gets rebuilt, see
+            rebuild_location_tree().
         """
 
         db = current.db
@@ -3193,30 +3608,169 @@ class GIS(object):
 
         else:
             # Do the whole database
-            query = (table.id > 0)
-            features = db(query).select(table.id,
-                                        table.gis_feature_type,
-                                        table.lat,
-                                        table.lon,
-                                        table.wkt,
-                                        table.parent)
-            for feature in features:
-                self.update_location_tree(feature.id, feature.parent)
-                # Also do the Bounds/Centroids/WKT
-                form = Storage()
-                form.vars = feature
-                form.errors = Storage()
-                self.wkt_centroid(form)
+            self.rebuild_location_tree()
+            return None
+
+    # -------------------------------------------------------------------------
+    def rebuild_location_tree(self):
+        """
+            Rebuild the materialized paths, centroids and bounds of all
+            locations in bulk:
+                - load the hierarchy once and compute all paths in memory
+                - compute the geometries batch-wise (see wkt_centroid)
+                - write back only the changed records, with one UPDATE
+                  statement per batch and set of changed fields
+
+            Does not commit, so the whole rebuild happens in the current
+            transaction.
+
+            @returns: the number of updated locations
+        """
+
+        db = current.db
+        table = current.s3db.gis_location
+        batch_size = self.REBUILD_BATCH_SIZE
+
+        # Load the hierarchy once
+        query = (table.id > 0)
+        rows = db(query).select(table.id,
+                                table.parent,
+                                table.path)
+        parents = {}
+        old_paths = {}
+        for row in rows:
+            parents[row.id] = row.parent
+            old_paths[row.id] = row.path
+        rows = None
+        total = len(parents)
+        s3_debug("Updating Location Tree: %s locations" % total)
+
+        # Compute all paths top-down: walk up each branch until a location
+        # with a known path (or the root), then set the paths on the way
+        # back down. Unknown parents and cycles end the branch.
+        paths = {}
+        for location_id in parents:
+            if location_id in paths:
+                continue
+            branch = [location_id]
+            visited = set(branch)
+            parent = parents[location_id]
+            while parent and parent in parents and \
+                  parent not in paths and parent not in visited:
+                branch.append(parent)
+                visited.add(parent)
+                parent = parents[parent]
+            if parent and parent in paths:
+                path = paths[parent]
+            else:
+                path = None
+            for node in reversed(branch):
+                if path:
+                    path = "%s/%s" % (path, node)
+                else:
+                    path = str(node)
+                paths[node] = path
+
+        # Geometries
+        fields = ("gis_feature_type", "lat", "lon", "wkt",
+                  "lat_max", "lat_min", "lon_min", "lon_max")
+        columns = [table[fn] for fn in fields]
+
+        wkt_centroid = self.wkt_centroid
+        ids = sorted(parents.keys())
+        updated = 0
+        for i in xrange(0, total, batch_size):
+            batch = ids[i:i + batch_size]
+            query = (table.id.belongs(batch))
+            rows = db(query).select(table.id, *columns)
+
+            # Changed fields per location, grouped by the set of fields
+            updates = {}
+            for row in rows:
+                location_id = row.id
+                values = {}
+
+                path = paths[location_id]
+                if path != old_paths[location_id]:
+                    values["path"] = path
+
+                form = Storage(vars=Storage(id=location_id,
+                                            gis_feature_type=row.gis_feature_type,
+                                            lat=row.lat,
+                                            lon=row.lon,
+                                            wkt=row.wkt),
+                               errors=Storage())
+                wkt_centroid(form)
                 _vars = form.vars
-                if "lat_max" in _vars:
-                    db(table.id == feature.id).update(gis_feature_type = _vars.gis_feature_type,
-                                                      lat = _vars.lat,
-                                                      lon = _vars.lon,
-                                                      wkt = _vars.wkt,
-                                                      lat_max = _vars.lat_max,
-                                                      lat_min = _vars.lat_min,
-                                                      lon_min = _vars.lon_min,
-                                                      lon_max = _vars.lon_max)
+                if "lat_max" in _vars and not form.errors:
+                    _vars.gis_feature_type = int(_vars.gis_feature_type)
+                    for fn in fields:
+                        if _vars[fn] != row[fn]:
+                            values.update([(f, _vars[f]) for f in fields])
+                            break
+
+                if values:
+                    key = tuple(sorted(values.keys()))
+                    if key not in updates:
+                        updates[key] = []
+                    updates[key].append((location_id, values))
+
+            for key in updates:
+                self._update_locations(key, updates[key])
+                updated += len(updates[key])
+
+            s3_debug("Updating Location Tree: %s of %s locations done, %s updated" %
+                     (min(i + batch_size, total), total, updated))
+
+        # Bounds have changed
+        self.invalidate_spatial_index()
+        return updated
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _update_locations(fieldnames, updates):
+        """
+            Update multiple gis_location records with one UPDATE statement,
+            with a CASE expression per field. The fields with update
+            defaults (e.g. modified_on) are set too, like the DAL does.
+
+            @param fieldnames: tuple of the names of the fields to update
+            @param updates: list of tuples (location_id, {fieldname: value})
+        """
+
+        if not updates:
+            return
+
+        db = current.db
+        table = current.s3db.gis_location
+        represent = db._adapter.represent
+
+        pkey = table._id.name
+        ids = [str(int(location_id)) for location_id, values in updates]
+
+        assignments = []
+        for fn in fieldnames:
+            field = table[fn]
+            cases = " ".join(["WHEN %s THEN %s" % (ids[i],
+                                                   represent(values[fn],
+                                                             field.type))
+                              for i, (location_id, values)
+                              in enumerate(updates)])
+            assignments.append("%s = CASE %s %s END" % (fn, pkey, cases))
+        for field in table:
+            if field.update is not None and field.name not in fieldnames:
+                value = field.update
+                if callable(value):
+                    value = value()
+                assignments.append("%s = %s" % (field.name,
+                                                represent(value, field.type)))
+
+        sql = "UPDATE %s SET %s WHERE %s IN (%s);" % (table._tablename,
+                                                     ", ".join(assignments),
+                                                     pkey,
+                                                     ", ".join(ids))
+        db.executesql(sql)
+        return
 
     # -------------------------------------------------------------------------
     @staticmethod
@@ -3336,6 +3890,17 @@ class GIS(object):
         db = current.db
         s3db = current.s3db
         table = s3db.gis_location
+
+        if not current.deployment_settings.get_gis_spatialdb():
+            # Use the spatial index
+            location_ids = self.get_location_ids_by_shape(shape,
+                                                          points=False)
+            if location_ids:
+                query = (table.id.belongs(location_ids))
+                for loc in db(query).select():
+                    yield loc
+            return
+
         in_bbox = self.query_features_by_bbox(*shape.bounds)
         has_wkt = (table.wkt != None) & (table.wkt != "")
 
@@ -3352,13 +3917,367 @@ class GIS(object):
         """
             Returns a generator of locations whose shape intersects the given LatLon.
 
-            Relies on Shapely.
+            Relies on Shapely, uses the spatial index unless
+            settings.gis.spatialdb is enabled.
             @todo: provide an option to use PostGIS/Spatialite
         """
 
         point = shapely.geometry.point.Point(lon, lat)
         return self._get_features_by_shape(point)
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def get_spatial_index():
+        """
+            Get the spatial index of all gis_locations (by their bounds,
+            or lat/lon for locations without bounds). The index is shared
+            by all requests in this process. Changes in this process
+            invalidate it onaccept, changes by other processes are detected
+            by checking the gis_location version every SPATIAL_INDEX_CHECK
+            seconds.
+
+            @returns: the S3SpatialIndex, values are the location IDs
+        """
+
+        db = current.db
+        table = current.s3db.gis_location
+
+        cache = GIS.SPATIAL_INDEX
+        now = time.time()
+        if cache.index is not None and \
+           now - cache.checked < GIS.SPATIAL_INDEX_CHECK:
+            return cache.index
+
+        version = GIS.get_location_version()
+        if cache.index is not None and cache.version == version:
+            cache.checked = now
+            return cache.index
+
+        query = (table.deleted != True)
+        rows = db(query).select(table.id,
+                                table.lon_min,
+                                table.lat_min,
+                                table.lon_max,
+                                table.lat_max,
+                                table.lon,
+                                table.lat)
+        items = []
+        append = items.append
+        for row in rows:
+            if row.lon_min is not None and row.lat_min is not None and \
+               row.lon_max is not None and row.lat_max is not None:
+                append((row.lon_min, row.lat_min,
+                        row.lon_max, row.lat_max, row.id))
+            elif row.lon is not None and row.lat is not None:
+                append((row.lon, row.lat, row.lon, row.lat, row.id))
+
+        index = S3SpatialIndex(items)
+        GIS.SPATIAL_INDEX = Storage(index=index,
+                                    version=version,
+                                    checked=now,
+                                    shapes={})
+        return index
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def get_location_version():
+        """
+            Cheap modification check for gis_location (also catches hard
+            deletes and changes which bypass the onaccept, e.g. bulk imports
+            or other processes)
+
+            @returns: tuple of row count and last modification date
+        """
+
+        return s3_table_version(current.s3db.gis_location)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def get_location_grid():
+        """
+            Get the grid of all gis_locations with lat/lon. The grid is
+            shared by all requests in this process, and rebuilt when
+            gis_location has been modified since it has been built (except
+            by update_location_grid). Callers must hold LOCATION_GRID_LOCK
+            while using the grid.
+
+            @returns: the S3PointGrid
+        """
+
+        version = GIS.get_location_version()
+        with GIS.LOCATION_GRID_LOCK:
+            cache = GIS.LOCATION_GRID
+            if cache.grid is not None and cache.version == version:
+                return cache.grid
+
+            db = current.db
+            table = current.s3db.gis_location
+            query = (table.deleted != True) & \
+                    (table.lat != None) & \
+                    (table.lon != None)
+            rows = db(query).select(table.id,
+                                    table.name,
+                                    table.lat,
+                                    table.lon)
+            grid = S3PointGrid([(row.id, row.lat, row.lon, row.name)
+                                for row in rows])
+            GIS.LOCATION_GRID = Storage(grid=grid,
+                                        version=version,
+                                        duplicates={})
+        return grid
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def update_location_grid(location_id):
+        """
+            Update the location grid after a gis_location has been created
+            or updated, so that imports do not rebuild the grid for every
+            item. The grid gets dropped instead if gis_location has also
+            been modified otherwise since it has been built (e.g. by
+            another process).
+
+            @param location_id: the gis_location record ID
+        """
+
+        db = current.db
+        table = current.s3db.gis_location
+
+        with GIS.LOCATION_GRID_LOCK:
+            cache = GIS.LOCATION_GRID
+            grid = cache.grid
+            if grid is None:
+                return
+
+            version = GIS.get_location_version()
+            if not s3_table_changed_only(table, cache.version, version,
+                                         lambda row: row.id == location_id):
+                GIS.LOCATION_GRID = Storage(grid=None,
+                                            version=None,
+                                            duplicates={})
+                return
+
+            row = db(table.id == location_id).select(table.id,
+                                                     table.name,
+                                                     table.lat,
+                                                     table.lon,
+                                                     table.deleted,
+                                                     limitby=(0, 1)).first()
+            grid.remove(location_id)
+            if row and not row.deleted and \
+               row.lat is not None and row.lon is not None:
+                grid.add(row.id, row.lat, row.lon, row.name)
+            cache.version = version
+            cache.duplicates = {}
+        return
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def get_location_duplicates(distance=50, start=0, limit=None):
+        """
+            Find pairs of gis_locations which are close together and
+            therefore possible duplicates, with the most similar names
+            first. Only the best LOCATION_DUPLICATES pairs are ranked, and
+            cached until gis_location gets modified.
+
+            @param distance: the maximum distance (in km)
+            @param start: index of the first pair to return
+            @param limit: maximum number of pairs to return
+
+            @returns: tuple (number of ranked pairs, list of tuples
+                      (location_id, name, location_id, name, distance))
+        """
+
+        with GIS.LOCATION_GRID_LOCK:
+            grid = GIS.get_location_grid()
+            duplicates = GIS.LOCATION_GRID.duplicates
+
+            pairs = duplicates.get(distance)
+            if pairs is None:
+                names = grid.names
+                size = GIS.LOCATION_DUPLICATES
+                heappush = heapq.heappush
+                heapreplace = heapq.heapreplace
+
+                # Keep the best pairs in a heap rather than all of them
+                ranking = []
+                for id1, id2, dist in grid.pairs(distance):
+                    # Weight the proximity by the similarity of the names
+                    name1 = names[id1]
+                    name2 = names[id2]
+                    similarity = s3_jaro_winkler(name1 and name1.lower(),
+                                                 name2 and name2.lower())
+                    score = similarity * (2.0 - dist / distance)
+                    item = (score, -dist, -id1, -id2)
+                    if len(ranking) < size:
+                        heappush(ranking, item)
+                    elif item > ranking[0]:
+                        heapreplace(ranking, item)
+                ranking.sort(reverse=True)
+                pairs = duplicates[distance] = [(-id1, names[-id1],
+                                                 -id2, names[-id2],
+                                                 -dist)
+                                                for score, dist, id1, id2 in ranking]
+
+        if limit is None:
+            return (len(pairs), pairs[start:])
+        else:
+            return (len(pairs), pairs[start:start + limit])
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def get_location_duplicate(name, lat, lon, distance=1, similarity=0.9):
+        """
+            Find a gis_location which is close to a point and has a
+            similar name (e.g. to deduplicate imports)
+
+            @param name: the name
+            @param lat: the latitude
+            @param lon: the longitude
+            @param distance: the maximum distance (in km)
+            @param similarity: the minimum Jaro-Winkler similarity of
+                               the names (0.0..1.0)
+
+            @returns: the location ID, or None if there is no match
+        """
+
+        if not name or lat is None or lon is None:
+            return None
+
+        name = name.lower()
+        with GIS.LOCATION_GRID_LOCK:
+            grid = GIS.get_location_grid()
+            names = grid.names
+            best = None
+            for location_id, dist in grid.near(lat, lon, distance):
+                other = names[location_id]
+                if not other:
+                    continue
+                match = s3_jaro_winkler(name, other.lower())
+                if match >= similarity and \
+                   (best is None or (match, -dist) > best[:2]):
+                    best = (match, -dist, location_id)
+        return best and best[2] or None
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def invalidate_spatial_index():
+        """
+            Invalidate the spatial index, to be called when a gis_location
+            has been created, updated or deleted. The index gets rebuilt
+            with the next lookup.
+        """
+
+        GIS.SPATIAL_INDEX = Storage(index=None, version=None, shapes={})
+        with GIS.LOCATION_GRID_LOCK:
+            GIS.LOCATION_GRID = Storage(grid=None, version=None, duplicates={})
+        return
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def update_spatial_index(location_id):
+        """
+            Update the spatial index after a gis_location has been created
+            or updated: the index gets rebuilt with the next lookup, whilst
+            the location grid is updated in-place (see update_location_grid)
+
+            @param location_id: the gis_location record ID
+        """
+
+        GIS.SPATIAL_INDEX = Storage(index=None, version=None, shapes={})
+        GIS.update_location_grid(location_id)
+        return
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _get_location_shapes(location_ids):
+        """
+            Get the prepared geometries for gis_locations, loading those
+            which are not cached yet with a single query
+
+            @param location_ids: list of gis_location record IDs
+            @returns: dict {location_id: (prepared geometry, has_wkt)},
+                      locations without geometry are omitted
+        """
+
+        cache = GIS.SPATIAL_INDEX
+        shapes = cache.shapes
+
+        missing = [i for i in location_ids if i not in shapes]
+        if missing:
+            if len(shapes) + len(missing) > GIS.SPATIAL_INDEX_SHAPES:
+                shapes = cache.shapes = {}
+            db = current.db
+            table = current.s3db.gis_location
+            query = (table.id.belongs(missing))
+            rows = db(query).select(table.id,
+                                    table.wkt,
+                                    table.lon,
+                                    table.lat)
+            Point = shapely.geometry.point.Point
+            for row in rows:
+                location_id = row.id
+                wkt = row.wkt
+                if wkt:
+                    try:
+                        shape = wkt_loads(wkt)
+                    except shapely.geos.ReadingError:
+                        s3_debug("Error reading wkt of location with id",
+                                 location_id)
+                        shapes[location_id] = None
+                        continue
+                    shapes[location_id] = (prep(shape), True)
+                elif row.lon is not None and row.lat is not None:
+                    shape = Point(row.lon, row.lat)
+                    shapes[location_id] = (prep(shape), False)
+                else:
+                    shapes[location_id] = None
+
+        output = {}
+        for location_id in location_ids:
+            shape = shapes.get(location_id)
+            if shape is not None:
+                output[location_id] = shape
+        return output
+
+    # -------------------------------------------------------------------------
+    def get_location_ids_by_shape(self, shape, points=True):
+        """
+            Get the IDs of all gis_locations which intersect a shape,
+            using the spatial index to find the candidates and prepared
+            geometries for the intersection test
+
+            @param shape: the Shapely geometry
+            @param points: include locations without WKT (by their lat/lon)
+            @returns: list of gis_location record IDs
+        """
+
+        index = self.get_spatial_index()
+        candidates = index.query(*shape.bounds)
+        if not candidates:
+            return []
+        shapes = self._get_location_shapes(candidates)
+
+        if shape.geom_type == "Point":
+            # Test the point against the (cached) prepared locations
+            intersects = lambda prepared: prepared.intersects(shape)
+        else:
+            # Prepare the shape once and test all locations against it
+            prepared_shape = prep(shape)
+            intersects = lambda prepared: \
+                         prepared_shape.intersects(prepared.context)
+
+        location_ids = []
+        append = location_ids.append
+        for location_id in candidates:
+            if location_id not in shapes:
+                continue
+            prepared, has_wkt = shapes[location_id]
+            if not has_wkt and not points:
+                continue
+            if intersects(prepared):
+                append(location_id)
+        return location_ids
+
     # -------------------------------------------------------------------------
     def _get_features_by_feature(self, feature):
         """
@@ -3574,7 +4493,6 @@ class GIS(object):
         settings = current.deployment_settings
         public_url = settings.get_base_public_url()
 
-        cachetable = s3db.gis_cache
         MAP_ADMIN = auth.s3_has_role(session.s3.system_roles.MAP_ADMIN)
 
         # Defaults
@@ -4458,6 +5376,668 @@ S3.gis.show_map();""" % ready
 
         return html
 
+# =============================================================================
+class S3SpatialIndex(object):
+    """
+        In-memory R-tree of bounding boxes, bulk-loaded with the
+        Sort-Tile-Recursive (STR) algorithm. The tree is static, i.e.
+        it needs to be rebuilt when the items change.
+    """
+
+    def __init__(self, items, node_capacity=10):
+        """
+            Constructor
+
+            @param items: iterable of tuples
+                          (lon_min, lat_min, lon_max, lat_max, value)
+            @param node_capacity: the maximum number of children per node
+        """
+
+        self.node_capacity = node_capacity
+
+        entries = list(items)
+        self.size = len(entries)
+        if not entries:
+            self.root = None
+            return
+
+        # Nodes are tuples (lon_min, lat_min, lon_max, lat_max,
+        # children, leaf), leaf nodes have the items as children
+        leaf = True
+        while True:
+            nodes = self._pack(entries, node_capacity, leaf)
+            if len(nodes) == 1:
+                break
+            entries = nodes
+            leaf = False
+        self.root = nodes[0]
+
+    # -------------------------------------------------------------------------
+    def __len__(self):
+
+        return self.size
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _pack(entries, capacity, leaf):
+        """
+            Pack entries into the nodes of the next tree level: sort
+            by the x center, cut into vertical slices, then sort each
+            slice by the y center and cut it into nodes
+
+            @param entries: the entries (items or nodes) to pack
+            @param capacity: the maximum number of entries per node
+            @param leaf: whether the entries are items
+            @returns: list of nodes
+        """
+
+        num_nodes = int(math.ceil(len(entries) / float(capacity)))
+        num_slices = int(math.ceil(math.sqrt(num_nodes)))
+        slice_size = num_slices * capacity
+
+        entries = sorted(entries, key=lambda e: e[0] + e[2])
+        nodes = []
+        for i in xrange(0, len(entries), slice_size):
+            tile = sorted(entries[i:i + slice_size],
+                          key=lambda e: e[1] + e[3])
+            for j in xrange(0, len(tile), capacity):
+                children = tile[j:j + capacity]
+                nodes.append((min([c[0] for c in children]),
+                              min([c[1] for c in children]),
+                              max([c[2] for c in children]),
+                              max([c[3] for c in children]),
+                              children,
+                              leaf))
+        return nodes
+
+    # -------------------------------------------------------------------------
+    def query(self, lon_min, lat_min, lon_max, lat_max):
+        """
+            Find all items whose bounding box intersects the given box
+
+            @param lon_min: minimum longitude
+            @param lat_min: minimum latitude
+            @param lon_max: maximum longitude
+            @param lat_max: maximum latitude
+            @returns: list of the item values
+        """
+
+        output = []
+        if self.root is None:
+            return output
+        stack = [self.root]
+        pop = stack.pop
+        while stack:
+            node = pop()
+            if node[0] > lon_max or node[2] < lon_min or \
+               node[1] > lat_max or node[3] < lat_min:
+                continue
+            children = node[4]
+            if node[5]:
+                for item in children:
+                    if item[0] <= lon_max and item[2] >= lon_min and \
+                       item[1] <= lat_max and item[3] >= lat_min:
+                        output.append(item[4])
+            else:
+                stack.extend(children)
+        return output
+
+# =============================================================================
+class S3PointGrid(object):
+    """
+        In-memory grid of points (lat/lon) for proximity searches: points
+        are bucketed into cells of CELL_SIZE degrees, so that a search only
+        needs to compute the distances to the points in the nearby cells.
+    """
+
+    # Size of the grid cells (in degrees)
+    CELL_SIZE = 0.25
+
+    # Kilometers per degree of latitude
+    KM_PER_DEGREE = math.pi * RADIUS_EARTH / 180
+
+    def __init__(self, points):
+        """
+            Constructor
+
+            @param points: iterable of tuples (id, lat, lon, name)
+        """
+
+        size = self.CELL_SIZE
+        self.columns = int(math.ceil(360 / size))
+
+        # {id: (lat radians, lon radians, cos(lat))}
+        self.coordinates = {}
+        # {id: name}
+        self.names = {}
+        # {id: (row, column)}
+        self.cells = {}
+        # {row: {column: [ids]}}
+        self.rows = {}
+
+        add = self.add
+        for point_id, lat, lon, name in points:
+            add(point_id, lat, lon, name)
+
+    # -------------------------------------------------------------------------
+    def __len__(self):
+
+        return len(self.coordinates)
+
+    # -------------------------------------------------------------------------
+    def add(self, point_id, lat, lon, name):
+        """
+            Add a point to the grid
+
+            @param point_id: the point ID
+            @param lat: the latitude
+            @param lon: the longitude
+            @param name: the name
+        """
+
+        row, column = cell = self.cell(lat, lon)
+        rows = self.rows
+        if row not in rows:
+            rows[row] = {}
+        cells = rows[row]
+        if column not in cells:
+            cells[column] = []
+        cells[column].append(point_id)
+        self.cells[point_id] = cell
+
+        lat = math.radians(lat)
+        self.coordinates[point_id] = (lat, math.radians(lon), math.cos(lat))
+        self.names[point_id] = name
+
+    # -------------------------------------------------------------------------
+    def remove(self, point_id):
+        """
+            Remove a point from the grid (if it is in the grid)
+
+            @param point_id: the point ID
+        """
+
+        cell = self.cells.pop(point_id, None)
+        if cell is None:
+            return
+        row, column = cell
+        cells = self.rows[row]
+        ids = cells[column]
+        ids.remove(point_id)
+        if not ids:
+            del cells[column]
+            if not cells:
+                del self.rows[row]
+        del self.coordinates[point_id]
+        del self.names[point_id]
+
+    # -------------------------------------------------------------------------
+    def cell(self, lat, lon):
+        """
+            Get the grid cell of a point
+
+            @param lat: the latitude
+            @param lon: the longitude
+            @returns: tuple (row, column)
+        """
+
+        size = self.CELL_SIZE
+        row = int(math.floor((lat + 90) / size))
+        column = int(math.floor((lon + 180) / size)) % self.columns
+        return (row, column)
+
+    # -------------------------------------------------------------------------
+    def candidates(self, lat, lon, distance):
+        """
+            Find all points in the cells within a distance from a point
+
+            @param lat: the latitude
+            @param lon: the longitude
+            @param distance: the distance (in km)
+            @returns: list of point IDs
+        """
+
+        size = self.CELL_SIZE
+        row, column = self.cell(lat, lon)
+
+        # Rows within the distance
+        span = distance / self.KM_PER_DEGREE
+        nrows = int(math.ceil(span / size))
+
+        # Columns within the distance (wider towards the poles)
+        edge = min(abs(lat) + span, 90)
+        cos_edge = math.cos(math.radians(edge))
+        if cos_edge > 1e-6:
+            ncolumns = int(math.ceil(span / cos_edge / size))
+        else:
+            ncolumns = self.columns
+        if 2 * ncolumns + 1 >= self.columns:
+            columns = None
+        else:
+            columns = [c % self.columns
+                       for c in xrange(column - ncolumns, column + ncolumns + 1)]
+
+        output = []
+        rows = self.rows
+        for r in xrange(row - nrows, row + nrows + 1):
+            cells = rows.get(r)
+            if not cells:
+                continue
+            if columns is None:
+                for ids in cells.values():
+                    output.extend(ids)
+            else:
+                for c in columns:
+                    ids = cells.get(c)
+                    if ids:
+                        output.extend(ids)
+        return output
+
+    # -------------------------------------------------------------------------
+    def distances(self, lat, lon, candidates, distance):
+        """
+            Compute the (Haversine) distances from a point to all
+            candidates, with the trigonometric functions of the point
+            computed only once
+
+            @param lat: the latitude (in radians)
+            @param lon: the longitude (in radians)
+            @param candidates: the point IDs
+            @param distance: the maximum distance (in km)
+
+            @returns: list of tuples (id, distance) for all points
+                      within the distance
+        """
+
+        sin = math.sin
+        asin = math.asin
+        sqrt = math.sqrt
+        coordinates = self.coordinates
+
+        # Maximum distance in radians
+        max_angle = distance / RADIUS_EARTH
+        # Maximum haversine
+        max_h = sin(min(max_angle, math.pi) / 2) ** 2
+        cos_lat = math.cos(lat)
+
+        output = []
+        append = output.append
+        for point_id in candidates:
+            lat2, lon2, cos_lat2 = coordinates[point_id]
+            dlat = lat2 - lat
+            if abs(dlat) > max_angle:
+                continue
+            h = sin(dlat / 2) ** 2 + \
+                cos_lat * cos_lat2 * sin((lon2 - lon) / 2) ** 2
+            if h <= max_h:
+                append((point_id, 2 * RADIUS_EARTH * asin(sqrt(min(h, 1.0)))))
+        return output
+
+    # -------------------------------------------------------------------------
+    def near(self, lat, lon, distance):
+        """
+            Find all points within a distance from a point
+
+            @param lat: the latitude
+            @param lon: the longitude
+            @param distance: the distance (in km)
+
+            @returns: list of tuples (id, distance)
+        """
+
+        candidates = self.candidates(lat, lon, distance)
+        return self.distances(math.radians(lat),
+                              math.radians(lon),
+                              candidates,
+                              distance)
+
+    # -------------------------------------------------------------------------
+    def pairs(self, distance):
+        """
+            Find all pairs of points within a distance from each other
+
+            @param distance: the distance (in km)
+            @returns: generator of tuples (id, id, distance), with the
+                      lower ID first
+        """
+
+        degrees = math.degrees
+        coordinates = self.coordinates
+        for point_id, (lat, lon, cos_lat) in coordinates.iteritems():
+            candidates = [c for c in self.candidates(degrees(lat),
+                                                     degrees(lon),
+                                                     distance)
+                          if c > point_id]
+            if not candidates:
+                continue
+            for other, dist in self.distances(lat, lon, candidates, distance):
+                yield (point_id, other, dist)
+
+# =============================================================================
+class S3LayerCache(object):
+    """
+        On-disk cache of the rendered output (GeoJSON/KML) of GIS Feature
+        Layers.
+
+        Entries are keyed by the layer, the request and the realms of the
+        user, and versioned by the last modification of the layer's table,
+        the gis_locations it references and the layer configuration. They
+        are never served if the data have changed since they have been
+        stored, and old versions get replaced when a new one is stored.
+
+        The viewport (bbox) is snapped to tiles (see GIS.snap_bbox) and the
+        zoom level only counts where the layer gets clustered, so that
+        panning and zooming in hits the same entries. Entries which have
+        not been used for MAX_AGE seconds, and the least recently used
+        ones beyond MAX_SIZE bytes, are removed when storing.
+
+        The version is also sent as ETag and Last-Modified, so clients can
+        revalidate unchanged layers with a 304 response.
+    """
+
+    # Representations to cache
+    FORMATS = ("geojson", "kml")
+
+    # URL variables which do not change the output (cache busters)
+    IGNORE = ("_", "_dc")
+
+    # Eviction: maximum age (seconds since last use) and total size (bytes)
+    MAX_AGE = 7 * 86400
+    MAX_SIZE = 100 * 1024 * 1024
+
+    def __init__(self, r):
+        """
+            Constructor
+
+            @param r: the S3Request of the Feature Layer export
+        """
+
+        self.r = r
+        self.resource = r.resource
+        self.layer_id = r.get_vars.layer
+
+        self.folder = os.path.join(r.folder, "cache", "layers")
+        self.key = self._key()
+
+        self._version = None
+        self._modified_on = None
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def cacheable(cls, r):
+        """
+            Check whether a request can be served from the cache
+
+            @param r: the S3Request
+        """
+
+        return bool(r.get_vars.layer) and \
+               r.representation in cls.FORMATS and \
+               r.http == "GET" and \
+               current.deployment_settings.get_gis_layer_cache()
+
+    # -------------------------------------------------------------------------
+    def _key(self):
+        """
+            The cache key: everything which changes the output except the
+            data, i.e. the resource, representation, URL variables (with
+            the bbox snapped to tiles), language and the realms of the user
+        """
+
+        r = self.r
+        auth = current.auth
+
+        get_vars = r.get_vars
+        items = sorted([(k, get_vars[k]) for k in get_vars
+                        if k not in self.IGNORE and k not in ("bbox", "zoom")])
+        if "bbox" in get_vars:
+            bbox = GIS.parse_bbox(get_vars.bbox)
+            if bbox:
+                bbox = GIS.snap_bbox(bbox)
+            items.append(("bbox", bbox))
+
+            # The zoom level only matters if the layer gets clustered
+            cluster_zoom = current.deployment_settings.get_gis_cluster_zoom()
+            try:
+                zoom = int(get_vars.zoom)
+            except (ValueError, TypeError):
+                zoom = None
+            if cluster_zoom is None or zoom is not None and zoom >= cluster_zoom:
+                zoom = None
+            items.append(("zoom", zoom))
+
+        # Realms (and the user, if access can depend on record ownership)
+        user = auth.user
+        if user:
+            realms = user.realms or {}
+            realms = sorted([(group_id, realms[group_id] and
+                                        sorted(realms[group_id]) or None)
+                             for group_id in realms])
+            if "owned_by_user" in self.resource.table.fields:
+                owner = user.id
+            else:
+                owner = None
+        else:
+            roles = current.session.s3 and current.session.s3.roles or []
+            realms = sorted(roles)
+            owner = None
+
+        key = repr((self.resource.tablename,
+                    r.component_name,
+                    r.id,
+                    r.representation,
+                    items,
+                    current.T.accepted_language,
+                    realms,
+                    owner))
+        return hashlib.md5(key).hexdigest()
+
+    # -------------------------------------------------------------------------
+    def version(self):
+        """
+            Determine the current version of the layer's data
+
+            @returns: tuple (version hash, last modification datetime)
+        """
+
+        if self._version is not None:
+            return self._version, self._modified_on
+
+        db = current.db
+        s3db = current.s3db
+        table = self.resource.table
+
+        # The table (count to also catch hard deletes)
+        count, modified_on = s3_table_version(table)
+        versions = [count]
+        dates = [modified_on]
+
+        # The referenced locations
+        gtable = s3db.gis_location
+        query = None
+        if "location_id" in table.fields:
+            query = (table.location_id == gtable.id)
+        elif "site_id" in table.fields:
+            stable = s3db.org_site
+            query = (table.site_id == stable.site_id) & \
+                    (stable.location_id == gtable.id)
+        if query is not None:
+            modified_on = gtable.modified_on.max()
+            dates.append(db(query).select(modified_on).first()[modified_on])
+
+        # The layer configuration
+        ftable = s3db.gis_layer_feature
+        ltable = s3db.gis_layer_symbology
+        query = (ftable.id == self.layer_id) & \
+                (ltable.layer_id == ftable.layer_id)
+        fmodified_on = ftable.modified_on.max()
+        lmodified_on = ltable.modified_on.max()
+        row = db(query).select(fmodified_on, lmodified_on).first()
+        if row:
+            dates.extend([row[fmodified_on], row[lmodified_on]])
+
+        dates = [d for d in dates if d is not None]
+        last_modified = dates and max(dates) or None
+        versions.extend(dates)
+
+        self._version = hashlib.md5(repr((self.key, versions))).hexdigest()
+        self._modified_on = last_modified
+        return self._version, self._modified_on
+
+    # -------------------------------------------------------------------------
+    def not_modified(self):
+        """
+            Check the conditional request headers against the current
+            version, and set the ETag and Last-Modified response headers
+
+            @returns: True if the client's copy is up to date (=> 304)
+        """
+
+        version, last_modified = self.version()
+
+        env = current.request.env
+        headers = current.response.headers
+
+        etag = '"%s"' % version
+        headers["ETag"] = etag
+        # Clients must revalidate, but may keep a copy
+        headers["Cache-Control"] = "private, max-age=0, must-revalidate"
+        headers.pop("Pragma", None)
+        headers.pop("Expires", None)
+        if last_modified:
+            headers["Last-Modified"] = \
+                time.strftime("%a, %d %b %Y %H:%M:%S GMT",
+                              last_modified.timetuple())
+
+        if_none_match = env.http_if_none_match
+        if if_none_match:
+            return etag in [t.strip() for t in if_none_match.split(",")]
+
+        if_modified_since = env.http_if_modified_since
+        if if_modified_since and last_modified:
+            since = parsedate(if_modified_since)
+            if since:
+                since = datetime.datetime(*since[:6])
+                return last_modified.replace(microsecond=0) <= since
+        return False
+
+    # -------------------------------------------------------------------------
+    def _path(self):
+        """ The file name of the current version """
+
+        version = self.version()[0]
+        return os.path.join(self.folder, "%s-%s.%s" % (self.key, version,
+                                                       self.r.representation))
+
+    # -------------------------------------------------------------------------
+    def get(self):
+        """
+            Get the cached output of the current version
+
+            @returns: the output, or None if not cached
+        """
+
+        path = self._path()
+        try:
+            f = open(path, "rb")
+        except IOError:
+            return None
+        try:
+            output = f.read()
+        finally:
+            f.close()
+        try:
+            # Mark as recently used (for the eviction)
+            os.utime(path, None)
+        except OSError:
+            pass
+        return output
+
+    # -------------------------------------------------------------------------
+    def store(self, output):
+        """
+            Store the output for the current version, and remove older
+            versions of this entry
+
+            @param output: the output (string)
+        """
+
+        folder = self.folder
+        if not os.path.exists(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                # Created concurrently, or not writable
+                if not os.path.isdir(folder):
+                    return
+        path = self._path()
+
+        # Write to a temporary file and rename it, so that concurrent
+        # requests never read a partial file
+        tmp = "%s.%s.tmp" % (path, os.getpid())
+        try:
+            f = open(tmp, "wb")
+            try:
+                if isinstance(output, unicode):
+                    output = output.encode("utf-8")
+                f.write(output)
+            finally:
+                f.close()
+            os.rename(tmp, path)
+        except (IOError, OSError):
+            s3_debug("Could not write layer cache file", path)
+            return
+
+        self._cleanup(os.path.basename(path))
+        return
+
+    # -------------------------------------------------------------------------
+    def _cleanup(self, filename):
+        """
+            Remove older versions of this entry, entries which have not
+            been used for MAX_AGE seconds, and the least recently used
+            entries beyond MAX_SIZE bytes
+
+            @param filename: the file name of the current version
+        """
+
+        folder = self.folder
+        prefix = "%s-" % self.key
+        now = time.time()
+
+        entries = []
+        for name in os.listdir(folder):
+            if name.endswith(".tmp") or name == filename:
+                continue
+            path = os.path.join(folder, name)
+            try:
+                if name.startswith(prefix):
+                    # Older version of this entry
+                    os.remove(path)
+                    continue
+                stat = os.stat(path)
+                if now - stat.st_mtime > self.MAX_AGE:
+                    os.remove(path)
+                    continue
+            except OSError:
+                # Removed concurrently
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        try:
+            total = os.path.getsize(os.path.join(folder, filename))
+        except OSError:
+            total = 0
+        entries.sort(reverse=True)
+        for mtime, size, path in entries:
+            total += size
+            if total > self.MAX_SIZE:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        return
+
 # =============================================================================
 class Marker(object):
     """
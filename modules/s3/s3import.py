@@ -954,12 +954,14 @@ class S3Importer(S3CRUD):
             args.update(mode=mode)
 
         # Generate the import job
+        bulk = current.deployment_settings.get_base_bulk_import()
         resource.import_xml(src,
                             format=fmt,
                             extra_data=self.csv_extra_data,
                             stylesheet=stylesheet,
                             ignore_errors = True,
                             commit_job = commit_job,
+                            bulk = bulk,
                             **args)
 
         job = resource.job
@@ -1089,9 +1091,11 @@ class S3Importer(S3CRUD):
             self._store_import_details(job_id, "preImportTree")
 
             # Now commit the remaining items
+            bulk = current.deployment_settings.get_base_bulk_import()
             msg = resource.import_xml(None,
                                       job_id = job_id,
-                                      ignore_errors = True)
+                                      ignore_errors = True,
+                                      bulk = bulk)
             return resource.error is None
 
     # -------------------------------------------------------------------------
@@ -1808,6 +1812,11 @@ class S3ImportItem(object):
         self.parent = None
         self.skip = False
 
+        # Bulk commit: original record already looked up by the job
+        self.original_checked = False
+        # Bulk commit: record data for the deferred insert
+        self.deferred = None
+
         # Conflict handling
         self.mci = 2
         self.mtime = datetime.utcnow()
@@ -1929,6 +1938,8 @@ class S3ImportItem(object):
             return
         if self.original is not None:
             original = self.original
+        elif self.original_checked:
+            original = None
         else:
             original = manager.original(table, self.data)
 
@@ -2041,12 +2052,15 @@ class S3ImportItem(object):
         return self.accepted
 
     # -------------------------------------------------------------------------
-    def commit(self, ignore_errors=False):
+    def commit(self, ignore_errors=False, bulk=False):
         """
             Commit this item to the database
 
             @param ignore_errors: skip invalid components
                                   (still reports errors)
+            @param bulk: do not insert new records, but store the record
+                         data in self.deferred for the job to insert it
+                         in a batch (the job must then call _postprocess)
         """
 
         manager = current.manager
@@ -2244,16 +2258,14 @@ class S3ImportItem(object):
                 if xml.MCI in table.fields:
                     data.update({xml.MCI:self.mci})
 
+                if bulk:
+                    # Leave the insert to the job
+                    self.deferred = dict(data)
+                    return True
+
                 # Insert the new record
-                try:
-                    success = table.insert(**dict(data))
-                except:
-                    self.error = sys.exc_info()[1]
-                    self.skip = True
+                if not self._insert(dict(data)):
                     return False
-                if success:
-                    self.id = success
-                    self.committed = True
 
             else:
                 # Nothing to create
@@ -2296,6 +2308,42 @@ class S3ImportItem(object):
                                                self.method))
             return True
 
+        self._postprocess()
+        return True
+
+    # -------------------------------------------------------------------------
+    def _insert(self, data):
+        """
+            Insert a new record for this item
+
+            @param data: the record data
+            @returns: True if successful, otherwise False (sets self.error)
+        """
+
+        try:
+            success = self.table.insert(**data)
+        except:
+            self.error = sys.exc_info()[1]
+            self.skip = True
+            return False
+        if success:
+            self.id = success
+            self.committed = True
+        return True
+
+    # -------------------------------------------------------------------------
+    def _postprocess(self):
+        """
+            Audit, update super-entities and call onaccept after this item
+            has been committed, then update the foreign keys in all items
+            which are referencing this item
+        """
+
+        manager = current.manager
+        db = current.db
+        model = manager.model
+        table = self.table
+
         # Audit + onaccept on successful commits
         if self.committed:
             form = Storage()
@@ -2339,7 +2387,7 @@ class S3ImportItem(object):
         _debug("Success: %s, id=%s %sd" % (self.tablename, self.id,
                                            self.skip and "skippe" or \
                                            self.method))
-        return True
+        return
 
     # -------------------------------------------------------------------------
     def _get_update_policy(self, field):
@@ -2608,6 +2656,8 @@ class S3ImportJob():
     JOB_TABLE_NAME = "s3_import_job"
     ITEM_TABLE_NAME = "s3_import_item"
 
+    BULK_SIZE = 250 # max number of records per batch insert (bulk commit)
+
     # -------------------------------------------------------------------------
     def __init__(self, manager, table,
                  tree=None,
@@ -2645,6 +2695,11 @@ class S3ImportJob():
         self.files = files
         self.directory = Storage()
 
+        # Index of all <resource> elements in the tree by UID/TUID
+        self.uidmap = None
+        if tree is not None:
+            self.uidmap = self.__build_uidmap(tree)
+
         self.elements = Storage()
         self.items = Storage()
         self.references = []
@@ -2695,6 +2750,41 @@ class S3ImportJob():
             import uuid
             self.job_id = uuid.uuid4() # unique ID for this job
 
+    # -------------------------------------------------------------------------
+    def __build_uidmap(self, tree):
+        """
+            Build an index of all <resource> elements in a tree, to look
+            up referenced elements without searching through the tree
+
+            @param tree: the element tree
+            @returns: a dict {(tablename, attr, uid): element}, where attr
+                      is either the UID or the TUID attribute name
+        """
+
+        xml = current.manager.xml
+
+        if isinstance(tree, etree._Element):
+            root = tree
+        else:
+            root = tree.getroot()
+
+        NAME = xml.ATTRIBUTE.name
+        attributes = (xml.UID, xml.ATTRIBUTE.tuid)
+
+        uidmap = {}
+        for element in root.iterdescendants(tag=xml.TAG.resource):
+            tablename = element.get(NAME, None)
+            if not tablename:
+                continue
+            for attr in attributes:
+                uid = element.get(attr, None)
+                if uid:
+                    key = (tablename, attr, uid)
+                    # First element in document order wins
+                    if key not in uidmap:
+                        uidmap[key] = element
+        return uidmap
+
     # -------------------------------------------------------------------------
     def add_item(self,
                  element=None,
@@ -2778,6 +2868,12 @@ class S3ImportJob():
                         celements = [celements[0]]
                         if uid:
                             celements[0].set(xml.UID, uid)
+                            # Update the element index
+                            uidmap = self.uidmap
+                            if uidmap is not None:
+                                key = (ctablename, xml.UID, uid)
+                                if key not in uidmap:
+                                    uidmap[key] = celements[0]
 
                     # @todo: match to component_id
 
@@ -2848,12 +2944,12 @@ class S3ImportJob():
         xml = manager.xml
         reference_list = []
 
-        root = None
+        uidmap = None
         if tree is not None:
-            if isinstance(tree, etree._Element):
-                root = tree
+            if tree is self.tree and self.uidmap is not None:
+                uidmap = self.uidmap
             else:
-                root = tree.getroot()
+                uidmap = self.__build_uidmap(tree)
         references = element.findall("reference")
         for reference in references:
             field = reference.get(xml.ATTRIBUTE.field, None)
@@ -2921,7 +3017,7 @@ class S3ImportJob():
                 if relements and not multiple:
                     relements = [relements[0]]
 
-            elif root is not None:
+            elif uidmap is not None:
 
                 for uid in uids:
 
@@ -2930,16 +3026,10 @@ class S3ImportJob():
                     if directory is not None:
                         entry = directory.get((tablename, attr, uid), None)
                     if not entry:
-                        expr = ".//%s[@%s='%s' and @%s='%s']" % (
-                                    xml.TAG.resource,
-                                    xml.ATTRIBUTE.name,
-                                    tablename,
-                                    attr,
-                                    uid)
-                        e = root.xpath(expr)
-                        if e:
+                        e = uidmap.get((tablename, attr, uid), None)
+                        if e is not None:
                             # Element in the source => append to relements
-                            relements.append(e[0])
+                            relements.append(e)
                         else:
                             # No element found, see if original record exists
                             _uid = xml.import_uid(uid)
@@ -3025,16 +3115,20 @@ class S3ImportJob():
         return True
 
     # -------------------------------------------------------------------------
-    def commit(self, ignore_errors=False):
+    def commit(self, ignore_errors=False, bulk=False):
         """
             Commit the import job to the DB
 
             @param ignore_errors: skip any items with errors
                                   (does still report the errors)
-        """
+            @param bulk: bulk commit mode - look up originals by UID with
+                         one query per table, insert new records in batches
+                         and run onaccept for each batch after the insert
 
-        manager = current.manager
-        xml = manager.xml
+            @note: in bulk mode, custom deduplicate resolvers only find
+                   records which have already been written, i.e. they can
+                   not detect duplicates within the same batch
+        """
 
         # Resolve references
         import_list = []
@@ -3043,22 +3137,278 @@ class S3ImportJob():
             if item_id not in import_list:
                 import_list.append(item_id)
         imports = [self.items[_id] for _id in import_list]
+
+        if bulk:
+            return self.__commit_bulk(imports, ignore_errors=ignore_errors)
+
         # Commit the items
         for item in imports:
-            error = None
-            success = item.commit(ignore_errors=ignore_errors)
-            error = item.error
-            if error:
-                self.error = error
-                element = item.element
-                if element is not None:
-                    if not element.get(xml.ATTRIBUTE.error, False):
-                        element.set(xml.ATTRIBUTE.error, str(self.error))
-                    self.error_tree.append(deepcopy(element))
+            item.commit(ignore_errors=ignore_errors)
+            if item.error:
+                self.__item_error(item)
+                if not ignore_errors:
+                    return False
+        return True
+
+    # -------------------------------------------------------------------------
+    def __item_error(self, item):
+        """
+            Report the error of an item in the error tree
+
+            @param item: the S3ImportItem
+        """
+
+        xml = current.manager.xml
+
+        self.error = item.error
+        element = item.element
+        if element is not None:
+            if not element.get(xml.ATTRIBUTE.error, False):
+                element.set(xml.ATTRIBUTE.error, str(self.error))
+            self.error_tree.append(deepcopy(element))
+        return
+
+    # -------------------------------------------------------------------------
+    def __commit_bulk(self, imports, ignore_errors=False):
+        """
+            Commit the items in bulk mode
+
+            @param imports: the items in import order
+            @param ignore_errors: skip any items with errors
+                                  (does still report the errors)
+        """
+
+        items = self.items
+
+        self.__find_originals(imports)
+
+        # Deferred inserts per table {tablename: [item, ...]}
+        pending = {}
+        flush = self.__flush
+
+        for item in imports:
+
+            # Write all pending records this item depends on
+            tablenames = set()
+            for reference in item.references:
+                entry = reference.entry
+                if entry and entry.item_id and entry.item_id in items:
+                    ritem = items[entry.item_id]
+                    if ritem.deferred is not None:
+                        tablenames.add(ritem.tablename)
+            tablename = item.tablename
+            if item.uid and tablename in pending and \
+               item.uid in [i.uid for i in pending[tablename]]:
+                # Same UID as a pending item => write that first
+                tablenames.add(tablename)
+            for tn in tablenames:
+                if not flush(pending.pop(tn), ignore_errors) and \
+                   not ignore_errors:
+                    return False
+
+            item.commit(ignore_errors=ignore_errors, bulk=True)
+
+            if item.deferred is not None:
+                batch = pending.get(tablename)
+                if batch is None:
+                    batch = pending[tablename] = []
+                batch.append(item)
+                if len(batch) >= self.BULK_SIZE:
+                    if not flush(pending.pop(tablename), ignore_errors) and \
+                       not ignore_errors:
+                        return False
+            elif item.error:
+                self.__item_error(item)
                 if not ignore_errors:
                     return False
+
+        # Write all remaining records
+        for tablename in pending.keys():
+            if not flush(pending.pop(tablename), ignore_errors) and \
+               not ignore_errors:
+                return False
         return True
 
+    # -------------------------------------------------------------------------
+    def __find_originals(self, imports):
+        """
+            Look up the original records of all new items by UID, with
+            one query per table (bulk commit)
+
+            @param imports: the import items
+        """
+
+        manager = current.manager
+        db = current.db
+        xml = manager.xml
+
+        UID = xml.UID
+        import_uid = xml.import_uid
+
+        # Collect the items per table
+        tables = {}
+        for item in imports:
+            table = item.table
+            if item.id or item.original is not None or \
+               table is None or item.data is None:
+                continue
+            # Items with other unique fields are looked up individually
+            unique = [f for f in table.fields
+                      if f != UID and table[f].unique and item.data.get(f)]
+            if unique:
+                continue
+            tablename = item.tablename
+            if tablename not in tables:
+                tables[tablename] = (table, [])
+            tables[tablename][1].append(item)
+
+        for tablename in tables:
+            table, items = tables[tablename]
+            if UID not in table.fields:
+                for item in items:
+                    item.original_checked = True
+                continue
+            uids = set()
+            for item in items:
+                uid = item.data.get(UID)
+                if uid:
+                    uids.add(import_uid(uid))
+            if uids:
+                query = table[UID].belongs(list(uids))
+                rows = db(query).select(table.ALL)
+                originals = dict((row[UID], row) for row in rows)
+            else:
+                originals = {}
+            seen = set()
+            for item in items:
+                uid = item.data.get(UID)
+                if uid:
+                    uid = import_uid(uid)
+                    if uid in seen:
+                        # Duplicate UID within the import: look up when
+                        # committing, i.e. after the first one is written
+                        continue
+                    seen.add(uid)
+                    original = originals.get(uid)
+                    if original is not None:
+                        item.original = original
+                item.original_checked = True
+        return
+
+    # -------------------------------------------------------------------------
+    def __flush(self, batch, ignore_errors=False):
+        """
+            Insert the records of a batch of deferred items (bulk commit),
+            then run onaccept for all successfully inserted items
+
+            @param batch: list of items of the same table
+            @param ignore_errors: skip any items with errors
+                                  (does still report the errors)
+            @returns: True if all records have been written, else False
+        """
+
+        if not batch:
+            return True
+
+        table = batch[0].table
+        records = [item.deferred for item in batch]
+
+        ids = self.__insert_multiple(table, records)
+        if ids is not None:
+            for item, record_id in zip(batch, ids):
+                item.id = record_id
+                item.committed = True
+        else:
+            # Not supported or failed => insert one by one (this will
+            # also report the errors per item)
+            for item in batch:
+                item._insert(item.deferred)
+
+        success = True
+        for item in batch:
+            item.deferred = None
+            if item.committed:
+                item._postprocess()
+            elif item.error:
+                self.__item_error(item)
+                success = False
+        return success
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def __insert_multiple(table, records):
+        """
+            Insert multiple records with one multi-row INSERT statement
+            (PostgreSQL only, needs INSERT...RETURNING)
+
+            @param table: the table
+            @param records: list of dicts with the record data
+            @returns: list of the new record IDs in the same order as
+                      records, or None if not supported or failed
+        """
+
+        db = current.db
+        if db._dbname != "postgres" or len(records) < 2:
+            return None
+
+        UID = current.manager.xml.UID
+        adapter = db._adapter
+        represent = adapter.represent
+        pkey = table._id.name
+
+        # Group the records by column set (fields with defaults etc.)
+        groups = {}
+        order = []
+        for index, record in enumerate(records):
+            try:
+                fields = table._listify(record)
+            except:
+                return None
+            # Evaluate callable defaults (e.g. UIDs) here, so that the
+            # new records can be matched by UID
+            fields = [(f, v() if callable(v) else v) for f, v in fields]
+            columns = tuple([f.name for f, v in fields])
+            values = "(%s)" % ", ".join([represent(v, f.type)
+                                         for f, v in fields])
+            if UID in columns:
+                uid = fields[columns.index(UID)][1]
+            else:
+                uid = None
+            if columns not in groups:
+                groups[columns] = []
+                order.append(columns)
+            groups[columns].append((index, uid, values))
+
+        ids = [None] * len(records)
+        savepoint = "s3_import_bulk"
+        db.executesql("SAVEPOINT %s;" % savepoint)
+        try:
+            for columns in order:
+                group = groups[columns]
+                returning = UID in columns and \
+                            "%s, %s" % (pkey, UID) or pkey
+                sql = "INSERT INTO %s(%s) VALUES %s RETURNING %s;" % \
+                      (table._tablename,
+                       ", ".join(columns),
+                       ", ".join([g[2] for g in group]),
+                       returning)
+                rows = db.executesql(sql)
+                if len(rows) != len(group):
+                    raise RuntimeError("Bulk insert failed")
+                if UID in columns:
+                    # Match the new IDs by UID
+                    new_ids = dict((row[1], row[0]) for row in rows)
+                    for index, uid, values in group:
+                        ids[index] = new_ids[uid]
+                else:
+                    for (index, uid, values), row in zip(group, rows):
+                        ids[index] = row[0]
+        except:
+            db.executesql("ROLLBACK TO SAVEPOINT %s;" % savepoint)
+            return None
+        db.executesql("RELEASE SAVEPOINT %s;" % savepoint)
+        return ids
+
     # -------------------------------------------------------------------------
     def __define_tables(self):
         """
@@ -55,6 +55,9 @@ class S3Model(object):
     LOAD = "s3_model_load"
     DELETED = "deleted"
 
+    # Index of the model modules {prefix: index}, see index()
+    INDEX = {}
+
     def __init__(self, module=None):
         """ Constructor """
 
@@ -184,28 +187,7 @@ class S3Model(object):
             return db[tablename]
         else:
             prefix, name = tablename.split("_", 1)
-            models = current.models
-            if hasattr(models, prefix):
-                module = models.__dict__[prefix]
-                loaded = False
-                generic = []
-                for n in module.__all__:
-                    model = module.__dict__[n]
-                    if type(model).__name__ == "type":
-                        if loaded:
-                            continue
-                        if hasattr(model, "names"):
-                            if tablename in model.names:
-                                model(prefix)
-                                loaded = True
-                                generic = []
-                            else:
-                                continue
-                        else:
-                            generic.append(n)
-                    elif n.startswith("%s_" % prefix):
-                        response.s3[n] = model
-                [module.__dict__[n](prefix) for n in generic]
+            S3Model.__load_models(prefix, tablename)
         if tablename not in db:
             # Backward compatiblity
             manager = current.manager
@@ -233,28 +215,7 @@ class S3Model(object):
             return response.s3[name]
         elif "_" in name:
             prefix = name.split("_", 1)[0]
-            models = current.models
-            if hasattr(models, prefix):
-                module = models.__dict__[prefix]
-                loaded = False
-                generic = []
-                for n in module.__all__:
-                    model = module.__dict__[n]
-                    if type(model).__name__ == "type":
-                        if loaded:
-                            continue
-                        if hasattr(model, "names"):
-                            if name in model.names:
-                                model(prefix)
-                                loaded = True
-                                generic = []
-                            else:
-                                continue
-                        else:
-                            generic.append(n)
-                    elif n.startswith("%s_" % prefix):
-                        response.s3[n] = model
-                [module.__dict__[n](prefix) for n in generic]
+            S3Model.__load_models(prefix, name)
         if name in response.s3:
             return response.s3[name]
         elif isinstance(default, Exception):
@@ -262,6 +223,79 @@ class S3Model(object):
         else:
             return default
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def index(prefix):
+        """
+            Get the index of a model module, i.e. which model class
+            defines which name. The index is built on first access and
+            then kept for the lifetime of the module.
+
+            @param prefix: the module name (=prefix)
+
+            @returns: Storage with the module, names={name: classname}
+                      (first class wins), generic=[classname, ...] (model
+                      classes without names attribute) and exports=[name,
+                      ...] (the prefixed non-class names), or None if
+                      there is no such module
+        """
+
+        models = current.models
+        if models is None or not hasattr(models, prefix):
+            return None
+        module = models.__dict__[prefix]
+
+        INDEX = S3Model.INDEX
+        index = INDEX.get(prefix)
+        if index is None or index.module is not module or \
+           index.all is not module.__all__:
+            names = {}
+            generic = []
+            exports = []
+            for n in module.__all__:
+                model = module.__dict__[n]
+                if type(model).__name__ == "type":
+                    if hasattr(model, "names"):
+                        for name in model.names:
+                            if name not in names:
+                                names[name] = n
+                    else:
+                        generic.append(n)
+                elif n.startswith("%s_" % prefix):
+                    exports.append(n)
+            index = Storage(module=module,
+                            all=module.__all__,
+                            names=names,
+                            generic=generic,
+                            exports=exports)
+            INDEX[prefix] = index
+        return index
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def __load_models(prefix, name):
+        """
+            Load the model class which defines a name, or all generic
+            model classes of the module if no class defines this name
+
+            @param prefix: the module name (=prefix)
+            @param name: the table name or response.s3 name
+        """
+
+        index = S3Model.index(prefix)
+        if index is None:
+            return
+        module = index.module.__dict__
+        s3 = current.response.s3
+        for n in index.exports:
+            s3[n] = module[n]
+        if name in index.names:
+            module[index.names[name]](prefix)
+        else:
+            for n in index.generic:
+                module[n](prefix)
+        return
+
     # -------------------------------------------------------------------------
     @staticmethod
     def load(name):
@@ -39,16 +39,29 @@
 """
 
 __all__ = ["S3Msg",
+           "S3MsgDispatcher",
            "S3Compose"]
 
 import datetime
 import difflib
+import httplib
+import Queue
+import select
+import smtplib
+import socket
 import string
+import threading
+import time
 import urllib
-from urllib2 import urlopen
+import urlparse
+from email.header import Header
+from email.mime.text import MIMEText
+from email.utils import formatdate
+from uuid import uuid4
 
 from gluon import current
 from gluon.html import *
+from gluon.storage import Storage
 from gluon.http import redirect
 
 from s3crud import S3CRUD
@@ -68,12 +81,29 @@ TWITTER_HAS_PREV_PREFIX = u'\u2026 '
 class S3Msg(object):
     """ Messaging framework """
 
+    # Name fields with phonetic keys for the message parser
+    # (see update_name_keys)
+    NAME_KEY_FIELDS = {"pr_person": ("first_name", "middle_name", "last_name"),
+                       "org_organisation": ("name", "acronym"),
+                       "hms_hospital": ("name", "aka1", "aka2"),
+                       }
+
+    # Phonetic keys loaded by this process, {tablename: Storage},
+    # shared by the request threads
+    NAME_KEYS = {}
+    NAME_KEYS_LOCK = threading.RLock()
+
+    # Number of Outbox messages to send per batch (see process_outbox)
+    OUTBOX_BATCH_SIZE = 500
+
     def __init__(self,
                  modem=None):
 
         T = current.T
         self.mail = current.mail
         self.modem = modem
+        # Settings and connections of the current batch (see open_batch)
+        self.batch = None
 
         # http://docs.oasis-open.org/emergency/edxl-have/cs01/xPIL-types.xsd
         # <xs:simpleType name="CommunicationMediaTypeList">
@@ -238,18 +268,11 @@ class S3Msg(object):
         if "person" in pquery:
             
             table = s3db.pr_person
-            rows = db(table.id > 0).select(table.pe_id,
-                                           table.first_name,
-                                           table.middle_name,
-                                           table.last_name)
-            for row in rows:
-                result = []
-                if (soundex(str(name)) == soundex(str(row.first_name))) or \
-                   (soundex(str(name)) == soundex(str(row.middle_name))) or \
-                   (soundex(str(name)) == soundex(str(row.last_name))):
-                    presult = dict(name = row.first_name, id = row.pe_id)
-                    result.append(presult)
-                    break    
+            row = S3Msg.find_by_name("pr_person", name, [table.pe_id])
+            result = []
+            if row:
+                presult = dict(name = row.first_name, id = row.pe_id)
+                result.append(presult)
             
             if len(result) > 1:
                 return T("Multiple Matches")
@@ -281,18 +304,10 @@ class S3Msg(object):
         #  Hospital Search [example: get name hospital facility status ]
         if "hospital" in pquery:
             table = s3db.hms_hospital
-            rows = db(table.id > 0).select(table.id,
-                                           table.name,
-                                           table.aka1,
-                                           table.aka2)
-            for row in rows:
-                result = []
-                if (soundex(str(name)) == soundex(str(row.name))) or \
-                   (soundex(name) == soundex(str(row.aka1))) or \
-                   (soundex(name) == soundex(str(row.aka2))):
-                    result.append(row)
-                    break    
-            
+            row = S3Msg.find_by_name("hms_hospital", name)
+            result = []
+            if row:
+                result.append(row)
 
             if len(result) > 1:
                 return T("Multiple Matches")
@@ -319,16 +334,10 @@ class S3Msg(object):
         # Organization search [example: get name organisation phone]
         if "organisation" in pquery:
             table = s3db.org_organisation
-            rows = db(table.id > 0).select(table.id,
-                                           table.name,
-                                           table.acronym)
-            for row in rows:
-                result = []
-                if (soundex(str(name)) == soundex(str(row.name))) or \
-                   (soundex(str(name)) == soundex(str(row.acronym))):
-                    result.append(row)
-                    break    
-            
+            row = S3Msg.find_by_name("org_organisation", name)
+            result = []
+            if row:
+                result.append(row)
             if len(result) > 1:
                 return T("Multiple Matches")
 
@@ -349,6 +358,205 @@ class S3Msg(object):
 
         return "Please provide one of the keywords - person, hospital, organisation"
 
+    # -------------------------------------------------------------------------
+    # Phonetic name keys for the parser
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def phonetic_key(name):
+        """
+            Get the phonetic key (soundex) of a name
+
+            @param name: the name
+            @returns: the key, or None if the name has no letters
+        """
+
+        if not name:
+            return None
+        if isinstance(name, unicode):
+            name = name.encode("utf-8")
+        else:
+            name = str(name)
+        key = soundex(name)
+        if key[0] == "0":
+            # No letters
+            return None
+        return key
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def update_name_keys(cls, tablename, record_id):
+        """
+            Update the phonetic keys of a record, to be called onaccept
+
+            @param tablename: the tablename
+            @param record_id: the record ID
+        """
+
+        fields = cls.NAME_KEY_FIELDS.get(tablename)
+        if not fields or not record_id:
+            return
+
+        db = current.db
+        s3db = current.s3db
+        table = s3db[tablename]
+        ktable = s3db.msg_name_key
+
+        record = db(table.id == record_id).select(table.deleted,
+                                                  limitby=(0, 1),
+                                                  *[table[f] for f in fields]
+                                                  ).first()
+        query = (ktable.tablename == tablename) & \
+                (ktable.record_id == record_id)
+        db(query).delete()
+        if record and not record.deleted:
+            keys = set([cls.phonetic_key(record[f]) for f in fields])
+            for key in keys:
+                if key:
+                    ktable.insert(tablename=tablename,
+                                  record_id=record_id,
+                                  phonetic_key=key)
+        return
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def rebuild_name_keys(cls, tablename):
+        """
+            Rebuild the phonetic keys of all records in a table, and mark
+            the table as complete (with a key without record_id)
+
+            @param tablename: the tablename
+        """
+
+        fields = cls.NAME_KEY_FIELDS.get(tablename)
+        if not fields:
+            return
+
+        db = current.db
+        s3db = current.s3db
+        table = s3db[tablename]
+        ktable = s3db.msg_name_key
+
+        db(ktable.tablename == tablename).delete()
+        with cls.NAME_KEYS_LOCK:
+            cls.NAME_KEYS.pop(tablename, None)
+
+        phonetic_key = cls.phonetic_key
+        last = 0
+        while True:
+            query = (table.deleted != True) & (table.id > last)
+            rows = db(query).select(table.id,
+                                    orderby=table.id,
+                                    limitby=(0, 1000),
+                                    *[table[f] for f in fields])
+            items = []
+            for row in rows:
+                keys = set([phonetic_key(row[f]) for f in fields])
+                for key in keys:
+                    if key:
+                        items.append(dict(tablename=tablename,
+                                          record_id=row.id,
+                                          phonetic_key=key))
+            if items:
+                ktable.bulk_insert(items)
+            if len(rows) < 1000:
+                break
+            last = rows.last().id
+
+        # All records have keys now
+        ktable.insert(tablename=tablename,
+                      record_id=None,
+                      phonetic_key=None)
+        return
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def get_name_keys(cls, tablename):
+        """
+            Get the phonetic keys of a table, loading the keys which have
+            been added since the last call (by any process). The caller
+            must hold NAME_KEYS_LOCK while using the keys.
+
+            @param tablename: the tablename
+            @returns: dict {phonetic key: set of record IDs}
+        """
+
+        db = current.db
+        s3db = current.s3db
+        ktable = s3db.msg_name_key
+
+        with cls.NAME_KEYS_LOCK:
+            index = cls.NAME_KEYS.get(tablename)
+            if index is None:
+                # Records which existed before the keys were introduced
+                # don't have keys until the first full build
+                query = (ktable.tablename == tablename) & \
+                        (ktable.record_id == None)
+                if not db(query).select(ktable.id, limitby=(0, 1)).first():
+                    cls.rebuild_name_keys(tablename)
+                index = cls.NAME_KEYS[tablename] = Storage(last=0, keys={})
+
+            # Keys are replaced rather than updated, so it is sufficient
+            # to load the new ones (outdated keys are filtered out in
+            # find_by_name)
+            query = (ktable.tablename == tablename) & \
+                    (ktable.id > index.last)
+            rows = db(query).select(ktable.id,
+                                    ktable.record_id,
+                                    ktable.phonetic_key,
+                                    orderby=ktable.id)
+            keys = index.keys
+            for row in rows:
+                key = row.phonetic_key
+                if key is None:
+                    # Complete-marker
+                    continue
+                if key not in keys:
+                    keys[key] = set()
+                keys[key].add(row.record_id)
+            if rows:
+                index.last = rows.last().id
+        return keys
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def find_by_name(cls, tablename, name, fields=None):
+        """
+            Find the first record with a name that sounds like the given
+            name (by phonetic key)
+
+            @param tablename: the tablename
+            @param name: the name
+            @param fields: additional fields to select
+
+            @returns: the record (Row), or None if there is no match
+        """
+
+        key = cls.phonetic_key(name)
+        if not key:
+            return None
+        with cls.NAME_KEYS_LOCK:
+            record_ids = cls.get_name_keys(tablename).get(key)
+            if not record_ids:
+                return None
+            record_ids = list(record_ids)
+
+        db = current.db
+        table = current.s3db[tablename]
+        name_fields = cls.NAME_KEY_FIELDS[tablename]
+
+        query = (table.id.belongs(record_ids)) & \
+                (table.deleted != True)
+        rows = db(query).select(table.id,
+                                orderby=table.id,
+                                *([table[f] for f in name_fields] +
+                                  (fields or [])))
+        for row in rows:
+            # Check the current names, in case the keys are outdated
+            for f in name_fields:
+                if cls.phonetic_key(row[f]) == key:
+                    return row
+        return None
+
 
 
     # =========================================================================
@@ -643,150 +851,429 @@ class S3Msg(object):
             If succesful then move from Outbox to Sent.
             Can be called from Cron
 
+            Group and Organisation recipients are expanded into their
+            members first, then the pending messages are sent in batches
+            of OUTBOX_BATCH_SIZE, with the contacts of each batch looked
+            up in one query and the connections to the gateways kept open
+            for the whole run.
+
+            If worker threads are configured for the contact method, the
+            messages are sent with a S3MsgDispatcher instead.
+
             @ToDo: contact_method = "ALL"
         """
 
+        settings = current.deployment_settings
+        if settings.get_msg_dispatch_workers(contact_method):
+            dispatcher = S3MsgDispatcher(self)
+            return dispatcher.run([contact_method])
+
         db = current.db
         s3db = current.s3db
 
+        sms_handler = None
         if contact_method == "SMS":
             table = s3db.msg_setting
             settings = db(table.id > 0).select(table.outgoing_sms_handler,
                                                limitby=(0, 1)).first()
             if not settings:
                 raise ValueError("No SMS handler defined!")
-            outgoing_sms_handler = settings.outgoing_sms_handler
-
-        def dispatch_to_pe_id(pe_id):
-            table = s3db.pr_contact
-            query = (table.pe_id == pe_id) & \
-                    (table.contact_method == contact_method) & \
-                    (table.deleted == False)
-            recipient = db(query).select(table.value,
-                                         orderby = table.priority,
-                                         limitby=(0, 1)).first()
-            if recipient:
-                if contact_method == "EMAIL":
-                    return self.send_email(recipient.value,
-                                           subject,
-                                           message)
-                elif contact_method == "SMS":
-                    if outgoing_sms_handler == "WEB_API":
-                        return self.send_sms_via_api(recipient.value,
-                                                     message)
-                    elif outgoing_sms_handler == "SMTP":
-                        return self.send_sms_via_smtp(recipient.value,
-                                                       message)
-                    elif outgoing_sms_handler == "MODEM":
-                        return self.send_sms_via_modem(recipient.value,
-                                                       message)
-                    elif outgoing_sms_handler == "TROPO":
-                        # NB This does not mean the message is sent
-                        return self.send_text_via_tropo(row.id,
-                                                        message_id,
-                                                        recipient.value,
-                                                        message)
-                    else:
-                        return False
+            sms_handler = settings.outgoing_sms_handler
 
-                elif contact_method == "TWITTER":
-                    return self.send_text_via_twitter(recipient.value,
-                                                      message)
-            return False
+        # Replace Group & Organisation recipients by their members
+        self.expand_outbox(contact_method)
+
+        table = s3db.msg_outbox
+        query = (table.status == 1) & \
+                (table.pr_message_method == contact_method)
+        size = self.OUTBOX_BATCH_SIZE
+        last_id = 0
+        self.open_batch()
+        try:
+            while True:
+                rows = db(query & (table.id > last_id)).select(table.id,
+                                                               table.message_id,
+                                                               table.pe_id,
+                                                               orderby=table.id,
+                                                               limitby=(0, size))
+                if not rows:
+                    break
+                last_id = rows.last().id
+                self.dispatch_outbox(rows, contact_method, sms_handler)
+                # Explicitly commit DB operations when running from Cron
+                db.commit()
+        finally:
+            self.close_batch()
+
+        return
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def expand_outbox(contact_method="EMAIL"):
+        """
+            Replace the pending Group and Organisation recipients in the
+            Outbox by system-generated messages to each of their members
+            (the persons in the group, or the staff/volunteers of the
+            organisation), and mark the original messages as sent
+
+            @param contact_method: the contact method to process
+            @returns: the number of messages added to the Outbox
+        """
+
+        db = current.db
+        s3db = current.s3db
 
         table = s3db.msg_outbox
         ltable = s3db.msg_log
-        ptable = s3db.pr_person
         petable = s3db.pr_pentity
+        ptable = s3db.pr_person
 
         query = (table.status == 1) & \
-                (table.pr_message_method == contact_method)
-        rows = db(query).select()
-        chainrun = False # Used to fire process_outbox again - Used when messages are sent to groups
+                (table.pr_message_method == contact_method) & \
+                (petable.id == table.pe_id) & \
+                (petable.instance_type.belongs(("pr_group",
+                                                "org_organisation")))
+        rows = db(query).select(table.id,
+                                table.message_id,
+                                table.pe_id,
+                                petable.instance_type)
+        if not rows:
+            return 0
+
+        entities = {}
+        for row in rows:
+            instance_type = row[petable.instance_type]
+            entities.setdefault(instance_type, set()).add(row[table.pe_id])
+
+        # Members of all the entities, {entity pe_id: set of person pe_ids}
+        members = {}
+        if "pr_group" in entities:
+            gtable = s3db.pr_group
+            mtable = s3db.pr_group_membership
+            query = (gtable.pe_id.belongs(entities["pr_group"])) & \
+                    (mtable.group_id == gtable.id) & \
+                    (mtable.deleted != True) & \
+                    (ptable.id == mtable.person_id) & \
+                    (ptable.deleted != True)
+            for member in db(query).select(gtable.pe_id, ptable.pe_id):
+                members.setdefault(member[gtable.pe_id],
+                                   set()).add(member[ptable.pe_id])
+        if "org_organisation" in entities:
+            otable = s3db.org_organisation
+            htable = s3db.hrm_human_resource
+            query = (otable.pe_id.belongs(entities["org_organisation"])) & \
+                    (htable.organisation_id == otable.id) & \
+                    (htable.deleted != True) & \
+                    (ptable.id == htable.person_id) & \
+                    (ptable.deleted != True)
+            for member in db(query).select(otable.pe_id, ptable.pe_id):
+                members.setdefault(member[otable.pe_id],
+                                   set()).add(member[ptable.pe_id])
+
+        # Send each message only once to each person, even if they are
+        # in several of the recipient groups
+        recipients = {}
+        for row in rows:
+            message_id = row[table.message_id]
+            pe_ids = members.get(row[table.pe_id])
+            if pe_ids:
+                recipients.setdefault(message_id, set()).update(pe_ids)
+        items = [dict(message_id = message_id,
+                      pe_id = pe_id,
+                      pr_message_method = contact_method,
+                      system_generated = True)
+                 for message_id in recipients
+                 for pe_id in recipients[message_id]]
+        if items:
+            table.bulk_insert(items)
+
+        db(table.id.belongs([row[table.id] for row in rows])).update(status=2)
+        message_ids = set([row[table.message_id] for row in rows])
+        db(ltable.id.belongs(message_ids)).update(actioned=True)
+        db.commit()
+
+        return len(items)
+
+    # -------------------------------------------------------------------------
+    def dispatch_outbox(self, rows, contact_method="EMAIL", sms_handler=None):
+        """
+            Send a batch of pending messages from the Outbox, and mark
+            those which have been sent. Messages to entities other than
+            persons (which should have been expanded before) are marked
+            as sent without sending them.
+
+            @param rows: the msg_outbox rows (id, message_id, pe_id)
+            @param contact_method: the contact method
+            @param sms_handler: the outgoing SMS handler
+            @returns: the IDs of the msg_outbox records which have been sent
+        """
+
+        jobs, other = self.prepare_outbox(rows, contact_method)
+
+        sent = [row.id for row in other]
+        actioned = set([row.message_id for row in other])
+        failed = []
+        for job in jobs:
+            try:
+                status = self.dispatch(contact_method,
+                                       job.recipient,
+                                       job.subject,
+                                       job.message,
+                                       outbox_id=job.outbox_id,
+                                       message_id=job.message_id,
+                                       sms_handler=sms_handler)
+            except S3MsgUnconfirmed, e:
+                # May have been sent => must not be sent again
+                s3_debug("s3msg", "Message not confirmed: %s" % e)
+                failed.append(job.outbox_id)
+                continue
+            if status:
+                sent.append(job.outbox_id)
+                actioned.add(job.message_id)
+
+        self.outbox_sent(sent, actioned)
+        self.outbox_failed(failed)
+        return sent
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def prepare_outbox(cls, rows, contact_method="EMAIL"):
+        """
+            Look up the messages and the recipient contacts for a batch
+            of Outbox rows
+
+            @param rows: the msg_outbox rows (id, message_id, pe_id)
+            @param contact_method: the contact method
+            @returns: tuple (jobs, other), with jobs = the messages to
+                      send, as list of Storages (outbox_id, message_id,
+                      recipient, subject, message), and other = the rows
+                      with messages to other entities than persons.
+                      Rows without message or contact are in neither.
+        """
+
+        db = current.db
+        s3db = current.s3db
+
+        ltable = s3db.msg_log
+        petable = s3db.pr_pentity
+
+        message_ids = set([row.message_id for row in rows])
+        query = (ltable.id.belongs(message_ids))
+        messages = db(query).select(ltable.id,
+                                    ltable.subject,
+                                    ltable.message).as_dict()
+
+        pe_ids = set([row.pe_id for row in rows])
+        query = (petable.id.belongs(pe_ids))
+        entities = db(query).select(petable.id,
+                                    petable.instance_type)
+        entity_types = dict([(e.id, e.instance_type) for e in entities])
+
+        persons = [pe_id for pe_id in pe_ids
+                   if entity_types.get(pe_id) == "pr_person"]
+        contacts = cls.get_contacts(persons, contact_method)
+
+        jobs = []
+        other = []
         for row in rows:
-            status = True
             message_id = row.message_id
-            query = (ltable.id == message_id)
-            logrow = db(query).select(limitby=(0, 1)).first()
+            logrow = messages.get(message_id)
             if not logrow:
                 s3_debug("s3msg", "logrow not found")
                 continue
-            # Get message from msg_log
-            message = logrow.message
-            subject = logrow.subject
-            sender_pe_id = logrow.pe_id
-            # Determine list of users
             entity = row.pe_id
-            query = petable.id == entity
-            entity_type = db(query).select(petable.instance_type,
-                                           limitby=(0, 1)).first()
-            if entity_type:
-                entity_type = entity_type.instance_type
+            entity_type = entity_types.get(entity)
+            if entity_type == "pr_person":
+                recipient = contacts.get(entity)
+                if recipient:
+                    jobs.append(Storage(outbox_id = row.id,
+                                        message_id = message_id,
+                                        recipient = recipient,
+                                        subject = logrow["subject"],
+                                        message = logrow["message"]))
             else:
-                s3_debug("s3msg", "Entity type unknown")
-
-            if entity_type == "pr_group":
-                # Take the entities of it and add in the messaging queue - with
-                # sender as the original sender and marks group email processed
-                # Set system generated = True
-                table3 = s3db.pr_group
-                query = (table3.pe_id == entity)
-                group_id = db(query).select(table3.id,
-                                            limitby=(0, 1)).first().id
-                table4 = s3db.pr_group_membership
-                query = (table4.group_id == group_id)
-                recipients = db(query).select(table4.person_id)
-                for recipient in recipients:
-                    person_id = recipient.person_id
-                    query = (ptable.id == person_id)
-                    pe_id = db(query).select(ptable.pe_id,
-                                             limitby=(0, 1)).first().pe_id
-                    table.insert(message_id = message_id,
-                                 pe_id = pe_id,
-                                 pr_message_method = contact_method,
-                                 system_generated = True)
-                status = True
-                chainrun = True
-
-            elif entity_type == "org_organisation":
-                # Take the entities of it and add in the messaging queue - with
-                # sender as the original sender and marks group email processed
-                # Set system generated = True
-                table3 = s3db.org_organisation
-                query = (table3.pe_id == entity)
-                org_id = db(query).select(table3.id,
-                                          limitby=(0, 1)).first().id
-                table4 = s3db.hrm_human_resource
-                query = (table4.organisation_id == org_id)
-                recipients = db(query).select(table4.person_id)
-                for recipient in recipients:
-                    person_id = recipient.person_id
-                    uery = (ptable.id == person_id)
-                    pe_id = db(query).select(ptable.pe_id,
-                                             limitby=(0, 1)).first().pe_id
-                    table.insert(message_id = message_id,
-                                 pe_id = pe_id,
-                                 pr_message_method = contact_method,
-                                 system_generated = True)
-                status = True
-                chainrun = True
+                if not entity_type:
+                    s3_debug("s3msg", "Entity type unknown")
+                other.append(row)
 
-            if entity_type == "pr_person":
-                # Person
-                status = dispatch_to_pe_id(entity)
+        return jobs, other
 
-            if status:
-                # Update status to sent in Outbox
-                db(table.id == row.id).update(status=2)
-                # Set message log to actioned
-                db(ltable.id == message_id).update(actioned=True)
-                # Explicitly commit DB operations when running from Cron
-                db.commit()
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def outbox_sent(outbox_ids, message_ids):
+        """
+            Mark Outbox messages as sent
 
-        if chainrun :
-            self.process_outbox(contact_method)
+            @param outbox_ids: the msg_outbox record IDs
+            @param message_ids: the msg_log record IDs
+        """
 
-        return
+        if not outbox_ids:
+            return
+
+        db = current.db
+        s3db = current.s3db
+
+        # Update status to sent in Outbox
+        table = s3db.msg_outbox
+        db(table.id.belongs(outbox_ids)).update(status=2)
+        # Set message log to actioned
+        table = s3db.msg_log
+        db(table.id.belongs(message_ids)).update(actioned=True)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def outbox_failed(outbox_ids):
+        """
+            Mark Outbox messages as failed, i.e. not to be sent again
+            (because the gateway may have received them)
+
+            @param outbox_ids: the msg_outbox record IDs
+        """
+
+        if not outbox_ids:
+            return
+
+        table = current.s3db.msg_outbox
+        current.db(table.id.belongs(outbox_ids)).update(status=6)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def get_contacts(pe_ids, contact_method="EMAIL"):
+        """
+            Look up the preferred contact of each of the entities
+
+            @param pe_ids: list of pe_ids
+            @param contact_method: the contact method
+            @returns: dict {pe_id: contact value}
+        """
+
+        contacts = {}
+        if not pe_ids:
+            return contacts
+
+        table = current.s3db.pr_contact
+        query = (table.pe_id.belongs(pe_ids)) & \
+                (table.contact_method == contact_method) & \
+                (table.deleted == False)
+        rows = current.db(query).select(table.pe_id,
+                                        table.value,
+                                        orderby=table.priority|table.id)
+        for row in rows:
+            if row.pe_id not in contacts:
+                contacts[row.pe_id] = row.value
+        return contacts
+
+    # -------------------------------------------------------------------------
+    def dispatch(self,
+                 contact_method,
+                 recipient,
+                 subject,
+                 message,
+                 outbox_id=None,
+                 message_id=None,
+                 sms_handler=None):
+        """
+            Send a message to a recipient via the handler for the
+            contact method
+
+            @param contact_method: the contact method
+            @param recipient: the contact (email address, phone number
+                              or twitter account)
+            @param subject: the subject
+            @param message: the message text
+            @param outbox_id: the msg_outbox record ID (for Tropo)
+            @param message_id: the msg_log record ID (for Tropo)
+            @param sms_handler: the outgoing SMS handler
+            @returns: True if the message has been sent
+        """
+
+        if contact_method == "EMAIL":
+            return self.send_email(recipient,
+                                   subject,
+                                   message)
+        elif contact_method == "SMS":
+            if sms_handler == "WEB_API":
+                return self.send_sms_via_api(recipient,
+                                             message)
+            elif sms_handler == "SMTP":
+                return self.send_sms_via_smtp(recipient,
+                                              message)
+            elif sms_handler == "MODEM":
+                return self.send_sms_via_modem(recipient,
+                                               message)
+            elif sms_handler == "TROPO":
+                # NB This does not mean the message is sent
+                return self.send_text_via_tropo(outbox_id,
+                                                message_id,
+                                                recipient,
+                                                message)
+        elif contact_method == "TWITTER":
+            return self.send_text_via_twitter(recipient,
+                                              message)
+        return False
+
+    # -------------------------------------------------------------------------
+    # Batches
+    # -------------------------------------------------------------------------
+    def open_batch(self):
+        """
+            Start a batch of messages: until close_batch, the gateway
+            settings are only read once, the SMTP connection and the HTTP
+            connections to the SMS gateways are kept open, and the daily
+            mail limit is only counted once
+        """
+
+        self.batch = Storage(http = S3HTTPSession())
+
+    # -------------------------------------------------------------------------
+    def close_batch(self):
+        """
+            End a batch of messages, closing the open connections
+        """
+
+        batch = self.batch
+        if batch is None:
+            return
+        self.batch = None
+        if batch.smtp:
+            batch.smtp.close()
+        batch.http.close()
+
+    # -------------------------------------------------------------------------
+    def batch_setting(self, key, lookup):
+        """
+            Get a gateway setting, looking it up only once per batch
+
+            @param key: the key for the setting in the batch
+            @param lookup: function to look up the setting
+        """
+
+        batch = self.batch
+        if batch is None:
+            return lookup()
+        if key not in batch:
+            batch[key] = lookup()
+        return batch[key]
+
+    # -------------------------------------------------------------------------
+    def http_request(self, url, data=None):
+        """
+            Send a HTTP request, reusing the connections of the batch
+
+            @param url: the URL
+            @param data: the urlencoded POST data (None for GET)
+            @returns: tuple (status, body)
+        """
+
+        batch = self.batch
+        if batch is not None:
+            return batch.http.request(url, data)
+        session = S3HTTPSession()
+        try:
+            return session.request(url, data)
+        finally:
+            session.close()
 
 
     # -------------------------------------------------------------------------
@@ -809,21 +1296,34 @@ class S3Msg(object):
                    http://eden.sahanafoundation.org/ticket/439
         """
 
-        limit = current.deployment_settings.get_mail_limit()
+        # NB The dispatcher threads have no database access, so the
+        #    limit is preset in their batch (see S3MsgDispatcher)
+        limit = self.batch_setting("mail_limit",
+                                   current.deployment_settings.get_mail_limit)
 
         if limit:
             db = current.db
-            s3db = current.db
+            s3db = current.s3db
             table = s3db.msg_limit
-            # Check whether we've reached our daily limit
-            day = datetime.timedelta(hours=24)
-            cutoff = current.request.utcnow - day
-            query = (table.created_on > cutoff)
-            check = db(query).count()
+            batch = self.batch
+            if batch is not None and batch.mail_count is not None:
+                check = batch.mail_count
+            else:
+                # Check whether we've reached our daily limit
+                day = datetime.timedelta(hours=24)
+                cutoff = current.request.utcnow - day
+                query = (table.created_on > cutoff)
+                check = db(query).count()
             if check >= limit:
                 return False
             # Log the sending
             table.insert()
+            if batch is not None:
+                batch.mail_count = check + 1
+
+        smtp = self.get_smtp_session()
+        if smtp and not (attachments or cc or bcc or reply_to):
+            return smtp.send(to, subject, message, encoding)
 
         result = self.mail.send(to,
                                 subject,
@@ -837,6 +1337,32 @@ class S3Msg(object):
 
         return result
 
+    # -------------------------------------------------------------------------
+    def get_smtp_session(self):
+        """
+            Get the SMTP connection of the current batch, opening it
+            on first use
+
+            @returns: the S3SMTPSession, or None if not in a batch or
+                      if the mail server can't be connected directly
+        """
+
+        batch = self.batch
+        if batch is None:
+            return None
+        if batch.smtp is None:
+            smtp = S3SMTPSession(self.mail.settings)
+            try:
+                smtp.open()
+            except Exception, e:
+                s3_debug("s3msg", "Unable to connect to mail server: %s" % e)
+                smtp = False
+            else:
+                if not smtp.connected:
+                    smtp = False
+            batch.smtp = smtp
+        return batch.smtp
+
     # -------------------------------------------------------------------------
     def send_email_by_pe_id(self,
                             pe_id,
@@ -942,13 +1468,8 @@ class S3Msg(object):
             Function to send SMS via Web API
         """
 
-        db = current.db
-        s3db = current.s3db
-        table = s3db.msg_api_settings
-
         # Get Configuration
-        query = (table.enabled == True)
-        sms_api = db(query).select(limitby=(0, 1)).first()
+        sms_api = self.get_sms_api()
         if not sms_api:
             return False
 
@@ -965,12 +1486,26 @@ class S3Msg(object):
             sms_api_post_config[sms_api.message_variable] = text
             sms_api_post_config[sms_api.to_variable] = str(mobile)
             query = urllib.urlencode(sms_api_post_config)
-            request = urllib.urlopen(sms_api.url, query)
-            output = request.read()
-            return True
+            status, output = self.http_request(sms_api.url, query)
+            return status < 400
+        except S3MsgUnconfirmed:
+            raise
         except:
             return False
 
+    # -------------------------------------------------------------------------
+    def get_sms_api(self):
+        """
+            Get the enabled Web API settings (once per batch)
+        """
+
+        def lookup():
+            table = current.s3db.msg_api_settings
+            query = (table.enabled == True)
+            return current.db(query).select(limitby=(0, 1)).first()
+
+        return self.batch_setting("sms_api", lookup)
+
     # -------------------------------------------------------------------------
     def send_sms_via_smtp(self, mobile, text=""):
         """
@@ -982,12 +1517,7 @@ class S3Msg(object):
             http://www.obviously.com/tech_tips/SMS_Text_Email_Gateway.html
         """
 
-        db = current.db
-        s3db = current.s3db
-        table = s3db.msg_smtp_to_sms_settings
-
-        query = (table.enabled == True)
-        settings = db(query).select(limitby=(0, 1)).first()
+        settings = self.get_smtp_to_sms()
         if not settings:
             return False
 
@@ -1004,6 +1534,19 @@ class S3Msg(object):
         except:
             return False
 
+    # -------------------------------------------------------------------------
+    def get_smtp_to_sms(self):
+        """
+            Get the enabled SMTP to SMS settings (once per batch)
+        """
+
+        def lookup():
+            table = current.s3db.msg_smtp_to_sms_settings
+            query = (table.enabled == True)
+            return current.db(query).select(limitby=(0, 1)).first()
+
+        return self.batch_setting("smtp_to_sms", lookup)
+
     #-------------------------------------------------------------------------------------------------
     def send_text_via_tropo(self,
                             row_id,
@@ -1015,50 +1558,72 @@ class S3Msg(object):
             Send a URL request to Tropo to pick a message up
         """
 
-        db = current.db
-        s3db = current.s3db
-        table = s3db.msg_tropo_settings
-
-        base_url = "http://api.tropo.com/1.0/sessions"
-        action = "create"
-
-        query = (table.id == 1)
-        tropo_settings = db(query).select(table.token_messaging,
-                                          limitby=(0, 1)).first()
-        if tropo_settings:
-            tropo_token_messaging = tropo_settings.token_messaging
-            #tropo_token_voice = tropo_settings.token_voice
-        else:
+        tropo_token_messaging = self.get_tropo_token()
+        if not tropo_token_messaging:
             return
 
         if network == "SMS":
             recipient = self.sanitise_phone(recipient)
 
         try:
-            s3db.msg_tropo_scratch.insert(row_id = row_id,
-                                          message_id = message_id,
-                                          recipient = recipient,
-                                          message = message,
-                                          network = network)
-            params = urllib.urlencode([("action", action),
-                                       ("token", tropo_token_messaging),
-                                       ("outgoing", "1"),
-                                       ("row_id", row_id)
-                                      ])
-            xml = urlopen("%s?%s" % (base_url, params)).read()
-            # Parse Response (actual message is sent as a response to the POST which will happen in parallel)
-            #root = etree.fromstring(xml)
-            #elements = root.getchildren()
-            #if elements[0].text == "false":
-            #    session.error = T("Message sending failed! Reason:") + " " + elements[2].text
-            #    redirect(URL(f='index'))
-            #else:
-            #    session.flash = T("Message Sent")
-            #    redirect(URL(f='index'))
+            current.s3db.msg_tropo_scratch.insert(row_id = row_id,
+                                                  message_id = message_id,
+                                                  recipient = recipient,
+                                                  message = message,
+                                                  network = network)
+            self.request_tropo(row_id, tropo_token_messaging)
         except:
             pass
         return False # Returning False because the API needs to ask us for the messsage again.
 
+    # -------------------------------------------------------------------------
+    def get_tropo_token(self):
+        """
+            Get the Tropo messaging token (once per batch)
+        """
+
+        def lookup():
+            table = current.s3db.msg_tropo_settings
+            query = (table.id == 1)
+            return current.db(query).select(table.token_messaging,
+                                            limitby=(0, 1)).first()
+
+        tropo_settings = self.batch_setting("tropo", lookup)
+        if tropo_settings:
+            return tropo_settings.token_messaging
+            #return tropo_settings.token_voice
+        return None
+
+    # -------------------------------------------------------------------------
+    def request_tropo(self, row_id, token):
+        """
+            Ask Tropo to pick up a message from the msg_tropo_scratch table
+
+            @param row_id: the msg_outbox record ID of the message
+            @param token: the Tropo messaging token
+            @returns: True if Tropo has accepted the request
+        """
+
+        base_url = "http://api.tropo.com/1.0/sessions"
+        action = "create"
+
+        params = urllib.urlencode([("action", action),
+                                   ("token", token),
+                                   ("outgoing", "1"),
+                                   ("row_id", row_id)
+                                  ])
+        status, xml = self.http_request("%s?%s" % (base_url, params))
+        # Parse Response (actual message is sent as a response to the POST which will happen in parallel)
+        #root = etree.fromstring(xml)
+        #elements = root.getchildren()
+        #if elements[0].text == "false":
+        #    session.error = T("Message sending failed! Reason:") + " " + elements[2].text
+        #    redirect(URL(f='index'))
+        #else:
+        #    session.flash = T("Message Sent")
+        #    redirect(URL(f='index'))
+        return status < 400
+
     # -------------------------------------------------------------------------
     def send_sms_by_pe_id(self,
                           pe_id,
@@ -1121,8 +1686,7 @@ class S3Msg(object):
                 current_prefix = prefix # from now on, we want a prefix
 
     # -------------------------------------------------------------------------
-    @staticmethod
-    def get_twitter_api():
+    def get_twitter_api(self):
         """
             Initialize Twitter API
         """
@@ -1136,7 +1700,7 @@ class S3Msg(object):
             self.tweepy = tweepy
 
         db = current.db
-        s3db = current.db
+        s3db = current.s3db
         settings = current.deployment_settings
 
         table = s3db.msg_twitter_settings
@@ -1149,7 +1713,7 @@ class S3Msg(object):
                 oauth.set_access_token(twitter_settings.oauth_key,
                                        twitter_settings.oauth_secret)
                 twitter_api = tweepy.API(oauth)
-                twitter_account = tmp_twitter_settings.twitter_account
+                twitter_account = twitter_settings.twitter_account
                 return dict(twitter_api=twitter_api, twitter_account=twitter_account)
             except:
                 pass
@@ -1166,8 +1730,9 @@ class S3Msg(object):
             @ToDo: Option to Send via Tropo
         """
 
-        # Initialize Twitter API
-        twitter_settings = self.get_twitter_api()
+        # Initialize Twitter API (once per batch)
+        twitter_settings = self.batch_setting("twitter",
+                                              self.get_twitter_api)
         tweepy = self.tweepy
 
         twitter_api = None
@@ -1458,6 +2023,834 @@ class S3Msg(object):
             M.close()
             M.logout()
 
+# =============================================================================
+class S3MsgUnconfirmed(Exception):
+    """
+        Sending a message failed after the gateway may have received
+        it, so it must not be sent again
+    """
+
+    pass
+
+# =============================================================================
+class S3SMTPSession(object):
+    """
+        SMTP connection to send a batch of plain text emails with the
+        mail settings of web2py's Mail, without reconnecting for each
+        message
+    """
+
+    TIMEOUT = 30
+
+    def __init__(self, settings):
+        """
+            Constructor
+
+            @param settings: the mail settings (current.mail.settings)
+        """
+
+        self.settings = settings
+        self.server = None
+
+    # -------------------------------------------------------------------------
+    @property
+    def connected(self):
+        """ Whether the connection is open """
+
+        return self.server is not None
+
+    # -------------------------------------------------------------------------
+    def open(self):
+        """
+            Connect to the mail server, unless it is not a SMTP server
+            (i.e. "logging" or "gae")
+        """
+
+        settings = self.settings
+        server = settings.server
+        if not server or server in ("logging", "gae"):
+            return
+        if ":" in server:
+            host, port = server.rsplit(":", 1)
+            port = int(port)
+        else:
+            host, port = server, smtplib.SMTP_PORT
+
+        timeout = settings.timeout or self.TIMEOUT
+        if settings.ssl:
+            server = smtplib.SMTP_SSL(host, port, timeout=timeout)
+        else:
+            server = smtplib.SMTP(host, port, timeout=timeout)
+        try:
+            if settings.tls and not settings.ssl:
+                server.ehlo()
+                server.starttls()
+                server.ehlo()
+            if settings.login:
+                server.login(*settings.login.split(":", 1))
+        except:
+            server.close()
+            raise
+        self.server = server
+
+    # -------------------------------------------------------------------------
+    def close(self):
+        """ Disconnect from the mail server """
+
+        server = self.server
+        if server is not None:
+            self.server = None
+            try:
+                server.quit()
+            except (smtplib.SMTPException, socket.error):
+                server.close()
+
+    # -------------------------------------------------------------------------
+    def send(self, to, subject, message, encoding="utf-8"):
+        """
+            Send a plain text email, reconnecting once if the server
+            has closed the connection
+
+            @param to: the recipient address (or list of addresses)
+            @param subject: the subject
+            @param message: the message text
+            @param encoding: the encoding
+            @returns: True if the message has been accepted by the server
+        """
+
+        if not isinstance(to, (list, tuple)):
+            to = [to]
+        if isinstance(message, unicode):
+            message = message.encode(encoding)
+        if isinstance(subject, unicode):
+            subject = subject.encode(encoding)
+
+        sender = self.settings.sender
+        payload = MIMEText(message, "plain", encoding)
+        payload["Subject"] = Header(subject or "", encoding)
+        payload["From"] = sender
+        payload["To"] = ", ".join(to)
+        payload["Date"] = formatdate()
+        payload = payload.as_string()
+
+        for attempt in (0, 1):
+            if self.server is None:
+                self.open()
+            try:
+                self.server.sendmail(sender, to, payload)
+            except (smtplib.SMTPServerDisconnected, socket.error):
+                self.server = None
+                if attempt:
+                    return False
+            except smtplib.SMTPException, e:
+                s3_debug("s3msg", "Unable to send email: %s" % e)
+                return False
+            else:
+                return True
+        return False
+
+# =============================================================================
+class S3HTTPSession(object):
+    """
+        Persistent HTTP connections (one per host) to send a batch of
+        requests to the same gateway without reconnecting for each
+    """
+
+    TIMEOUT = 30
+
+    def __init__(self):
+        """ Constructor """
+
+        self.connections = {}
+
+    # -------------------------------------------------------------------------
+    def request(self, url, data=None):
+        """
+            Send a request, reconnecting if the server has closed the
+            connection. POST requests are only repeated if they can not
+            have reached the server.
+
+            @param url: the URL
+            @param data: the urlencoded POST data (None for GET)
+            @returns: tuple (status, body)
+            @raises S3MsgUnconfirmed: if a POST request failed after it
+                                      has been sent
+        """
+
+        scheme, netloc, path, query, fragment = urlparse.urlsplit(url)
+        path = path or "/"
+        if query:
+            path = "%s?%s" % (path, query)
+        if data is None:
+            method = "GET"
+            headers = {}
+        else:
+            method = "POST"
+            headers = {"Content-Type": "application/x-www-form-urlencoded"}
+
+        key = (scheme, netloc)
+        connections = self.connections
+        for attempt in (0, 1):
+            connection = connections.get(key)
+            if connection is not None and self.dropped(connection):
+                connection.close()
+                del connections[key]
+                connection = None
+            if connection is None:
+                if scheme == "https":
+                    connection = httplib.HTTPSConnection(netloc,
+                                                         timeout=self.TIMEOUT)
+                else:
+                    connection = httplib.HTTPConnection(netloc,
+                                                        timeout=self.TIMEOUT)
+                connections[key] = connection
+            try:
+                connection.request(method, path, data, headers)
+            except (httplib.HTTPException, socket.error):
+                # Not (completely) sent, e.g. connection refused
+                connection.close()
+                del connections[key]
+                if attempt:
+                    raise
+                continue
+            try:
+                response = connection.getresponse()
+                body = response.read()
+            except (httplib.HTTPException, socket.error), e:
+                connection.close()
+                del connections[key]
+                if method == "GET":
+                    if attempt:
+                        raise
+                    continue
+                # The server may have processed the request
+                raise S3MsgUnconfirmed(str(e) or e.__class__.__name__)
+            else:
+                if response.will_close:
+                    connection.close()
+                    del connections[key]
+                return response.status, body
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def dropped(connection):
+        """
+            Check whether the server has closed a kept-alive connection
+            (which is readable then, as the server sends nothing else
+            between requests)
+
+            @param connection: the HTTPConnection
+        """
+
+        sock = connection.sock
+        if sock is None:
+            # Not connected
+            return False
+        try:
+            readable = select.select([sock], [], [], 0)[0]
+        except (select.error, socket.error, ValueError):
+            return True
+        return bool(readable)
+
+    # -------------------------------------------------------------------------
+    def close(self):
+        """ Close all connections """
+
+        for connection in self.connections.values():
+            connection.close()
+        self.connections = {}
+
+# =============================================================================
+class S3MsgDispatcher(object):
+    """
+        Outbox dispatcher, sending the pending messages of one or more
+        contact methods concurrently, with a pool of worker threads, an
+        optional rate limit and retries with exponential backoff per
+        contact method.
+
+        Messages are claimed in the Outbox before they are sent, so that
+        several dispatchers (e.g. in different scheduler workers) never
+        send the same message twice. All database access happens in the
+        calling thread: the worker threads only talk to the gateways,
+        each with its own S3Msg instance and connections.
+    """
+
+    # Outbox status of claimed messages
+    CLAIMED = 5
+    # Outbox status of messages waiting for Tropo to pick them up
+    HANDED_OVER = 7
+
+    # Number of messages to claim at a time per contact method
+    BATCH_SIZE = 100
+
+    def __init__(self,
+                 msg=None,
+                 workers=None,
+                 rate=None,
+                 retries=None,
+                 backoff=None,
+                 claim_timeout=None):
+        """
+            Constructor, the default for all parameters are taken from
+            the deployment settings
+
+            @param msg: the S3Msg instance (default: current.msg)
+            @param workers: number of threads per contact method,
+                            dict {contact_method: number}
+            @param rate: maximum number of messages per second per
+                         contact method, dict {contact_method: rate}
+            @param retries: how often to retry sending a message
+            @param backoff: seconds to wait before the first retry
+            @param claim_timeout: seconds after which messages claimed
+                                  by another dispatcher can be claimed
+        """
+
+        settings = current.deployment_settings
+
+        self.msg = msg or current.msg
+        self.workers = workers or {}
+        self.rate = rate or {}
+        if retries is None:
+            retries = settings.get_msg_dispatch_retries()
+        self.retries = retries
+        if backoff is None:
+            backoff = settings.get_msg_dispatch_backoff()
+        self.backoff = backoff
+        if claim_timeout is None:
+            claim_timeout = settings.get_msg_dispatch_claim_timeout()
+        self.claim_timeout = claim_timeout
+
+        self.claim_id = str(uuid4())
+        self.mail_quota = None
+
+    # -------------------------------------------------------------------------
+    def run(self, contact_methods=("EMAIL",)):
+        """
+            Send all pending messages of the contact methods
+
+            @param contact_methods: the contact methods
+            @returns: the metrics per contact method,
+                      dict {contact_method: dict of metrics}
+        """
+
+        db = current.db
+
+        for contact_method in contact_methods:
+            S3Msg.expand_outbox(contact_method)
+        self.mail_quota = self.get_mail_quota()
+
+        results = Queue.Queue()
+        channels = {}
+        try:
+            for contact_method in contact_methods:
+                channel = self.channel(contact_method, results)
+                channels[contact_method] = channel
+                channel.start()
+
+            active = set(channels)
+            pending = dict([(contact_method, 0) for contact_method in channels])
+            done = []
+            while True:
+                # Feed the idle channels
+                for contact_method in list(active):
+                    if pending[contact_method]:
+                        continue
+                    channel = channels[contact_method]
+                    jobs = self.claim(channel)
+                    if jobs is None:
+                        active.discard(contact_method)
+                        continue
+                    for job in jobs:
+                        channel.put(job)
+                    pending[contact_method] += len(jobs)
+                if not any(pending.values()):
+                    if active:
+                        # Nothing to send in these batches, claim more
+                        continue
+                    break
+
+                # Wait for the results
+                contact_method, job, status = results.get()
+                pending[contact_method] -= 1
+                done.append((channels[contact_method], job, status))
+                if not pending[contact_method]:
+                    self.update(done)
+                    done = []
+                    db.commit()
+        finally:
+            for channel in channels.values():
+                channel.stop()
+
+        metrics = {}
+        for contact_method, channel in channels.items():
+            metrics[contact_method] = m = channel.metrics()
+            s3_debug("s3msg", "%s: %s sent, %s failed, %s retries, "
+                              "%.1f messages/s, latency %.3fs avg, "
+                              "%.3fs 95%%, %.3fs max" % (contact_method,
+                                                         m["sent"],
+                                                         m["failed"],
+                                                         m["retries"],
+                                                         m["throughput"],
+                                                         m["latency_avg"],
+                                                         m["latency_95"],
+                                                         m["latency_max"]))
+        return metrics
+
+    # -------------------------------------------------------------------------
+    def channel(self, contact_method, results):
+        """
+            Set up the worker threads for a contact method
+
+            @param contact_method: the contact method
+            @param results: the queue for the results
+            @returns: the S3MsgChannel
+        """
+
+        db = current.db
+        s3db = current.s3db
+        settings = current.deployment_settings
+
+        sms_handler = None
+        if contact_method == "SMS":
+            table = s3db.msg_setting
+            row = db(table.id > 0).select(table.outgoing_sms_handler,
+                                          limitby=(0, 1)).first()
+            if not row:
+                raise ValueError("No SMS handler defined!")
+            sms_handler = row.outgoing_sms_handler
+
+        workers = self.workers.get(contact_method,
+                    settings.get_msg_dispatch_workers(contact_method))
+        if sms_handler == "MODEM":
+            # The modem can only send one message at a time
+            workers = 1
+        rate = self.rate.get(contact_method,
+                    settings.get_msg_dispatch_rate(contact_method))
+
+        # Each thread gets its own S3Msg, with the gateway settings
+        # looked up here since the threads have no database access
+        senders = []
+        for i in xrange(max(1, workers)):
+            msg = S3Msg(modem=self.msg.modem)
+            msg.open_batch()
+            # The mail limit is checked by the dispatcher
+            msg.batch.mail_limit = None
+            if contact_method == "SMS":
+                if sms_handler == "WEB_API":
+                    msg.get_sms_api()
+                elif sms_handler == "SMTP":
+                    msg.get_smtp_to_sms()
+                elif sms_handler == "TROPO":
+                    msg.get_tropo_token()
+            elif contact_method == "TWITTER":
+                msg.batch_setting("twitter", msg.get_twitter_api)
+            senders.append(msg)
+
+        return S3MsgChannel(contact_method,
+                            senders,
+                            results,
+                            sms_handler = sms_handler,
+                            rate = rate,
+                            retries = self.retries,
+                            backoff = self.backoff)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def get_mail_quota():
+        """
+            Get the number of emails which can be sent today
+
+            @returns: the number, or None if there is no limit
+        """
+
+        limit = current.deployment_settings.get_mail_limit()
+        if not limit:
+            return None
+        table = current.s3db.msg_limit
+        cutoff = current.request.utcnow - datetime.timedelta(hours=24)
+        query = (table.created_on > cutoff)
+        return max(0, limit - current.db(query).count())
+
+    # -------------------------------------------------------------------------
+    def claim(self, channel):
+        """
+            Claim the next batch of pending messages for a channel
+
+            @param channel: the S3MsgChannel
+            @returns: the messages to send (list of Storages, see
+                      S3Msg.prepare_outbox), or None if there are no
+                      more messages to claim
+        """
+
+        db = current.db
+        s3db = current.s3db
+        table = s3db.msg_outbox
+
+        limit = self.BATCH_SIZE
+        quota = self.mail_quota
+        if channel.mail and quota is not None:
+            if quota <= 0:
+                return None
+            limit = min(limit, quota)
+
+        now = datetime.datetime.utcnow()
+        expired = now - datetime.timedelta(seconds=self.claim_timeout)
+        claimable = (table.status == 1) | \
+                    ((table.status == self.CLAIMED) & \
+                     (table.claimed_on < expired))
+        query = (table.pr_message_method == channel.contact_method) & \
+                (table.id > channel.last_id) & claimable
+        rows = db(query).select(table.id,
+                                orderby=table.id,
+                                limitby=(0, limit))
+        if not rows:
+            return None
+        outbox_ids = [row.id for row in rows]
+        channel.last_id = outbox_ids[-1]
+
+        # The conditional update makes sure that each message can only
+        # be claimed by one dispatcher
+        query = (table.id.belongs(outbox_ids)) & claimable
+        db(query).update(status = self.CLAIMED,
+                         claimed_by = self.claim_id,
+                         claimed_on = now)
+        db.commit()
+
+        query = (table.id.belongs(outbox_ids)) & \
+                (table.status == self.CLAIMED) & \
+                (table.claimed_by == self.claim_id)
+        rows = db(query).select(table.id,
+                                table.message_id,
+                                table.pe_id)
+        if not rows:
+            return []
+
+        jobs, other = S3Msg.prepare_outbox(rows, channel.contact_method)
+
+        # Messages to other entities are done, those without message
+        # or recipient contact stay pending
+        done = [row.id for row in other]
+        S3Msg.outbox_sent(done, set([row.message_id for row in other]))
+        done = set(done + [job.outbox_id for job in jobs])
+        self.release([row.id for row in rows if row.id not in done])
+
+        if channel.sms_handler == "TROPO":
+            # Tropo picks the messages up from the scratchpad
+            stable = s3db.msg_tropo_scratch
+            stable.bulk_insert([dict(row_id = job.outbox_id,
+                                     message_id = job.message_id,
+                                     recipient = S3Msg.sanitise_phone(job.recipient),
+                                     message = job.message,
+                                     network = "SMS") for job in jobs])
+        if channel.mail and quota is not None:
+            self.mail_quota = quota - len(jobs)
+
+        db.commit()
+        return jobs
+
+    # -------------------------------------------------------------------------
+    def update(self, done):
+        """
+            Update the Outbox with the results of the worker threads
+
+            @param done: list of tuples (channel, job, status)
+        """
+
+        s3db = current.s3db
+
+        sent = []
+        actioned = set()
+        failed = []
+        unconfirmed = []
+        handed_over = []
+        tropo = []
+        mails = 0
+        for channel, job, status in done:
+            if status is None:
+                # Not to be sent again
+                unconfirmed.append(job.outbox_id)
+                if channel.mail:
+                    mails += 1
+            elif status:
+                if channel.sms_handler == "TROPO":
+                    # Marked as sent when Tropo picks it up
+                    handed_over.append(job.outbox_id)
+                    continue
+                sent.append(job.outbox_id)
+                actioned.add(job.message_id)
+                if channel.mail:
+                    mails += 1
+            else:
+                failed.append(job.outbox_id)
+                if channel.sms_handler == "TROPO":
+                    tropo.append(job.outbox_id)
+                if channel.mail and self.mail_quota is not None:
+                    self.mail_quota += 1
+
+        S3Msg.outbox_sent(sent, actioned)
+        S3Msg.outbox_failed(unconfirmed)
+        self.release(failed)
+        if handed_over:
+            # Must not be claimed again once the claim has expired
+            table = s3db.msg_outbox
+            query = (table.id.belongs(handed_over))
+            current.db(query).update(status = self.HANDED_OVER,
+                                     claimed_by = None,
+                                     claimed_on = None)
+        if tropo:
+            table = s3db.msg_tropo_scratch
+            current.db(table.row_id.belongs(tropo)).delete()
+        if mails and self.mail_quota is not None:
+            # Log the sending for the daily limit
+            s3db.msg_limit.bulk_insert([{}] * mails)
+
+    # -------------------------------------------------------------------------
+    def release(self, outbox_ids):
+        """
+            Return claimed messages to the Outbox as unsent
+
+            @param outbox_ids: the msg_outbox record IDs
+        """
+
+        if not outbox_ids:
+            return
+        table = current.s3db.msg_outbox
+        query = (table.id.belongs(outbox_ids)) & \
+                (table.claimed_by == self.claim_id)
+        current.db(query).update(status = 1,
+                                 claimed_by = None,
+                                 claimed_on = None)
+
+# =============================================================================
+class S3MsgChannel(object):
+    """
+        Worker threads sending the messages of one contact method for
+        the S3MsgDispatcher, with rate limit, retries and metrics
+    """
+
+    def __init__(self,
+                 contact_method,
+                 senders,
+                 results,
+                 sms_handler=None,
+                 rate=None,
+                 retries=0,
+                 backoff=1.0):
+        """
+            Constructor
+
+            @param contact_method: the contact method
+            @param senders: the S3Msg instances, one per worker thread
+            @param results: queue for the results, gets tuples
+                            (contact_method, job, status)
+            @param sms_handler: the outgoing SMS handler
+            @param rate: maximum number of messages per second
+            @param retries: how often to retry sending a message
+            @param backoff: seconds to wait before the first retry
+        """
+
+        # The worker threads have no database access, but share the
+        # deployment settings
+        self.settings = current.deployment_settings
+
+        self.contact_method = contact_method
+        self.senders = senders
+        self.results = results
+        self.sms_handler = sms_handler
+        self.rate = rate
+        self.retries = retries
+        self.backoff = backoff
+
+        # Whether the messages count towards the daily mail limit
+        self.mail = contact_method == "EMAIL" or sms_handler == "SMTP"
+        # Last claimed msg_outbox record ID
+        self.last_id = 0
+
+        self.queue = Queue.Queue()
+        self.lock = threading.Lock()
+        self.threads = []
+        self.next_send = 0
+
+        # Metrics
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.latency = []
+        self.started = None
+        self.stopped = None
+
+    # -------------------------------------------------------------------------
+    def start(self):
+        """ Start the worker threads """
+
+        self.started = time.time()
+        for msg in self.senders:
+            thread = threading.Thread(target=self.work, args=(msg,))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    # -------------------------------------------------------------------------
+    def put(self, job):
+        """
+            Queue a message for sending
+
+            @param job: the message (Storage, see S3Msg.prepare_outbox)
+        """
+
+        self.queue.put(job)
+
+    # -------------------------------------------------------------------------
+    def stop(self):
+        """
+            Stop the worker threads once they've finished the current
+            messages, dropping the queued ones (which stay claimed)
+        """
+
+        queue = self.queue
+        try:
+            while True:
+                queue.get_nowait()
+        except Queue.Empty:
+            pass
+        for thread in self.threads:
+            queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        self.stopped = time.time()
+
+    # -------------------------------------------------------------------------
+    def work(self, msg):
+        """
+            Worker thread: send the queued messages
+
+            @param msg: the S3Msg instance of this thread
+        """
+
+        current.deployment_settings = self.settings
+        try:
+            while True:
+                job = self.queue.get()
+                if job is None:
+                    break
+                status = self.attempt(msg, job)
+                self.results.put((self.contact_method, job, status))
+        finally:
+            msg.close_batch()
+
+    # -------------------------------------------------------------------------
+    def attempt(self, msg, job):
+        """
+            Send a message, retrying with exponential backoff
+
+            @param msg: the S3Msg instance of this thread
+            @param job: the message
+            @returns: True if the message has been sent, False if not,
+                      None if it failed but may have been received by
+                      the gateway (must not be sent again)
+        """
+
+        delay = self.backoff
+        retries = self.retries
+        attempt = 0
+        while True:
+            self.throttle()
+            start = time.time()
+            unconfirmed = False
+            try:
+                status = self.send(msg, job)
+            except S3MsgUnconfirmed, e:
+                s3_debug("s3msg", "Message not confirmed: %s" % e)
+                status = False
+                unconfirmed = True
+            except Exception, e:
+                s3_debug("s3msg", "Unable to send message: %s" % e)
+                status = False
+            latency = time.time() - start
+            with self.lock:
+                self.latency.append(latency)
+                if status:
+                    self.sent += 1
+                elif unconfirmed or attempt >= retries:
+                    self.failed += 1
+                else:
+                    self.retried += 1
+            if unconfirmed:
+                return None
+            if status or attempt >= retries:
+                return bool(status)
+            time.sleep(delay)
+            delay *= 2
+            attempt += 1
+
+    # -------------------------------------------------------------------------
+    def send(self, msg, job):
+        """
+            Send a message via the gateway
+
+            @param msg: the S3Msg instance of this thread
+            @param job: the message
+        """
+
+        if self.sms_handler == "TROPO":
+            # The message is in the scratchpad already
+            return msg.request_tropo(job.outbox_id, msg.get_tropo_token())
+        return msg.dispatch(self.contact_method,
+                            job.recipient,
+                            job.subject,
+                            job.message,
+                            outbox_id=job.outbox_id,
+                            message_id=job.message_id,
+                            sms_handler=self.sms_handler)
+
+    # -------------------------------------------------------------------------
+    def throttle(self):
+        """ Wait until the rate limit allows to send the next message """
+
+        rate = self.rate
+        if not rate:
+            return
+        with self.lock:
+            now = time.time()
+            wait = self.next_send - now
+            self.next_send = max(now, self.next_send) + 1.0 / rate
+        if wait > 0:
+            time.sleep(wait)
+
+    # -------------------------------------------------------------------------
+    def metrics(self):
+        """
+            Throughput and latency metrics
+
+            @returns: dict with the number of messages sent and failed,
+                      the number of retries, the elapsed time (seconds),
+                      the throughput (messages per second) and the
+                      average, 95th percentile and maximum latency of
+                      the send attempts (seconds)
+        """
+
+        with self.lock:
+            latency = sorted(self.latency)
+        elapsed = (self.stopped or time.time()) - (self.started or time.time())
+        if latency:
+            latency_avg = sum(latency) / len(latency)
+            latency_95 = latency[min(len(latency) - 1,
+                                     int(len(latency) * 0.95))]
+            latency_max = latency[-1]
+        else:
+            latency_avg = latency_95 = latency_max = 0.0
+        return {"workers": len(self.senders),
+                "sent": self.sent,
+                "failed": self.failed,
+                "retries": self.retried,
+                "elapsed": elapsed,
+                "throughput": elapsed and self.sent / elapsed or 0.0,
+                "latency_avg": latency_avg,
+                "latency_95": latency_95,
+                "latency_max": latency_max,
+                }
+
 # =============================================================================
 class S3Compose(S3CRUD):
     """ RESTful method for messaging """
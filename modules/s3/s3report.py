@@ -33,7 +33,7 @@
     OTHER DEALINGS IN THE SOFTWARE.
 """
 
-__all__ = ["S3Cube", "S3Report", "S3ContingencyTable"]
+__all__ = ["S3Cube", "S3Report", "S3PivotTable", "S3ContingencyTable"]
 
 import sys
 import datetime
@@ -48,6 +48,13 @@ from s3search import S3Search
 from s3utils import s3_truncate
 from s3validators import IS_INT_AMOUNT, IS_FLOAT_AMOUNT, IS_NUMBER
 
+NUMPY = False
+try:
+    import numpy
+    NUMPY = True
+except ImportError:
+    pass
+
 
 # =============================================================================
 
@@ -583,6 +590,9 @@ class S3Report:
 
     METHODS = ["list", "count", "min", "max", "sum", "avg"] #, "std"]
 
+    # Methods which can be aggregated in the database
+    SQL_METHODS = ["count", "min", "max", "sum", "avg"]
+
     def __init__(self, resource, rows, cols, layers):
         """
             Constructor
@@ -607,6 +617,7 @@ class S3Report:
         self.layers = layers
 
         self.records = None
+        self.numrecords = None
         self.empty = False
 
         self.lfields = None
@@ -627,6 +638,11 @@ class S3Report:
                  model.get_config(resource.tablename, "list_fields"))
         self._get_fields(fields=fields)
 
+        # Aggregate in the database if possible -------------------------------
+        #
+        if self._sql_report():
+            return
+
         # Retrieve the records --------------------------------------------------
         #
         records = resource.sqltable(self.rfields,
@@ -645,48 +661,23 @@ class S3Report:
                 raise KeyError("Could not retrieve primary key values of %s" %
                                resource.tablename)
 
-            # Generate the data frame -----------------------------------------
+            # Group the items -------------------------------------------------
             #
-            from pyvttbl import DataFrame
-            df = DataFrame()
-            insert = df.insert
-
-            item_list = []
-            seen = item_list.append
-
             flatten = self._flatten
             expand = self._expand
-
-            for row in records:
-                item = expand(flatten(row))
-                for i in item:
-                    if i not in item_list:
-                        seen(i)
-                        insert(i)
-
-            # Group the items -------------------------------------------------
-            #
-            rows = self.rows and [self.rows] or []
-            cols = self.cols and [self.cols] or []
-            pt = df.pivot(pkey, rows, cols, aggregate="tolist")
+            items = (item for row in records for item in expand(flatten(row)))
+            pt = S3PivotTable(items, pkey, rows=self.rows, cols=self.cols)
 
             # Initialize columns and rows -------------------------------------
             #
-            if cols:
-                self.col = [Storage({"value": v != "__NONE__" and v or None})
-                            for v in [n[0][1] for n in pt.cnames]]
-                self.numcols = len(self.col)
-            else:
-                self.col = [Storage({"value": None})]
-                self.numcols = 1
+            NONE = S3PivotTable.NONE
+            self.col = [Storage({"value": None if v == NONE else v})
+                        for v in pt.cvalues]
+            self.numcols = len(self.col)
 
-            if rows:
-                self.row = [Storage({"value": v != "__NONE__" and v or None})
-                            for v in [n[0][1] for n in pt.rnames]]
-                self.numrows = len(self.row)
-            else:
-                self.row = [Storage({"value": None})]
-                self.numrows = 1
+            self.row = [Storage({"value": None if v == NONE else v})
+                        for v in pt.rvalues]
+            self.numrows = len(self.row)
 
             # Add the layers --------------------------------------------------
             #
@@ -747,6 +738,219 @@ class S3Report:
 
         return
 
+    # -------------------------------------------------------------------------
+    def _sql_field(self, selector, method=None):
+        """
+            Get the database field for a selector, if it can be used in
+            a GROUP BY query, i.e. if it is a real field in the master
+            table or in a table referenced by the master table
+
+            @param selector: the field selector
+            @param method: the aggregation method if the field is a fact
+
+            @returns: the Field, or None if it can not be used
+        """
+
+        if "." in selector or ":" in selector or selector.count("$") > 1:
+            # Component or link table field
+            return None
+        lfields = self.lfields
+        if selector not in lfields:
+            return None
+        field = lfields[selector].field
+        if field is None:
+            # Virtual field
+            return None
+        if "$" in selector:
+            table = self.resource.table
+            fn = selector.split("$", 1)[0]
+            if fn not in table.fields or \
+               str(table[fn].type)[:9] != "reference":
+                return None
+
+        ftype = str(field.type)
+        if ftype[:5] == "list:":
+            return None
+        numeric = ftype in ("integer", "double") or ftype[:7] == "decimal"
+        if method in ("sum", "avg") and not numeric:
+            return None
+        if method in ("min", "max") and not numeric and \
+           ftype not in ("date", "datetime", "time"):
+            return None
+        return field
+
+    # -------------------------------------------------------------------------
+    def _sql_report(self):
+        """
+            Generate the report from a single GROUP BY query, if the rows,
+            columns and all facts are real fields (see _sql_field), all
+            layers use SQL_METHODS and no virtual filter applies
+
+            @returns: True if the report has been generated, False to
+                      fall back to aggregating the records in Python
+        """
+
+        resource = self.resource
+        table = resource.table
+        pkey = table._id.name
+
+        query = resource.get_query()
+        rfilter = resource.rfilter
+        if resource.get_filter() is not None or rfilter.distinct:
+            return False
+
+        # Resolve the fields
+        sql_field = self._sql_field
+        dimensions = []
+        for selector in (self.rows, self.cols):
+            if selector:
+                field = sql_field(selector)
+                if field is None:
+                    return False
+                dimensions.append(field)
+            else:
+                dimensions.append(None)
+        facts = []
+        for fact, method in self.layers:
+            if method not in self.SQL_METHODS:
+                return False
+            field = sql_field(fact or pkey, method=method)
+            if field is None:
+                return False
+            facts.append(field)
+
+        # Expressions to select
+        number = table._id.count()
+        expressions = [number]
+        aggregates = []
+        for i, (fact, method) in enumerate(self.layers):
+            field = facts[i]
+            if method == "count":
+                exprs = (field.count(distinct=True),)
+            elif method == "avg":
+                exprs = (field.sum(), field.count())
+            elif method == "sum":
+                exprs = (field.sum(),)
+            elif method == "min":
+                exprs = (field.min(),)
+            else:
+                exprs = (field.max(),)
+            expressions.extend(exprs)
+            aggregates.append(exprs)
+        groupby = []
+        for field in dimensions:
+            if field is not None and str(field) not in map(str, groupby):
+                groupby.append(field)
+
+        # Left joins
+        left_joins = []
+        joined_tables = []
+        lfields = self.lfields
+        for selector in (self.rows, self.cols) + tuple(f for f, m in self.layers):
+            if not selector or selector not in lfields:
+                continue
+            ljoins = lfields[selector].left
+            if not ljoins:
+                continue
+            for tn in ljoins:
+                for join in ljoins[tn]:
+                    if str(join.first) not in joined_tables:
+                        joined_tables.append(str(join.first))
+                        left_joins.append(join)
+        for join in rfilter.get_left_joins():
+            if str(join.first) not in joined_tables:
+                joined_tables.append(str(join.first))
+                left_joins.append(join)
+        if left_joins:
+            try:
+                left_joins.sort(resource.sortleft)
+            except:
+                pass
+        else:
+            left_joins = None
+
+        # Run the query
+        rows = current.db(query).select(*(groupby + expressions),
+                                        left=left_joins,
+                                        groupby=groupby)
+        if not rows:
+            self.empty = True
+            return True
+
+        # Collect the groups
+        NONE = S3PivotTable.NONE
+        def group_value(row, field):
+            if field is None:
+                return None
+            value = row[field]
+            if value is None:
+                return NONE
+            if type(value) is str:
+                value = unicode(value.decode("utf-8"))
+            return value
+        rfield, cfield = dimensions
+        groups = {}
+        rvalues = set()
+        cvalues = set()
+        numrecords = 0
+        for row in rows:
+            rvalue = group_value(row, rfield)
+            cvalue = group_value(row, cfield)
+            rvalues.add(rvalue)
+            cvalues.add(cvalue)
+            groups[(rvalue, cvalue)] = row
+            numrecords += row[number]
+        self.numrecords = numrecords
+
+        rvalues = sorted(rvalues)
+        cvalues = sorted(cvalues)
+        self.row = [Storage({"value": None if v == NONE else v})
+                    for v in rvalues]
+        self.col = [Storage({"value": None if v == NONE else v})
+                    for v in cvalues]
+        numrows = self.numrows = len(rvalues)
+        numcols = self.numcols = len(cvalues)
+        cells = self.cell = [[Storage() for c in xrange(numcols)]
+                             for r in xrange(numrows)]
+
+        # Add the layers
+        combine = S3PivotTable.combine
+        for i, layer in enumerate(self.layers):
+            method = layer[1]
+            exprs = aggregates[i]
+            partials = []
+            counts = []
+            for rvalue in rvalues:
+                prow = []
+                crow = []
+                for cvalue in cvalues:
+                    row = groups.get((rvalue, cvalue))
+                    value = None
+                    count = 0
+                    if row is not None:
+                        value = row[exprs[0]]
+                        if method == "avg":
+                            count = row[exprs[1]] or 0
+                    if value is None and method in ("sum", "avg", "count"):
+                        value = 0
+                    prow.append(value)
+                    if method == "avg":
+                        crow.append(count)
+                partials.append(prow)
+                counts.append(crow)
+            if method != "avg":
+                counts = None
+            values, rtotals, ctotals, total = combine(partials, method,
+                                                      counts=counts)
+            for r in xrange(numrows):
+                for c in xrange(numcols):
+                    cells[r][c][layer] = values[r][c]
+                self.row[r][layer] = rtotals[r]
+            for c in xrange(numcols):
+                self.col[c][layer] = ctotals[c]
+            self.totals[layer] = total
+        return True
+
     # -------------------------------------------------------------------------
     def _flatten(self, row):
         """
@@ -765,7 +969,7 @@ class S3Report:
         for field in fields:
             value = extract(row, field)
             if value is None and field != pkey:
-                value = "__NONE__"
+                value = S3PivotTable.NONE
             if type(value) is str:
                 value = unicode(value.decode("utf-8"))
             item[field] = value
@@ -831,7 +1035,7 @@ class S3Report:
         """
             Compute a new layer from the base layer (pt+items)
 
-            @param pt: the pivot table with record IDs
+            @param pt: the S3PivotTable with the record IDs
             @param fact: the fact field for the layer
             @param method: the aggregation method of the layer
         """
@@ -839,113 +1043,47 @@ class S3Report:
         if method not in self.METHODS:
             raise SyntaxError("Unsupported aggregation method: %s" % method)
 
-        items = self.records
-        lfields = self.lfields
         rows = self.row
         cols = self.col
         records = self.records
         extract = self._extract
-        aggregate = self._aggregate
-        resource = self.resource
 
         RECORDS = "records"
-        VALUES = "values"
-
-        table = resource.table
-        pkey = table._id.name
 
         if method is None:
             method = "list"
         layer = (fact, method)
+        if fact is None:
+            fact = self.resource.table._id.name
 
-        numcols = len(pt.cnames)
-        numrows = len(pt.rnames)
+        numcols = pt.numcols
+        numrows = pt.numrows
 
-        # Initialize cells
+        # Initialize cells, rows and columns
         if self.cell is None:
-            self.cell = [[Storage()
-                          for i in xrange(numcols)]
-                         for j in xrange(numrows)]
+            self.cell = [[Storage({RECORDS: ids}) for ids in cells]
+                         for cells in pt.cells]
+            for r in xrange(numrows):
+                rows[r][RECORDS] = pt.row_records(r)
+            for c in xrange(numcols):
+                cols[c][RECORDS] = pt.col_records(c)
         cells = self.cell
 
-        all_values = []
-        for r in xrange(numrows):
-
-            # Initialize row header
-            row = rows[r]
-            row[RECORDS] = []
-            row[VALUES] = []
-
-            row_records = row[RECORDS]
-            row_values = row[VALUES]
+        # Get the fact values of all records
+        values = dict((record_id, extract(records[record_id], fact))
+                      for record_id in records)
 
+        # Aggregate
+        cvalues, rtotals, ctotals, total = pt.aggregate(values, method)
+        for r in xrange(numrows):
+            row_cells = cells[r]
+            row_values = cvalues[r]
             for c in xrange(numcols):
-
-                # Initialize column header
-                col = cols[c]
-                if RECORDS not in col:
-                    col[RECORDS] = []
-                col_records = col[RECORDS]
-                if VALUES not in col:
-                    col[VALUES] = []
-                col_values = col[VALUES]
-
-                # Get the records
-                cell = cells[r][c]
-                if RECORDS in cell and cell[RECORDS] is not None:
-                    ids = cell[RECORDS]
-                else:
-                    data = pt[r][c]
-                    if data:
-                        remove = data.remove
-                        while None in data:
-                            remove(None)
-                        ids = data
-                    else:
-                        ids = []
-                    cell[RECORDS] = ids
-                row_records.extend(ids)
-                col_records.extend(ids)
-
-                # Get the values
-                if fact is None:
-                    fact = pkey
-                    values = ids
-                    row_values = row_records
-                    col_values = row_records
-                    all_values = self.records.keys()
-                else:
-                    values = []
-                    append = values.append
-                    for i in ids:
-                        value = extract(records[i], fact)
-                        if value is None:
-                            continue
-                        append(value)
-                    if len(values) and type(values[0]) is list:
-                        values = reduce(lambda x, y: x.extend(y) or x, values)
-                    if method in ("list", "count"):
-                        values =  list(set(values))
-                    row_values.extend(values)
-                    col_values.extend(values)
-                    all_values.extend(values)
-
-                # Aggregate values
-                value = aggregate(values, method)
-                cell[layer] = value
-
-            # Compute row total
-            row[layer] = aggregate(row_values, method)
-            del row[VALUES]
-
-        # Compute column total
+                row_cells[c][layer] = row_values[c]
+            rows[r][layer] = rtotals[r]
         for c in xrange(numcols):
-            col = cols[c]
-            col[layer] = aggregate(col[VALUES], method)
-            del col[VALUES]
-
-        # Compute overall total
-        self.totals[layer] = aggregate(all_values, method)
+            cols[c][layer] = ctotals[c]
+        self.totals[layer] = total
         return
 
     # -------------------------------------------------------------------------
@@ -1015,12 +1153,314 @@ class S3Report:
 
         items = self.records
         if items is None:
-            return 0
+            return self.numrecords or 0
         else:
             return len(self.records)
 
 # =============================================================================
 
+class S3PivotTable(object):
+    """
+        Pivot table of record IDs: groups the report items by their
+        rows and columns values in a single pass, and aggregates fact
+        values per cell, row, column and for the whole table.
+    """
+
+    # Placeholder for None in rows/columns values (keeps them sortable)
+    NONE = "__NONE__"
+
+    def __init__(self, items, pkey, rows=None, cols=None):
+        """
+            Constructor
+
+            @param items: iterable of report items (dicts with the
+                          rows/cols values and the record ID)
+            @param pkey: the name of the record ID field in the items
+            @param rows: the rows field (None for a single row)
+            @param cols: the columns field (None for a single column)
+        """
+
+        groups = {}
+        rvalues = set()
+        cvalues = set()
+        seen = set()
+        add = seen.add
+
+        for item in items:
+            if rows:
+                rvalue = item[rows]
+            else:
+                rvalue = None
+            if cols:
+                cvalue = item[cols]
+            else:
+                cvalue = None
+            record_id = item[pkey]
+            key = (rvalue, cvalue, record_id)
+            if key in seen:
+                continue
+            add(key)
+            group = (rvalue, cvalue)
+            if group in groups:
+                groups[group].append(record_id)
+            else:
+                groups[group] = [record_id]
+                rvalues.add(rvalue)
+                cvalues.add(cvalue)
+
+        if rows:
+            self.rvalues = sorted(rvalues)
+        else:
+            self.rvalues = [None]
+        if cols:
+            self.cvalues = sorted(cvalues)
+        else:
+            self.cvalues = [None]
+        self.numrows = numrows = len(self.rvalues)
+        self.numcols = numcols = len(self.cvalues)
+
+        # Matrix of record ID lists [row][col]
+        rindex = dict((v, i) for i, v in enumerate(self.rvalues))
+        cindex = dict((v, i) for i, v in enumerate(self.cvalues))
+        cells = [[[] for c in xrange(numcols)] for r in xrange(numrows)]
+        for (rvalue, cvalue), ids in groups.iteritems():
+            cells[rindex[rvalue]][cindex[cvalue]] = ids
+        self.cells = cells
+
+    # -------------------------------------------------------------------------
+    def row_records(self, r):
+        """
+            All record IDs in a row (with duplicates if records appear
+            in multiple columns)
+
+            @param r: the row index
+        """
+
+        records = []
+        for ids in self.cells[r]:
+            records.extend(ids)
+        return records
+
+    # -------------------------------------------------------------------------
+    def col_records(self, c):
+        """
+            All record IDs in a column (with duplicates if records appear
+            in multiple rows)
+
+            @param c: the column index
+        """
+
+        records = []
+        for cells in self.cells:
+            records.extend(cells[c])
+        return records
+
+    # -------------------------------------------------------------------------
+    def aggregate(self, values, method):
+        """
+            Aggregate fact values per cell, row, column and in total
+
+            @param values: the fact values as dict {record_id: value}
+            @param method: the aggregation method
+
+            @returns: tuple (cells, rows, cols, total) with the matrix
+                      [row][col] of cell aggregates, the list of row
+                      totals, the list of column totals and the total
+
+            @note: the row/column totals aggregate the values of all
+                   cells in the row/column (rather than of all records),
+                   as in the contingency table
+        """
+
+        numrows = self.numrows
+        numcols = self.numcols
+
+        # Collect the values of each cell
+        distinct = method in ("list", "count")
+        get_value = values.get
+        numeric = True
+        cvalues = []
+        for cells in self.cells:
+            row = []
+            for ids in cells:
+                items = []
+                append = items.append
+                for record_id in ids:
+                    value = get_value(record_id)
+                    if value is None:
+                        continue
+                    if type(value) in (list, tuple):
+                        items.extend([v for v in value if v is not None])
+                    else:
+                        append(value)
+                if distinct:
+                    items = list(set(items))
+                elif numeric:
+                    for v in items:
+                        if type(v) not in (int, long, float):
+                            numeric = False
+                            break
+                row.append(items)
+            cvalues.append(row)
+
+        counts = None
+        if method == "list":
+            partials = [[items or None for items in row] for row in cvalues]
+        elif method == "count":
+            partials = [[len(items) for items in row] for row in cvalues]
+        elif method == "avg":
+            partials = self._partials(cvalues, "sum", numeric=numeric)
+            counts = [[len(items) for items in row] for row in cvalues]
+        elif method in ("sum", "min", "max"):
+            partials = self._partials(cvalues, method, numeric=numeric)
+        else:
+            partials = [[None for c in xrange(numcols)]
+                        for r in xrange(numrows)]
+        return self.combine(partials, method, counts=counts)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def combine(partials, method, counts=None):
+        """
+            Compute the cell values and the row, column and overall
+            totals from the partial aggregates of each cell
+
+            @param partials: matrix [row][col] of the partial aggregates
+                             (the distinct values for "list", the number
+                             of distinct values for "count", the sum of
+                             the values for "sum" and "avg", the minimum
+                             or maximum for "min" and "max")
+            @param method: the aggregation method
+            @param counts: matrix [row][col] of the numbers of values
+                           (required for "avg")
+
+            @returns: tuple (cells, rows, cols, total), see aggregate()
+        """
+
+        numrows = len(partials)
+        numcols = numrows and len(partials[0]) or 0
+
+        if method == "list":
+            def total(parts):
+                result = []
+                for items in parts:
+                    if items:
+                        result.extend(items)
+                return result or None
+
+        elif method == "count":
+            total = sum
+
+        elif method in ("min", "max"):
+            function = method == "min" and min or max
+            def total(parts):
+                parts = [v for v in parts if v is not None]
+                if not parts:
+                    return None
+                try:
+                    return function(parts)
+                except TypeError:
+                    return None
+
+        elif method in ("sum", "avg"):
+            def total(parts):
+                try:
+                    return sum(parts)
+                except TypeError:
+                    return None
+
+        else:
+            total = lambda parts: None
+
+        if method == "avg":
+            # Totals are averages over all values in the row/col/table
+            def average(sums, counts):
+                s = total(sums)
+                if s is None:
+                    return None
+                n = sum(counts)
+                try:
+                    return n and s / float(n) or 0.0
+                except TypeError:
+                    return None
+            cells = [[average([partials[r][c]], [counts[r][c]])
+                      for c in xrange(numcols)]
+                     for r in xrange(numrows)]
+            rows = [average(partials[r], counts[r])
+                    for r in xrange(numrows)]
+            cols = [average([partials[r][c] for r in xrange(numrows)],
+                            [counts[r][c] for r in xrange(numrows)])
+                    for c in xrange(numcols)]
+            all_sums = [v for row in partials for v in row]
+            all_counts = [n for row in counts for n in row]
+            return cells, rows, cols, average(all_sums, all_counts)
+
+        cells = partials
+        rows = [total(cells[r]) for r in xrange(numrows)]
+        cols = [total([cells[r][c] for r in xrange(numrows)])
+                for c in xrange(numcols)]
+        return cells, rows, cols, total([v for row in cells for v in row])
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _partials(cvalues, method, numeric=False):
+        """
+            Compute sum, min or max of the values of each cell
+
+            @param cvalues: the matrix [row][col] of cell value lists
+            @param method: "sum", "min" or "max"
+            @param numeric: all values are numbers (can use NumPy)
+
+            @returns: matrix [row][col] of cell aggregates (0 for
+                      the sum of an empty cell, None for min/max)
+        """
+
+        if NUMPY and numeric:
+            # Columnar: one array with all values, cells as slices
+            flat = []
+            starts = []
+            positions = []
+            for r, row in enumerate(cvalues):
+                for c, items in enumerate(row):
+                    if items:
+                        starts.append(len(flat))
+                        positions.append((r, c))
+                        flat.extend(items)
+            if method == "sum":
+                partials = [[0 for items in row] for row in cvalues]
+            else:
+                partials = [[None for items in row] for row in cvalues]
+            if flat:
+                if method == "sum":
+                    reduceat = numpy.add.reduceat
+                elif method == "min":
+                    reduceat = numpy.minimum.reduceat
+                else:
+                    reduceat = numpy.maximum.reduceat
+                results = reduceat(numpy.array(flat), starts).tolist()
+                for i, (r, c) in enumerate(positions):
+                    partials[r][c] = results[i]
+            return partials
+
+        if method == "sum":
+            def aggregate(items):
+                try:
+                    return sum(items)
+                except TypeError:
+                    return None
+        else:
+            function = method == "min" and min or max
+            def aggregate(items):
+                if not items:
+                    return None
+                try:
+                    return function(items)
+                except TypeError:
+                    return None
+        return [[aggregate(items) for items in row] for row in cvalues]
+
+# =============================================================================
+
 class S3ContingencyTable(TABLE):
     """ HTML Helper to generate a contingency table """
 
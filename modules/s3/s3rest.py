@@ -65,7 +65,7 @@ import gluon.contrib.simplejson as json
 
 from s3validators import IS_ONE_OF, IS_INT_AMOUNT, IS_FLOAT_AMOUNT
 from s3tools import SQLTABLES3
-from s3xml import S3XML
+from s3xml import S3XML, S3XMLWriter
 from s3model import S3Model, S3ModelExtensions
 from s3export import S3Exporter
 from s3method import S3Method
@@ -1344,6 +1344,45 @@ class S3Request(object):
             default = "text/xml"
         headers["Content-Type"] = content_type.get(representation, default)
 
+        # GIS Feature Layers: use the layer cache
+        layer_cache = None
+        from s3gis import S3LayerCache
+        if S3LayerCache.cacheable(r):
+            layer_cache = S3LayerCache(r)
+            if layer_cache.not_modified():
+                raise HTTP(304)
+            output = layer_cache.get()
+            if output is not None:
+                return output
+
+        # Native S3XML/S3JSON can be exported page by page
+        native = stylesheet is None
+        if not native and representation == "s3json":
+            import os
+            native = stylesheet == os.path.join(r.folder, r.XSLT_PATH,
+                                                "s3json", "export.xsl")
+        settings = current.deployment_settings
+        page_size = settings.get_base_xml_export_page_size()
+        if native and page_size:
+            # The database connection is closed once the controller
+            # returns, so write to a temporary file rather than
+            # streaming directly into the response
+            import tempfile
+            output = tempfile.TemporaryFile()
+            for chunk in resource.export_stream(start=start,
+                                                limit=limit,
+                                                msince=msince,
+                                                fields=fields,
+                                                dereference=True,
+                                                references=references,
+                                                mcomponents=mcomponents,
+                                                rcomponents=rcomponents,
+                                                as_json=as_json,
+                                                page_size=page_size):
+                output.write(chunk)
+            output.seek(0)
+            return current.response.stream(output, chunk_size=65536)
+
         # Export the resource
         output = resource.export_xml(start=start,
                                      limit=limit,
@@ -1360,6 +1399,9 @@ class S3Request(object):
         if not output:
             r.error(400, "XSLT Transformation Error: %s " % xml.error)
 
+        if layer_cache is not None:
+            layer_cache.store(output)
+
         return output
 
     # -------------------------------------------------------------------------
@@ -2001,6 +2043,8 @@ class S3Resource(object):
         # The Rows
         self._rows = None
         self._rowindex = None
+        self._rlookup = None
+        self._cindex = None
         self.rfields = None
         self.dfields = None
         self._ids = []
@@ -2267,12 +2311,13 @@ class S3Resource(object):
         return rows
 
     # -------------------------------------------------------------------------
-    def load(self, start=None, limit=None):
+    def load(self, start=None, limit=None, orderby=None):
         """
             Load records from this resource
 
             @param start: the index of the first record to load
             @param limit: the maximum number of records to load
+            @param orderby: orderby for the query
         """
 
         manager = current.manager
@@ -2313,13 +2358,14 @@ class S3Resource(object):
             rows = self.sqltable(fnames,
                                  start=start,
                                  limit=limit,
+                                 orderby=orderby,
                                  as_rows=True)
             if rows is None:
                 rows = []
             if not limitby:
                 self._length = len(rows)
         else:
-            rows = self.select(limitby=limitby, *fields)
+            rows = self.select(limitby=limitby, orderby=orderby, *fields)
             self._length = len(rows)
         id = table._id.name
         self._ids = [row[id] for row in rows]
@@ -2631,6 +2677,8 @@ class S3Resource(object):
 
         self._rows = None
         self._rowindex = None
+        self._rlookup = None
+        self._cindex = None
         self._length = None
         self._ids = []
         self._uids = []
@@ -2716,16 +2764,59 @@ class S3Resource(object):
                 raise AttributeError("Undefined component %s" % component)
             if c._rows is None:
                 c.load()
-            rows = c._rows
-            pkey, fkey = c.pkey, c.fkey
-            master_id = master[pkey]
-            if c.link:
-                lkey, rkey = c.lkey, c.rkey
-                lids = [r[rkey] for r in c.link if master_id == r[lkey]]
-                rows = [record for record in rows if record[fkey] in lids]
+            index = c._cindex
+            if index is None:
+                index = c._cindex = c.__index_component()
+            master_id = master[c.pkey]
+            if master_id in index:
+                return list(index[master_id])
             else:
-                rows = [record for record in rows if master_id == record[fkey]]
-            return rows
+                return []
+
+    # -------------------------------------------------------------------------
+    def __index_component(self):
+        """
+            Builds an index of the loaded rows of this component by
+            the primary key of the master record they belong to, so
+            that __call__ doesn't have to scan all rows (and all link
+            table rows) for each master record
+
+            @returns: a dict {master key: [row, ...]}, with the rows
+                      in the order they have been loaded
+        """
+
+        index = {}
+        rows = self._rows
+        if not rows:
+            return index
+        fkey = self.fkey
+        if self.link:
+            # Map the right key to all master keys linked to it
+            lkey, rkey = self.lkey, self.rkey
+            masters = {}
+            for r in self.link:
+                rid = r[rkey]
+                if rid in masters:
+                    masters[rid].add(r[lkey])
+                else:
+                    masters[rid] = set([r[lkey]])
+            for row in rows:
+                rid = row[fkey]
+                if rid not in masters:
+                    continue
+                for master_id in masters[rid]:
+                    if master_id in index:
+                        index[master_id].append(row)
+                    else:
+                        index[master_id] = [row]
+        else:
+            for row in rows:
+                master_id = row[fkey]
+                if master_id in index:
+                    index[master_id].append(row)
+                else:
+                    index[master_id] = [row]
+        return index
 
     # -------------------------------------------------------------------------
     def get_id(self):
@@ -3001,23 +3092,35 @@ class S3Resource(object):
             mci_filter = (table.mci >= 0)
             self.add_filter(mci_filter)
 
+        # GIS Feature Layer: only export the features inside the map
+        # viewport, and grid clusters instead of features if zoomed out
+        get_vars = current.request.get_vars
+        layer_id = get_vars.layer
+        if layer_id and "bbox" in get_vars:
+            gis = current.gis
+            bbox = gis.parse_bbox(get_vars.bbox)
+            if bbox and current.deployment_settings.get_gis_layer_cache():
+                # Same viewport as in the cache key (see S3LayerCache)
+                bbox = gis.snap_bbox(bbox)
+            if bbox:
+                bbox_filter = gis.get_feature_layer_query(self, layer_id, bbox)
+                if bbox_filter is not None:
+                    self.add_filter(bbox_filter)
+                    clusters = gis.get_feature_clusters(self, layer_id,
+                                                        get_vars.zoom)
+                    if clusters is not None:
+                        return self.__export_clusters(clusters, layer_id)
+
         # Total number of results
         results = self.count()
 
         # Load slice
         self.load(start=start, limit=limit)
 
-        _vars = current.request.get_vars
-        layer_id = _vars.layer
-        if layer_id:
-            # We're being called as a GIS Feature Layer, so do lookup per layer
-            # and not per-record
-            # Marker, Popup & LatLon
-            marker = current.gis.get_marker_and_popup(layer_id, self)
-        else:
-            # Marker provided in request
-            # Q: What does this?
-            marker = _vars.get("marker", None)
+        # Look up all referenced records at once
+        self._rlookup = xml.lookup(table, self._rows, rfields)
+
+        marker = self.__export_marker()
 
         # Build the tree
         if DEBUG:
@@ -3060,29 +3163,12 @@ class S3Resource(object):
         while reference_map and depth:
             depth -= 1
             load_map = dict()
-            get_exported = export_map.get
-            for ref in reference_map:
-                if "table" in ref and "id" in ref:
-                    tname = ref["table"]
-                    ids = ref["id"]
-                    if not isinstance(ids, list):
-                        ids = [ids]
-                    # Exclude records which are already in the tree
-                    exported = get_exported(tname, [])
-                    ids = [x for x in ids if x not in exported]
-                    if not ids:
-                        continue
-                    # Append the new ids to load_map[tname]
-                    if tname in load_map:
-                        ids = [x for x in ids if x not in load_map[tname]]
-                        load_map[tname] += ids
-                    else:
-                        load_map[tname] = ids
+            self.__load_map(reference_map, export_map, load_map)
 
             reference_map = []
             REF = xml.ATTRIBUTE.ref
             for tablename in load_map:
-                load_list = load_map[tablename]
+                load_list = list(load_map[tablename])
                 prefix, name = tablename.split("_", 1)
                 rresource = manager.define_resource(prefix, name,
                                                     id=load_list,
@@ -3096,6 +3182,8 @@ class S3Resource(object):
                                                           data=fields,
                                                           references=references)
                 rresource.load()
+                rresource._rlookup = xml.lookup(table, rresource._rows,
+                                                rfields)
                 export_resource = rresource.__export_resource
                 for record in rresource:
                     element = export_resource(record,
@@ -3130,6 +3218,307 @@ class S3Resource(object):
                         limit=limit)
         return tree
 
+    # -------------------------------------------------------------------------
+    def export_stream(self,
+                      start=None,
+                      limit=None,
+                      msince=None,
+                      fields=None,
+                      dereference=True,
+                      mcomponents=None,
+                      rcomponents=None,
+                      references=None,
+                      as_json=False,
+                      page_size=500):
+        """
+            Export this resource as S3XML (or S3JSON) page by page,
+            without building the complete element tree in memory
+
+            @param start: index of the first record to export (slicing)
+            @param limit: maximum number of records to export (slicing)
+            @param msince: export only records which have been modified
+                            after this datetime
+            @param fields: data fields to include (None for all)
+            @param dereference: include referenced resources
+            @param mcomponents: components of the master resource to
+                                include (list of tablenames), empty list
+                                for all
+            @param rcomponents: components of referenced resources to
+                                include (list of tablenames), empty list
+                                for all
+            @param references: reference fields to include (None for all)
+            @param as_json: produce S3JSON instead of S3XML
+            @param page_size: the number of records to export at a time
+
+            @returns: a generator of strings
+
+            @note: the output is the same as from export_xml without
+                   stylesheet, except that the "results" attribute
+                   is always the total number of matching records (i.e.
+                   records skipped because of msince are included)
+        """
+
+        manager = current.manager
+        xml = manager.xml
+        define_resource = manager.define_resource
+
+        if manager.show_urls:
+            base_url = manager.s3.base_url
+        else:
+            base_url = None
+
+        # Filter for MCI >= 0 (setting)
+        table = self.table
+        if xml.filter_mci and "mci" in table.fields:
+            mci_filter = (table.mci >= 0)
+            self.add_filter(mci_filter)
+
+        # Total number of results
+        results = self.count()
+
+        marker = self.__export_marker()
+
+        # Start the document
+        root = xml.tree(None,
+                        domain=manager.domain,
+                        url=base_url,
+                        results=results,
+                        start=start,
+                        limit=limit).getroot()
+        root.set(xml.ATTRIBUTE.success, json.dumps(results > 0))
+        writer = S3XMLWriter(root, as_json=as_json)
+        yield writer.head()
+
+        skip = []
+        export_map = Storage()
+        reference_map = []
+        load_map = dict()
+
+        def export_page(resource, rfields, dfields, url, components, load_map,
+                        referenced=False):
+            """ Export the loaded records of a resource """
+
+            resource._rlookup = xml.lookup(resource.table,
+                                           resource._rows,
+                                           rfields)
+            export_resource = resource.__export_resource
+            page = etree.Element(xml.TAG.root)
+            REF = xml.ATTRIBUTE.ref
+            for record in resource:
+                element = export_resource(record,
+                                          rfields=rfields,
+                                          dfields=dfields,
+                                          parent=page,
+                                          base_url=url,
+                                          reference_map=reference_map,
+                                          export_map=export_map,
+                                          components=components,
+                                          skip=skip,
+                                          msince=msince,
+                                          marker=marker)
+                # Mark as referenced element (for XSLT)
+                if referenced and element is not None:
+                    element.set(REF, "True")
+            self.__load_map(reference_map, export_map, load_map)
+            del reference_map[:]
+            return writer.write(page)
+
+        # Export the master records: page over this resource itself, so
+        # that all its filters (including virtual filters and component
+        # filters) apply, and restrict the components to the master
+        # records of each page
+        prefix = self.prefix
+        name = self.name
+        if base_url:
+            url = "%s/%s/%s" % (base_url, prefix, name)
+        else:
+            url = "/%s/%s" % (prefix, name)
+        rfields, dfields = self.split_fields(skip=skip,
+                                             data=fields,
+                                             references=references)
+        if not self.components:
+            mcomponents = None
+        pkey = table._id
+        limitby = self.limitby(start=start, limit=limit)
+        if limitby:
+            page_start, end = limitby
+        else:
+            page_start, end = 0, None
+        while end is None or page_start < end:
+            if end is not None:
+                size = min(page_size, end - page_start)
+            else:
+                size = page_size
+            self.load(start=page_start, limit=size, orderby=pkey)
+            ids = self._ids
+            if not ids:
+                break
+            queries = self.__restrict_components(pkey.belongs(ids))
+            try:
+                output = export_page(self, rfields, dfields, url,
+                                     mcomponents, load_map)
+            finally:
+                for rfilter, query in queries:
+                    rfilter.query = query
+            yield output
+            if len(ids) < size:
+                break
+            page_start += size
+        self.clear()
+
+        # Export the referenced records
+        depth = dereference and manager.MAX_DEPTH or 0
+        while load_map and depth:
+            depth -= 1
+            current_map = load_map
+            load_map = dict()
+            for tablename in current_map:
+                exported = export_map.get(tablename, ())
+                ids = [x for x in current_map[tablename]
+                         if x not in exported]
+                if not ids:
+                    continue
+                prefix, name = tablename.split("_", 1)
+                if manager.s3.base_url:
+                    url = "%s/%s/%s" % (manager.s3.base_url, prefix, name)
+                else:
+                    url = "/%s/%s" % (prefix, name)
+                for i in xrange(0, len(ids), page_size):
+                    rresource = define_resource(prefix, name,
+                                                id=ids[i:i + page_size],
+                                                components=[])
+                    rfields, dfields = rresource.split_fields(skip=skip,
+                                                              data=fields,
+                                                              references=references)
+                    rresource.load()
+                    yield export_page(rresource, rfields, dfields, url,
+                                      rcomponents, load_map, referenced=True)
+
+        # Complete the document
+        for output in writer.tail():
+            yield output
+
+    # -------------------------------------------------------------------------
+    def __restrict_components(self, query):
+        """
+            Restrict the components (and link tables) of this resource
+            to the master records matching a query, without changing
+            their other filters (the caller must restore the queries)
+
+            @param query: the query for the master records
+            @returns: list of tuples (component filter, original query)
+        """
+
+        queries = []
+        for c in self.components.values() + self.links.values():
+            c.get_query()
+            rfilter = c.rfilter
+            queries.append((rfilter, rfilter.query))
+            rfilter.query = rfilter.query & query
+            c.clear()
+        return queries
+
+    # -------------------------------------------------------------------------
+    def __export_clusters(self, clusters, layer_id):
+        """
+            Export grid clusters of a GIS Feature Layer as S3XML
+
+            @param clusters: the clusters, see GIS.get_feature_clusters
+            @param layer_id: the gis_layer_feature record ID
+            @returns: the element tree, with one <resource> element
+                      per cluster, with the number of features in the
+                      cluster as "count" attribute
+        """
+
+        manager = current.manager
+        xml = manager.xml
+        ATTRIBUTE = xml.ATTRIBUTE
+        T = current.T
+
+        marker, popup_url = current.gis.get_layer_marker(layer_id, self)
+        marker_url = "/%s/static/img/markers/%s" % \
+                     (current.request.application, marker)
+
+        root = etree.Element(xml.TAG.root)
+        SubElement = etree.SubElement
+        tablename = self.tablename
+        for cluster in clusters:
+            element = SubElement(root, xml.TAG.resource)
+            attr = element.attrib
+            count = cluster.count
+            attr[ATTRIBUTE.name] = tablename
+            attr["count"] = str(count)
+            attr[ATTRIBUTE.lat] = "%.4f" % cluster.lat
+            attr[ATTRIBUTE.lon] = "%.4f" % cluster.lon
+            attr[ATTRIBUTE.marker] = marker_url
+            if count == 1:
+                attr[ATTRIBUTE.url] = "%s/%i.plain" % (popup_url, cluster.id)
+            else:
+                attr[ATTRIBUTE.popup] = \
+                    unicode(T("%(count)s features - zoom in to see them")) % \
+                    dict(count=count)
+
+        return xml.tree(None,
+                        root=root,
+                        domain=manager.domain,
+                        url=manager.show_urls and manager.s3.base_url or None,
+                        results=len(clusters))
+
+    # -------------------------------------------------------------------------
+    def __export_marker(self):
+        """
+            Get the marker for a GIS feature layer export
+
+            @returns: the marker (or marker and popup) as required
+                      by __export_record
+        """
+
+        _vars = current.request.get_vars
+        layer_id = _vars.layer
+        if layer_id:
+            # We're being called as a GIS Feature Layer, so do lookup per layer
+            # and not per-record
+            # Marker, Popup & LatLon
+            marker = current.gis.get_marker_and_popup(layer_id, self)
+        else:
+            # Marker provided in request
+            # Q: What does this?
+            marker = _vars.get("marker", None)
+        return marker
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def __load_map(reference_map, export_map, load_map):
+        """
+            Collect the IDs of referenced records which are not yet
+            exported
+
+            @param reference_map: the reference map of the export
+            @param export_map: the export map of the export
+            @param load_map: dict {tablename: set of record IDs} to add
+                             the IDs to
+        """
+
+        get_exported = export_map.get
+        no_ids = set()
+        for ref in reference_map:
+            if "table" in ref and "id" in ref:
+                tname = ref["table"]
+                ids = ref["id"]
+                if not isinstance(ids, list):
+                    ids = [ids]
+                # Exclude records which are already in the tree
+                exported = get_exported(tname, no_ids)
+                ids = [x for x in ids if x not in exported]
+                if not ids:
+                    continue
+                # Add the new ids to load_map[tname]
+                if tname in load_map:
+                    load_map[tname].update(ids)
+                else:
+                    load_map[tname] = set(ids)
+        return
+
     # -------------------------------------------------------------------------
     def __export_resource(self,
                           record,
@@ -3218,6 +3607,10 @@ class S3Resource(object):
                 if c._rows is None:
                     c.load()
 
+                # Look up the referenced records of all component records
+                if c._rlookup is None:
+                    c._rlookup = xml.lookup(ctable, c._rows, crfields)
+
                 # Construct the component base URL
                 if record_url:
                     component_url = "%s/%s" % (record_url, c.alias)
@@ -3317,7 +3710,7 @@ class S3Resource(object):
                   record=record[table._id], representation="xml")
 
         # Reference map for this record
-        rmap = xml.rmap(table, record, rfields)
+        rmap = xml.rmap(table, record, rfields, lookup=self._rlookup)
 
         # Generate the element
         element = xml.resource(parent, table, record,
@@ -3352,9 +3745,9 @@ class S3Resource(object):
         if rmap:
             reference_map.extend(rmap)
         if tablename in export_map:
-            export_map[tablename].append(record_id)
+            export_map[tablename].add(record_id)
         else:
-            export_map[tablename] = [record_id]
+            export_map[tablename] = set([record_id])
         return
 
     # -------------------------------------------------------------------------
@@ -3375,6 +3768,7 @@ class S3Resource(object):
                    conflict_policy=None,
                    last_sync=None,
                    onconflict=None,
+                   bulk=False,
                    **args):
         """
             XML Importer
@@ -3396,6 +3790,8 @@ class S3Resource(object):
             @param conflict_policy: policy for conflict resolution (sync)
             @param last_sync: last synchronization datetime (sync)
             @param onconflict: callback hook for conflict resolution (sync)
+            @param bulk: commit the import job in bulk mode
+                         (see S3ImportJob.commit)
             @param args: parameters to pass to the transformation stylesheet
         """
 
@@ -3485,7 +3881,8 @@ class S3Resource(object):
                                    update_policy=update_policy,
                                    conflict_policy=conflict_policy,
                                    last_sync=last_sync,
-                                   onconflict=onconflict)
+                                   onconflict=onconflict,
+                                   bulk=bulk)
 
         self.files = Storage()
 
@@ -3517,7 +3914,8 @@ class S3Resource(object):
                     update_policy=None,
                     conflict_policy=None,
                     last_sync=None,
-                    onconflict=None):
+                    onconflict=None,
+                    bulk=False):
         """
             Import data from an S3XML element tree.
 
@@ -3528,6 +3926,8 @@ class S3Resource(object):
             @param job_id: restore a job from the job table (ID or UID)
             @param delete_job: delete the import job from the job table
             @param commit_job: commit the job (default)
+            @param bulk: commit the job in bulk mode
+                         (see S3ImportJob.commit)
 
             @todo: update for link table support
         """
@@ -3676,7 +4076,7 @@ class S3Resource(object):
                 return False
 
         # Commit the import job
-        import_job.commit(ignore_errors=ignore_errors)
+        import_job.commit(ignore_errors=ignore_errors, bulk=bulk)
         self.error = import_job.error
         if self.error:
             if ignore_errors:
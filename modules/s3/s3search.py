@@ -31,9 +31,13 @@
 """
 
 import re
+import time
+import threading
 import gluon.contrib.simplejson as jsonlib
 import cPickle
 
+from datetime import datetime, timedelta
+
 from gluon.storage import Storage
 from gluon import *
 from gluon.serializers import json
@@ -61,6 +65,7 @@ __all__ = ["S3SearchWidget",
            "S3HRSearch",
            "S3PentitySearch",
            "S3TrainingSearch",
+           "S3NameIndex",
            ]
 
 MAX_RESULTS = 1000
@@ -2248,7 +2253,31 @@ class S3LocationSearch(S3Search):
                 exclude_value = None
 
             filter = _vars.filter
+            index = None
+            if filter == "~" and fieldname == "name" and \
+               not field2 and not (exclude_field and exclude_value):
+                index = S3NameIndex.get_index("gis_location")
+
             if filter == "~":
+                if children and index is not None:
+                    # New LocationSelector
+                    ids = index.descendants(children)
+                    if level:
+                        ids = index.filter(ids, "level", level)
+                    ids = index.filter(ids, "name", value, contains=True)
+                    if len(ids) > index.MAX_CANDIDATES:
+                        # Too many to filter by ID
+                        index = None
+                    else:
+                        if ids:
+                            db = current.db
+                            output = db(table.id.belongs(ids)).select(table.id,
+                                                                      table.name).json()
+                        else:
+                            output = json([])
+                        response.headers["Content-Type"] = "application/json"
+                        return output
+
                 if children:
                     # New LocationSelector
                     children = gis.get_children(children, level=level)
@@ -2258,7 +2287,24 @@ class S3LocationSearch(S3Search):
                     response.headers["Content-Type"] = "application/json"
                     return output
 
-                if exclude_field and exclude_value:
+                if index is not None:
+                    # Lookup the candidates in the name index
+                    ids = index.lookup(value)
+                    if level == "NULLNONE":
+                        ids = index.filter(ids, "level", None)
+                    elif level:
+                        ids = index.filter(ids, "level", level)
+                    if parent:
+                        ids = index.filter(ids, "parent", parent)
+                    if len(ids) > index.MAX_CANDIDATES:
+                        # Too many to filter by ID
+                        index = None
+
+                if index is not None:
+                    # Level and parent already filtered in the index
+                    query = (table.id.belongs(ids))
+
+                elif exclude_field and exclude_value:
                     # Old LocationSelector
                     # Filter out poor-quality data, such as from Ushahidi
                     query = (field.lower().like(value + "%")) & \
@@ -2274,7 +2320,7 @@ class S3LocationSearch(S3Search):
                     # Normal single-field
                     query = (field.lower().like(value + "%"))
 
-                if level:
+                if level and index is None:
                     resource.add_filter(query)
                     # New LocationSelector or Autocomplete
                     if isinstance(level, list):
@@ -2285,7 +2331,7 @@ class S3LocationSearch(S3Search):
                     else:
                         query = (table.level == level)
 
-                if parent:
+                if parent and index is None:
                     # New LocationSelector
                     resource.add_filter(query)
                     query = (table.parent == parent)
@@ -2349,6 +2395,357 @@ class S3LocationSearch(S3Search):
         response.headers["Content-Type"] = "application/json"
         return output
 
+# =============================================================================
+class S3NameIndex(object):
+    """
+        In-process name index for the autocomplete searches
+
+        Indexes the lower-case names of the records by their edge n-grams
+        (the first NGRAM characters), so that a prefix search only needs
+        to check the records with the same n-gram rather than scanning
+        the table.
+
+        The index is loaded with the first search, updated onaccept of
+        the indexed tables, and synchronized with the database every
+        SYNC_INTERVAL seconds (to pick up changes by other processes).
+
+        There is one index per table and process, which is updated by
+        onaccept and sync while other requests look up names in it, so
+        sync, load, lookup, descendants and filter hold the index lock.
+    """
+
+    # Indexed tables {tablename: (name fields, attributes)}
+    TABLES = {"gis_location": (("name",),
+                               ("level", "parent")),
+              "org_organisation": (("name", "acronym"),
+                                   ()),
+              "pr_person": (("first_name", "middle_name", "last_name"),
+                            ()),
+              }
+
+    NGRAM = 3
+    SYNC_INTERVAL = 60      # seconds between delta syncs
+    SYNC_OVERLAP = 300      # seconds overlap of delta syncs (for long transactions)
+    RELOAD_INTERVAL = 3600  # seconds between full reloads (for rollbacks)
+    BATCH_SIZE = 10000      # records per query when loading
+    MAX_CANDIDATES = 10000  # max number of records to filter by ID
+
+    INDEXES = {}
+    LOCK = threading.Lock()
+
+    def __init__(self, tablename):
+        """
+            Constructor
+
+            @param tablename: the name of the indexed table
+        """
+
+        self.tablename = tablename
+        self.fields, self.attributes = self.TABLES[tablename]
+
+        # {record_id: (names, attributes)}
+        self.records = {}
+        # {(field index, n-gram): set of record_ids}
+        self.ngrams = {}
+        # {parent: set of record_ids}
+        self.children = {}
+
+        self.synced = None
+        self.checked = None
+        self.loaded = None
+
+        self._lock = threading.Lock()
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def get_index(cls, tablename):
+        """
+            Get the (synchronized) name index for a table
+
+            @param tablename: the tablename
+            @returns: the S3NameIndex, or None if the table isn't indexed
+        """
+
+        if tablename not in cls.TABLES or \
+           not current.deployment_settings.get_ui_autocomplete_index():
+            return None
+        with cls.LOCK:
+            index = cls.INDEXES.get(tablename)
+            if index is None:
+                index = cls.INDEXES[tablename] = cls(tablename)
+        index.sync()
+        return index
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def update(cls, tablename, record_id):
+        """
+            Update the index for a record, to be called onaccept
+
+            @param tablename: the tablename
+            @param record_id: the record ID
+        """
+
+        index = cls.INDEXES.get(tablename)
+        if index is not None and index.synced is not None and record_id:
+            table = current.s3db[tablename]
+            index.load(table._id == record_id)
+        return
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def normalize(name):
+        """
+            Normalize a name for the index (lower-case unicode)
+
+            @param name: the name
+        """
+
+        if not name:
+            return None
+        if not isinstance(name, unicode):
+            try:
+                name = unicode(name, "utf-8")
+            except (TypeError, UnicodeDecodeError):
+                name = unicode(str(name), "utf-8", "ignore")
+        return name.lower().strip()
+
+    # -------------------------------------------------------------------------
+    def sync(self):
+        """ Load the index or the changes since the last sync """
+
+        with self._lock:
+            now = time.time()
+            if self.checked is not None and \
+               now - self.checked < self.SYNC_INTERVAL:
+                return
+            if self.loaded is not None and \
+               now - self.loaded > self.RELOAD_INTERVAL:
+                # Full reload to drop changes which have been rolled back
+                self.records = {}
+                self.ngrams = {}
+                self.children = {}
+                self.synced = None
+
+            table = current.s3db[self.tablename]
+            synced = datetime.utcnow()
+            if self.synced is None:
+                query = (table.deleted != True)
+            else:
+                since = self.synced - timedelta(seconds=self.SYNC_OVERLAP)
+                query = (table.modified_on >= since)
+            self._load(query)
+
+            if self.synced is None:
+                self.loaded = now
+            self.synced = synced
+            self.checked = now
+        return
+
+    # -------------------------------------------------------------------------
+    def load(self, query):
+        """
+            Load (or reload) the records matching a query into the index
+
+            @param query: the query
+        """
+
+        with self._lock:
+            self._load(query)
+        return
+
+    # -------------------------------------------------------------------------
+    def _load(self, query):
+        """
+            Load the records matching a query (caller must hold the lock)
+
+            @param query: the query
+        """
+
+        db = current.db
+        table = current.s3db[self.tablename]
+
+        fields = [table._id, table.deleted] + \
+                 [table[f] for f in self.fields] + \
+                 [table[a] for a in self.attributes]
+
+        key = table._id.name
+        last = 0
+        while True:
+            q = query & (table._id > last)
+            rows = db(q).select(orderby=table._id,
+                                limitby=(0, self.BATCH_SIZE),
+                                *fields)
+            for row in rows:
+                self._update(row)
+            if len(rows) < self.BATCH_SIZE:
+                break
+            last = rows.last()[key]
+        return
+
+    # -------------------------------------------------------------------------
+    def _update(self, row):
+        """
+            Update the index entry of a record
+
+            @param row: the record (Row with all indexed fields)
+        """
+
+        record_id = row[current.s3db[self.tablename]._id.name]
+        self._remove(record_id)
+        if row.deleted:
+            return
+
+        names = tuple([self.normalize(row[f]) for f in self.fields])
+        attributes = tuple([row[a] for a in self.attributes])
+        self.records[record_id] = (names, attributes)
+
+        ngrams = self.ngrams
+        NGRAM = self.NGRAM
+        for i, name in enumerate(names):
+            if name:
+                key = (i, name[:NGRAM])
+                if key not in ngrams:
+                    ngrams[key] = set()
+                ngrams[key].add(record_id)
+
+        if "parent" in self.attributes:
+            parent = attributes[list(self.attributes).index("parent")]
+            if parent:
+                if parent not in self.children:
+                    self.children[parent] = set()
+                self.children[parent].add(record_id)
+        return
+
+    # -------------------------------------------------------------------------
+    def _remove(self, record_id):
+        """
+            Remove a record from the index
+
+            @param record_id: the record ID
+        """
+
+        record = self.records.pop(record_id, None)
+        if record is None:
+            return
+        names, attributes = record
+
+        ngrams = self.ngrams
+        NGRAM = self.NGRAM
+        for i, name in enumerate(names):
+            if name:
+                key = (i, name[:NGRAM])
+                if key in ngrams:
+                    ngrams[key].discard(record_id)
+                    if not ngrams[key]:
+                        del ngrams[key]
+
+        if "parent" in self.attributes:
+            parent = attributes[list(self.attributes).index("parent")]
+            if parent in self.children:
+                self.children[parent].discard(record_id)
+        return
+
+    # -------------------------------------------------------------------------
+    def lookup(self, value, fields=None):
+        """
+            Find all records where any of the fields starts with value
+
+            @param value: the search string
+            @param fields: the names of the fields to search (default: all)
+
+            @returns: list of record IDs
+        """
+
+        value = self.normalize(value)
+        if not value:
+            return []
+        if fields is None:
+            indexes = range(len(self.fields))
+        else:
+            indexes = [i for i, f in enumerate(self.fields) if f in fields]
+
+        NGRAM = self.NGRAM
+        result = set()
+        with self._lock:
+            ngrams = self.ngrams
+            if len(value) >= NGRAM:
+                keys = [(i, value[:NGRAM]) for i in indexes]
+            else:
+                # Short search string => all n-grams starting with it
+                keys = [key for key in ngrams
+                        if key[0] in indexes and key[1].startswith(value)]
+
+            records = self.records
+            for key in keys:
+                for record_id in ngrams.get(key, ()):
+                    if record_id in result:
+                        continue
+                    names = records[record_id][0]
+                    for i in indexes:
+                        name = names[i]
+                        if name and name.startswith(value):
+                            result.add(record_id)
+                            break
+        return list(result)
+
+    # -------------------------------------------------------------------------
+    def descendants(self, record_id):
+        """
+            Find all descendants of a record (by the parent attribute)
+
+            @param record_id: the record ID
+            @returns: list of record IDs
+        """
+
+        result = set()
+        queue = [record_id]
+        with self._lock:
+            children = self.children
+            while queue:
+                node = queue.pop()
+                for child in children.get(node, ()):
+                    if child not in result and child != record_id:
+                        result.add(child)
+                        queue.append(child)
+        return list(result)
+
+    # -------------------------------------------------------------------------
+    def filter(self, ids, name, value, contains=False):
+        """
+            Filter records by an indexed field or attribute
+
+            @param ids: the record IDs
+            @param name: the field or attribute name
+            @param value: the value (or list of values)
+            @param contains: for fields, match records where the field
+                             contains the value (rather than equals it)
+
+            @returns: list of record IDs
+        """
+
+        if name in self.fields:
+            i = list(self.fields).index(name)
+            value = self.normalize(value)
+            if contains:
+                match = lambda v: v is not None and value in v
+            else:
+                match = lambda v: v == value
+            j = 0
+        else:
+            i = list(self.attributes).index(name)
+            if isinstance(value, (list, tuple)):
+                values = value
+            else:
+                values = [value]
+            match = lambda v: v in values
+            j = 1
+
+        with self._lock:
+            records = self.records
+            return [record_id for record_id in ids
+                    if record_id in records and match(records[record_id][j][i])]
+
 # =============================================================================
 class S3OrganisationSearch(S3Search):
     """
@@ -2401,10 +2798,19 @@ class S3OrganisationSearch(S3Search):
             fields = [table.id, field, field2, field3]
 
             if filter == "~":
-                query = (S3FieldSelector("parent.name").lower().like(value + "%")) | \
-                        (S3FieldSelector("parent.acronym").lower().like(value + "%")) | \
-                        (S3FieldSelector("organisation.name").lower().like(value + "%")) | \
-                        (S3FieldSelector("organisation.acronym").lower().like(value + "%"))
+                index = S3NameIndex.get_index("org_organisation")
+                if index is not None:
+                    ids = index.lookup(value)
+                    if len(ids) > index.MAX_CANDIDATES:
+                        index = None
+                if index is not None:
+                    query = (S3FieldSelector("parent.id").belongs(ids)) | \
+                            (S3FieldSelector("organisation.id").belongs(ids))
+                else:
+                    query = (S3FieldSelector("parent.name").lower().like(value + "%")) | \
+                            (S3FieldSelector("parent.acronym").lower().like(value + "%")) | \
+                            (S3FieldSelector("organisation.name").lower().like(value + "%")) | \
+                            (S3FieldSelector("organisation.acronym").lower().like(value + "%"))
 
             else:
                 output = xml.json_message(False,
@@ -2504,17 +2910,37 @@ class S3PersonSearch(S3Search):
 
             if filter == "~":
                 # pr_person Autocomplete
+                index = S3NameIndex.get_index("pr_person")
                 if " " in value:
                     value1, value2 = value.split(" ", 1)
                     value2 = value2.strip()
-                    query = (field.lower().like(value1 + "%")) & \
-                            ((field2.lower().like(value2 + "%")) | \
-                             (field3.lower().like(value2 + "%")))
+                    if index is not None:
+                        ids = set(index.lookup(value1, fields=["first_name"]))
+                        ids &= set(index.lookup(value2,
+                                                fields=["middle_name",
+                                                        "last_name"]))
+                        if len(ids) > index.MAX_CANDIDATES:
+                            # Too many to filter by ID
+                            index = None
+                    if index is not None:
+                        query = (table.id.belongs(ids))
+                    else:
+                        query = (field.lower().like(value1 + "%")) & \
+                                ((field2.lower().like(value2 + "%")) | \
+                                 (field3.lower().like(value2 + "%")))
                 else:
                     value = value.strip()
-                    query = ((field.lower().like(value + "%")) | \
-                            (field2.lower().like(value + "%")) | \
-                            (field3.lower().like(value + "%")))
+                    if index is not None:
+                        ids = index.lookup(value)
+                        if len(ids) > index.MAX_CANDIDATES:
+                            # Too many to filter by ID
+                            index = None
+                    if index is not None:
+                        query = (table.id.belongs(ids))
+                    else:
+                        query = ((field.lower().like(value + "%")) | \
+                                (field2.lower().like(value + "%")) | \
+                                (field3.lower().like(value + "%")))
 
             else:
                 output = xml.json_message(False,
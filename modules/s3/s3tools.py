@@ -483,10 +483,12 @@ class S3BulkImporter(object):
                     pass
             try:
                 # @todo: add extra_data and file attachments
+                bulk = current.deployment_settings.get_base_bulk_import()
                 result = resource.import_xml(csv,
                                              format="csv",
                                              stylesheet=task[4],
-                                             extra_data=extra_data)
+                                             extra_data=extra_data,
+                                             bulk=bulk)
             except SyntaxError, e:
                 self.errorList.append("WARNING: import error - %s" % e)
                 return
@@ -214,57 +214,62 @@ class S3Trackable(object):
             @returns: a location record, or a list of location records (if multiple)
         """
 
-        db = current.db
-        s3db = current.s3db
-
-        ptable = s3db[PRESENCE]
-        ltable = s3db[LOCATION]
-
         if timestmp is None:
             timestmp = datetime.utcnow()
 
-        locations = []
-        for r in self.records:
-            location = None
-            if TRACK_ID in r:
-                query = ((ptable.deleted == False) & \
-                         (ptable[TRACK_ID] == r[TRACK_ID]) & \
-                         (ptable.timestmp <= timestmp))
-                presence = db(query).select(orderby=~ptable.timestmp,
-                                            limitby=(0, 1)).first()
-                if presence:
-                    if presence.interlock:
-                        exclude = [r[TRACK_ID]] + exclude
-                        tablename, record = presence.interlock.split(",", 1)
-                        trackable = S3Trackable(tablename, record)
-                        record = trackable.records.first()
-                        if TRACK_ID not in record or \
-                           record[TRACK_ID] not in exclude:
-                            location = trackable.get_location(timestmp=timestmp,
-                                                              exclude=exclude)
-                    elif presence.location_id:
-                        query = (ltable.id == presence.location_id)
-                        if _filter is not None:
-                            query = query & _filter
-                        if _fields is None:
-                            location = db(query).select(ltable.ALL,
-                                                        limitby=(0, 1)).first()
-                        else:
-                            location = db(query).select(limitby=(0, 1),
-                                                        *_fields).first()
-
-            if not location:
-                if len(self.records) > 1:
-                    trackable = S3Trackable(r, rtable=self.rtable)
-                else:
-                    trackable = self
-                location = trackable.get_base_location(_fields=_fields)
-
-            if location:
-                locations.append(location)
-            else:
-                # Ensure we return an entry so that indexes match
-                locations.append(Row({"lat": None, "lon": None}))
+        # Follow the presence log of all instances at once, one
+        # interlock level per iteration
+        nodes = list(self.records)
+        excludes = [list(exclude) for node in nodes]
+        location_ids = [None] * len(nodes)
+        pending = [i for i, node in enumerate(nodes) if TRACK_ID in node]
+        while pending:
+            track_ids = set([nodes[i][TRACK_ID] for i in pending])
+            presences = self.__get_presences(track_ids, timestmp)
+            interlocks = {}
+            for i in pending:
+                track_id = nodes[i][TRACK_ID]
+                presence = presences.get(track_id)
+                if not presence:
+                    continue
+                if presence.interlock:
+                    excludes[i] = [track_id] + excludes[i]
+                    tablename, record = presence.interlock.split(",", 1)
+                    if tablename not in interlocks:
+                        interlocks[tablename] = []
+                    interlocks[tablename].append((i, record))
+                elif presence.location_id:
+                    location_ids[i] = presence.location_id
+            pending = []
+            for tablename, items in interlocks.items():
+                records = self.__get_records(tablename,
+                                             [record for i, record in items])
+                for i, record in items:
+                    record = records.get(str(record))
+                    if record is None:
+                        continue
+                    if TRACK_ID in record:
+                        if record[TRACK_ID] in excludes[i]:
+                            # Circular check-in => stop here
+                            continue
+                        pending.append(i)
+                    nodes[i] = record
+
+        locations = self.__get_locations(location_ids,
+                                         _fields=_fields,
+                                         _filter=_filter)
+
+        # Fall back to the base location
+        missing = [i for i, location in enumerate(locations) if not location]
+        if missing:
+            base_ids = self.__get_base_location_ids([nodes[i] for i in missing])
+            base_locations = self.__get_locations(base_ids, _fields=_fields)
+            for i, location in zip(missing, base_locations):
+                locations[i] = location
+
+        # Ensure we return an entry so that indexes match
+        locations = [location or Row({"lat": None, "lon": None})
+                     for location in locations]
 
         if as_rows:
             return Rows(records=locations, compact=False)
@@ -277,6 +282,160 @@ class S3Trackable(object):
             return locations
 
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def __get_presences(track_ids, timestmp):
+        """
+            Get the latest presence log entries before timestmp
+
+            @param track_ids: the track IDs
+            @param timestmp: the date/time
+
+            @returns: a dict {track_id: presence Row}
+        """
+
+        db = current.db
+        ptable = current.s3db[PRESENCE]
+
+        if not track_ids:
+            return {}
+
+        query = (ptable.deleted == False) & \
+                (ptable[TRACK_ID].belongs(track_ids)) & \
+                (ptable.timestmp <= timestmp)
+
+        # Latest timestamp per track ID
+        latest = ptable.timestmp.max()
+        rows = db(query).select(ptable[TRACK_ID], latest,
+                                groupby=ptable[TRACK_ID])
+        timestamps = dict([(row[PRESENCE][TRACK_ID], row[latest])
+                           for row in rows])
+        if not timestamps:
+            return {}
+
+        # The entries with these timestamps
+        query = query & (ptable.timestmp.belongs(set(timestamps.values())))
+        rows = db(query).select(ptable.ALL, orderby=~ptable.id)
+        presences = {}
+        for row in rows:
+            track_id = row[TRACK_ID]
+            if track_id not in presences and \
+               row.timestmp == timestamps.get(track_id):
+                presences[track_id] = row
+        return presences
+
+
+    # -------------------------------------------------------------------------
+    def __get_records(self, tablename, record_ids):
+        """
+            Get the trackable fields of instance records
+
+            @param tablename: the instance tablename
+            @param record_ids: the record IDs
+
+            @returns: a dict {str(record_id): Row}
+        """
+
+        db = current.db
+        table = current.s3db[tablename]
+
+        fields = self.__get_fields(table, super_entity=False)
+        if not fields:
+            raise SyntaxError("Not a trackable type: %s" % tablename)
+        fields = [table._id] + [table[f] for f in fields]
+        rows = db(table._id.belongs(record_ids)).select(*fields)
+        return dict([(str(row[table._id.name]), row) for row in rows])
+
+
+    # -------------------------------------------------------------------------
+    def __get_base_location_ids(self, records):
+        """
+            Get the base location IDs of records
+
+            @param records: the records
+
+            @returns: a list of location IDs (None where not found), in
+                      the same order as records
+        """
+
+        db = current.db
+        s3db = current.s3db
+
+        location_ids = [None] * len(records)
+
+        # Records without location_id: look up the instance records
+        lookup = {}
+        for i, r in enumerate(records):
+            if LOCATION_ID in r:
+                location_ids[i] = r[LOCATION_ID]
+            elif TRACK_ID in r:
+                track_id = r[TRACK_ID]
+                if track_id not in lookup:
+                    lookup[track_id] = []
+                lookup[track_id].append(i)
+
+        if lookup:
+            table = self.table
+            rows = db(table[TRACK_ID].belongs(lookup.keys())).select(
+                                                    table[TRACK_ID],
+                                                    table.instance_type)
+            instance_types = {}
+            for row in rows:
+                instance_type = row.instance_type
+                if instance_type not in instance_types:
+                    instance_types[instance_type] = []
+                instance_types[instance_type].append(row[TRACK_ID])
+            for instance_type, track_ids in instance_types.items():
+                itable = s3db[instance_type]
+                if LOCATION_ID not in itable.fields:
+                    continue
+                query = (itable[TRACK_ID].belongs(track_ids))
+                rows = db(query).select(itable[TRACK_ID],
+                                        itable[LOCATION_ID])
+                for row in rows:
+                    for i in lookup.get(row[TRACK_ID], []):
+                        location_ids[i] = row[LOCATION_ID]
+
+        return location_ids
+
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def __get_locations(location_ids, _fields=None, _filter=None):
+        """
+            Get location records
+
+            @param location_ids: list of location IDs
+            @param _fields: fields to retrieve from the location records (None for ALL)
+            @param _filter: filter for the locations
+
+            @returns: a list of location records (None where not found),
+                      in the same order as location_ids
+        """
+
+        db = current.db
+        ltable = current.s3db[LOCATION]
+
+        ids = set([location_id for location_id in location_ids
+                               if location_id])
+        if not ids:
+            return [None] * len(location_ids)
+
+        query = (ltable.id.belongs(ids))
+        if _filter is not None:
+            query = query & _filter
+        if not _fields:
+            rows = db(query).select(ltable.ALL)
+        else:
+            fields = list(_fields)
+            if "id" not in [f.name for f in fields]:
+                fields.append(ltable.id)
+            rows = db(query).select(*fields)
+        locations = dict([(row.id, row) for row in rows])
+        return [location_id and locations.get(location_id) or None
+                for location_id in location_ids]
+
+
     # -------------------------------------------------------------------------
     def set_location(self, location, timestmp=None):
         """
@@ -479,43 +638,14 @@ class S3Trackable(object):
             @returns: the base location(s) of the current instance
         """
 
-        db = current.db
-        s3db = current.s3db
+        location_ids = self.__get_base_location_ids(self.records)
+        locations = self.__get_locations(location_ids,
+                                         _fields=_fields,
+                                         _filter=_filter)
 
-        ltable = s3db[LOCATION]
-        rtable = self.rtable
-
-        locations = []
-        for r in self.records:
-            location = None
-            query = None
-            if LOCATION_ID in r:
-                query = (ltable.id == r[LOCATION_ID])
-                if rtable:
-                    query = query & (rtable[LOCATION_ID] == ltable.id)
-                    if TRACK_ID in r:
-                        query = query & (rtable[TRACK_ID] == r[TRACK_ID])
-            elif TRACK_ID in r:
-                q = (self.table[TRACK_ID] == r[TRACK_ID])
-                trackable = db(q).select(limitby=(0, 1)).first()
-                table = s3db[trackable.instance_type]
-                if LOCATION_ID in table.fields:
-                    query = ((table[TRACK_ID] == r[TRACK_ID]) &
-                             (table[LOCATION_ID] == ltable.id))
-            if query:
-                if _filter is not None:
-                    query = query & _filter
-                if not _fields:
-                    location = db(query).select(ltable.ALL,
-                                                limitby=(0, 1)).first()
-                else:
-                    location = db(query).select(limitby=(0, 1),
-                                                *_fields).first()
-            if location:
-                locations.append(location)
-            else:
-                # Ensure we return an entry so that indexes match
-                locations.append(Row({"lat": None, "lon": None}))
+        # Ensure we return an entry so that indexes match
+        locations = [location or Row({"lat": None, "lon": None})
+                     for location in locations]
 
         if as_rows:
             return Rows(records=locations, compact=False)
@@ -40,6 +40,8 @@ __all__ = ["URL2",
            "s3_truncate",
            "s3_split_multi_value",
            "s3_get_db_field_value",
+           "s3_table_version",
+           "s3_table_changed_only",
            "s3_filter_staff",
            "s3_fullname",
            "s3_represent_facilities",
@@ -52,6 +54,7 @@ __all__ = ["URL2",
            "sort_dict_by_values",
            "jaro_winkler",
            "jaro_winkler_distance_row",
+           "s3_jaro_winkler",
            "soundex",
            "search_vars_represent"]
 
@@ -420,6 +423,59 @@ def s3_get_db_field_value(tablename=None,
     row = db(query).select(lt[fieldname], limitby=(0, 1)).first()
     return row and row[fieldname] or None
 
+# =============================================================================
+def s3_table_version(table):
+    """
+        Cheap modification check for a table: the row count also
+        catches hard deletes, and both catch changes which bypass
+        the onaccept (e.g. bulk imports or other processes)
+
+        @param table: the Table
+
+        @returns: tuple of row count and last modification date
+    """
+
+    count = table.id.count()
+    modified_on = table.modified_on.max()
+    row = current.db(table.id > 0).select(count, modified_on).first()
+    return (row[count], row[modified_on])
+
+# =============================================================================
+def s3_table_changed_only(table, old, new, explained, fields=None):
+    """
+        Check whether the change of a table between two versions (as
+        returned by s3_table_version) is explained by the changes of
+        known records alone, i.e. whether no other records have been
+        inserted, updated or deleted in the meantime
+
+        @param table: the Table
+        @param old: the old version, or None if not known
+        @param new: the current version
+        @param explained: function(row) returning True if the change
+                          of this record is known
+        @param fields: the fields to pass to explained (default: id)
+    """
+
+    if old is None:
+        return False
+    old_count, old_modified_on = old
+    count = new[0]
+    if count < old_count:
+        # Records have been deleted from the database
+        return False
+
+    if old_modified_on is not None:
+        query = (table.modified_on > old_modified_on)
+    else:
+        query = (table.id > 0)
+    rows = current.db(query).select(*(fields or [table.id]))
+    if count - old_count > len(rows):
+        return False
+    for row in rows:
+        if not explained(row):
+            return False
+    return True
+
 # =============================================================================
 def s3_filter_staff(r):
     """
@@ -967,6 +1023,63 @@ def jaro_winkler_distance_row(row1, row2):
     dw = dw * 100       # Convert to percentage
     return dw
 
+# =============================================================================
+def s3_jaro_winkler(str1, str2):
+    """
+        Return the Jaro-Winkler similarity of two strings (between 0.0
+        and 1.0), using match flags rather than copying the strings for
+        every matched character as jaro_winkler() does
+
+        @see http://en.wikipedia.org/wiki/Jaro-Winkler_distance
+
+        @param str1: the first string
+        @param str2: the second string
+    """
+
+    if str1 == str2:
+        return 1.0
+    if not str1 or not str2:
+        return 0.0
+
+    len1 = len(str1)
+    len2 = len(str2)
+    window = max(max(len1, len2) / 2 - 1, 0)
+
+    # Find the common characters
+    matched = [False] * len2
+    common1 = []
+    for i in xrange(len1):
+        c = str1[i]
+        for j in xrange(max(0, i - window), min(i + window + 1, len2)):
+            if not matched[j] and str2[j] == c:
+                matched[j] = True
+                common1.append(c)
+                break
+    common = len(common1)
+    if not common:
+        return 0.0
+    common2 = [str2[j] for j in xrange(len2) if matched[j]]
+
+    # Transpositions
+    transpositions = 0
+    for i in xrange(common):
+        if common1[i] != common2[i]:
+            transpositions += 1
+    transpositions /= 2.0
+
+    common = float(common)
+    jaro = (common / len1 + common / len2 + \
+            (common - transpositions) / common) / 3.0
+
+    # Common prefix (up to 4 characters)
+    prefix = 0
+    for i in xrange(min(len1, len2, 4)):
+        if str1[i] != str2[i]:
+            break
+        prefix += 1
+
+    return jaro + prefix * 0.1 * (1.0 - jaro)
+
 # =============================================================================
 def soundex(name, len=4):
     """
@@ -35,14 +35,20 @@
     OTHER DEALINGS IN THE SOFTWARE.
 """
 
-__all__ = ["S3XML"]
+__all__ = ["S3XML",
+           "S3XMLWriter",
+           "S3XSLTCache"]
 
 import os
 import sys
 import csv
 import datetime
+import tempfile
+import threading
 import urllib2
 
+from collections import OrderedDict
+
 from gluon import *
 from gluon.storage import Storage
 import gluon.contrib.simplejson as json
@@ -57,6 +63,114 @@ except ImportError:
 
 # =============================================================================
 
+class S3XSLTCache(object):
+    """
+        Process-wide LRU cache of compiled XSLT stylesheets, keyed by
+        stylesheet path and invalidated when the file is modified
+
+        NB: modifications of stylesheets which are only imported or
+            included by the cached stylesheet are not detected
+    """
+
+    def __init__(self, size=64):
+        """
+            Constructor
+
+            @param size: the maximum number of stylesheets to keep
+        """
+
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def mtime(path):
+        """
+            Get the modification time of a stylesheet file
+
+            @param path: the stylesheet path
+            @returns: the mtime, or None if path is not a local file
+                      (i.e. the stylesheet is not cacheable)
+        """
+
+        if not isinstance(path, basestring):
+            return None
+        try:
+            return os.path.getmtime(path)
+        except (OSError, IOError):
+            return None
+
+    # -------------------------------------------------------------------------
+    def get(self, path):
+        """
+            Get a compiled stylesheet from the cache
+
+            @param path: the stylesheet path
+            @returns: the etree.XSLT instance, or None if not cached
+                      or the file has been modified since
+        """
+
+        mtime = self.mtime(path)
+        if mtime is None:
+            return None
+
+        cache = self._cache
+        with self._lock:
+            entry = cache.pop(path, None)
+            if entry is not None and entry[0] == mtime:
+                # Re-insert as most recently used
+                cache[path] = entry
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        return None
+
+    # -------------------------------------------------------------------------
+    def store(self, path, transformer):
+        """
+            Add a compiled stylesheet to the cache
+
+            @param path: the stylesheet path
+            @param transformer: the etree.XSLT instance
+        """
+
+        mtime = self.mtime(path)
+        if mtime is None:
+            return
+
+        cache = self._cache
+        with self._lock:
+            cache.pop(path, None)
+            cache[path] = (mtime, transformer)
+            while len(cache) > self.size:
+                # Drop the least recently used
+                cache.popitem(last=False)
+
+    # -------------------------------------------------------------------------
+    def clear(self):
+        """ Remove all stylesheets from the cache, reset the counters """
+
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+    # -------------------------------------------------------------------------
+    def stats(self):
+        """ Get the cache statistics as Storage """
+
+        with self._lock:
+            return Storage(size=len(self._cache),
+                           max_size=self.size,
+                           hits=self.hits,
+                           misses=self.misses)
+
+# =============================================================================
+
 class S3XML(S3Codec):
     """
         XML toolkit for S3XRC
@@ -66,6 +180,9 @@ class S3XML(S3Codec):
 
     CACHE_TTL = 20 # time-to-live of RAM cache for field representations
 
+    # Compiled XSLT stylesheets (process-wide)
+    xslt_cache = S3XSLTCache(size=64)
+
     UID = "uuid"
     MCI = "mci"
     DELETED = "deleted"
@@ -229,25 +346,52 @@ class S3XML(S3Codec):
             _args = dict([(k, "'%s'" % args[k]) for k in args])
         else:
             _args = None
-        stylesheet = self.parse(stylesheet_path)
 
-        if stylesheet:
-            try:
-                ac = etree.XSLTAccessControl(read_file=True, read_network=True)
-                transformer = etree.XSLT(stylesheet, access_control=ac)
-                if _args:
-                    result = transformer(tree, **_args)
-                else:
-                    result = transformer(tree)
-                return result
-            except:
-                e = sys.exc_info()[1]
-                self.error = e
-                return None
-        else:
-            # Error parsing the XSL stylesheet
+        transformer = self.transformer(stylesheet_path)
+        if transformer is None:
+            # Error parsing or compiling the XSL stylesheet
+            return None
+        try:
+            if _args:
+                result = transformer(tree, **_args)
+            else:
+                result = transformer(tree)
+            return result
+        except:
+            e = sys.exc_info()[1]
+            self.error = e
             return None
 
+    # -------------------------------------------------------------------------
+    def transformer(self, stylesheet_path):
+        """
+            Get the compiled XSLT transformer for a stylesheet, from the
+            process-wide cache if possible
+
+            @param stylesheet_path: pathname of the XSLT stylesheet
+
+            @returns: the etree.XSLT instance, or None if the stylesheet
+                      could not be parsed or compiled (self.error is set)
+        """
+
+        cache = self.xslt_cache
+        transformer = cache.get(stylesheet_path)
+        if transformer is not None:
+            return transformer
+
+        stylesheet = self.parse(stylesheet_path)
+        if not stylesheet:
+            return None
+        try:
+            ac = etree.XSLTAccessControl(read_file=True, read_network=True)
+            transformer = etree.XSLT(stylesheet, access_control=ac)
+        except:
+            e = sys.exc_info()[1]
+            self.error = e
+            return None
+        cache.store(stylesheet_path, transformer)
+        return transformer
+
     # -------------------------------------------------------------------------
     def envelope(self, tree, stylesheet_path, **args):
         """
@@ -465,13 +609,101 @@ class S3XML(S3Codec):
         return None
 
     # -------------------------------------------------------------------------
-    def rmap(self, table, record, fields):
+    def lookup(self, table, rows, fields):
+        """
+            Looks up all records referenced by a set of rows, using one
+            query per referenced table (instead of one query per reference
+            and record in rmap)
+
+            @param table: the database table
+            @param rows: the rows
+            @param fields: list of reference field names in this table
+
+            @returns: a dict {tablename: {id: Row}} of the referenced
+                      records, to pass as lookup to rmap()
+        """
+
+        db = current.db
+        lookup = {}
+
+        if not rows or not fields:
+            return lookup
+
+        UID = self.UID
+        MCI = self.MCI
+        DELETED = self.DELETED
+
+        filter_mci = self.filter_mci
+
+        # Collect the foreign keys per referenced table
+        keys = {}
+        for f in fields:
+            if f not in table.fields:
+                continue
+            fieldtype = str(table[f].type)
+            if fieldtype[:9] == "reference":
+                ktablename = fieldtype[10:]
+                multiple = False
+            elif fieldtype[:14] == "list:reference":
+                ktablename = fieldtype[15:]
+                multiple = True
+            else:
+                continue
+            if ktablename in keys:
+                ids = keys[ktablename]
+            else:
+                ids = keys[ktablename] = set()
+            for row in rows:
+                if f not in row:
+                    continue
+                val = row[f]
+                if val is None:
+                    continue
+                if multiple:
+                    ids.update([v for v in val if v is not None])
+                else:
+                    ids.add(val)
+
+        # Look up the referenced records
+        for ktablename in keys:
+            ids = keys[ktablename]
+            if not ids:
+                lookup[ktablename] = {}
+                continue
+            ktable = db[ktablename]
+            ktable_fields = ktable.fields
+            k_id = ktable._id
+            pkey = k_id.name
+
+            query = k_id.belongs(list(ids))
+            if pkey != "id" and "instance_type" in ktable_fields:
+                # Super-entity: no deleted/MCI filter (same as in rmap)
+                kfields = [k_id, ktable[UID], ktable.instance_type]
+            else:
+                if DELETED in ktable_fields:
+                    query = (ktable.deleted != True) & query
+                if filter_mci and MCI in ktable_fields:
+                    query = (ktable.mci >= 0) & query
+                kfields = [k_id]
+                if UID in ktable_fields:
+                    kfields.append(ktable[UID])
+            krecords = db(query).select(*kfields)
+            lookup[ktablename] = dict((r[pkey], r) for r in krecords)
+
+        return lookup
+
+    # -------------------------------------------------------------------------
+    def rmap(self, table, record, fields, lookup=None):
         """
             Generates a reference map for a record
 
             @param table: the database table
             @param record: the record
             @param fields: list of reference field names in this table
+            @param lookup: dict of pre-fetched referenced records as
+                           returned from lookup(), referenced tables
+                           which are not in this dict will be looked
+                           up per record
         """
 
         db = current.db
@@ -508,6 +740,11 @@ class S3XML(S3Codec):
             k_id = ktable._id
             pkey = k_id.name
 
+            if lookup is not None and ktablename in lookup:
+                krecords = lookup[ktablename]
+            else:
+                krecords = None
+
             if multiple:
                 query = k_id.belongs(ids)
                 limitby = None
@@ -521,9 +758,12 @@ class S3XML(S3Codec):
             if pkey != "id" and "instance_type" in ktable_fields:
                 if multiple:
                     continue
-                krecord = db(query).select(ktable[UID],
-                                           ktable.instance_type,
-                                           limitby=(0, 1)).first()
+                if krecords is not None:
+                    krecord = krecords.get(ids[0])
+                else:
+                    krecord = db(query).select(ktable[UID],
+                                               ktable.instance_type,
+                                               limitby=(0, 1)).first()
                 if not krecord:
                     continue
                 ktablename = krecord.instance_type
@@ -533,22 +773,38 @@ class S3XML(S3Codec):
                     continue
                 uids = [uid]
             else:
-                if DELETED in ktable_fields:
-                    query = (ktable.deleted != True) & query
-                if filter_mci and MCI in ktable_fields:
-                    query = (ktable.mci >= 0) & query
-                if UID in ktable_fields:
-                    krecords = db(query).select(ktable[UID], limitby=limitby)
-                    if krecords:
-                        uids = [r[UID] for r in krecords if r[UID]]
+                if krecords is not None:
+                    found = []
+                    seen = set()
+                    for i in ids:
+                        if i in krecords and i not in seen:
+                            seen.add(i)
+                            found.append(krecords[i])
+                    if not found:
+                        continue
+                    if UID in ktable_fields:
+                        uids = [r[UID] for r in found if r[UID]]
                         if ktablename != gtablename:
                             uids = map(export_uid, uids)
-                    else:
-                        continue
                 else:
-                    krecord = db(query).select(k_id, limitby=(0, 1)).first()
-                    if not krecord:
-                        continue
+                    if DELETED in ktable_fields:
+                        query = (ktable.deleted != True) & query
+                    if filter_mci and MCI in ktable_fields:
+                        query = (ktable.mci >= 0) & query
+                    if UID in ktable_fields:
+                        krecords = db(query).select(ktable[UID],
+                                                    limitby=limitby)
+                        if krecords:
+                            uids = [r[UID] for r in krecords if r[UID]]
+                            if ktablename != gtablename:
+                                uids = map(export_uid, uids)
+                        else:
+                            continue
+                    else:
+                        krecord = db(query).select(k_id,
+                                                   limitby=(0, 1)).first()
+                        if not krecord:
+                            continue
             value = str(table[f].formatter(val)).decode("utf-8")
             if table[f].represent:
                 text = represent(table, f, val)
@@ -1729,6 +1985,18 @@ class S3XML(S3Codec):
         else:
             return json.dumps(root_dict)
 
+    # -------------------------------------------------------------------------
+    @classmethod
+    def resource2json(cls, element):
+        """
+            Converts a single <resource> element into JSON, in the same
+            way as tree2json converts it as part of a S3XML tree
+
+            @param element: the <resource> element
+        """
+
+        return json.dumps(cls.__element2json(element, native=True))
+
     # -------------------------------------------------------------------------
     @staticmethod
     def collect_errors(job):
@@ -1855,4 +2123,132 @@ class S3XML(S3Codec):
 
         return  etree.ElementTree(root)
 
+# =============================================================================
+class S3XMLWriter(object):
+    """
+        Incremental writer for S3XML/S3JSON documents, to produce the
+        output of an export page by page rather than from a complete
+        element tree.
+
+        In S3JSON, all records of the same resource must be in the
+        same list. Records of the first resource written are therefore
+        written out immediately, while those of all other resources are
+        buffered in temporary files until the end of the document.
+    """
+
+    def __init__(self, root, as_json=False):
+        """
+            Constructor
+
+            @param root: the root element, with all attributes set
+                         but without any child elements
+            @param as_json: write S3JSON rather than S3XML
+        """
+
+        self.root = root
+        self.as_json = as_json
+
+        self.main = None
+        self.spools = {}
+        self.count = 0
+
+    # -------------------------------------------------------------------------
+    def head(self):
+        """ Start the document, returns a string """
+
+        if self.as_json:
+            return "{"
+        else:
+            # Serialize the empty root element, and open it
+            root = etree.tostring(self.root,
+                                  xml_declaration=True,
+                                  encoding="utf-8").rstrip()
+            return "%s>\n" % root[:-2]
+
+    # -------------------------------------------------------------------------
+    def write(self, elements):
+        """
+            Write <resource> elements
+
+            @param elements: iterable of <resource> elements
+            @returns: the output as string (may be empty)
+        """
+
+        output = []
+        append = output.append
+        if self.as_json:
+            NAME = S3XML.ATTRIBUTE.name
+            resource2json = S3XML.resource2json
+            spools = self.spools
+            for element in elements:
+                name = element.get(NAME)
+                obj = resource2json(element)
+                if self.main is None:
+                    self.main = name
+                    append('"%s_%s": [%s' % (S3XML.PREFIX.resource,
+                                             name, obj))
+                elif name == self.main:
+                    append(", %s" % obj)
+                elif name in spools:
+                    spools[name].write(", %s" % obj)
+                else:
+                    spool = spools[name] = tempfile.TemporaryFile()
+                    spool.write(obj)
+                self.count += 1
+        else:
+            tostring = etree.tostring
+            for element in elements:
+                append(tostring(element,
+                                xml_declaration=False,
+                                encoding="utf-8",
+                                pretty_print=True))
+                self.count += 1
+        return "".join(output)
+
+    # -------------------------------------------------------------------------
+    def tail(self, chunk_size=65536):
+        """
+            End the document
+
+            @param chunk_size: size of the chunks to read from the
+                               temporary files
+            @returns: generator of strings
+        """
+
+        if not self.as_json:
+            yield "</%s>\n" % self.root.tag
+            return
+
+        PREFIX = S3XML.PREFIX
+        items = 0
+        if self.main is not None:
+            yield "]"
+            items += 1
+        spools = self.spools
+        for name in spools:
+            spool = spools[name]
+            spool.seek(0)
+            yield '%s"%s_%s": [' % (items and ", " or "",
+                                    PREFIX.resource, name)
+            while True:
+                chunk = spool.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+            spool.close()
+            yield "]"
+            items += 1
+        self.spools = {}
+
+        # Root attributes
+        root = self.root
+        root.set(S3XML.ATTRIBUTE.success, json.dumps(self.count > 0))
+        attributes = root.attrib
+        for a in attributes:
+            yield '%s%s: %s' % (items and ", " or "",
+                                json.dumps(PREFIX.attribute + a),
+                                json.dumps(attributes[a]))
+            items += 1
+        yield "}"
+
 # End =========================================================================
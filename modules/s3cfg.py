@@ -53,6 +53,7 @@ class S3Config(Storage):
         self.gis = Storage()
         self.osm = Storage()    # Backwards-compatiblity, deprecate soon
         self.mail = Storage()
+        self.msg = Storage()
         self.twitter = Storage()
         self.L10n = Storage()
         self.options = Storage()
@@ -62,6 +63,7 @@ class S3Config(Storage):
         self.req = Storage()
         self.inv = Storage()
         self.org = Storage()
+        self.pr = Storage()
         self.supply = Storage()
         self.hrm = Storage()
         self.project = Storage()
@@ -199,6 +201,12 @@ class S3Config(Storage):
         return self.security.get("audit_read", False)
     def get_security_audit_write(self):
         return self.security.get("audit_write", False)
+    def get_security_acl_cache(self):
+        """
+            Share ACLs and realms across requests (in Memcache if
+            base.session_memcache is configured, otherwise in RAM)
+        """
+        return self.security.get("acl_cache", False)
     def get_security_policy(self):
         " Default is Simple Security Policy "
         return self.security.get("policy", 1)
@@ -224,6 +232,18 @@ class S3Config(Storage):
     def get_base_prepopulate(self):
         """ Whether to prepopulate the database &, if so, which set of data to use for this """
         return self.base.get("prepopulate", 1)
+    def get_base_bulk_import(self):
+        """
+            Whether to commit prepopulate and CSV imports in bulk mode
+            (batch inserts, deferred onaccept)
+        """
+        return self.base.get("bulk_import", False)
+    def get_base_xml_export_page_size(self):
+        """
+            Number of records per page when streaming S3XML/S3JSON
+            exports, 0 to always build the complete element tree
+        """
+        return self.base.get("xml_export_page_size", 500)
     def get_base_public_url(self):
         return self.base.get("public_url", "http://127.0.0.1:8000")
     def get_base_cdn(self):
@@ -311,8 +331,34 @@ class S3Config(Storage):
         return self.gis.get("display_L0", False)
     def get_gis_display_l1(self):
         return self.gis.get("display_L1", True)
+    def get_gis_cluster_zoom(self):
+        """
+            Feature Layers requested with a lower zoom level than this
+            are returned as grid clusters rather than individual features
+            (None to disable server-side clustering)
+        """
+        return self.gis.get("cluster_zoom", 8)
+    def get_gis_cluster_threshold(self):
+        """
+            Minimum number of features in the map viewport for
+            server-side clustering
+        """
+        return self.gis.get("cluster_threshold", 500)
     def get_gis_duplicate_features(self):
         return self.gis.get("duplicate_features", False)
+    def get_gis_import_duplicate_distance(self):
+        """
+            Maximum distance (in km) of a location with a similar name to
+            be treated as duplicate during imports (None to only match
+            by name)
+        """
+        return self.gis.get("import_duplicate_distance", None)
+    def get_gis_layer_cache(self):
+        """
+            Cache the GeoJSON/KML output of Feature Layers on disk
+            (per layer and realms, until the data change)
+        """
+        return self.gis.get("layer_cache", False)
     def get_gis_edit_group(self):
         " Edit Location Groups "
         return self.gis.get("edit_GR", False)
@@ -430,6 +476,33 @@ class S3Config(Storage):
         """ A daily limit to the number of messages which can be sent """
         return self.mail.get("limit", None)
 
+    # Outbox dispatch settings
+    def get_msg_dispatch_workers(self, contact_method):
+        """
+            Number of threads to send the Outbox messages of a contact
+            method with, e.g. {"EMAIL": 4, "SMS": 2} (0 to send them one
+            after the other)
+        """
+        return self.msg.get("dispatch_workers", {}).get(contact_method, 0)
+    def get_msg_dispatch_rate(self, contact_method):
+        """
+            Maximum number of messages per second for a contact method,
+            e.g. {"SMS": 5} (None for no limit)
+        """
+        return self.msg.get("dispatch_rate", {}).get(contact_method, None)
+    def get_msg_dispatch_retries(self):
+        """ How often to retry sending a message before giving up """
+        return self.msg.get("dispatch_retries", 2)
+    def get_msg_dispatch_backoff(self):
+        """ Seconds to wait before the first retry (doubled for each) """
+        return self.msg.get("dispatch_backoff", 1.0)
+    def get_msg_dispatch_claim_timeout(self):
+        """
+            Seconds after which messages claimed by a dispatcher which has
+            not finished sending them can be claimed by another one
+        """
+        return self.msg.get("dispatch_claim_timeout", 600)
+
     # Twitter settings
     def get_twitter_oauth_consumer_key(self):
         return self.twitter.get("oauth_consumer_key", "")
@@ -466,6 +539,18 @@ class S3Config(Storage):
 
     # -------------------------------------------------------------------------
     # UI/Workflow Settings
+    def get_ui_autocomplete_index(self):
+        """
+            Whether to use an in-memory name index for the location,
+            organisation and person autocompletes (instead of LIKE queries)
+        """
+        return self.ui.get("autocomplete_index", False)
+    def get_ui_ssp_label_cache(self):
+        """
+            Time (in seconds) to cache the option labels of foreign keys
+            for the list filter (dataTables search), 0 to disable
+        """
+        return self.ui.get("ssp_label_cache", 0)
     def get_ui_navigate_away_confirm(self):
         return self.ui.get("navigate_away_confirm", True)
     def get_ui_confirm(self):
@@ -595,6 +680,15 @@ class S3Config(Storage):
     def get_org_site_code_len(self):
         return self.org.get("site_code_len", 10)
 
+    # -------------------------------------------------------------------------
+    # Person Registry
+    def get_pr_import_match_threshold(self):
+        """
+            Minimum match percentage for the person matcher to identify
+            a duplicate during imports (None to only use exact matches)
+        """
+        return self.pr.get("import_match_threshold", None)
+
     # -------------------------------------------------------------------------
     # Human Resource Management
     def get_hrm_email_required(self):
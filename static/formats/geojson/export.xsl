@@ -152,6 +152,41 @@
         </properties>
     </xsl:template>
 
+    <!-- ****************************************************************** -->
+    <xsl:template match="resource[@count]" priority="1">
+        <!-- Server-side cluster of a Feature Layer -->
+        <type>Feature</type>
+        <geometry>
+            <type>
+                <xsl:text>Point</xsl:text>
+            </type>
+            <coordinates>
+                <xsl:value-of select="@lon"/>
+            </coordinates>
+            <coordinates>
+                <xsl:value-of select="@lat"/>
+            </coordinates>
+        </geometry>
+        <properties>
+            <count>
+                <xsl:value-of select="@count"/>
+            </count>
+            <marker>
+                <xsl:value-of select="@marker"/>
+            </marker>
+            <xsl:if test="@popup!=''">
+                <popup>
+                    <xsl:value-of select="@popup"/>
+                </popup>
+            </xsl:if>
+            <xsl:if test="@url!=''">
+                <url>
+                    <xsl:value-of select="@url"/>
+                </url>
+            </xsl:if>
+        </properties>
+    </xsl:template>
+
     <!-- ****************************************************************** -->
     <xsl:template match="resource[@name='gis_feature_query']">
         <!-- Feature Query -->
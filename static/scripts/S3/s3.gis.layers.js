@@ -608,6 +608,9 @@ function addGeoJSONLayer(layer) {
                 // Label For Clustered Point
                 if (feature.cluster && feature.attributes.count > 1) {
                     label = feature.attributes.count;
+                } else if (feature.attributes.count > 1) {
+                    // Server-side cluster
+                    label = feature.attributes.count;
                 }
                 return label;
             }
@@ -652,6 +655,23 @@ function addGeoJSONLayer(layer) {
             strokeColor: '#ff9933'
         }
     });
+    if ('feature' == layer_type) {
+        // Feature Layers are filtered by bbox and clustered by zoom level
+        // on the server, so reload them after every zoom
+        var params = {zoom: map.getZoom()};
+        var resFactor = 1;
+        var triggerRead = function(options) {
+            // Send the zoom level the request is made for (the BBOX
+            // strategy reloads on moveend, i.e. before zoomend)
+            this.layer.protocol.params.zoom = this.layer.map.getZoom();
+            return OpenLayers.Strategy.BBOX.prototype.triggerRead.apply(this, arguments);
+        };
+    } else {
+        var params = {};
+        // don't fetch features after every resolution change
+        var resFactor = null;
+        var triggerRead = OpenLayers.Strategy.BBOX.prototype.triggerRead;
+    }
     var geojsonLayer = new OpenLayers.Layer.Vector(
         name, {
             dir: dir,
@@ -660,9 +680,9 @@ function addGeoJSONLayer(layer) {
                 // Need to be uniquely instantiated
                 new OpenLayers.Strategy.BBOX({
                     // load features for a wider area than the visible extent to reduce calls
-                    ratio: 1.5
-                    // don't fetch features after every resolution change
-                    //resFactor: 1
+                    ratio: 1.5,
+                    resFactor: resFactor,
+                    triggerRead: triggerRead
                 }),
                 new OpenLayers.Strategy.Refresh({
                     force: true,
@@ -693,6 +713,7 @@ function addGeoJSONLayer(layer) {
             styleMap: featureClusterStyleMap,
             protocol: new OpenLayers.Protocol.HTTP({
                 url: url,
+                params: params,
                 format: S3.gis.format_geojson
             })
         }
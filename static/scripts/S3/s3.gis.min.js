@@ -1,107 +1,270 @@
-var map;S3.gis.layers_all=[];S3.gis.format_geojson=new OpenLayers.Format.GeoJSON;S3.gis.dirs=[];S3.gis.ajax_loader=S3.Ap.concat("/static/img/ajax-loader.gif");S3.gis.marker_url=S3.Ap.concat("/static/img/markers/");OpenLayers.ImgPath=S3.Ap.concat("/static/img/gis/openlayers/");OpenLayers.IMAGE_RELOAD_ATTEMPTS=3;OpenLayers.Util.onImageLoadErrorColor="transparent";OpenLayers.ProxyHost=S3.Ap.concat("/gis/proxy?url=");S3.gis.proj4326=new OpenLayers.Projection("EPSG:4326");
-S3.gis.projection_current=new OpenLayers.Projection("EPSG:"+S3.gis.projection);S3.gis.options={displayProjection:S3.gis.proj4326,projection:S3.gis.projection_current,theme:null,units:S3.gis.units,maxResolution:S3.gis.maxResolution,maxExtent:new OpenLayers.Bounds(S3.gis.maxExtent[0],S3.gis.maxExtent[1],S3.gis.maxExtent[2],S3.gis.maxExtent[3]),numZoomLevels:S3.gis.numZoomLevels};S3.gis.cluster_distance=20;S3.gis.cluster_threshold=2;S3.gis.layers_loading=0;S3.gis.plugins=[];
-function registerPlugin(a){S3.gis.plugins.push(a)}S3.gis.show_map=function(){S3.gis.lat&&S3.gis.lon?(S3.gis.center=new OpenLayers.LonLat(S3.gis.lon,S3.gis.lat),S3.gis.center.transform(S3.gis.proj4326,S3.gis.projection_current)):S3.gis.bottom_left&&S3.gis.top_right&&s3_gis_setCenter(S3.gis.bottom_left,S3.gis.top_right);addMap();addMapUI();S3.gis.bounds&&map.zoomToExtent(S3.gis.bounds);Ext.QuickTips.init()};
-function s3_gis_setCenter(a,b){a=new OpenLayers.LonLat(a[0],a[1]);a.transform(S3.gis.proj4326,S3.gis.projection_current);var c=a.lon,d=a.lat,b=new OpenLayers.LonLat(b[0],b[1]);b.transform(S3.gis.proj4326,S3.gis.projection_current);S3.gis.bounds=OpenLayers.Bounds.fromArray([c,d,b.lon,b.lat]);S3.gis.center=S3.gis.bounds.getCenterLonLat()}function addMap(){map=new OpenLayers.Map("center",S3.gis.options);addLayers();addControls()}
-function addMapUI(){S3.gis.mapPanel=new GeoExt.MapPanel({height:S3.gis.map_height,width:S3.gis.map_width,id:"mappanel",xtype:"gx_mappanel",map:map,center:S3.gis.center,zoom:S3.gis.zoom,plugins:[]});S3.gis.portal={};S3.gis.portal.map=S3.gis.mapPanel;if(S3.i18n.gis_legend||S3.gis.layers_wms)for(var a=0;a<map.layers.length;a++)if(map.layers[a].legendURL&&(S3.gis.mapPanel.layers.data.items[a].data.legendURL=map.layers[a].legendURL),map.layers[a].queryable)S3.gis.mapPanel.layers.data.items[a].data.queryable=
-1;addLayerTree();var b=[S3.gis.layerTree];S3.gis.wms_browser_url&&(addWMSBrowser(),S3.gis.wmsBrowser&&b.push(S3.gis.wmsBrowser));S3.gis.printFormPanel&&b.push(S3.gis.printFormPanel);S3.i18n.gis_legend&&(S3.gis.legendPanel=new GeoExt.LegendPanel({id:"legendpanel",title:S3.i18n.gis_legend,defaults:{labelCls:"mylabel",style:"padding:4px"},bodyStyle:"padding:4px",autoScroll:!0,collapsible:!0,collapseMode:"mini",lines:!1}),b.push(S3.gis.legendPanel));for(a=0;a<S3.gis.plugins.length;++a)S3.gis.plugins[a].setup(map),
-S3.gis.plugins[a].addToMapWindow(b);S3.gis.mapWestPanel=new Ext.Panel({id:"tools",header:!1,border:!1,split:!0,items:b});S3.gis.window?addMapWindow():addMapPanel()}function addWestPanel(){void 0==S3.gis.west_collapsed&&(S3.gis.west_collapsed=!1);S3.gis.mapWestPanelContainer=new Ext.Panel({region:"west",header:!1,border:!0,width:250,autoScroll:!0,collapsible:!0,collapseMode:"mini",collapsed:S3.gis.west_collapsed,items:[S3.gis.mapWestPanel]})}
-function addMapPanelContainer(){S3.gis.toolbar&&addToolbar();S3.gis.mapPanelContainer=new Ext.Panel({layout:"card",region:"center",id:"mappnlcntr",defaults:{border:!1},items:[S3.gis.mapPanel],activeItem:0,tbar:S3.gis.toolbar,scope:this});S3.gis.Google&&S3.gis.Google.Earth&&(S3.gis.googleEarthPanel=new gxp.GoogleEarthPanel({mapPanel:S3.gis.mapPanel}),S3.gis.mapPanelContainer.items.items.push(S3.gis.googleEarthPanel))}
-function addMapPanel(){addWestPanel();addMapPanelContainer();S3.gis.mapWin=new Ext.Panel({id:"gis-map-panel",renderTo:"map_panel",autoScroll:!0,titleCollapse:!0,height:S3.gis.map_height,width:S3.gis.map_width,layout:"border",items:[S3.gis.mapWestPanelContainer,S3.gis.mapPanelContainer]})}
-function addMapWindow(){addWestPanel();addMapPanelContainer();var a=new Ext.Window({id:"gis-map-window",collapsible:!1,constrain:!0,closable:!S3.gis.windowNotClosable,closeAction:"hide",autoScroll:!0,maximizable:S3.gis.maximizable,titleCollapse:!1,height:S3.gis.map_height,width:S3.gis.map_width,layout:"border",items:[S3.gis.mapWestPanelContainer,S3.gis.mapPanelContainer]});a.on("beforehide",function(a){a.maximized&&a.restore()});S3.gis.windowHide||(a.show(),a.maximize());S3.gis.mapWin=a}
-function addLayerTree(){for(var a=[{text:S3.i18n.gis_base_layers,nodeType:"gx_baselayercontainer",layerStore:S3.gis.mapPanel.layers,loader:{filter:function(a){a=a.getLayer();return!0===a.displayInLayerSwitcher&&!0===a.isBaseLayer&&(void 0===a.dir||""==a.dir)}},leaf:!1,expanded:!0},{text:S3.i18n.gis_overlays,nodeType:"gx_overlaylayercontainer",layerStore:S3.gis.mapPanel.layers,loader:{filter:function(a){a=a.getLayer();return!0===a.displayInLayerSwitcher&&!1===a.isBaseLayer&&(void 0===a.dir||""==a.dir)}},
-leaf:!1,expanded:!0}],b=S3.gis.dirs,c=0;c<b.length;c++){var d={text:b[c],nodeType:"gx_layercontainer",layerStore:S3.gis.mapPanel.layers,loader:{filter:function(a){return function(b){if("undefined"!==b.data.layer.dir)return b.data.layer.dir===a}}(b[c])},leaf:!1,expanded:!0};a.push(d)}a=new Ext.tree.AsyncTreeNode({expanded:!0,children:a});b=S3.i18n.gis_uploadlayer||S3.i18n.gis_properties?new Ext.Toolbar:null;S3.gis.layerTree=new Ext.tree.TreePanel({id:"treepanel",title:S3.i18n.gis_layers,loader:new Ext.tree.TreeLoader({applyLoader:!1}),
-root:a,rootVisible:!1,split:!0,autoScroll:!0,collapsible:!0,collapseMode:"mini",lines:!1,tbar:b,enableDD:!0});S3.i18n.gis_uploadlayer&&addRemoveLayersControl();S3.i18n.gis_properties&&addLayerPropertiesButton()}
-function addWMSBrowser(){var a=new Ext.tree.AsyncTreeNode({expanded:!0,loader:new GeoExt.tree.WMSCapabilitiesLoader({url:OpenLayers.ProxyHost+S3.gis.wms_browser_url,layerOptions:{buffer:1,singleTile:!1,ratio:1,wrapDateLine:!0},layerParams:{TRANSPARENT:"TRUE"},createNode:function(a){a.checked=a.leaf?!1:void 0;return GeoExt.tree.WMSCapabilitiesLoader.prototype.createNode.apply(this,[a])}})});S3.gis.wmsBrowser=new Ext.tree.TreePanel({id:"wmsbrowser",title:S3.gis.wms_browser_name,root:a,rootVisible:!1,
-split:!0,autoScroll:!0,collapsible:!0,collapseMode:"mini",lines:!1,listeners:{checkchange:function(a,c){!0===c?S3.gis.mapPanel.map.addLayer(a.attributes.layer):S3.gis.mapPanel.map.removeLayer(a.attributes.layer)}}})}
-function addToolbar(){var a=new Ext.Toolbar({id:"gis_toolbar",height:34}),b=new GeoExt.Action({control:new OpenLayers.Control.ZoomToMaxExtent,map:map,iconCls:"zoomfull",tooltip:S3.i18n.gis_zoomfull}),c=new GeoExt.Action({control:new OpenLayers.Control.ZoomBox({out:!0}),map:map,iconCls:"zoomout",tooltip:S3.i18n.gis_zoomout,toggleGroup:"controls"}),d=new GeoExt.Action({control:new OpenLayers.Control.ZoomBox,map:map,iconCls:"zoomin",tooltip:S3.i18n.gis_zoomin,toggleGroup:"controls"});if("active"==S3.gis.draw_feature)var e=
-!1,f=!0,h=!1;else"active"==S3.gis.draw_polygon?(f=e=!1,h=!0):(e=!0,h=f=!1);S3.gis.panButton=new GeoExt.Action({control:new OpenLayers.Control.Navigation,map:map,iconCls:"pan-off",tooltip:S3.i18n.gis_pan,toggleGroup:"controls",allowDepress:!0,pressed:e});a.add(b);navigator.geolocation&&addGeolocateControl(a);void 0===S3.gis.loc_select&&(a.add(c),a.add(d),a.add(S3.gis.panButton),a.addSeparator());void 0===S3.gis.loc_select&&addNavigationControl(a);void 0===S3.gis.loc_select&&S3.auth&&addSaveButton(a);
-a.addSeparator();addMeasureControls(a);S3.gis.mgrs_url&&addPdfControl(a);if(S3.gis.draw_feature||S3.gis.draw_polygon)a.addSeparator(),S3.gis.draw_feature&&addPointControl(a,f),S3.gis.draw_polygon&&addPolygonControl(a,h);S3.i18n.gis_get_feature_info&&addWMSGetFeatureInfoControl(a);S3.gis.osm_oauth&&addPotlatchButton(a);S3.gis.Google&&S3.gis.Google.StreetviewButton&&addGoogleStreetviewControl(a);try{S3.gis.Google.Earth&&google&addGoogleEarthControl(a)}catch(g){}S3.i18n.gis_search&&(b=Math.min(350,S3.gis.map_width-
-680),b=new GeoExt.ux.GeoNamesSearchCombo({map:map,width:b,listWidth:b,minChars:2,emptyText:S3.i18n.gis_search}),a.addSeparator(),a.add(b));b=new Ext.BoxComponent({autoEl:{tag:"img",src:S3.gis.ajax_loader},cls:"hidden",id:"layer_throbber"});a.add(b);S3.gis.toolbar=a}
-function addLayers(){var a;if(S3.gis.layers_osm)for(a=0;a<S3.gis.layers_osm.length;a++)addOSMLayer(S3.gis.layers_osm[a]);try{google&addGoogleLayers()}catch(b){}S3.gis.Bing&&addBingLayers();if(S3.gis.layers_tms)for(a=0;a<S3.gis.layers_tms.length;a++)addTMSLayer(S3.gis.layers_tms[a]);if(S3.gis.layers_wms)for(a=0;a<S3.gis.layers_wms.length;a++)addWMSLayer(S3.gis.layers_wms[a]);if(S3.gis.layers_xyz)for(a=0;a<S3.gis.layers_xyz.length;a++)addXYZLayer(S3.gis.layers_xyz[a]);S3.gis.EmptyLayer&&(a=new OpenLayers.Layer(S3.gis.EmptyLayer.name,
-{isBaseLayer:!0,displayInLayerSwitcher:!0,s3_layer_id:S3.gis.EmptyLayer.id,s3_layer_type:"empty"}),map.addLayer(a),S3.gis.EmptyLayer.base&&map.setBaseLayer(a));try{addJSLayers()}catch(c){}if(S3.gis.layers_theme)for(a=0;a<S3.gis.layers_theme.length;a++)addGeoJSONLayer(S3.gis.layers_theme[a]);if(S3.gis.layers_geojson)for(a=0;a<S3.gis.layers_geojson.length;a++)addGeoJSONLayer(S3.gis.layers_geojson[a]);if(S3.gis.layers_gpx)for(a=0;a<S3.gis.layers_gpx.length;a++)addGPXLayer(S3.gis.layers_gpx[a]);if(S3.gis.layers_arcrest)for(a=
-0;a<S3.gis.layers_arcrest.length;a++)addArcRESTLayer(S3.gis.layers_arcrest[a]);S3.gis.CoordinateGrid&&addCoordinateGrid();if(S3.gis.layers_georss)for(a=0;a<S3.gis.layers_georss.length;a++)addGeoJSONLayer(S3.gis.layers_georss[a]);if(S3.gis.layers_kml){S3.gis.format_kml=new OpenLayers.Format.KML({extractStyles:!0,extractAttributes:!0,maxDepth:2});for(a=0;a<S3.gis.layers_kml.length;a++)addKMLLayer(S3.gis.layers_kml[a])}if(S3.gis.layers_wfs)for(a=0;a<S3.gis.layers_wfs.length;a++)addWFSLayer(S3.gis.layers_wfs[a]);
-if(S3.gis.layers_feature_queries)for(a=0;a<S3.gis.layers_feature_queries.length;a++)addGeoJSONLayer(S3.gis.layers_feature_queries[a]);if(S3.gis.layers_features)for(a=0;a<S3.gis.layers_features.length;a++)addGeoJSONLayer(S3.gis.layers_features[a]);(S3.gis.features||S3.gis.draw_feature||S3.gis.draw_polygon||navigator.geolocation)&&addDraftLayer();if(S3.gis.features)for(a=0;a<S3.gis.features.length;a++){var d=new OpenLayers.Geometry.Point(S3.gis.features[a].lon,S3.gis.features[a].lat);d.transform(S3.gis.proj4326,
-S3.gis.projection_current);S3.gis.draftLayer.addFeatures(new OpenLayers.Feature.Vector(d))}}
-function addArcRESTLayer(a){var b=a.name,c=[a.url],d=void 0!=a.layers?a.layers:0;if(void 0!=a.dir){var e=a.dir;-1==$.inArray(e,S3.gis.dirs)&&S3.gis.dirs.push(e)}else e="";var f=void 0!=a.visibility?a.visibility:!0,b=new OpenLayers.Layer.ArcGIS93Rest(b,c,{layers:"show:"+d,isBaseLayer:void 0!=a.base?a.base:!1,transparent:void 0!=a.transparent?a.transparent:!0,dir:e,s3_layer_id:a.id,s3_layer_type:"arcrest"});b.setVisibility(f);map.addLayer(b);a._base&&map.setBaseLayer(b)}
-function addBingLayers(){var a=S3.gis.Bing,b=a.ApiKey,c;a.Aerial&&(c=new OpenLayers.Layer.Bing({key:b,type:"Aerial",name:a.Aerial.name,s3_layer_id:a.Aerial.id,s3_layer_type:"bing"}),map.addLayer(c),"aerial"==Bing.Base&&map.setBaseLayer(c));a.Road&&(c=new OpenLayers.Layer.Bing({key:b,type:"Road",name:a.Road.name,s3_layer_id:a.Road.id,s3_layer_type:"bing"}),map.addLayer(c),"road"==Bing.Base&&map.setBaseLayer(c));a.Hybrid&&(c=new OpenLayers.Layer.Bing({key:b,type:"AerialWithLabels",name:a.Hybrid.name,
-s3_layer_id:a.Hybrid.id,s3_layer_type:"bing"}),map.addLayer(c),"hybrid"==Bing.Base&&map.setBaseLayer(c))}function addCoordinateGrid(){map.addLayer(new OpenLayers.Layer.cdauth.CoordinateGrid(null,{name:S3.gis.CoordinateGrid.name,shortName:"grid",visibility:S3.gis.CoordinateGrid.visibility,s3_layer_id:S3.gis.CoordinateGrid.id,s3_layer_type:"coordinate"}))}
-function addDraftLayer(){var a=S3.gis.marker_url+S3.gis.marker_default,b=S3.gis.marker_default_height,c=S3.gis.marker_default_width,d=OpenLayers.Util.extend({},OpenLayers.Feature.Vector.style["default"]);d.graphicOpacity=1;d.graphicWidth=c;d.graphicHeight=b;d.graphicXOffset=-(c/2);d.graphicYOffset=-b;d.externalGraphic=a;S3.gis.draftLayer=new OpenLayers.Layer.Vector(S3.i18n.gis_draft_layer,{style:d,displayInLayerSwitcher:!1});S3.gis.draftLayer.setVisibility(!0);map.addLayer(S3.gis.draftLayer)}
-OpenLayers.Strategy.AttributeCluster=OpenLayers.Class(OpenLayers.Strategy.Cluster,{attribute:null,shouldCluster:function(a,b){var c=OpenLayers.Strategy.Cluster.prototype;return a.cluster[0].attributes[this.attribute]===b.attributes[this.attribute]&&c.shouldCluster.apply(this,arguments)},CLASS_NAME:"OpenLayers.Strategy.AttributeCluster"});
-function addGeoJSONLayer(a){var b=a.name,c=a.url;if(void 0!=a.marker_image)var d=S3.gis.marker_url+a.marker_image,e=a.marker_height,f=a.marker_width;else d="";var h=void 0!=a.refresh?a.refresh:900;if(void 0!=a.dir){var g=a.dir;-1==$.inArray(g,S3.gis.dirs)&&S3.gis.dirs.push(g)}else g="";var j=void 0!=a.visibility?a.visibility:!0,m=void 0!=a.opacity?a.opacity:1,n=void 0!=a.cluster_distance?a.cluster_distance:S3.gis.cluster_distance,p=void 0!=a.cluster_threshold?a.cluster_threshold:S3.gis.cluster_threshold,
-l=void 0!=a.projection?a.projection:4326,l=4326==l?S3.gis.proj4326:new OpenLayers.Projection("EPSG:"+l),o=void 0!=a.type?a.type:"feature",k=void 0!=a.style?a.style:[],m=new OpenLayers.Style({label:"${label}",labelAlign:"cm",pointRadius:"${radius}",fillColor:"${fill}",fillOpacity:"${fillOpacity}",strokeColor:"${stroke}",strokeWidth:2,strokeOpacity:m,graphicWidth:"${graphicWidth}",graphicHeight:"${graphicHeight}",graphicXOffset:"${graphicXOffset}",graphicYOffset:"${graphicYOffset}",graphicOpacity:m,
-graphicName:"${graphicName}",externalGraphic:"${externalGraphic}"},{context:{graphicWidth:function(a){return a.cluster?"":a.attributes.marker_width?a.attributes.marker_width:f},graphicHeight:function(a){return a.cluster?"":a.attributes.marker_height?a.attributes.marker_height:e},graphicXOffset:function(a){return a.cluster?"":a.attributes.marker_width?-(a.attributes.marker_width/2):-(f/2)},graphicYOffset:function(a){return a.cluster?"":a.attributes.marker_height?-a.attributes.marker_height:-e},graphicName:function(a){return a.cluster?
-"circle":a.attributes.shape?a.attributes.shape:"circle"},externalGraphic:function(a){return a.cluster?"":a.attributes.marker_url?a.attributes.marker_url:d},radius:function(a){return a.cluster?Math.min(a.attributes.count/2,8)+10:a.attributes.size?a.attributes.size:10},fill:function(a){if(a.cluster)var b=a.cluster[0].attributes.colour?a.cluster[0].attributes.colour:"#8087ff";else if(a.attributes.colour)b=a.attributes.colour;else if(k.length){var c=a.attributes.value;$.each(k,function(a,d){if(c>=d.low&&
-c<d.high)return b=d.fill,!1});b=void 0!=b?"#"+b:"#000000"}else b="#f5902e";return b},fillOpacity:function(a){if(a.cluster){if(a.cluster[0].attributes.opacity)var b=a.cluster[0].attributes.opacity}else a.attributes.opacity&&(b=a.attributes.opacity);return b},stroke:function(a){if(a.cluster)var b=a.cluster[0].attributes.colour?a.cluster[0].attributes.colour:"#2b2f76";else if(a.attributes.colour)b=a.attributes.colour;else if(k.length){var c=a.attributes.value;$.each(k,function(a,d){if(c>=d.low&&c<d.high)return b=
-d.fill,!1});b=void 0!=b?"#"+b:"#000000"}else b="#f5902e";return b},label:function(a){var b="";a.cluster&&1<a.attributes.count&&(b=a.attributes.count);return b}}});if(k.length){var r=[],s;$.each(k,function(a,b){s="#"+b.fill;var c=new OpenLayers.Rule({filter:new OpenLayers.Filter.Comparison({type:OpenLayers.Filter.Comparison.BETWEEN,property:"value",lowerBoundary:b.low,upperBoundary:b.high}),symbolizer:{fillColor:s,strokeColor:s,graphicName:"circle",pointRadius:10},title:b.low+"-"+b.high});r.push(c)});
-m.addRules(r)}m=new OpenLayers.StyleMap({"default":m,select:{fillColor:"#ffdc33",strokeColor:"#ff9933"}});a=new OpenLayers.Layer.Vector(b,{dir:g,projection:l,strategies:[new OpenLayers.Strategy.BBOX({ratio:1.5}),new OpenLayers.Strategy.Refresh({force:!0,interval:1E3*h}),new OpenLayers.Strategy.AttributeCluster({attribute:"colour",distance:n,threshold:p})],legendURL:d,s3_layer_id:a.id,s3_layer_type:o,s3_style:k,styleMap:m,protocol:new OpenLayers.Protocol.HTTP({url:c,format:S3.gis.format_geojson})});
-a.setVisibility(j);a.events.on({featureselected:onGeojsonFeatureSelect,featureunselected:onFeatureUnselect,loadstart:showThrobber,loadend:hideThrobber,loadcancel:hideThrobber});map.addLayer(a);S3.gis.layers_all.push(a)}
-function addGoogleLayers(){var a=S3.gis.Google,b;if(a.MapMaker||a.MapMakerHybrid){if(a.Satellite&&(b=new OpenLayers.Layer.Google(a.Satellite.name,{type:G_SATELLITE_MAP,sphericalMercator:!0,s3_layer_id:a.Satellite.id,s3_layer_type:"google"}),map.addLayer(b),"satellite"==a.Base&&map.setBaseLayer(b)),a.Maps&&(b=new OpenLayers.Layer.Google(a.Maps.name,{type:G_NORMAL_MAP,sphericalMercator:!0,s3_layer_id:a.Maps.id,s3_layer_type:"google"}),map.addLayer(b),"maps"==a.Base&&map.setBaseLayer(b)),a.Hybrid&&(b=
-new OpenLayers.Layer.Google(a.Hybrid.name,{type:G_HYBRID_MAP,sphericalMercator:!0,s3_layer_id:a.Hybrid.id,s3_layer_type:"google"}),map.addLayer(b),"maps"==a.Base&&map.setBaseLayer(b)),a.Terrain&&(b=new OpenLayers.Layer.Google(a.Terrain.name,{type:G_PHYSICAL_MAP,sphericalMercator:!0,s3_layer_id:a.Terrain.id,s3_layer_type:"google"}),map.addLayer(b),"terrain"==a.Base&&map.setBaseLayer(b)),a.MapMaker&&(b=new OpenLayers.Layer.Google(a.MapMaker.name,{type:G_MAPMAKER_NORMAL_MAP,sphericalMercator:!0,s3_layer_id:b.id,
-s3_layer_type:"google"}),map.addLayer(b),"mapmaker"==a.Base&&map.setBaseLayer(b)),a.MapMakerHybrid)b=new OpenLayers.Layer.Google(a.MapMakerHybrid.name,{type:G_MAPMAKER_HYBRID_MAP,sphericalMercator:!0,s3_layer_id:b.id,s3_layer_type:"google"}),map.addLayer(b),"mapmakerhybrid"==a.Base&&map.setBaseLayer(b)}else if(a.Satellite&&(b=new OpenLayers.Layer.Google(a.Satellite.name,{type:"satellite",numZoomLevels:22,s3_layer_id:a.Satellite.id,s3_layer_type:"google"}),map.addLayer(b),"satellite"==a.Base&&map.setBaseLayer(b)),
-a.Maps&&(b=new OpenLayers.Layer.Google(a.Maps.name,{numZoomLevels:20,s3_layer_id:a.Maps.id,s3_layer_type:"google"}),map.addLayer(b),"maps"==a.Base&&map.setBaseLayer(b)),a.Hybrid&&(b=new OpenLayers.Layer.Google(a.Hybrid.name,{type:"hybrid",numZoomLevels:20,s3_layer_id:a.Hybrid.id,s3_layer_type:"google"}),map.addLayer(b),"hybrid"==a.Base&&map.setBaseLayer(b)),a.Terrain)b=new OpenLayers.Layer.Google(a.Terrain.name,{type:"terrain",s3_layer_id:a.Terrain.id,s3_layer_type:"google"}),map.addLayer(b),"terrain"==
-a.Base&&map.setBaseLayer(b)}
-function addGPXLayer(a){var b=a.name,c=a.url,d=S3.gis.marker_url+a.marker_image,e=a.marker_height,f=a.marker_width,h=void 0!=a.waypoints?a.waypoints:!0,g=void 0!=a.tracks?a.tracks:!0,j=void 0!=a.routes?a.routes:!0,m=void 0!=a.visibility?a.visibility:!0;if(void 0!=a.dir){var n=a.dir;-1==$.inArray(n,S3.gis.dirs)&&S3.gis.dirs.push(n)}else n="";var p=void 0!=a.opacity?a.opacity:1,l=void 0!=a.cluster_distance?a.cluster_distance:S3.gis.cluster_distance,o=void 0!=a.cluster_threshold?a.cluster_threshold:
-S3.gis.cluster_threshold,k=OpenLayers.Util.extend({},OpenLayers.Feature.Vector.style["default"]);h?(k.graphicOpacity=p,k.graphicWidth=f,k.graphicHeight=e,k.graphicXOffset=-(f/2),k.graphicYOffset=-e,k.externalGraphic=d):k.externalGraphic="";k.strokeColor="blue";k.strokeWidth=6;k.strokeOpacity=p;a=new OpenLayers.Layer.Vector(b,{dir:n,projection:S3.gis.proj4326,strategies:[new OpenLayers.Strategy.Fixed,new OpenLayers.Strategy.Cluster({distance:l,threshold:o})],s3_layer_id:a.id,s3_layer_type:"gpx",legendURL:d,
-style:k,protocol:new OpenLayers.Protocol.HTTP({url:c,format:new OpenLayers.Format.GPX({extractAttributes:!0,extractWaypoints:h,extractTracks:g,extractRoutes:j})})});a.setVisibility(m);a.events.on({featureselected:onGpxFeatureSelect,featureunselected:onFeatureUnselect,loadstart:showThrobber,loadend:hideThrobber,loadcancel:hideThrobber});map.addLayer(a);S3.gis.layers_all.push(a)}
-function addKMLLayer(a){var b=a.name,c=a.url,d=S3.gis.marker_url+a.marker_image,e=void 0!=a.title?a.title:"name",f=void 0!=a.body?a.body:"description",h=void 0!=a.refresh?a.refresh:900,g=void 0!=a.visibility?a.visibility:!0;if(void 0!=a.dir){var j=a.dir;-1==$.inArray(j,S3.gis.dirs)&&S3.gis.dirs.push(j)}else j="";var m=void 0!=a.opacity?a.opacity:1,n=void 0!=a.cluster_distance?a.cluster_distance:S3.gis.cluster_distance,p=void 0!=a.cluster_threshold?a.cluster_threshold:S3.gis.cluster_threshold;S3.gis.image=
-new Image;S3.gis.image.onload=s3_gis_scaleImage;S3.gis.image.src=d;var l=OpenLayers.Util.extend({},OpenLayers.Feature.Vector.style["default"]);l.graphicOpacity=m;l.graphicWidth=S3.gis.image.width;l.graphicHeight=S3.gis.image.height;l.graphicXOffset=-(S3.gis.image.width/2);l.graphicYOffset=-S3.gis.image.height;l.externalGraphic=d;a=new OpenLayers.Layer.Vector(b,{dir:j,projection:S3.gis.proj4326,strategies:[new OpenLayers.Strategy.Fixed,new OpenLayers.Strategy.Cluster({distance:n,threshold:p}),new OpenLayers.Strategy.Refresh({force:!0,
-interval:1E3*h})],s3_layer_id:a.id,s3_layer_type:"kml",legendURL:d,style:l,protocol:new OpenLayers.Protocol.HTTP({url:c,format:S3.gis.format_kml})});a.title=e;a.body=f;a.setVisibility(g);a.events.on({featureselected:onKmlFeatureSelect,featureunselected:onFeatureUnselect,loadstart:showThrobber,loadend:hideThrobber,loadcancel:hideThrobber});map.addLayer(a);S3.gis.layers_all.push(a)}
-var s3_gis_scaleImage=function(){var a=S3.gis.image.height/S3.gis.image.width,b=Math.min(S3.gis.image.width,S3.gis.max_w),a=b*a;a>S3.gis.max_h&&(a=S3.gis.max_h,b*=b/a);S3.gis.image.height=a;S3.gis.image.width=b};
-function addOSMLayer(a){var b=a.name,c=[a.url1];void 0!=a.url2&&c.push(a.url2);void 0!=a.url3&&c.push(a.url3);var d=void 0!=a.visibility?a.visibility:!0;if(void 0!=a.dir){var e=a.dir;-1==$.inArray(e,S3.gis.dirs)&&S3.gis.dirs.push(e)}else e="";b=new OpenLayers.Layer.TMS(b,c,{dir:e,type:"png",getURL:osm_getTileURL,displayOutsideMaxExtent:!0,numZoomLevels:void 0!=a.zoomLevels?a.zoomLevels:19,isBaseLayer:void 0!=a.base?a.base:!0,s3_layer_id:a.id,s3_layer_type:"openstreetmap"});void 0!=a.attribution&&
-(b.attribution=a.attribution);b.setVisibility(d);map.addLayer(b);a._base&&map.setBaseLayer(b)}function osm_getTileURL(a){var b=this.map.getResolution(),c=Math.round((a.left-this.maxExtent.left)/(b*this.tileSize.w)),a=Math.round((this.maxExtent.top-a.top)/(b*this.tileSize.h)),b=this.map.getZoom(),d=Math.pow(2,b);if(0>a||a>=d)return OpenLayers.Util.getImagesLocation()+"404.png";c=b+"/"+(c%d+d)%d+"/"+a+"."+this.type;a=this.url;a instanceof Array&&(a=this.selectUrl(c,a));return a+c}
-function addTMSLayer(a){var b=a.name,c=[a.url];void 0!=a.url2&&c.push(a.url2);void 0!=a.url3&&c.push(a.url3);var d=a.layername,e=void 0!=a.zoomLevels?a.zoomLevels:19;if(void 0!=a.dir){var f=a.dir;-1==$.inArray(f,S3.gis.dirs)&&S3.gis.dirs.push(f)}else f="";b=new OpenLayers.Layer.TMS(b,c,{dir:f,s3_layer_id:a.id,s3_layer_type:"tms",layername:d,type:void 0!=a.format?a.format:"png",numZoomLevels:e});void 0!=a.attribution&&(b.attribution=a.attribution);map.addLayer(b);a._base&&map.setBaseLayer(b)}
-function addWFSLayer(a){var b=a.name,c=a.url;void 0!=a.username&&void 0!=a.password&&(c=c.replace("://","://"+a.username+":"+a.password+"@"));var d=a.title,e=a.featureType,f=a.featureNS,h=a.schema,g=void 0!=a.version?a.version:"1.1.0",j=void 0!=a.geometryName?a.geometryName:"the_geom",m=void 0!=a.styleField?a.styleField:"",n=void 0!=a.styleValues?a.styleValues:{},p=void 0!=a.visibility?a.visibility:!0;if(void 0!=a.dir){var l=a.dir;-1==$.inArray(l,S3.gis.dirs)&&S3.gis.dirs.push(l)}else l="";var o=
-void 0!=a.opacity?a.opacity:1,k=void 0!=a.cluster_distance?a.cluster_distance:S3.gis.cluster_distance,r=void 0!=a.cluster_threshold?a.cluster_threshold:S3.gis.cluster_threshold,c=new OpenLayers.Protocol.WFS({version:g,srsName:void 0!=a.projection?"EPSG:"+a.projection:"EPSG:4326",url:c,featureType:e,featureNS:f,geometryName:j,schema:h}),e={context:{radius:function(a){var b=12;a.cluster&&(b=Math.min(a.attributes.count/2,8)+12);return b},fill:function(a){var b="#f5902e";a.cluster&&(b="#8087ff");return b},
-stroke:function(a){var b="#f5902e";a.cluster&&(b="#2b2f76");return b},label:function(a){var b="";a.cluster&&1<a.attributes.count&&(b=a.attributes.count);return b}}};m&&n&&(e.context.fill=function(a){var b;$.each(n,function(c,d){c==a.attributes[m]&&(b=d)});b||(b="#f5902e");a.cluster&&(b="#8087ff");return b},e.context.stroke=function(a){var b;$.each(n,function(c,d){c==a.attributes[m]&&(b=d)});b||(b="#f5902e");a.cluster&&(b="#2b2f76");return b});o=new OpenLayers.Style({label:"${label}",labelAlign:"cm",
-pointRadius:"${radius}",fillColor:"${fill}",fillOpacity:o/2,strokeColor:"${stroke}",strokeWidth:2,strokeOpacity:o},e);o=new OpenLayers.StyleMap({"default":o,select:{fillColor:"#ffdc33",strokeColor:"#ff9933"}});projection=!projection||"4326"==projection?S3.gis.proj4326:new OpenLayers.Projection("EPSG:"+projection);a=new OpenLayers.Layer.Vector(b,{maxFeatures:1E3,strategies:[new OpenLayers.Strategy.BBOX({ratio:1.5}),new OpenLayers.Strategy.Cluster({distance:k,threshold:r})],dir:l,s3_layer_id:a.id,s3_layer_type:"wfs",
-projection:projection,protocol:c,styleMap:o});a.title=d;a.setVisibility(p);a.events.on({featureselected:onWfsFeatureSelect,featureunselected:onFeatureUnselect,loadstart:showThrobber,loadend:hideThrobber,loadcancel:hideThrobber});map.addLayer(a);S3.gis.layers_all.push(a)}
-function addWMSLayer(a){var b=a.name,c=a.url;void 0!=a.username&&void 0!=a.password&&(c=c.replace("://","://"+a.username+":"+a.password+"@"));var d=a.layers,e=void 0!=a.visibility?a.visibility:!0;if(void 0!=a.dir){var f=a.dir;-1==$.inArray(f,S3.gis.dirs)&&S3.gis.dirs.push(f)}else f="";var h=void 0!=a.base?a.base:!1,g=void 0!=a.format?a.format:"image/png",j=void 0!=a.version?a.version:"1.1.1",m=void 0!=a.map?a.map:"",n=void 0!=a.style?a.style:"",p=void 0!=a.bgcolor?"0x"+a.bgcolor:"",l=void 0!=a.buffer?
-a.buffer:0,o=void 0!=a.tiled?a.tiled:!1,k=void 0!=a.opacity?a.opacity:1;if(void 0!=a.legendURL)var r=a.legendURL;b=new OpenLayers.Layer.WMS(b,c,{layers:d},{dir:f,wrapDateLine:!0,isBaseLayer:h,transparent:void 0!=a.transparent?a.transparent:!0,s3_layer_id:a.id,s3_layer_type:"wms",queryable:void 0!=a.queryable?a.queryable:1,visibility:e});m&&(b.params.MAP=m);g&&(b.params.FORMAT=g);j&&(b.params.VERSION=j);n&&(b.params.STYLES=n);p&&(b.params.BGCOLOR=p);o&&(b.params.TILED=!0,b.params.TILESORIGIN=[map.maxExtent.left,
-map.maxExtent.bottom]);h||(b.opacity=k,b.buffer=l?l:0);r&&(b.legendURL=r);map.addLayer(b);a._base&&map.setBaseLayer(b)}
-function addXYZLayer(a){var b=a.name,c=[a.url];void 0!=a.url2&&c.push(a.url2);void 0!=a.url3&&c.push(a.url3);var d=a.layername,e=void 0!=a.zoomLevels?a.zoomLevels:19;if(void 0!=a.dir){var f=a.dir;-1==$.inArray(f,S3.gis.dirs)&&S3.gis.dirs.push(f)}else f="";b=new OpenLayers.Layer.XYZ(b,c,{dir:f,s3_layer_id:a.id,s3_layer_type:"xyz",layername:d,type:void 0!=a.format?a.format:"png",numZoomLevels:e});void 0!=a.attribution&&(b.attribution=a.attribution);map.addLayer(b);a._base&&map.setBaseLayer(b)}
-function showThrobber(){$("#layer_throbber").show().removeClass("hidden");S3.gis.layers_loading++}function hideThrobber(){S3.gis.layers_loading--;0>=S3.gis.layers_loading&&$("#layer_throbber").hide().addClass("hidden")}function s3_gis_loadDetails(a,b,c){$.ajax({url:a,success:function(a){$("#"+b).html(a);c.updateSize()},error:function(a,e,f){msg="UNAUTHORIZED"==f?S3.i18n.gis_requires_login:a.responseText;$("#"+b+"_contentDiv").html(msg);c.updateSize()},dataType:"html"})}
-function onGeojsonFeatureSelect(a){s3_gis_tooltipUnselect(a);var a=a.feature,b=S3.uid(),c=a.geometry.getBounds().getCenterLonLat(),d=!1;if(a.cluster){for(var e,f,h=S3.i18n.gis_cluster_multiple+":<ul>",g=0;g<a.cluster.length;g++)e=void 0!=a.cluster[g].attributes.popup?a.cluster[g].attributes.popup.split("<br />",1)[0]:a.cluster[g].attributes.name,void 0!=a.cluster[g].attributes.url?(f=a.cluster[g].attributes.url,h+="<li><a href='javascript:s3_gis_loadClusterPopup(\""+f+'", "'+b+"\")'>"+e+"</a></li>"):
-h+="<li>"+e+"</li>";h=h+"</ul>"+("<div align='center'><a href='javascript:s3_gis_zoomToSelectedFeature("+c.lon+","+c.lat+", 3)'>Zoom in</a></div>")}else if(void 0!=a.attributes.url)h=S3.i18n.gis_loading+"...<img src='"+S3.gis.ajax_loader+"' border=0 />";else{e=void 0==a.attributes.name?"":"<h3>"+a.attributes.name+"</h3>";f=void 0==a.attributes.description?"":"<p>"+a.attributes.description+"</p>";h=void 0==a.attributes.link?"":'<a href="'+a.attributes.link+'" target="_blank">'+a.attributes.link+"</a>";
-if(void 0==a.attributes.data)g="";else if(0===a.attributes.data.indexOf("http://"))var d=!0,j=S3.uid(),g='<div id="'+j+'">'+S3.i18n.gis_loading+"...<img src='"+S3.gis.ajax_loader+"' border=0 /></div>";else g="<p>"+a.attributes.data+"</p>";var m=void 0==a.attributes.image?"":0===a.attributes.image.indexOf("http://")?'<img src="'+a.attributes.image+'" height=300 width=300>':"",h=e+f+h+g+m}c=new OpenLayers.Popup.FramedCloud(b,c,new OpenLayers.Size(200,200),h,null,!0,onPopupClose);void 0!=a.attributes.url?
-s3_gis_loadDetails(a.attributes.url,b+"_contentDiv",c):d&&s3_gis_loadDetails(a.attributes.data,j,c);a.popup=c;map.addPopup(c)}function onGpxFeatureSelect(a){s3_gis_tooltipUnselect(a)}
-function onKmlFeatureSelect(a){s3_gis_tooltipUnselect(a);for(var a=a.feature,b=S3.uid(),c=a.geometry.getBounds().getCenterLonLat(),d=a.layer.title,e=a.attributes,f=typeof e[d],d="object"==f?e[d].value:e[d],h=a.layer.body.split(" "),g="",j=0;j<h.length;j++)f=typeof e[h[j]],"object"==f?(f=e[h[j]].displayName,""==f&&(f=h[j]),f="<b>"+f+"</b>: "+e[h[j]].value+"<br />"):f=e[h[j]]+"<br />",g+=f;-1!=g.search("<script")&&(g="Content contained Javascript! Escaped content below.<br />"+g.replace(/</g,"<"));
-b=new OpenLayers.Popup.FramedCloud(b,c,new OpenLayers.Size(200,200),"<h3>"+d+"</h3>"+g,null,!0,onPopupClose);a.popup=b;map.addPopup(b)}
-function onWfsFeatureSelect(a){s3_gis_tooltipUnselect(a);var a=a.feature,b=S3.uid(),c=a.geometry.getBounds().getCenterLonLat(),d=a.layer.title;if(a.cluster){for(var e,f=S3.i18n.gis_cluster_multiple+":<ul>",h=Math.min(a.cluster.length,9),g=0;g<h;g++)e=a.cluster[g].attributes[d],f+="<li>"+e+"</li>";f=f+"</ul>"+("<div align='center'><a href='javascript:s3_gis_zoomToSelectedFeature("+c.lon+","+c.lat+", 3)'>Zoom in</a></div>")}else{e=a.attributes;var d=e[d],j="";$.each(e,function(a,b){j+="<b>"+a+":</b> "+
-b+"<br />"});f="<h3>"+d+"</h3>"+j}b=new OpenLayers.Popup.FramedCloud(b,c,new OpenLayers.Size(200,200),f,null,!0,onPopupClose);a.popup=b;map.addPopup(b)}
-function addControls(){map.addControl(new OpenLayers.Control.ScaleLine);"mgrs"==S3.gis.mouse_position?map.addControl(new OpenLayers.Control.MGRSMousePosition):S3.gis.mouse_position&&map.addControl(new OpenLayers.Control.MousePosition);map.addControl(new OpenLayers.Control.Permalink);map.addControl(new OpenLayers.Control.OverviewMap({mapOptions:S3.gis.options}));addPopupControls()}
-function addPopupControls(){S3.gis.popupControl=new OpenLayers.Control.SelectFeature(S3.gis.layers_all,{toggle:!0,clickout:!0,multiple:!0});S3.gis.highlightControl=new OpenLayers.Control.SelectFeature(S3.gis.layers_all,{hover:!0,highlightOnly:!0,eventListeners:{featurehighlighted:s3_gis_tooltipSelect,featureunhighlighted:s3_gis_tooltipUnselect}});map.addControl(S3.gis.highlightControl);map.addControl(S3.gis.popupControl);S3.gis.highlightControl.activate();S3.gis.popupControl.activate()}
-function onFeatureUnselect(a){a=a.feature;a.popup&&(map.removePopup(a.popup),a.popup.destroy(),delete a.popup)}function onPopupClose(){for(;map.popups.length;)map.removePopup(map.popups[0])}
-function s3_gis_tooltipSelect(a){a=a.feature;if(!a.cluster&&null==a.popup){null!=S3.gis.tooltipPopup&&(map.removePopup(S3.gis.tooltipPopup),S3.gis.tooltipPopup.destroy(),null!=S3.gis.lastFeature&&delete S3.gis.lastFeature.popup,S3.gis.tooltipPopup=null);S3.gis.lastFeature=a;var b=a.geometry.getBounds().getCenterLonLat(),c=a.attributes,d;if(void 0!=c.popup)d=c.popup;else if(void 0!=c.name)d=c.name;else{var e=a.layer.title;void 0!=e&&(d="object"==typeof c[e]?c[e].value:c[e])}d&&(S3.gis.tooltipPopup=
-new OpenLayers.Popup("activetooltip",b,new OpenLayers.Size(80,12),d,!1));null!=S3.gis.tooltipPopup&&(S3.gis.tooltipPopup.contentDiv.style.backgroundColor="ffffcb",S3.gis.tooltipPopup.contentDiv.style.overflow="hidden",S3.gis.tooltipPopup.contentDiv.style.padding="3px",S3.gis.tooltipPopup.contentDiv.style.margin="10px",S3.gis.tooltipPopup.closeOnMove=!0,S3.gis.tooltipPopup.autoSize=!0,S3.gis.tooltipPopup.opacity=0.7,a.popup=S3.gis.tooltipPopup,map.addPopup(S3.gis.tooltipPopup))}}
-function s3_gis_tooltipUnselect(a){a=a.feature;null!=a&&null!=a.popup&&(map.removePopup(a.popup),a.popup.destroy(),delete a.popup,S3.gis.tooltipPopup=null,S3.gis.lastFeature=null)}function s3_gis_loadClusterPopup(a,b){var c=S3.i18n.gis_loading+"...<img src='"+S3.gis.ajax_loader+"' border=0 />";$("#"+b+"_contentDiv").html(c);$.get(a,function(a){$("#"+b+"_contentDiv").html(a);map.popups[0].updateSize()},"html")}
-function s3_gis_zoomToSelectedFeature(a,b,c){a=new OpenLayers.LonLat(a,b);c=map.getZoom()+c;map.setCenter(a,c);for(c=0;c<map.popups.length;c++)map.removePopup(map.popups[c])}
-function addGeolocateControl(a){var b=S3.gis.draftLayer,c={fillColor:"#000",fillOpacity:0.1,strokeWidth:0},d=new OpenLayers.Control.Geolocate({geolocationOptions:{enableHighAccuracy:!1,maximumAge:0,timeout:7E3}});map.addControl(d);d.events.register("locationupdated",this,function(a){b.removeAllFeatures();var d=new OpenLayers.Feature.Vector(OpenLayers.Geometry.Polygon.createRegularPolygon(new OpenLayers.Geometry.Point(a.point.x,a.point.y),a.position.coords.accuracy/2,40,0),{},c);b.addFeatures([new OpenLayers.Feature.Vector(a.point,
-{},{graphicName:"cross",strokeColor:"#f00",strokeWidth:2,fillOpacity:0,pointRadius:10}),d]);map.zoomToExtent(b.getDataExtent());s3_gis_pulsate(d)});d.events.register("locationfailed",this,function(){OpenLayers.Console.log("Location detection failed")});S3.gis.geolocateControl=d;d=new Ext.Toolbar.Button({iconCls:"geolocation",tooltip:S3.i18n.gis_geoLocate,handler:function(){S3.gis.draftLayer.removeAllFeatures();S3.gis.geolocateControl.activate()}});a.addButton(d)}
-function s3_gis_pulsate(a){var b=a.geometry.getCentroid(),c=a.geometry.getBounds(),d=Math.abs((c.right-c.left)/2),e=0,f="up";window.resizeInterval=window.setInterval(function(){16<e&&clearInterval(window.resizeInterval);var c=0.03*d/d;switch(e){case 4:case 12:f="down";break;case 8:f="up"}"up"!==f&&(c=-Math.abs(c));a.geometry.resize(1+c,b);S3.gis.draftLayer.drawFeature(a);e++},50,b,d)}
-function addGoogleEarthControl(a){var b=new Ext.Toolbar.Button({iconCls:"googleearth",tooltip:S3.gis.Google.Earth,enableToggle:!0,toggleHandler:function(a,b){!0===b?(S3.gis.mapPanelContainer.getLayout().setActiveItem(1),S3.gis.mapWin.items.items[0].collapse(),S3.gis.googleEarthPanel.on("pluginready",function(){addGoogleEarthKmlLayers()})):(S3.gis.mapPanelContainer.getLayout().setActiveItem(0),S3.gis.mapWin.items.items[0].expand())}});a.addSeparator();a.addButton(b)}
-function addGoogleEarthKmlLayers(){if(S3.gis.layers_features)for(var a=0;a<S3.gis.layers_features.length;a++){var b=S3.gis.layers_features[a];if(void 0!=b.visibility?b.visibility:1)b=S3.public_url+b.url.replace("geojson","kml"),google.earth.fetchKml(S3.gis.googleEarthPanel.earth,b,googleEarthKmlLoaded)}}function googleEarthKmlLoaded(a){a&&S3.gis.googleEarthPanel.earth.getFeatures().appendChild(a)}
-function addGoogleStreetviewControl(a){var b=OpenLayers.Class(OpenLayers.Control,{defaults:{pixelTolerance:1,stopSingle:!0},initialize:function(a){this.handlerOptions=OpenLayers.Util.extend({},this.defaults);OpenLayers.Control.prototype.initialize.apply(this,arguments);this.handler=new OpenLayers.Handler.Click(this,{click:this.trigger},this.handlerOptions)},trigger:function(a){openStreetviewPopup(map.getLonLatFromViewPortPx(a.xy))}});S3.gis.StreetviewClicker=new b({autoactivate:!1});map.addControl(S3.gis.StreetviewClicker);
-b=new Ext.Toolbar.Button({iconCls:"streetview",tooltip:S3.gis.Google.StreetviewButton,toggleGroup:"controls",allowDepress:!0,enableToggle:!0,toggleHandler:function(a,b){!0===b?S3.gis.StreetviewClicker.activate():S3.gis.StreetviewClicker.deactivate()}});a.addSeparator();a.addButton(b)}
-function openStreetviewPopup(a){a||(a=map.getCenter());S3.gis.sv_popup&&S3.gis.sv_popup.anc&&S3.gis.sv_popup.close();S3.gis.sv_popup=new GeoExt.Popup({title:S3.gis.Google.StreetviewTitle,location:a,width:300,height:300,collapsible:!0,map:S3.gis.mapPanel,items:[new gxp.GoogleStreetViewPanel]});S3.gis.sv_popup.show()}
-function addMeasureControls(a){var b=new OpenLayers.Style;b.addRules([new OpenLayers.Rule({symbolizer:{Point:{pointRadius:5,graphicName:"circle",fillColor:"white",fillOpacity:1,strokeWidth:1,strokeOpacity:1,strokeColor:"#f5902e"},Line:{strokeWidth:3,strokeOpacity:1,strokeColor:"#f5902e",strokeDashstyle:"dash"},Polygon:{strokeWidth:2,strokeOpacity:1,strokeColor:"#f5902e",fillColor:"white",fillOpacity:0.5}}})]);var b=new OpenLayers.StyleMap({"default":b}),c=new OpenLayers.Control.Measure(OpenLayers.Handler.Path,
-{geodesic:!0,persist:!0,handlerOptions:{layerOptions:{styleMap:b}}});c.events.on({measure:function(a){alert(S3.i18n.gis_length_message+" "+a.measure.toFixed(2)+" "+a.units)}});c=new GeoExt.Action({control:c,map:map,iconCls:"measure-off",tooltip:S3.i18n.gis_length_tooltip,toggleGroup:"controls",allowDepress:!0,enableToggle:!0});a.add(c);void 0===S3.gis.loc_select&&(b=new OpenLayers.Control.Measure(OpenLayers.Handler.Polygon,{geodesic:!0,persist:!0,handlerOptions:{layerOptions:{styleMap:b}}}),b.events.on({measure:function(a){alert(S3.i18n.gis_area_message+
-" "+a.measure.toFixed(2)+" "+a.units+"2")}}),b=new GeoExt.Action({control:b,map:map,iconCls:"measure-area",tooltip:S3.i18n.gis_area_tooltip,toggleGroup:"controls",allowDepress:!0,enableToggle:!0}),a.add(b))}
-function addNavigationControl(a){var b=new OpenLayers.Control.NavigationHistory;map.addControl(b);b.activate();var c=new Ext.Toolbar.Button({iconCls:"back",tooltip:S3.i18n.gis_navPrevious,handler:b.previous.trigger}),b=new Ext.Toolbar.Button({iconCls:"next",tooltip:S3.i18n.gis_navNext,handler:b.next.trigger});a.addButton(c);a.addButton(b)}
-function addPointControl(a,b){OpenLayers.Handler.PointS3=OpenLayers.Class(OpenLayers.Handler.Point,{dblclick:function(){return!0},CLASS_NAME:"OpenLayers.Handler.PointS3"});S3.gis.pointButton=new GeoExt.Action({control:new OpenLayers.Control.DrawFeature(S3.gis.draftLayer,OpenLayers.Handler.PointS3,{featureAdded:function(a){S3.gis.lastDraftFeature?S3.gis.lastDraftFeature.destroy():1<S3.gis.draftLayer.features.length&&S3.gis.draftLayer.features[0].destroy();var b=a.geometry.getBounds().getCenterLonLat();
-b.transform(S3.gis.projection_current,S3.gis.proj4326);$("#gis_location_lon").val(b.lon);$("#gis_location_lat").val(b.lat);S3.gis.lastDraftFeature=a}}),handler:function(){S3.gis.pointButton.items[0].pressed?$(".olMapViewport").addClass("crosshair"):$(".olMapViewport").removeClass("crosshair")},map:map,iconCls:"drawpoint-off",tooltip:S3.i18n.gis_draw_feature,toggleGroup:"controls",allowDepress:!0,enableToggle:!0,pressed:b});a.add(S3.gis.pointButton)}
-function addPolygonControl(a,b){S3.gis.polygonButton=new GeoExt.Action({control:new OpenLayers.Control.DrawFeature(S3.gis.draftLayer,OpenLayers.Handler.RegularPolygon,{handlerOptions:{sides:4,snapAngle:90},featureAdded:function(a){S3.gis.lastDraftFeature&&S3.gis.lastDraftFeature.destroy();var b=a.geometry.transform(S3.gis.projection_current,S3.gis.proj4326).toString();$("#gis_search_polygon_input").val(b);S3.gis.lastDraftFeature=a}}),handler:function(){S3.gis.polygonButton.items[0].pressed?$(".olMapViewport").addClass("crosshair"):
-$(".olMapViewport").removeClass("crosshair")},map:map,iconCls:"drawpolygon-off",tooltip:S3.i18n.gis_draw_polygon,toggleGroup:"controls",allowDepress:!0,pressed:b,enableToggle:!0,activateOnEnable:!0,deactivateOnDisable:!0});a.add(S3.gis.polygonButton)}
-function addPotlatchButton(a){var b=new Ext.Toolbar.Button({iconCls:"potlatch",tooltip:S3.i18n.gis_potlatch,handler:function(){var a=map.getZoom();if(14>a)alert(S3.gis.osm_oauth);else{var b=map.getCenter();b.transform(map.getProjectionObject(),S3.gis.proj4326);a=S3.Ap.concat("/gis/potlatch2/potlatch2.html")+"?lat="+b.lat+"&lon="+b.lon+"&zoom="+a;window.open(a)}}});a.addSeparator();a.addButton(b)}
-function addSaveButton(a){var b=new Ext.Toolbar.Button({iconCls:"save",tooltip:S3.i18n.gis_save,handler:function(){var a=getState(),b=Ext.util.JSON.encode(a.layers),e=Ext.util.JSON.encode(a.plugins),f=S3.gis.config_id?S3.Ap.concat("/gis/config/"+S3.gis.config_id+".url/update"):S3.Ap.concat("/gis/config.url/create");Ext.Ajax.request({url:f,method:"POST",success:function(a){if(a=Ext.decode(a.responseText).message.split("=",2)[1])S3.gis.config_id=a,a=S3.Ap.concat("/gis/config/",a,"/layer_entity"),$("#gis_menu_config").attr("href",
-a)},params:{lat:a.lat,lon:a.lon,zoom:a.zoom,layers:b,plugins:e}})}});a.addSeparator();a.addButton(b)}
-function getState(){var a={},b=map.getCenter();b.transform(map.getProjectionObject(),S3.gis.proj4326);a.lon=b.lon;a.lat=b.lat;a.zoom=map.getZoom();var c=[],d,e=map.baseLayer.s3_layer_id;Ext.iterate(map.layers,function(a){var b=a.s3_layer_id;d={id:b};a.visibility&&(d.visible=a.visibility);b==e&&(d.base=!0);a.s3_style&&(d.style=a.s3_style);c.push(d)});a.layers=c;var f=[];Ext.iterate(S3.gis.plugins,function(a){a.getState&&f.push(a.getState())});a.plugins=f;return a}
-function addPdfControl(a){selectPdfControl=new OpenLayers.Control;OpenLayers.Util.extend(selectPdfControl,{draw:function(){this.box=new OpenLayers.Handler.Box(this,{done:this.getPdf});this.box.activate()},response:function(a){this.w.destroy();var a=(new OpenLayers.Format.GML).read(a.responseText),b=a.length+" pdfs. <br /><ul>";if(a.length)for(var e=0;e<a.length;e++)var f=a[e],b=b+("<li><a href='"+a[e].attributes.url+"'>"+(f.attributes.utm_zone+f.attributes.grid_zone+f.attributes.grid_square+f.attributes.easting+
-f.attributes.northing)+"</a></li>");this.w=new Ext.Window({html:b+"</ul>",width:300,title:"Results",height:200});this.w.show()},getPdf:function(a){var b=map.getLonLatFromPixel(new OpenLayers.Pixel(a.left,a.bottom)).transform(S3.gis.projection_current,S3.gis.proj4326),a=map.getLonLatFromPixel(new OpenLayers.Pixel(a.right,a.top)).transform(S3.gis.projection_current,S3.gis.proj4326);bbox=(new OpenLayers.Bounds(b.lon,b.lat,a.lon,a.lat)).toBBOX();OpenLayers.Request.GET({url:S3.gis.mgrs_url+"&bbox="+bbox,
-callback:OpenLayers.Function.bind(this.response,this)});this.w=new Ext.Window({html:"Searching "+S3.gis.mgrs_name+", please wait.",width:200,title:"Please Wait."});this.w.show()}});var b="Select "+S3.gis.mgrs_name,b=new GeoExt.Action({text:b,control:selectPdfControl,map:map,toggleGroup:"controls",allowDepress:!1,tooltip:b});a.addSeparator();a.add(b)}
-function addWMSGetFeatureInfoControl(){S3.gis.wmsGetFeatureInfo=new gxp.plugins.WMSGetFeatureInfo({actionTarget:"gis_toolbar",outputTarget:"map",outputConfig:{width:400,height:200},toggleGroup:"controls",format:"grid",infoActionTip:S3.i18n.gis_get_feature_info,popupTitle:S3.i18n.gis_feature_info});S3.gis.wmsGetFeatureInfo.target=S3.gis;S3.gis.wmsGetFeatureInfo.addActions()}
-function addRemoveLayersControl(){S3.gis.addLayersControl=new gxp.plugins.AddLayers({actionTarget:"treepanel.tbar",addActionTip:"Add layers",addActionMenuText:"Add layers",addServerText:"Add a New Server",doneText:"Done",upload:{url:null},uploadText:S3.i18n.gis_uploadlayer,relativeUploadOnly:!1});var a=new GeoExt.data.LayerStore;S3.gis.addLayersControl.target=S3.gis.layerTree;S3.gis.layerTree.proxy=OpenLayers.ProxyHost;S3.gis.layerTree.layerSources={};S3.gis.layerTree.layerSources.local=new gxp.plugins.LayerSource({title:"local",
-store:a});S3.gis.addLayersControl.addActions()[0].enable();S3.gis.removeLayerControl=new gxp.plugins.RemoveLayer({actionTarget:"treepanel.tbar",removeActionTip:"Remove layer"});S3.gis.removeLayerControl.target=S3.gis.layerTree;S3.gis.layerTree.mapPanel=S3.gis.mapPanel;S3.gis.removeLayerControl.addActions()}
-function addLayerPropertiesButton(){var a=new Ext.Toolbar.Button({iconCls:"gxp-icon-layerproperties",tooltip:S3.i18n.gis_properties,handler:function(){var a=S3.gis.layerTree.root.findChildBy(function(a){return a.isSelected()?a.leaf?!0:!1:!1},null,!0);if(a){var c=a.layer.s3_layer_type,d=S3.Ap.concat("/gis/layer_"+c+".plain?layer_"+c+".layer_id="+a.layer.s3_layer_id+"&update=1");Ext.Ajax.request({url:d,method:"GET",success:function(d){S3.gis.propertiesWindow&&S3.gis.propertiesWindow.close();"feature"==
-c?(d=new Ext.TabPanel({activeTab:0,items:[{title:"Layer Properties",html:d.responseText},{title:"Filter",id:"s3_gis_layer_filter_tab",html:""}]}),d.items.items[1].on("activate",function(){var c;Ext.iterate(S3.gis.layers_features,function(d){d.id==a.layer.s3_layer_id&&(c=d.url.replace(/.geojson.+/,"/search.plain"))});Ext.get("s3_gis_layer_filter_tab").load({url:c,discardUrl:!1,callback:function(){S3.addTooltips();S3.search.select_letter_label()},text:"Loading...",timeout:30,scripts:!1})})):d=new Ext.Panel({title:"Layer Properties",
-html:d.responseText});S3.gis.propertiesWindow=new Ext.Window({width:400,layout:"fit",items:[d]});S3.gis.propertiesWindow.show();$("#plain form").submit(function(){var a=$('#plain input[name="id"]').val(),a=S3.Ap.concat("/gis/layer_"+c+"/"+a+".plain/update"),b=$("#plain input"),d=[];Ext.iterate(b,function(a,b){b.id&&b.id.indexOf("gis_layer_")!=-1&&d.push(b.id)});b=[];for(i=0;i<d.length;i++)(q=$("#"+d[i]).serialize())&&b.push(q);(q=$('#plain input[name="id"]').serialize())&&b.push(q);(q=$('#plain input[name="_formkey"]').serialize())&&
-b.push(q);(q=$('#plain input[name="_formname"]').serialize())&&b.push(q);if(b.length>0){b=b.join("&");$.ajax({type:"POST",url:a,data:b,success:function(a){$("#plain").html(a)}})}return false});S3.addTooltips();S3.autocomplete("role","admin","group","gis_layer_"+c+"_role_required")}})}}});S3.gis.layerTree.getTopToolbar().add(a)};
+var map;S3.gis.layers_all=new Array();S3.gis.format_geojson=new OpenLayers.Format.GeoJSON();S3.gis.dirs=new Array();S3.gis.ajax_loader=S3.Ap.concat('/static/img/ajax-loader.gif');S3.gis.marker_url=S3.Ap.concat('/static/img/markers/');OpenLayers.ImgPath=S3.Ap.concat('/static/img/gis/openlayers/');OpenLayers.IMAGE_RELOAD_ATTEMPTS=3;OpenLayers.Util.onImageLoadErrorColor='transparent';OpenLayers.ProxyHost=S3.Ap.concat('/gis/proxy?url=');S3.gis.proj4326=new OpenLayers.Projection('EPSG:4326');S3.gis.projection_current=new OpenLayers.Projection('EPSG:'+S3.gis.projection);S3.gis.options={displayProjection:S3.gis.proj4326,projection:S3.gis.projection_current,theme:null,units:S3.gis.units,maxResolution:S3.gis.maxResolution,maxExtent:new OpenLayers.Bounds(S3.gis.maxExtent[0],S3.gis.maxExtent[1],S3.gis.maxExtent[2],S3.gis.maxExtent[3]),numZoomLevels:S3.gis.numZoomLevels};S3.gis.cluster_distance=20;S3.gis.cluster_threshold=2;S3.gis.layers_loading=0;S3.gis.plugins=[];function registerPlugin(plugin){S3.gis.plugins.push(plugin);}
+S3.gis.show_map=function(){if(S3.gis.lat&&S3.gis.lon){S3.gis.center=new OpenLayers.LonLat(S3.gis.lon,S3.gis.lat);S3.gis.center.transform(S3.gis.proj4326,S3.gis.projection_current);}else if(S3.gis.bottom_left&&S3.gis.top_right){s3_gis_setCenter(S3.gis.bottom_left,S3.gis.top_right);}
+addMap();addMapUI();if(S3.gis.bounds){map.zoomToExtent(S3.gis.bounds);}
+Ext.QuickTips.init();}
+function s3_gis_setCenter(bottom_left,top_right){bottom_left=new OpenLayers.LonLat(bottom_left[0],bottom_left[1]);bottom_left.transform(S3.gis.proj4326,S3.gis.projection_current);var left=bottom_left.lon;var bottom=bottom_left.lat;top_right=new OpenLayers.LonLat(top_right[0],top_right[1]);top_right.transform(S3.gis.proj4326,S3.gis.projection_current);var right=top_right.lon;var top=top_right.lat;S3.gis.bounds=OpenLayers.Bounds.fromArray([left,bottom,right,top]);S3.gis.center=S3.gis.bounds.getCenterLonLat();}
+function addMap(){map=new OpenLayers.Map('center',S3.gis.options);addLayers();addControls();}
+function addMapUI(){S3.gis.mapPanel=new GeoExt.MapPanel({height:S3.gis.map_height,width:S3.gis.map_width,id:'mappanel',xtype:'gx_mappanel',map:map,center:S3.gis.center,zoom:S3.gis.zoom,plugins:[]});S3.gis.portal=Object();S3.gis.portal.map=S3.gis.mapPanel;if(S3.i18n.gis_legend||S3.gis.layers_wms){for(var i=0;i<map.layers.length;i++){if(map.layers[i].legendURL){S3.gis.mapPanel.layers.data.items[i].data.legendURL=map.layers[i].legendURL;}
+if(map.layers[i].queryable){S3.gis.mapPanel.layers.data.items[i].data.queryable=1;}}}
+addLayerTree();var items=[S3.gis.layerTree];if(S3.gis.wms_browser_url){addWMSBrowser();if(S3.gis.wmsBrowser){items.push(S3.gis.wmsBrowser);}}
+if(S3.gis.printFormPanel){items.push(S3.gis.printFormPanel);}
+if(S3.i18n.gis_legend){S3.gis.legendPanel=new GeoExt.LegendPanel({id:'legendpanel',title:S3.i18n.gis_legend,defaults:{labelCls:'mylabel',style:'padding:4px'},bodyStyle:'padding:4px',autoScroll:true,collapsible:true,collapseMode:'mini',lines:false});items.push(S3.gis.legendPanel);}
+for(var i=0;i<S3.gis.plugins.length;++i){S3.gis.plugins[i].setup(map);S3.gis.plugins[i].addToMapWindow(items);}
+S3.gis.mapWestPanel=new Ext.Panel({id:'tools',header:false,border:false,split:true,items:items});if(S3.gis.window){addMapWindow();}else{addMapPanel();}}
+function addWestPanel(){if(undefined==S3.gis.west_collapsed){S3.gis.west_collapsed=false;}
+S3.gis.mapWestPanelContainer=new Ext.Panel({region:'west',header:false,border:true,width:250,autoScroll:true,collapsible:true,collapseMode:'mini',collapsed:S3.gis.west_collapsed,items:[S3.gis.mapWestPanel]});};function addMapPanelContainer(){if(S3.gis.toolbar){addToolbar();}
+S3.gis.mapPanelContainer=new Ext.Panel({layout:'card',region:'center',id:'mappnlcntr',defaults:{border:false},items:[S3.gis.mapPanel],activeItem:0,tbar:S3.gis.toolbar,scope:this});if(S3.gis.Google&&S3.gis.Google.Earth){S3.gis.googleEarthPanel=new gxp.GoogleEarthPanel({mapPanel:S3.gis.mapPanel});S3.gis.mapPanelContainer.items.items.push(S3.gis.googleEarthPanel);}};function addMapPanel(){addWestPanel();addMapPanelContainer();S3.gis.mapWin=new Ext.Panel({id:'gis-map-panel',renderTo:'map_panel',autoScroll:true,titleCollapse:true,height:S3.gis.map_height,width:S3.gis.map_width,layout:'border',items:[S3.gis.mapWestPanelContainer,S3.gis.mapPanelContainer]});}
+function addMapWindow(){addWestPanel();addMapPanelContainer();var mapWin=new Ext.Window({id:'gis-map-window',collapsible:false,constrain:true,closable:!S3.gis.windowNotClosable,closeAction:'hide',autoScroll:true,maximizable:S3.gis.maximizable,titleCollapse:false,height:S3.gis.map_height,width:S3.gis.map_width,layout:'border',items:[S3.gis.mapWestPanelContainer,S3.gis.mapPanelContainer]});mapWin.on("beforehide",function(mw){if(mw.maximized){mw.restore();}});if(!S3.gis.windowHide){mapWin.show();mapWin.maximize();}
+S3.gis.mapWin=mapWin;}
+function addLayerTree(){var layerTreeBase={text:S3.i18n.gis_base_layers,nodeType:'gx_baselayercontainer',layerStore:S3.gis.mapPanel.layers,loader:{filter:function(record){var layer=record.getLayer();return layer.displayInLayerSwitcher===true&&layer.isBaseLayer===true&&(layer.dir===undefined||layer.dir=='');}},leaf:false,expanded:true};var layerTreeOverlays={text:S3.i18n.gis_overlays,nodeType:'gx_overlaylayercontainer',layerStore:S3.gis.mapPanel.layers,loader:{filter:function(record){var layer=record.getLayer();return layer.displayInLayerSwitcher===true&&layer.isBaseLayer===false&&(layer.dir===undefined||layer.dir=='');}},leaf:false,expanded:true};var nodesArr=[layerTreeBase,layerTreeOverlays];var dirs=S3.gis.dirs;for(var i=0;i<dirs.length;i++){var folder=dirs[i];var child={text:dirs[i],nodeType:'gx_layercontainer',layerStore:S3.gis.mapPanel.layers,loader:{filter:(function(folder){return function(read){if(read.data.layer.dir!=='undefined')
+return read.data.layer.dir===folder;}})(folder)},leaf:false,expanded:true}
+nodesArr.push(child);}
+var treeRoot=new Ext.tree.AsyncTreeNode({expanded:true,children:nodesArr});if(S3.i18n.gis_uploadlayer||S3.i18n.gis_properties){var tbar=new Ext.Toolbar();}else{var tbar=null;}
+S3.gis.layerTree=new Ext.tree.TreePanel({id:'treepanel',title:S3.i18n.gis_layers,loader:new Ext.tree.TreeLoader({applyLoader:false}),root:treeRoot,rootVisible:false,split:true,autoScroll:true,collapsible:true,collapseMode:'mini',lines:false,tbar:tbar,enableDD:true});if(S3.i18n.gis_uploadlayer){addRemoveLayersControl();}
+if(S3.i18n.gis_properties){addLayerPropertiesButton();}}
+function addWMSBrowser(){var root=new Ext.tree.AsyncTreeNode({expanded:true,loader:new GeoExt.tree.WMSCapabilitiesLoader({url:OpenLayers.ProxyHost+S3.gis.wms_browser_url,layerOptions:{buffer:1,singleTile:false,ratio:1,wrapDateLine:true},layerParams:{'TRANSPARENT':'TRUE'},createNode:function(attr){attr.checked=attr.leaf?false:undefined;return GeoExt.tree.WMSCapabilitiesLoader.prototype.createNode.apply(this,[attr]);}})});S3.gis.wmsBrowser=new Ext.tree.TreePanel({id:'wmsbrowser',title:S3.gis.wms_browser_name,root:root,rootVisible:false,split:true,autoScroll:true,collapsible:true,collapseMode:'mini',lines:false,listeners:{'checkchange':function(node,checked){if(checked===true){S3.gis.mapPanel.map.addLayer(node.attributes.layer);}else{S3.gis.mapPanel.map.removeLayer(node.attributes.layer);}}}});}
+function addToolbar(){var toolbar=new Ext.Toolbar({id:'gis_toolbar',height:34});var zoomfull=new GeoExt.Action({control:new OpenLayers.Control.ZoomToMaxExtent(),map:map,iconCls:'zoomfull',tooltip:S3.i18n.gis_zoomfull});var zoomout=new GeoExt.Action({control:new OpenLayers.Control.ZoomBox({out:true}),map:map,iconCls:'zoomout',tooltip:S3.i18n.gis_zoomout,toggleGroup:'controls'});var zoomin=new GeoExt.Action({control:new OpenLayers.Control.ZoomBox(),map:map,iconCls:'zoomin',tooltip:S3.i18n.gis_zoomin,toggleGroup:'controls'});if(S3.gis.draw_feature=="active"){var pan_pressed=false;var point_pressed=true;var polygon_pressed=false;}else if(S3.gis.draw_polygon=="active"){var pan_pressed=false;var point_pressed=false;var polygon_pressed=true;}else{var pan_pressed=true;var point_pressed=false;var polygon_pressed=false;}
+S3.gis.panButton=new GeoExt.Action({control:new OpenLayers.Control.Navigation(),map:map,iconCls:'pan-off',tooltip:S3.i18n.gis_pan,toggleGroup:'controls',allowDepress:true,pressed:pan_pressed});toolbar.add(zoomfull);if(navigator.geolocation){addGeolocateControl(toolbar)}
+if(undefined===S3.gis.loc_select){toolbar.add(zoomout);toolbar.add(zoomin);toolbar.add(S3.gis.panButton);toolbar.addSeparator();}
+if(undefined===S3.gis.loc_select){addNavigationControl(toolbar);}
+if((undefined===S3.gis.loc_select)&&(S3.auth)){addSaveButton(toolbar);}
+toolbar.addSeparator();addMeasureControls(toolbar);if(S3.gis.mgrs_url){addPdfControl(toolbar);}
+if(S3.gis.draw_feature||S3.gis.draw_polygon){toolbar.addSeparator();if(S3.gis.draw_feature){addPointControl(toolbar,point_pressed);}
+if(S3.gis.draw_polygon){addPolygonControl(toolbar,polygon_pressed);}}
+if(S3.i18n.gis_get_feature_info){addWMSGetFeatureInfoControl(toolbar);}
+if(S3.gis.osm_oauth){addPotlatchButton(toolbar);}
+if(S3.gis.Google&&S3.gis.Google.StreetviewButton){addGoogleStreetviewControl(toolbar);}
+try{if(S3.gis.Google.Earth){google&addGoogleEarthControl(toolbar);}}catch(err){};if(S3.i18n.gis_search){var width=Math.min(350,(S3.gis.map_width-680));var mapSearch=new GeoExt.ux.GeoNamesSearchCombo({map:map,width:width,listWidth:width,minChars:2,emptyText:S3.i18n.gis_search});toolbar.addSeparator();toolbar.add(mapSearch);}
+var throbber=new Ext.BoxComponent({autoEl:{tag:'img',src:S3.gis.ajax_loader},cls:'hidden',id:'layer_throbber'});toolbar.add(throbber);S3.gis.toolbar=toolbar;}
+function addLayers(){var i;if(S3.gis.layers_osm){for(i=0;i<S3.gis.layers_osm.length;i++){addOSMLayer(S3.gis.layers_osm[i]);}}
+try{google&addGoogleLayers();}catch(err){};if(S3.gis.Bing){addBingLayers();}
+if(S3.gis.layers_tms){for(i=0;i<S3.gis.layers_tms.length;i++){addTMSLayer(S3.gis.layers_tms[i]);}}
+if(S3.gis.layers_wms){for(i=0;i<S3.gis.layers_wms.length;i++){addWMSLayer(S3.gis.layers_wms[i]);}}
+if(S3.gis.layers_xyz){for(i=0;i<S3.gis.layers_xyz.length;i++){addXYZLayer(S3.gis.layers_xyz[i]);}}
+if(S3.gis.EmptyLayer){var layer=new OpenLayers.Layer(S3.gis.EmptyLayer.name,{isBaseLayer:true,displayInLayerSwitcher:true,s3_layer_id:S3.gis.EmptyLayer.id,s3_layer_type:'empty'});map.addLayer(layer);if(S3.gis.EmptyLayer.base){map.setBaseLayer(layer);}}
+try{addJSLayers();}catch(err){};if(S3.gis.layers_theme){for(i=0;i<S3.gis.layers_theme.length;i++){addGeoJSONLayer(S3.gis.layers_theme[i]);}}
+if(S3.gis.layers_geojson){for(i=0;i<S3.gis.layers_geojson.length;i++){addGeoJSONLayer(S3.gis.layers_geojson[i]);}}
+if(S3.gis.layers_gpx){for(i=0;i<S3.gis.layers_gpx.length;i++){addGPXLayer(S3.gis.layers_gpx[i]);}}
+if(S3.gis.layers_arcrest){for(i=0;i<S3.gis.layers_arcrest.length;i++){addArcRESTLayer(S3.gis.layers_arcrest[i]);}}
+if(S3.gis.CoordinateGrid){addCoordinateGrid();}
+if(S3.gis.layers_georss){for(i=0;i<S3.gis.layers_georss.length;i++){addGeoJSONLayer(S3.gis.layers_georss[i]);}}
+if(S3.gis.layers_kml){S3.gis.format_kml=new OpenLayers.Format.KML({extractStyles:true,extractAttributes:true,maxDepth:2})
+for(i=0;i<S3.gis.layers_kml.length;i++){addKMLLayer(S3.gis.layers_kml[i]);}}
+if(S3.gis.layers_wfs){for(i=0;i<S3.gis.layers_wfs.length;i++){addWFSLayer(S3.gis.layers_wfs[i]);}}
+if(S3.gis.layers_feature_queries){for(i=0;i<S3.gis.layers_feature_queries.length;i++){addGeoJSONLayer(S3.gis.layers_feature_queries[i]);}}
+if(S3.gis.layers_features){for(i=0;i<S3.gis.layers_features.length;i++){addGeoJSONLayer(S3.gis.layers_features[i]);}}
+if(S3.gis.features||S3.gis.draw_feature||S3.gis.draw_polygon||navigator.geolocation){addDraftLayer();}
+if(S3.gis.features){for(i=0;i<S3.gis.features.length;i++){var point=new OpenLayers.Geometry.Point(S3.gis.features[i].lon,S3.gis.features[i].lat);point.transform(S3.gis.proj4326,S3.gis.projection_current);S3.gis.draftLayer.addFeatures(new OpenLayers.Feature.Vector(point));}}}
+function addArcRESTLayer(layer){var name=layer.name;var url=[layer.url];if(undefined!=layer.layers){var layers=layer.layers;}else{var layers=0;}
+if(undefined!=layer.dir){var dir=layer.dir;if($.inArray(dir,S3.gis.dirs)==-1){S3.gis.dirs.push(dir);}}else{var dir='';}
+if(undefined!=layer.base){var isBaseLayer=layer.base;}else{var isBaseLayer=false;}
+if(undefined!=layer.transparent){var transparent=layer.transparent;}else{var transparent=true;}
+if(undefined!=layer.visibility){var visibility=layer.visibility;}else{var visibility=true;}
+var arcRESTLayer=new OpenLayers.Layer.ArcGIS93Rest(name,url,{layers:'show:'+layers,isBaseLayer:isBaseLayer,transparent:transparent,dir:dir,s3_layer_id:layer.id,s3_layer_type:'arcrest'});arcRESTLayer.setVisibility(visibility);map.addLayer(arcRESTLayer);if(layer._base){map.setBaseLayer(arcRESTLayer);}}
+function addBingLayers(){var bing=S3.gis.Bing;var ApiKey=bing.ApiKey;var layer;if(bing.Aerial){layer=new OpenLayers.Layer.Bing({key:ApiKey,type:'Aerial',name:bing.Aerial.name,s3_layer_id:bing.Aerial.id,s3_layer_type:'bing'});map.addLayer(layer);if(Bing.Base=='aerial'){map.setBaseLayer(layer);}}
+if(bing.Road){layer=new OpenLayers.Layer.Bing({key:ApiKey,type:'Road',name:bing.Road.name,s3_layer_id:bing.Road.id,s3_layer_type:'bing'});map.addLayer(layer);if(Bing.Base=='road'){map.setBaseLayer(layer);}}
+if(bing.Hybrid){layer=new OpenLayers.Layer.Bing({key:ApiKey,type:'AerialWithLabels',name:bing.Hybrid.name,s3_layer_id:bing.Hybrid.id,s3_layer_type:'bing'});map.addLayer(layer);if(Bing.Base=='hybrid'){map.setBaseLayer(layer);}}}
+function addCoordinateGrid(){map.addLayer(new OpenLayers.Layer.cdauth.CoordinateGrid(null,{name:S3.gis.CoordinateGrid.name,shortName:'grid',visibility:S3.gis.CoordinateGrid.visibility,s3_layer_id:S3.gis.CoordinateGrid.id,s3_layer_type:'coordinate'}));}
+function addDraftLayer(){var iconURL=S3.gis.marker_url+S3.gis.marker_default;var marker_height=S3.gis.marker_default_height;var marker_width=S3.gis.marker_default_width;var style_marker=OpenLayers.Util.extend({},OpenLayers.Feature.Vector.style['default']);style_marker.graphicOpacity=1;style_marker.graphicWidth=marker_width;style_marker.graphicHeight=marker_height;style_marker.graphicXOffset=-(marker_width/2);style_marker.graphicYOffset=-marker_height;style_marker.externalGraphic=iconURL;S3.gis.draftLayer=new OpenLayers.Layer.Vector(S3.i18n.gis_draft_layer,{style:style_marker,displayInLayerSwitcher:false});S3.gis.draftLayer.setVisibility(true);map.addLayer(S3.gis.draftLayer);}
+OpenLayers.Strategy.AttributeCluster=OpenLayers.Class(OpenLayers.Strategy.Cluster,{attribute:null,shouldCluster:function(cluster,feature){var cc_attrval=cluster.cluster[0].attributes[this.attribute];var fc_attrval=feature.attributes[this.attribute];var superProto=OpenLayers.Strategy.Cluster.prototype;return cc_attrval===fc_attrval&&superProto.shouldCluster.apply(this,arguments);},CLASS_NAME:"OpenLayers.Strategy.AttributeCluster"});function addGeoJSONLayer(layer){var name=layer.name;var url=layer.url;if(undefined!=layer.marker_image){var marker_url=S3.gis.marker_url+layer.marker_image;var marker_height=layer.marker_height;var marker_width=layer.marker_width;}else{var marker_url='';}
+if(undefined!=layer.refresh){var refresh=layer.refresh;}else{var refresh=900;}
+if(undefined!=layer.dir){var dir=layer.dir;if($.inArray(dir,S3.gis.dirs)==-1){S3.gis.dirs.push(dir);}}else{var dir='';}
+if(undefined!=layer.visibility){var visibility=layer.visibility;}else{var visibility=true;}
+if(undefined!=layer.opacity){var opacity=layer.opacity;}else{var opacity=1;}
+if(undefined!=layer.cluster_distance){var cluster_distance=layer.cluster_distance;}else{var cluster_distance=S3.gis.cluster_distance;}
+if(undefined!=layer.cluster_threshold){var cluster_threshold=layer.cluster_threshold;}else{var cluster_threshold=S3.gis.cluster_threshold;}
+if(undefined!=layer.projection){var projection=layer.projection;}else{var projection=4326;}
+if(4326==projection){projection=S3.gis.proj4326;}else{projection=new OpenLayers.Projection('EPSG:'+projection);}
+if(undefined!=layer.type){var layer_type=layer.type;}else{var layer_type='feature';}
+if(undefined!=layer.style){var style=layer.style;}else{var style=[];}
+var cluster_style={label:'${label}',labelAlign:'cm',pointRadius:'${radius}',fillColor:'${fill}',fillOpacity:'${fillOpacity}',strokeColor:'${stroke}',strokeWidth:2,strokeOpacity:opacity,graphicWidth:'${graphicWidth}',graphicHeight:'${graphicHeight}',graphicXOffset:'${graphicXOffset}',graphicYOffset:'${graphicYOffset}',graphicOpacity:opacity,graphicName:'${graphicName}',externalGraphic:'${externalGraphic}'};var cluster_options={context:{graphicWidth:function(feature){if(feature.cluster){var pix='';}else if(feature.attributes.marker_width){var pix=feature.attributes.marker_width;}else{var pix=marker_width;}
+return pix;},graphicHeight:function(feature){if(feature.cluster){var pix='';}else if(feature.attributes.marker_height){var pix=feature.attributes.marker_height;}else{var pix=marker_height;}
+return pix;},graphicXOffset:function(feature){if(feature.cluster){var pix='';}else if(feature.attributes.marker_width){var pix=-(feature.attributes.marker_width/2);}else{var pix=-(marker_width/2);}
+return pix;},graphicYOffset:function(feature){if(feature.cluster){var pix='';}else if(feature.attributes.marker_height){var pix=-feature.attributes.marker_height;}else{var pix=-marker_height;}
+return pix;},graphicName:function(feature){if(feature.cluster){var shape='circle';}else if(feature.attributes.shape){var shape=feature.attributes.shape;}else{var shape='circle';}
+return shape;},externalGraphic:function(feature){if(feature.cluster){var url='';}else if(feature.attributes.marker_url){var url=feature.attributes.marker_url;}else{var url=marker_url;}
+return url;},radius:function(feature){if(feature.cluster){var pix=Math.min(feature.attributes.count/2,8)+10;}else if(feature.attributes.size){var pix=feature.attributes.size;}else{var pix=10;}
+return pix;},fill:function(feature){if(feature.cluster){if(feature.cluster[0].attributes.colour){var color=feature.cluster[0].attributes.colour;}else{var color='#8087ff';}}else if(feature.attributes.colour){var color=feature.attributes.colour;}else if(style.length){var value=feature.attributes.value;var color;$.each(style,function(index,elem){if((value>=elem.low)&&(value<elem.high)){color=elem.fill;return false;}});if(undefined!=color){color='#'+color;}else{color='#000000';}}else{var color='#f5902e';}
+return color;},fillOpacity:function(feature){if(feature.cluster){if(feature.cluster[0].attributes.opacity){var opacity=feature.cluster[0].attributes.opacity;}else{var opacity=opacity;}}else if(feature.attributes.opacity){var opacity=feature.attributes.opacity;}else{var opacity=opacity;}
+return opacity;},stroke:function(feature){if(feature.cluster){if(feature.cluster[0].attributes.colour){var color=feature.cluster[0].attributes.colour;}else{var color='#2b2f76';}}else if(feature.attributes.colour){var color=feature.attributes.colour;}else if(style.length){var value=feature.attributes.value;var color;$.each(style,function(index,elem){if((value>=elem.low)&&(value<elem.high)){color=elem.fill;return false;}});if(undefined!=color){color='#'+color;}else{color='#000000';}}else{var color='#f5902e';}
+return color;},label:function(feature){var label='';if(feature.cluster&&feature.attributes.count>1){label=feature.attributes.count;}else if(feature.attributes.count>1){label=feature.attributes.count;}
+return label;}}};var style_cluster=new OpenLayers.Style(cluster_style,cluster_options);if(style.length){var rules=[];var fill;$.each(style,function(index,elem){fill='#'+elem.fill;var rule=new OpenLayers.Rule({filter:new OpenLayers.Filter.Comparison({type:OpenLayers.Filter.Comparison.BETWEEN,property:'value',lowerBoundary:elem.low,upperBoundary:elem.high}),symbolizer:{fillColor:fill,strokeColor:fill,graphicName:'circle',pointRadius:10},title:elem.low+'-'+elem.high});rules.push(rule);});style_cluster.addRules(rules);}
+var featureClusterStyleMap=new OpenLayers.StyleMap({'default':style_cluster,'select':{fillColor:'#ffdc33',strokeColor:'#ff9933'}});if('feature'==layer_type){var params={zoom:map.getZoom()};var resFactor=1;var triggerRead=function(options){this.layer.protocol.params.zoom=this.layer.map.getZoom();return OpenLayers.Strategy.BBOX.prototype.triggerRead.apply(this,arguments);};}else{var params={};var resFactor=null;var triggerRead=OpenLayers.Strategy.BBOX.prototype.triggerRead;}
+var geojsonLayer=new OpenLayers.Layer.Vector(name,{dir:dir,projection:projection,strategies:[new OpenLayers.Strategy.BBOX({ratio:1.5,resFactor:resFactor,triggerRead:triggerRead}),new OpenLayers.Strategy.Refresh({force:true,interval:refresh*1000}),new OpenLayers.Strategy.AttributeCluster({attribute:'colour',distance:cluster_distance,threshold:cluster_threshold})],legendURL:marker_url,s3_layer_id:layer.id,s3_layer_type:layer_type,s3_style:style,styleMap:featureClusterStyleMap,protocol:new OpenLayers.Protocol.HTTP({url:url,params:params,format:S3.gis.format_geojson})});geojsonLayer.setVisibility(visibility);geojsonLayer.events.on({'featureselected':onGeojsonFeatureSelect,'featureunselected':onFeatureUnselect,'loadstart':showThrobber,'loadend':hideThrobber,'loadcancel':hideThrobber});map.addLayer(geojsonLayer);S3.gis.layers_all.push(geojsonLayer);}
+function addGoogleLayers(){var google=S3.gis.Google;var layer;if(google.MapMaker||google.MapMakerHybrid){if(google.Satellite){layer=new OpenLayers.Layer.Google(google.Satellite.name,{type:G_SATELLITE_MAP,sphericalMercator:true,s3_layer_id:google.Satellite.id,s3_layer_type:'google'});map.addLayer(layer);if(google.Base=='satellite'){map.setBaseLayer(layer);}}
+if(google.Maps){layer=new OpenLayers.Layer.Google(google.Maps.name,{type:G_NORMAL_MAP,sphericalMercator:true,s3_layer_id:google.Maps.id,s3_layer_type:'google'});map.addLayer(layer);if(google.Base=='maps'){map.setBaseLayer(layer);}}
+if(google.Hybrid){layer=new OpenLayers.Layer.Google(google.Hybrid.name,{type:G_HYBRID_MAP,sphericalMercator:true,s3_layer_id:google.Hybrid.id,s3_layer_type:'google'});map.addLayer(layer);if(google.Base=='maps'){map.setBaseLayer(layer);}}
+if(google.Terrain){layer=new OpenLayers.Layer.Google(google.Terrain.name,{type:G_PHYSICAL_MAP,sphericalMercator:true,s3_layer_id:google.Terrain.id,s3_layer_type:'google'});map.addLayer(layer);if(google.Base=='terrain'){map.setBaseLayer(layer);}}
+if(google.MapMaker){layer=new OpenLayers.Layer.Google(google.MapMaker.name,{type:G_MAPMAKER_NORMAL_MAP,sphericalMercator:true,s3_layer_id:layer.id,s3_layer_type:'google'});map.addLayer(layer);if(google.Base=='mapmaker'){map.setBaseLayer(layer);}}
+if(google.MapMakerHybrid){layer=new OpenLayers.Layer.Google(google.MapMakerHybrid.name,{type:G_MAPMAKER_HYBRID_MAP,sphericalMercator:true,s3_layer_id:layer.id,s3_layer_type:'google'});map.addLayer(layer);if(google.Base=='mapmakerhybrid'){map.setBaseLayer(layer);}}}else{if(google.Satellite){layer=new OpenLayers.Layer.Google(google.Satellite.name,{type:'satellite',numZoomLevels:22,s3_layer_id:google.Satellite.id,s3_layer_type:'google'});map.addLayer(layer);if(google.Base=='satellite'){map.setBaseLayer(layer);}}
+if(google.Maps){layer=new OpenLayers.Layer.Google(google.Maps.name,{numZoomLevels:20,s3_layer_id:google.Maps.id,s3_layer_type:'google'});map.addLayer(layer);if(google.Base=='maps'){map.setBaseLayer(layer);}}
+if(google.Hybrid){layer=new OpenLayers.Layer.Google(google.Hybrid.name,{type:'hybrid',numZoomLevels:20,s3_layer_id:google.Hybrid.id,s3_layer_type:'google'});map.addLayer(layer);if(google.Base=='hybrid'){map.setBaseLayer(layer);}}
+if(google.Terrain){layer=new OpenLayers.Layer.Google(google.Terrain.name,{type:'terrain',s3_layer_id:google.Terrain.id,s3_layer_type:'google'});map.addLayer(layer);if(google.Base=='terrain'){map.setBaseLayer(layer);}}}}
+function addGPXLayer(layer){var name=layer.name;var url=layer.url;var marker_url=S3.gis.marker_url+layer.marker_image;var marker_height=layer.marker_height;var marker_width=layer.marker_width;if(undefined!=layer.waypoints){var waypoints=layer.waypoints;}else{var waypoints=true;}
+if(undefined!=layer.tracks){var tracks=layer.tracks;}else{var tracks=true;}
+if(undefined!=layer.routes){var routes=layer.routes;}else{var routes=true;}
+if(undefined!=layer.visibility){var visibility=layer.visibility;}else{var visibility=true;}
+if(undefined!=layer.dir){var dir=layer.dir;if($.inArray(dir,S3.gis.dirs)==-1){S3.gis.dirs.push(dir);}}else{var dir='';}
+if(undefined!=layer.opacity){var opacity=layer.opacity;}else{var opacity=1;}
+if(undefined!=layer.cluster_distance){var cluster_distance=layer.cluster_distance;}else{var cluster_distance=S3.gis.cluster_distance;}
+if(undefined!=layer.cluster_threshold){var cluster_threshold=layer.cluster_threshold;}else{var cluster_threshold=S3.gis.cluster_threshold;}
+var style_marker=OpenLayers.Util.extend({},OpenLayers.Feature.Vector.style['default']);if(waypoints){style_marker.graphicOpacity=opacity;style_marker.graphicWidth=marker_width;style_marker.graphicHeight=marker_height;style_marker.graphicXOffset=-(marker_width/2);style_marker.graphicYOffset=-marker_height;style_marker.externalGraphic=marker_url;}else{style_marker.externalGraphic='';}
+style_marker.strokeColor='blue';style_marker.strokeWidth=6;style_marker.strokeOpacity=opacity;var gpxLayer=new OpenLayers.Layer.Vector(name,{dir:dir,projection:S3.gis.proj4326,strategies:[new OpenLayers.Strategy.Fixed(),new OpenLayers.Strategy.Cluster({distance:cluster_distance,threshold:cluster_threshold})],s3_layer_id:layer.id,s3_layer_type:'gpx',legendURL:marker_url,style:style_marker,protocol:new OpenLayers.Protocol.HTTP({url:url,format:new OpenLayers.Format.GPX({extractAttributes:true,extractWaypoints:waypoints,extractTracks:tracks,extractRoutes:routes})})});gpxLayer.setVisibility(visibility);gpxLayer.events.on({'featureselected':onGpxFeatureSelect,'featureunselected':onFeatureUnselect,'loadstart':showThrobber,'loadend':hideThrobber,'loadcancel':hideThrobber});map.addLayer(gpxLayer);S3.gis.layers_all.push(gpxLayer);}
+function addKMLLayer(layer){var name=layer.name;var url=layer.url;var marker_url=S3.gis.marker_url+layer.marker_image;var marker_height=layer.marker_height;var marker_width=layer.marker_width;if(undefined!=layer.title){var title=layer.title;}else{var title='name';}
+if(undefined!=layer.body){var body=layer.body;}else{var body='description';}
+if(undefined!=layer.refresh){var refresh=layer.refresh;}else{var refresh=900;}
+if(undefined!=layer.visibility){var visibility=layer.visibility;}else{var visibility=true;}
+if(undefined!=layer.dir){var dir=layer.dir;if($.inArray(dir,S3.gis.dirs)==-1){S3.gis.dirs.push(dir);}}else{var dir='';}
+if(undefined!=layer.opacity){var opacity=layer.opacity;}else{var opacity=1;}
+if(undefined!=layer.cluster_distance){var cluster_distance=layer.cluster_distance;}else{var cluster_distance=S3.gis.cluster_distance;}
+if(undefined!=layer.cluster_threshold){var cluster_threshold=layer.cluster_threshold;}else{var cluster_threshold=S3.gis.cluster_threshold;}
+S3.gis.image=new Image();S3.gis.image.onload=s3_gis_scaleImage;S3.gis.image.src=marker_url;var style_marker=OpenLayers.Util.extend({},OpenLayers.Feature.Vector.style['default']);style_marker.graphicOpacity=opacity;style_marker.graphicWidth=S3.gis.image.width;style_marker.graphicHeight=S3.gis.image.height;style_marker.graphicXOffset=-(S3.gis.image.width/2);style_marker.graphicYOffset=-S3.gis.image.height;style_marker.externalGraphic=marker_url;var kmlLayer=new OpenLayers.Layer.Vector(name,{dir:dir,projection:S3.gis.proj4326,strategies:[new OpenLayers.Strategy.Fixed(),new OpenLayers.Strategy.Cluster({distance:cluster_distance,threshold:cluster_threshold}),new OpenLayers.Strategy.Refresh({force:true,interval:refresh*1000})],s3_layer_id:layer.id,s3_layer_type:'kml',legendURL:marker_url,style:style_marker,protocol:new OpenLayers.Protocol.HTTP({url:url,format:S3.gis.format_kml})});kmlLayer.title=title;kmlLayer.body=body;kmlLayer.setVisibility(visibility);kmlLayer.events.on({'featureselected':onKmlFeatureSelect,'featureunselected':onFeatureUnselect,'loadstart':showThrobber,'loadend':hideThrobber,'loadcancel':hideThrobber});map.addLayer(kmlLayer);S3.gis.layers_all.push(kmlLayer);}
+var s3_gis_scaleImage=function(){var scaleRatio=S3.gis.image.height/S3.gis.image.width;var w=Math.min(S3.gis.image.width,S3.gis.max_w);var h=w*scaleRatio;if(h>S3.gis.max_h){h=S3.gis.max_h;scaleRatio=w/h;w=w*scaleRatio;}
+S3.gis.image.height=h;S3.gis.image.width=w;}
+function addOSMLayer(layer){var name=layer.name;var url=[layer.url1];if(undefined!=layer.url2){url.push(layer.url2);}
+if(undefined!=layer.url3){url.push(layer.url3);}
+if(undefined!=layer.visibility){var visibility=layer.visibility;}else{var visibility=true;}
+if(undefined!=layer.dir){var dir=layer.dir;if($.inArray(dir,S3.gis.dirs)==-1){S3.gis.dirs.push(dir);}}else{var dir='';}
+if(undefined!=layer.base){var isBaseLayer=layer.base;}else{var isBaseLayer=true;}
+if(undefined!=layer.zoomLevels){var numZoomLevels=layer.zoomLevels;}else{var numZoomLevels=19;}
+var osmLayer=new OpenLayers.Layer.TMS(name,url,{dir:dir,type:'png',getURL:osm_getTileURL,displayOutsideMaxExtent:true,numZoomLevels:numZoomLevels,isBaseLayer:isBaseLayer,s3_layer_id:layer.id,s3_layer_type:'openstreetmap'});if(undefined!=layer.attribution){osmLayer.attribution=layer.attribution;}
+osmLayer.setVisibility(visibility);map.addLayer(osmLayer);if(layer._base){map.setBaseLayer(osmLayer);}}
+function osm_getTileURL(bounds){var res=this.map.getResolution();var x=Math.round((bounds.left-this.maxExtent.left)/(res*this.tileSize.w));var y=Math.round((this.maxExtent.top-bounds.top)/(res*this.tileSize.h));var z=this.map.getZoom();var limit=Math.pow(2,z);if(y<0||y>=limit){return OpenLayers.Util.getImagesLocation()+'404.png';}else{x=((x%limit)+limit)%limit;var path=z+'/'+x+'/'+y+'.'+this.type;var url=this.url;if(url instanceof Array){url=this.selectUrl(path,url);}
+return url+path;}}
+function addTMSLayer(layer){var name=layer.name;var url=[layer.url];if(undefined!=layer.url2){url.push(layer.url2);}
+if(undefined!=layer.url3){url.push(layer.url3);}
+var layername=layer.layername;if(undefined!=layer.zoomLevels){var numZoomLevels=layer.zoomLevels;}else{var numZoomLevels=19;}
+if(undefined!=layer.dir){var dir=layer.dir;if($.inArray(dir,S3.gis.dirs)==-1){S3.gis.dirs.push(dir);}}else{var dir='';}
+if(undefined!=layer.format){var format=layer.format;}else{var format='png';}
+var tmsLayer=new OpenLayers.Layer.TMS(name,url,{dir:dir,s3_layer_id:layer.id,s3_layer_type:'tms',layername:layername,type:format,numZoomLevels:numZoomLevels});if(undefined!=layer.attribution){tmsLayer.attribution=layer.attribution;}
+map.addLayer(tmsLayer);if(layer._base){map.setBaseLayer(tmsLayer);}}
+function addWFSLayer(layer){var name=layer.name;var url=layer.url;if((undefined!=layer.username)&&(undefined!=layer.password)){var username=layer.username;var password=layer.password;url=url.replace('://','://'+username+':'+password+'@');}
+var title=layer.title;var featureType=layer.featureType;var featureNS=layer.featureNS;var schema=layer.schema;if(undefined!=layer.version){var version=layer.version;}else{var version='1.1.0';}
+if(undefined!=layer.geometryName){var geometryName=layer.geometryName;}else{var geometryName='the_geom';}
+if(undefined!=layer.styleField){var styleField=layer.styleField;}else{var styleField='';}
+if(undefined!=layer.styleValues){var styleValues=layer.styleValues;}else{var styleValues={};}
+if(undefined!=layer.visibility){var visibility=layer.visibility;}else{var visibility=true;}
+if(undefined!=layer.dir){var dir=layer.dir;if($.inArray(dir,S3.gis.dirs)==-1){S3.gis.dirs.push(dir);}}else{var dir='';}
+if(undefined!=layer.opacity){var opacity=layer.opacity;}else{var opacity=1;}
+if(undefined!=layer.cluster_distance){var cluster_distance=layer.cluster_distance;}else{var cluster_distance=S3.gis.cluster_distance;}
+if(undefined!=layer.cluster_threshold){var cluster_threshold=layer.cluster_threshold;}else{var cluster_threshold=S3.gis.cluster_threshold;}
+if(undefined!=layer.projection){var srsName='EPSG:'+layer.projection;}else{var srsName='EPSG:4326';}
+var protocol=new OpenLayers.Protocol.WFS({version:version,srsName:srsName,url:url,featureType:featureType,featureNS:featureNS,geometryName:geometryName,schema:schema})
+var cluster_options={context:{radius:function(feature){var pix=12;if(feature.cluster){pix=Math.min(feature.attributes.count/2,8)+12;}
+return pix;},fill:function(feature){var color='#f5902e';if(feature.cluster){color='#8087ff';}
+return color;},stroke:function(feature){var color='#f5902e';if(feature.cluster){color='#2b2f76';}
+return color;},label:function(feature){var label='';if(feature.cluster&&feature.attributes.count>1){label=feature.attributes.count;}
+return label;}}}
+if(styleField&&styleValues){cluster_options.context.fill=function(feature){var color;$.each(styleValues,function(i,n){if(i==feature.attributes[styleField]){color=n;}});if(!color){color='#f5902e';}
+if(feature.cluster){color='#8087ff';}
+return color;};cluster_options.context.stroke=function(feature){var color
+$.each(styleValues,function(i,n){if(i==feature.attributes[styleField]){color=n;}});if(!color){color='#f5902e';}
+if(feature.cluster){color='#2b2f76';}
+return color;};}
+var style_cluster=new OpenLayers.Style({label:'${label}',labelAlign:'cm',pointRadius:'${radius}',fillColor:'${fill}',fillOpacity:opacity/2,strokeColor:'${stroke}',strokeWidth:2,strokeOpacity:opacity},cluster_options);var featureClusterStyleMap=new OpenLayers.StyleMap({'default':style_cluster,'select':{fillColor:'#ffdc33',strokeColor:'#ff9933'}});if((!projection)||('4326'==projection)){projection=S3.gis.proj4326;}else{projection=new OpenLayers.Projection('EPSG:'+projection);}
+var wfsLayer=new OpenLayers.Layer.Vector(name,{maxFeatures:1000,strategies:[new OpenLayers.Strategy.BBOX({ratio:1.5}),new OpenLayers.Strategy.Cluster({distance:cluster_distance,threshold:cluster_threshold})],dir:dir,s3_layer_id:layer.id,s3_layer_type:'wfs',projection:projection,protocol:protocol,styleMap:featureClusterStyleMap});wfsLayer.title=title;wfsLayer.setVisibility(visibility);wfsLayer.events.on({'featureselected':onWfsFeatureSelect,'featureunselected':onFeatureUnselect,'loadstart':showThrobber,'loadend':hideThrobber,'loadcancel':hideThrobber});map.addLayer(wfsLayer);S3.gis.layers_all.push(wfsLayer);}
+function addWMSLayer(layer){var name=layer.name;var url=layer.url;if((undefined!=layer.username)&&(undefined!=layer.password)){var username=layer.username;var password=layer.password;url=url.replace('://','://'+username+':'+password+'@');}
+var layers=layer.layers;if(undefined!=layer.visibility){var visibility=layer.visibility;}else{var visibility=true;}
+if(undefined!=layer.dir){var dir=layer.dir;if($.inArray(dir,S3.gis.dirs)==-1){S3.gis.dirs.push(dir);}}else{var dir='';}
+if(undefined!=layer.base){var isBaseLayer=layer.base;}else{var isBaseLayer=false;}
+if(undefined!=layer.transparent){var transparent=layer.transparent;}else{var transparent=true;}
+if(undefined!=layer.format){var format=layer.format;}else{var format='image/png';}
+if(undefined!=layer.version){var version=layer.version;}else{var version='1.1.1';}
+if(undefined!=layer.map){var wms_map=layer.map;}else{var wms_map='';}
+if(undefined!=layer.style){var style=layer.style;}else{var style='';}
+if(undefined!=layer.bgcolor){var bgcolor='0x'+layer.bgcolor;}else{var bgcolor='';}
+if(undefined!=layer.buffer){var buffer=layer.buffer;}else{var buffer=0;}
+if(undefined!=layer.tiled){var tiled=layer.tiled;}else{var tiled=false;}
+if(undefined!=layer.opacity){var opacity=layer.opacity;}else{var opacity=1;}
+if(undefined!=layer.queryable){var queryable=layer.queryable;}else{var queryable=1;}
+if(undefined!=layer.legendURL){var legendURL=layer.legendURL;}else{var legendURL;}
+var wmsLayer=new OpenLayers.Layer.WMS(name,url,{layers:layers},{dir:dir,wrapDateLine:true,isBaseLayer:isBaseLayer,transparent:transparent,s3_layer_id:layer.id,s3_layer_type:'wms',queryable:queryable,visibility:visibility});if(wms_map){wmsLayer.params.MAP=wms_map;}
+if(format){wmsLayer.params.FORMAT=format;}
+if(version){wmsLayer.params.VERSION=version;}
+if(style){wmsLayer.params.STYLES=style;}
+if(bgcolor){wmsLayer.params.BGCOLOR=bgcolor;}
+if(tiled){wmsLayer.params.TILED=true;wmsLayer.params.TILESORIGIN=[map.maxExtent.left,map.maxExtent.bottom];}
+if(!isBaseLayer){wmsLayer.opacity=opacity;if(buffer){wmsLayer.buffer=buffer;}else{wmsLayer.buffer=0;}}
+if(legendURL){wmsLayer.legendURL=legendURL;}
+map.addLayer(wmsLayer);if(layer._base){map.setBaseLayer(wmsLayer);}}
+function addXYZLayer(layer){var name=layer.name;var url=[layer.url];if(undefined!=layer.url2){url.push(layer.url2);}
+if(undefined!=layer.url3){url.push(layer.url3);}
+var layername=layer.layername;if(undefined!=layer.zoomLevels){var numZoomLevels=layer.zoomLevels;}else{var numZoomLevels=19;}
+if(undefined!=layer.dir){var dir=layer.dir;if($.inArray(dir,S3.gis.dirs)==-1){S3.gis.dirs.push(dir);}}else{var dir='';}
+if(undefined!=layer.format){var format=layer.format;}else{var format='png';}
+var xyzLayer=new OpenLayers.Layer.XYZ(name,url,{dir:dir,s3_layer_id:layer.id,s3_layer_type:'xyz',layername:layername,type:format,numZoomLevels:numZoomLevels});if(undefined!=layer.attribution){xyzLayer.attribution=layer.attribution;}
+map.addLayer(xyzLayer);if(layer._base){map.setBaseLayer(xyzLayer);}}
+function showThrobber(){$('#layer_throbber').show().removeClass('hidden');S3.gis.layers_loading++;}
+function hideThrobber(){S3.gis.layers_loading--;if(S3.gis.layers_loading<=0){$('#layer_throbber').hide().addClass('hidden');}}
+function s3_gis_loadDetails(url,id,popup){$.ajax({'url':url,'success':function(data){$('#'+id).html(data);popup.updateSize();},'error':function(request,status,error){if(error=='UNAUTHORIZED'){msg=S3.i18n.gis_requires_login;}else{msg=request.responseText;}
+$('#'+id+'_contentDiv').html(msg);popup.updateSize();},'dataType':'html'});}
+function onGeojsonFeatureSelect(event){s3_gis_tooltipUnselect(event);var feature=event.feature;var popup_id=S3.uid();var centerPoint=feature.geometry.getBounds().getCenterLonLat();var data_link=false;if(feature.cluster){var name,uuid,url;var contents=S3.i18n.gis_cluster_multiple+':<ul>';for(var i=0;i<feature.cluster.length;i++){if(undefined!=feature.cluster[i].attributes.popup){name=feature.cluster[i].attributes.popup.split('<br />',1)[0];}else{name=feature.cluster[i].attributes.name;}
+if(undefined!=feature.cluster[i].attributes.url){url=feature.cluster[i].attributes.url;contents+="<li><a href='javascript:s3_gis_loadClusterPopup("+"\""+url+"\", \""+popup_id+"\""+")'>"+name+"</a></li>";}else{contents+='<li>'+name+'</li>';}}
+contents+='</ul>';contents+="<div align='center'><a href='javascript:s3_gis_zoomToSelectedFeature("+centerPoint.lon+","+centerPoint.lat+", 3)'>Zoom in</a></div>";}else{if(undefined!=feature.attributes.url){var contents=S3.i18n.gis_loading+"...<img src='"+S3.gis.ajax_loader+"' border=0 />";}else{if(undefined==feature.attributes.name){var name='';}else{var name='<h3>'+feature.attributes.name+'</h3>';};if(undefined==feature.attributes.description){var description='';}else{var description='<p>'+feature.attributes.description+'</p>';};if(undefined==feature.attributes.link){var link='';}else{var link='<a href="'+feature.attributes.link+'" target="_blank">'+feature.attributes.link+'</a>';};if(undefined==feature.attributes.data){var data='';}else if(feature.attributes.data.indexOf('http://')===0){data_link=true;var data_id=S3.uid();var data='<div id="'+data_id+'">'+S3.i18n.gis_loading+"...<img src='"+S3.gis.ajax_loader+"' border=0 />"+'</div>';}else{var data='<p>'+feature.attributes.data+'</p>';};if(undefined==feature.attributes.image){var image='';}else if(feature.attributes.image.indexOf('http://')===0){var image='<img src="'+feature.attributes.image+'" height=300 width=300>';}else{var image='';};var contents=name+description+link+data+image;}};var popup=new OpenLayers.Popup.FramedCloud(popup_id,centerPoint,new OpenLayers.Size(200,200),contents,null,true,onPopupClose);if(undefined!=feature.attributes.url){var popup_url=feature.attributes.url;s3_gis_loadDetails(popup_url,popup_id+'_contentDiv',popup);}else if(data_link){s3_gis_loadDetails(feature.attributes.data,data_id,popup);}
+feature.popup=popup;map.addPopup(popup);}
+function onGpxFeatureSelect(event){s3_gis_tooltipUnselect(event);var feature=event.feature;}
+function onKmlFeatureSelect(event){s3_gis_tooltipUnselect(event);var feature=event.feature;var popup_id=S3.uid();var centerPoint=feature.geometry.getBounds().getCenterLonLat();var titleField=feature.layer.title;var attributes=feature.attributes;var type=typeof attributes[titleField];if('object'==type){var title=attributes[titleField].value;}else{var title=attributes[titleField];}
+var body=feature.layer.body.split(' ');var content='';for(var i=0;i<body.length;i++){type=typeof attributes[body[i]];if('object'==type){var displayName=attributes[body[i]].displayName;if(displayName==''){displayName=body[i];}
+var value=attributes[body[i]].value;var row='<b>'+displayName+'</b>: '+value+'<br />';}else{var row=attributes[body[i]]+'<br />';}
+content+=row;}
+if(content.search('<script')!=-1){content='Content contained Javascript! Escaped content below.<br />'+content.replace(/</g,'<');}
+var contents='<h3>'+title+'</h3>'+content;var popup=new OpenLayers.Popup.FramedCloud(popup_id,centerPoint,new OpenLayers.Size(200,200),contents,null,true,onPopupClose);feature.popup=popup;map.addPopup(popup);}
+function onWfsFeatureSelect(event){s3_gis_tooltipUnselect(event);var feature=event.feature;var popup_id=S3.uid();var centerPoint=feature.geometry.getBounds().getCenterLonLat();var titleField=feature.layer.title;if(feature.cluster){var name;var contents=S3.i18n.gis_cluster_multiple+':<ul>';var length=Math.min(feature.cluster.length,9);for(var i=0;i<length;i++){name=feature.cluster[i].attributes[titleField];contents+='<li>'+name+'</li>';}
+contents+='</ul>';contents+="<div align='center'><a href='javascript:s3_gis_zoomToSelectedFeature("+centerPoint.lon+","+centerPoint.lat+", 3)'>Zoom in</a></div>";}else{var attributes=feature.attributes;var title=attributes[titleField];var content='';$.each(attributes,function(i,n){content+='<b>'+i+':</b> '+n+'<br />';});var contents='<h3>'+title+'</h3>'+content;}
+var popup=new OpenLayers.Popup.FramedCloud(popup_id,centerPoint,new OpenLayers.Size(200,200),contents,null,true,onPopupClose);feature.popup=popup;map.addPopup(popup);}
+function addControls(){map.addControl(new OpenLayers.Control.ScaleLine());if(S3.gis.mouse_position=='mgrs'){map.addControl(new OpenLayers.Control.MGRSMousePosition());}else if(S3.gis.mouse_position){map.addControl(new OpenLayers.Control.MousePosition());}
+map.addControl(new OpenLayers.Control.Permalink());map.addControl(new OpenLayers.Control.OverviewMap({mapOptions:S3.gis.options}));addPopupControls();}
+function addPopupControls(){S3.gis.popupControl=new OpenLayers.Control.SelectFeature(S3.gis.layers_all,{toggle:true,clickout:true,multiple:true});S3.gis.highlightControl=new OpenLayers.Control.SelectFeature(S3.gis.layers_all,{hover:true,highlightOnly:true,eventListeners:{featurehighlighted:s3_gis_tooltipSelect,featureunhighlighted:s3_gis_tooltipUnselect}});map.addControl(S3.gis.highlightControl);map.addControl(S3.gis.popupControl);S3.gis.highlightControl.activate();S3.gis.popupControl.activate();}
+function onFeatureUnselect(event){var feature=event.feature;if(feature.popup){map.removePopup(feature.popup);feature.popup.destroy();delete feature.popup;}}
+function onPopupClose(evt){while(map.popups.length){map.removePopup(map.popups[0]);}}
+function s3_gis_tooltipSelect(event){var feature=event.feature;if(feature.cluster){}else{if(feature.popup!=null){return;}
+if(S3.gis.tooltipPopup!=null){map.removePopup(S3.gis.tooltipPopup);S3.gis.tooltipPopup.destroy();if(S3.gis.lastFeature!=null){delete S3.gis.lastFeature.popup;}
+S3.gis.tooltipPopup=null;}
+S3.gis.lastFeature=feature;var centerPoint=feature.geometry.getBounds().getCenterLonLat();var attributes=feature.attributes;var tooltip;if(undefined!=attributes.popup){tooltip=attributes.popup;}else if(undefined!=attributes.name){tooltip=attributes.name;}else{var titleField=feature.layer.title;if(undefined!=titleField){var type=typeof attributes[titleField];if('object'==type){tooltip=attributes[titleField].value;}else{tooltip=attributes[titleField];}}}
+if(tooltip){S3.gis.tooltipPopup=new OpenLayers.Popup('activetooltip',centerPoint,new OpenLayers.Size(80,12),tooltip,false);}
+if(S3.gis.tooltipPopup!=null){S3.gis.tooltipPopup.contentDiv.style.backgroundColor='ffffcb';S3.gis.tooltipPopup.contentDiv.style.overflow='hidden';S3.gis.tooltipPopup.contentDiv.style.padding='3px';S3.gis.tooltipPopup.contentDiv.style.margin='10px';S3.gis.tooltipPopup.closeOnMove=true;S3.gis.tooltipPopup.autoSize=true;S3.gis.tooltipPopup.opacity=0.7;feature.popup=S3.gis.tooltipPopup;map.addPopup(S3.gis.tooltipPopup);}}}
+function s3_gis_tooltipUnselect(event){var feature=event.feature;if(feature!=null&&feature.popup!=null){map.removePopup(feature.popup);feature.popup.destroy();delete feature.popup;S3.gis.tooltipPopup=null;S3.gis.lastFeature=null;}}
+function s3_gis_loadClusterPopup(url,id){var contents=S3.i18n.gis_loading+"...<img src='"+S3.gis.ajax_loader+"' border=0 />";$('#'+id+'_contentDiv').html(contents);$.get(url,function(data){$('#'+id+'_contentDiv').html(data);map.popups[0].updateSize();},'html');}
+function s3_gis_zoomToSelectedFeature(lon,lat,zoomfactor){var lonlat=new OpenLayers.LonLat(lon,lat);var currZoom=map.getZoom();var newZoom=currZoom+zoomfactor;map.setCenter(lonlat,newZoom);for(var i=0;i<map.popups.length;i++){map.removePopup(map.popups[i]);}}
+function addGeolocateControl(toolbar){var vector=S3.gis.draftLayer;var style={fillColor:'#000',fillOpacity:0.1,strokeWidth:0};var geolocate=new OpenLayers.Control.Geolocate({geolocationOptions:{enableHighAccuracy:false,maximumAge:0,timeout:7000}});map.addControl(geolocate);geolocate.events.register('locationupdated',this,function(e){vector.removeAllFeatures();var circle=new OpenLayers.Feature.Vector(OpenLayers.Geometry.Polygon.createRegularPolygon(new OpenLayers.Geometry.Point(e.point.x,e.point.y),e.position.coords.accuracy/2,40,0),{},style);vector.addFeatures([new OpenLayers.Feature.Vector(e.point,{},{graphicName:'cross',strokeColor:'#f00',strokeWidth:2,fillOpacity:0,pointRadius:10}),circle]);map.zoomToExtent(vector.getDataExtent());s3_gis_pulsate(circle);});geolocate.events.register('locationfailed',this,function(){OpenLayers.Console.log('Location detection failed');});S3.gis.geolocateControl=geolocate;var geoLocateButton=new Ext.Toolbar.Button({iconCls:'geolocation',tooltip:S3.i18n.gis_geoLocate,handler:function(){S3.gis.draftLayer.removeAllFeatures();S3.gis.geolocateControl.activate();}});toolbar.addButton(geoLocateButton);}
+function s3_gis_pulsate(feature){var point=feature.geometry.getCentroid(),bounds=feature.geometry.getBounds(),radius=Math.abs((bounds.right-bounds.left)/2),count=0,grow='up';var resize=function(){if(count>16){clearInterval(window.resizeInterval);}
+var interval=radius*0.03;var ratio=interval/radius;switch(count){case 4:case 12:grow='down';break;case 8:grow='up';break;}
+if(grow!=='up'){ratio=-Math.abs(ratio);}
+feature.geometry.resize(1+ratio,point);S3.gis.draftLayer.drawFeature(feature);count++;};window.resizeInterval=window.setInterval(resize,50,point,radius);};function addGoogleEarthControl(toolbar){var googleEarthButton=new Ext.Toolbar.Button({iconCls:'googleearth',tooltip:S3.gis.Google.Earth,enableToggle:true,toggleHandler:function(button,state){if(state===true){S3.gis.mapPanelContainer.getLayout().setActiveItem(1);S3.gis.mapWin.items.items[0].collapse();S3.gis.googleEarthPanel.on('pluginready',function(){addGoogleEarthKmlLayers();});}else{S3.gis.mapPanelContainer.getLayout().setActiveItem(0);S3.gis.mapWin.items.items[0].expand();}}});toolbar.addSeparator();toolbar.addButton(googleEarthButton);}
+function addGoogleEarthKmlLayers(){if(S3.gis.layers_features){for(var i=0;i<S3.gis.layers_features.length;i++){var layer=S3.gis.layers_features[i];if(undefined!=layer.visibility){var visibility=layer.visibility;}else{var visibility=true;}
+if(visibility){var url=S3.public_url+layer.url.replace('geojson','kml');google.earth.fetchKml(S3.gis.googleEarthPanel.earth,url,googleEarthKmlLoaded);}}}}
+function googleEarthKmlLoaded(object){if(!object){return;}
+S3.gis.googleEarthPanel.earth.getFeatures().appendChild(object);}
+function addGoogleStreetviewControl(toolbar){var Clicker=OpenLayers.Class(OpenLayers.Control,{defaults:{pixelTolerance:1,stopSingle:true},initialize:function(options){this.handlerOptions=OpenLayers.Util.extend({},this.defaults);OpenLayers.Control.prototype.initialize.apply(this,arguments);this.handler=new OpenLayers.Handler.Click(this,{click:this.trigger},this.handlerOptions);},trigger:function(event){openStreetviewPopup(map.getLonLatFromViewPortPx(event.xy));}});S3.gis.StreetviewClicker=new Clicker({autoactivate:false});map.addControl(S3.gis.StreetviewClicker);var googleStreetviewButton=new Ext.Toolbar.Button({iconCls:'streetview',tooltip:S3.gis.Google.StreetviewButton,toggleGroup:'controls',allowDepress:true,enableToggle:true,toggleHandler:function(button,state){if(state===true){S3.gis.StreetviewClicker.activate();}else{S3.gis.StreetviewClicker.deactivate();}}});toolbar.addSeparator();toolbar.addButton(googleStreetviewButton);}
+function openStreetviewPopup(location){if(!location){location=map.getCenter();}
+if(S3.gis.sv_popup&&S3.gis.sv_popup.anc){S3.gis.sv_popup.close();}
+S3.gis.sv_popup=new GeoExt.Popup({title:S3.gis.Google.StreetviewTitle,location:location,width:300,height:300,collapsible:true,map:S3.gis.mapPanel,items:[new gxp.GoogleStreetViewPanel()]});S3.gis.sv_popup.show();}
+function addMeasureControls(toolbar){var measureSymbolizers={'Point':{pointRadius:5,graphicName:'circle',fillColor:'white',fillOpacity:1,strokeWidth:1,strokeOpacity:1,strokeColor:'#f5902e'},'Line':{strokeWidth:3,strokeOpacity:1,strokeColor:'#f5902e',strokeDashstyle:'dash'},'Polygon':{strokeWidth:2,strokeOpacity:1,strokeColor:'#f5902e',fillColor:'white',fillOpacity:0.5}};var styleMeasure=new OpenLayers.Style();styleMeasure.addRules([new OpenLayers.Rule({symbolizer:measureSymbolizers})]);var styleMapMeasure=new OpenLayers.StyleMap({'default':styleMeasure});var length=new OpenLayers.Control.Measure(OpenLayers.Handler.Path,{geodesic:true,persist:true,handlerOptions:{layerOptions:{styleMap:styleMapMeasure}}});length.events.on({'measure':function(evt){alert(S3.i18n.gis_length_message+' '+evt.measure.toFixed(2)+' '+evt.units);}});var lengthButton=new GeoExt.Action({control:length,map:map,iconCls:'measure-off',tooltip:S3.i18n.gis_length_tooltip,toggleGroup:'controls',allowDepress:true,enableToggle:true});toolbar.add(lengthButton);if(undefined===S3.gis.loc_select){var area=new OpenLayers.Control.Measure(OpenLayers.Handler.Polygon,{geodesic:true,persist:true,handlerOptions:{layerOptions:{styleMap:styleMapMeasure}}});area.events.on({'measure':function(evt){alert(S3.i18n.gis_area_message+' '+evt.measure.toFixed(2)+' '+evt.units+'2');}});var areaButton=new GeoExt.Action({control:area,map:map,iconCls:'measure-area',tooltip:S3.i18n.gis_area_tooltip,toggleGroup:'controls',allowDepress:true,enableToggle:true});toolbar.add(areaButton);}}
+function addNavigationControl(toolbar){var nav=new OpenLayers.Control.NavigationHistory();map.addControl(nav);nav.activate();var navPreviousButton=new Ext.Toolbar.Button({iconCls:'back',tooltip:S3.i18n.gis_navPrevious,handler:nav.previous.trigger});var navNextButton=new Ext.Toolbar.Button({iconCls:'next',tooltip:S3.i18n.gis_navNext,handler:nav.next.trigger});toolbar.addButton(navPreviousButton);toolbar.addButton(navNextButton);}
+function addPointControl(toolbar,point_pressed){OpenLayers.Handler.PointS3=OpenLayers.Class(OpenLayers.Handler.Point,{dblclick:function(evt){return true;},CLASS_NAME:'OpenLayers.Handler.PointS3'});S3.gis.pointButton=new GeoExt.Action({control:new OpenLayers.Control.DrawFeature(S3.gis.draftLayer,OpenLayers.Handler.PointS3,{'featureAdded':function(feature){if(S3.gis.lastDraftFeature){S3.gis.lastDraftFeature.destroy();}else if(S3.gis.draftLayer.features.length>1){S3.gis.draftLayer.features[0].destroy();}
+var centerPoint=feature.geometry.getBounds().getCenterLonLat();centerPoint.transform(S3.gis.projection_current,S3.gis.proj4326);$('#gis_location_lon').val(centerPoint.lon);$('#gis_location_lat').val(centerPoint.lat);S3.gis.lastDraftFeature=feature;}}),handler:function(){if(S3.gis.pointButton.items[0].pressed){$('.olMapViewport').addClass('crosshair');}else{$('.olMapViewport').removeClass('crosshair');}},map:map,iconCls:'drawpoint-off',tooltip:S3.i18n.gis_draw_feature,toggleGroup:'controls',allowDepress:true,enableToggle:true,pressed:point_pressed});toolbar.add(S3.gis.pointButton);}
+function addPolygonControl(toolbar,polygon_pressed){S3.gis.polygonButton=new GeoExt.Action({control:new OpenLayers.Control.DrawFeature(S3.gis.draftLayer,OpenLayers.Handler.RegularPolygon,{handlerOptions:{sides:4,snapAngle:90},'featureAdded':function(feature){if(S3.gis.lastDraftFeature){S3.gis.lastDraftFeature.destroy();}
+var WKT=feature.geometry.transform(S3.gis.projection_current,S3.gis.proj4326).toString();$('#gis_search_polygon_input').val(WKT);S3.gis.lastDraftFeature=feature;}}),handler:function(){if(S3.gis.polygonButton.items[0].pressed){$('.olMapViewport').addClass('crosshair');}else{$('.olMapViewport').removeClass('crosshair');}},map:map,iconCls:'drawpolygon-off',tooltip:S3.i18n.gis_draw_polygon,toggleGroup:'controls',allowDepress:true,pressed:polygon_pressed,enableToggle:true,activateOnEnable:true,deactivateOnDisable:true});toolbar.add(S3.gis.polygonButton);}
+function addPotlatchButton(toolbar){var potlatchButton=new Ext.Toolbar.Button({iconCls:'potlatch',tooltip:S3.i18n.gis_potlatch,handler:function(){var zoom_current=map.getZoom();if(zoom_current<14){alert(S3.gis.osm_oauth);}else{var lonlat=map.getCenter();lonlat.transform(map.getProjectionObject(),S3.gis.proj4326);var url=S3.Ap.concat('/gis/potlatch2/potlatch2.html')+'?lat='+lonlat.lat+'&lon='+lonlat.lon+'&zoom='+zoom_current;window.open(url);}}});toolbar.addSeparator();toolbar.addButton(potlatchButton);}
+function addSaveButton(toolbar){var saveButton=new Ext.Toolbar.Button({iconCls:'save',tooltip:S3.i18n.gis_save,handler:function(){var state=getState();var layersStr=Ext.util.JSON.encode(state.layers);var pluginsStr=Ext.util.JSON.encode(state.plugins);if(S3.gis.config_id){var url=S3.Ap.concat('/gis/config/'+S3.gis.config_id+'.url/update');}else{var url=S3.Ap.concat('/gis/config.url/create');}
+Ext.Ajax.request({url:url,method:'POST',success:function(response,opts){var obj=Ext.decode(response.responseText);var id=obj.message.split('=',2)[1];if(id){S3.gis.config_id=id;var url=S3.Ap.concat('/gis/config/',id,'/layer_entity')
+$('#gis_menu_config').attr('href',url);}},params:{lat:state.lat,lon:state.lon,zoom:state.zoom,layers:layersStr,plugins:pluginsStr}});}});toolbar.addSeparator();toolbar.addButton(saveButton);}
+function getState(){var state={};var lonlat=map.getCenter();lonlat.transform(map.getProjectionObject(),S3.gis.proj4326);state.lon=lonlat.lon;state.lat=lonlat.lat;state.zoom=map.getZoom();var layers=[];var layer_config;var base_id=map.baseLayer.s3_layer_id;Ext.iterate(map.layers,function(key,val,obj){var id=key.s3_layer_id;layer_config={id:id}
+if(key.visibility){layer_config['visible']=key.visibility;}
+if(id==base_id){layer_config['base']=true;}
+if(key.s3_style){layer_config['style']=key.s3_style;}
+layers.push(layer_config);});state.layers=layers;var plugins=[];Ext.iterate(S3.gis.plugins,function(key,val,obj){if(key.getState){plugins.push(key.getState());}});state.plugins=plugins;return state;}
+function addPdfControl(toolbar){selectPdfControl=new OpenLayers.Control();OpenLayers.Util.extend(selectPdfControl,{draw:function(){this.box=new OpenLayers.Handler.Box(this,{'done':this.getPdf});this.box.activate();},response:function(req){this.w.destroy();var gml=new OpenLayers.Format.GML();var features=gml.read(req.responseText);var html=features.length+' pdfs. <br /><ul>';if(features.length){for(var i=0;i<features.length;i++){var f=features[i];var text=f.attributes.utm_zone+f.attributes.grid_zone+f.attributes.grid_square+f.attributes.easting+f.attributes.northing;html+="<li><a href='"+features[i].attributes.url+"'>"+text+'</a></li>';}}
+html+='</ul>';this.w=new Ext.Window({'html':html,width:300,'title':'Results',height:200});this.w.show();},getPdf:function(bounds){var ll=map.getLonLatFromPixel(new OpenLayers.Pixel(bounds.left,bounds.bottom)).transform(S3.gis.projection_current,S3.gis.proj4326);var ur=map.getLonLatFromPixel(new OpenLayers.Pixel(bounds.right,bounds.top)).transform(S3.gis.projection_current,S3.gis.proj4326);var boundsgeog=new OpenLayers.Bounds(ll.lon,ll.lat,ur.lon,ur.lat);bbox=boundsgeog.toBBOX();OpenLayers.Request.GET({url:S3.gis.mgrs_url+'&bbox='+bbox,callback:OpenLayers.Function.bind(this.response,this)});this.w=new Ext.Window({'html':'Searching '+S3.gis.mgrs_name+', please wait.',width:200,'title':'Please Wait.'});this.w.show();}});var tooltip='Select '+S3.gis.mgrs_name;var mgrsButton=new GeoExt.Action({text:tooltip,control:selectPdfControl,map:map,toggleGroup:'controls',allowDepress:false,tooltip:tooltip});toolbar.addSeparator();toolbar.add(mgrsButton);}
+function addWMSGetFeatureInfoControl(toolbar){S3.gis.wmsGetFeatureInfo=new gxp.plugins.WMSGetFeatureInfo({actionTarget:'gis_toolbar',outputTarget:'map',outputConfig:{width:400,height:200},toggleGroup:'controls',format:"grid",infoActionTip:S3.i18n.gis_get_feature_info,popupTitle:S3.i18n.gis_feature_info});S3.gis.wmsGetFeatureInfo.target=S3.gis;S3.gis.wmsGetFeatureInfo.addActions();}
+function addRemoveLayersControl(){S3.gis.addLayersControl=new gxp.plugins.AddLayers({actionTarget:'treepanel.tbar',addActionTip:'Add layers',addActionMenuText:'Add layers',addServerText:'Add a New Server',doneText:'Done',upload:{url:null},uploadText:S3.i18n.gis_uploadlayer,relativeUploadOnly:false});var store=new GeoExt.data.LayerStore();S3.gis.addLayersControl.target=S3.gis.layerTree;S3.gis.layerTree.proxy=OpenLayers.ProxyHost;S3.gis.layerTree.layerSources={};S3.gis.layerTree.layerSources['local']=new gxp.plugins.LayerSource({title:'local',store:store});var actions=S3.gis.addLayersControl.addActions();actions[0].enable();S3.gis.removeLayerControl=new gxp.plugins.RemoveLayer({actionTarget:'treepanel.tbar',removeActionTip:'Remove layer'});S3.gis.removeLayerControl.target=S3.gis.layerTree;S3.gis.layerTree.mapPanel=S3.gis.mapPanel;S3.gis.removeLayerControl.addActions();}
+function addLayerPropertiesButton(){var layerPropertiesButton=new Ext.Toolbar.Button({iconCls:'gxp-icon-layerproperties',tooltip:S3.i18n.gis_properties,handler:function(){function isSelected(node){var selected=node.isSelected();if(selected){if(!node.leaf){return false;}else{return true;}}else{return false;}}
+var node=S3.gis.layerTree.root.findChildBy(isSelected,null,true);if(node){var layer_type=node.layer.s3_layer_type;var url=S3.Ap.concat('/gis/layer_'+layer_type+'.plain?layer_'+layer_type+'.layer_id='+node.layer.s3_layer_id+'&update=1');Ext.Ajax.request({url:url,method:'GET',success:function(response,opts){if(S3.gis.propertiesWindow){S3.gis.propertiesWindow.close();}
+if(layer_type=='feature'){var tabPanel=new Ext.TabPanel({activeTab:0,items:[{title:'Layer Properties',html:response.responseText},{title:'Filter',id:'s3_gis_layer_filter_tab',html:''}]});tabPanel.items.items[1].on('activate',function(){var search_url;Ext.iterate(S3.gis.layers_features,function(key,val,obj){if(key.id==node.layer.s3_layer_id){search_url=key.url.replace(/.geojson.+/,'/search.plain');}});Ext.get('s3_gis_layer_filter_tab').load({url:search_url,discardUrl:false,callback:function(){S3.addTooltips();S3.search.select_letter_label();},text:'Loading...',timeout:30,scripts:false});});}else{var tabPanel=new Ext.Panel({title:'Layer Properties',html:response.responseText});}
+S3.gis.propertiesWindow=new Ext.Window({width:400,layout:'fit',items:[tabPanel]});S3.gis.propertiesWindow.show();$('#plain form').submit(function(){var id=$('#plain input[name="id"]').val();var update_url=S3.Ap.concat('/gis/layer_'+layer_type+'/'+id+'.plain/update');var fields=$('#plain input');var ids=[];Ext.iterate(fields,function(key,val,obj){if(val.id&&(val.id.indexOf('gis_layer_')!=-1)){ids.push(val.id);}});var pcs=[];for(i=0;i<ids.length;i++){q=$('#'+ids[i]).serialize();if(q){pcs.push(q);}}
+q=$('#plain input[name="id"]').serialize();if(q){pcs.push(q);}
+q=$('#plain input[name="_formkey"]').serialize();if(q){pcs.push(q);}
+q=$('#plain input[name="_formname"]').serialize();if(q){pcs.push(q);}
+if(pcs.length>0){var query=pcs.join("&");$.ajax({type:'POST',url:update_url,data:query,success:function(msg){$('#plain').html(msg);}});}
+return false;})
+S3.addTooltips();S3.autocomplete('role','admin','group','gis_layer_'+layer_type+'_role_required');}});}}});var toolbar=S3.gis.layerTree.getTopToolbar();toolbar.add(layerPropertiesButton);}
\ No newline at end of file
@@ -109,6 +109,181 @@ class PRTests(unittest.TestCase):
         finally:
             db.rollback()
 
+    def testDescendants(self):
+
+        try:
+            auth.s3_impersonate("normaluser@example.com")
+            user_pe_id = auth.s3_user_pe_id(auth.user.id)
+            auth.s3_impersonate(None)
+
+            organisations = s3db.pr_get_entities(types="org_organisation", as_list=True, represent=False)
+            org1 = organisations[0]
+            org2 = organisations[1]
+            org3 = organisations[2]
+
+            # Load the hierarchy before the changes
+            s3db.pr_descendants([org1])
+
+            # org1 => org2 => org3 => user
+            s3db.pr_add_affiliation(org1, org2, role="TestOrgUnit")
+            s3db.pr_add_affiliation(org2, org3, role="TestOrgUnit")
+            s3db.pr_add_affiliation(org3, user_pe_id, role="TestStaff")
+
+            descendants = s3db.pr_descendants([org1, org2, org3])
+            self.assertTrue(org2 in descendants[org1])
+            self.assertTrue(org3 in descendants[org1])
+            self.assertTrue(org3 in descendants[org2])
+            # Persons are not included
+            self.assertFalse(user_pe_id in descendants[org1])
+            self.assertFalse(org3 in descendants)
+
+            # Same result as the full search
+            branches = s3db.pr_get_descendants(org1)
+            self.assertEqual(set(descendants[org1]),
+                             set([b for b in branches if b != user_pe_id]))
+
+            # Circular affiliation does not include the entity itself
+            s3db.pr_add_affiliation(org3, org1, role="TestOrgUnit")
+            descendants = s3db.pr_descendants([org1])
+            self.assertFalse(org1 in descendants[org1])
+            s3db.pr_remove_affiliation(org3, org1, role="TestOrgUnit")
+
+            # Removed affiliations are removed from the closure
+            s3db.pr_remove_affiliation(org2, org3, role="TestOrgUnit")
+            descendants = s3db.pr_descendants([org1])
+            self.assertTrue(org2 in descendants[org1])
+            self.assertFalse(org3 in descendants[org1])
+
+            # The hierarchy gets rebuilt if changed outside of the API
+            db.rollback()
+            descendants = s3db.pr_descendants([org1])
+            self.assertFalse(org1 in descendants and org2 in descendants[org1])
+
+        finally:
+            db.rollback()
+
+    def testDescendantsConcurrentChange(self):
+
+        try:
+            organisations = s3db.pr_get_entities(types="org_organisation", as_list=True, represent=False)
+            org1 = organisations[0]
+            org2 = organisations[1]
+            org3 = organisations[2]
+
+            # Load the hierarchy before the changes
+            s3db.pr_descendants([org1])
+
+            # Affiliation added without updating the closure, as if
+            # by another process
+            rtable = s3db.pr_role
+            atable = s3db.pr_affiliation
+            role_id = rtable.insert(pe_id=org2,
+                                    role="TestOrgUnit",
+                                    role_type=1)
+            atable.insert(role_id=role_id, pe_id=org3)
+
+            # A later change of another entity must not hide it
+            s3db.pr_add_affiliation(org1, org2, role="TestOrgUnit")
+            descendants = s3db.pr_descendants([org1])
+            self.assertTrue(org2 in descendants[org1])
+            self.assertTrue(org3 in descendants[org1])
+
+        finally:
+            db.rollback()
+
+# =============================================================================
+class PersonMatcherTests(unittest.TestCase):
+    """ Person Matcher Tests """
+
+    def testPairs(self):
+
+        import datetime
+        from eden.pr import S3PersonMatcher
+
+        try:
+            table = s3db.pr_person
+            dob = datetime.date(1970, 5, 1)
+            p1 = table.insert(first_name="Matchtest",
+                              last_name="Johnson",
+                              date_of_birth=dob)
+            p2 = table.insert(first_name="Matchtset",
+                              last_name="Jonson",
+                              date_of_birth=dob)
+            p3 = table.insert(first_name="Otherperson",
+                              last_name="Xylophone")
+
+            matcher = S3PersonMatcher()
+            matcher.sync()
+            ids = (p1, p2, p3)
+            count, pairs = matcher.pairs()
+            pairs = [pair for pair in pairs
+                     if pair[0] in ids or pair[1] in ids]
+            self.assertEqual(len(pairs), 1)
+            self.assertEqual(pairs[0][:2], (p1, p2))
+
+            # Incremental update: new similar record
+            p4 = table.insert(first_name="Matchtest",
+                              last_name="Johnsen",
+                              date_of_birth=dob)
+            matcher.sync()
+            count, pairs = matcher.pairs()
+            pairs = [pair[:2] for pair in pairs if pair[1] == p4]
+            self.assertEqual(set(pairs), set([(p1, p4), (p2, p4)]))
+
+            # Match for import
+            match = matcher.match({"first_name": "Matchtest",
+                                   "last_name": "Johnson",
+                                   "date_of_birth": dob},
+                                  threshold=90)
+            self.assertEqual(match[0], p1)
+            self.assertEqual(matcher.match({"first_name": "Nobody",
+                                            "last_name": "Xylophone"},
+                                           threshold=90),
+                             None)
+
+        finally:
+            db.rollback()
+
+    def testImportUpdate(self):
+
+        import datetime
+        from eden.pr import S3PersonMatcher
+
+        try:
+            table = s3db.pr_person
+            dob = datetime.date(1971, 6, 2)
+            p1 = table.insert(first_name="Importtest",
+                              last_name="Miller",
+                              date_of_birth=dob)
+
+            matcher = S3PersonMatcher()
+            matcher.sync()
+
+            # Records are loaded onaccept, but not scored
+            p2 = table.insert(first_name="Importtset",
+                              last_name="Miler",
+                              date_of_birth=dob)
+            matcher.update(p2)
+            self.assertEqual(matcher.version, matcher.get_version())
+            self.assertTrue(p2 in matcher.unscored)
+            match = matcher.match({"first_name": "Importtset",
+                                   "last_name": "Miler",
+                                   "date_of_birth": dob},
+                                  threshold=90)
+            self.assertEqual(match[0], p2)
+
+            # Imports don't score the pairs
+            matcher.sync(score=False)
+            self.assertFalse((p1, p2) in matcher.matches)
+            matcher.sync()
+            self.assertFalse(matcher.unscored)
+            self.assertTrue((p1, p2) in matcher.matches)
+
+            # Unchanged records are not re-loaded
+            self.assertEqual(matcher.load(table.id.belongs((p1, p2))), [])
+        finally:
+            db.rollback()
+
 # =============================================================================
 def run_suite(*test_classes):
     """ Run the test suite """
@@ -126,6 +301,7 @@ if __name__ == "__main__":
 
     run_suite(
         PRTests,
+        PersonMatcherTests,
     )
 
 # END ========================================================================
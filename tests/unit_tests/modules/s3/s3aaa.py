@@ -1238,6 +1238,65 @@ class S3HasPermissionTests(unittest.TestCase):
         # Logout
         auth.s3_impersonate(None)
 
+    def testPolicy6Cached(self):
+
+        deployment_settings.security.policy = 6
+        deployment_settings.security.acl_cache = True
+        try:
+            auth.permission = s3base.S3Permission(auth)
+            acl = auth.permission
+
+            has_permission = auth.s3_has_permission
+
+            auth.s3_impersonate("normaluser@example.com")
+            version = acl.version()
+            self.assertNotEqual(version, None)
+
+            # Role assignment invalidates the cache
+            auth.s3_assign_role(auth.user.id, self.dvi_editor, for_pe=self.org1)
+            self.assertNotEqual(acl.version(), version)
+            permitted = has_permission("update", c="dvi", f="body", table="dvi_body", record_id=self.record1)
+            self.assertTrue(permitted)
+            permitted = has_permission("update", c="dvi", f="body", table="dvi_body", record_id=self.record2)
+            self.assertFalse(permitted)
+
+            # Cached realms are the same as looked up
+            realms = auth.user.realms
+            auth.s3_set_roles()
+            self.assertEqual(auth.user.realms, realms)
+
+            # Role retraction invalidates the cache
+            version = acl.version()
+            auth.s3_retract_role(auth.user.id, self.dvi_editor, for_pe=[])
+            self.assertNotEqual(acl.version(), version)
+            permitted = has_permission("update", c="dvi", f="body", table="dvi_body", record_id=self.record1)
+            self.assertFalse(permitted)
+
+            # ACL changes invalidate the cache
+            version = acl.version()
+            acl.update_acl(self.dvi_editor, t="dvi_body",
+                           uacl=acl.READ, oacl=acl.READ)
+            self.assertNotEqual(acl.version(), version)
+
+            # Direct membership changes invalidate the cache
+            version = acl.version()
+            auth.add_membership(self.dvi_editor, auth.user.id)
+            self.assertNotEqual(acl.version(), version)
+            version = acl.version()
+            auth.del_membership(self.dvi_editor, auth.user.id)
+            self.assertNotEqual(acl.version(), version)
+
+            # Cached values can be modified without affecting the cache
+            value = acl.cached("test", lambda: {"acls": [acl.READ]})
+            value["acls"].append(acl.UPDATE)
+            value = acl.cached("test", lambda: None)
+            self.assertEqual(value, {"acls": [acl.READ]})
+
+            # Logout
+            auth.s3_impersonate(None)
+        finally:
+            deployment_settings.security.acl_cache = False
+
     def testPolicy7(self):
 
         deployment_settings.security.policy = 7
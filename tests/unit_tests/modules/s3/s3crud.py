@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#
+# S3CRUD Unit Tests
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/tests/unit_tests/modules/s3/s3crud.py
+#
+import unittest
+
+from gluon import current
+
+from s3.s3crud import S3CRUD
+
+# =============================================================================
+class S3CRUDSSPFilterTests(unittest.TestCase):
+    """ Test the foreign key filters for server-side pagination """
+
+    def setUp(self):
+
+        s3db = current.s3db
+
+        ptable = s3db.pr_person
+        self.person_id = ptable.insert(first_name="Sspfilter",
+                                       last_name="Testperson")
+        otable = s3db.org_organisation
+        self.organisation_id = otable.insert(name="Sspfilter Organisation")
+
+    def testReferenceQuery(self):
+        """ Test the query for a foreign key with a represent function """
+
+        db = current.db
+        table = current.s3db.hrm_human_resource
+        field = table.person_id
+        requires = field.requires.other
+
+        query = S3CRUD.ssp_reference_query(field, requires, "testperson")
+        self.assertNotEqual(query, None)
+        hr_id = table.insert(person_id=self.person_id,
+                             organisation_id=self.organisation_id)
+        rows = db(query).select(table.id)
+        self.assertEqual([row.id for row in rows], [hr_id])
+
+        query = S3CRUD.ssp_reference_query(field, requires, "nomatch")
+        self.assertEqual(db(query).count(), 0)
+
+        # Labels composed of multiple fields
+        query = S3CRUD.ssp_reference_query(field, requires,
+                                           "sspfilter testperson")
+        rows = db(query).select(table.id)
+        self.assertEqual([row.id for row in rows], [hr_id])
+        query = S3CRUD.ssp_reference_query(field, requires,
+                                           "sspfilter nomatch")
+        self.assertEqual(db(query).count(), 0)
+
+    def testAccessibleQuery(self):
+        """ Test that the query only matches readable records """
+
+        auth = current.auth
+        table = current.s3db.hrm_human_resource
+        field = table.person_id
+        requires = field.requires.other
+
+        query = S3CRUD.ssp_reference_query(field, requires, "testperson")
+        accessible = auth.s3_accessible_query("read", current.s3db.pr_person)
+        self.assertTrue(str(accessible) in str(query))
+
+    def testTemplateQuery(self):
+        """ Test the query for a foreign key with a label template """
+
+        from s3.s3validators import IS_ONE_OF
+
+        db = current.db
+        table = current.s3db.hrm_human_resource
+        field = table.organisation_id
+        requires = IS_ONE_OF(db, "org_organisation.id", "%(name)s")
+
+        query = S3CRUD.ssp_reference_query(field, requires, "sspfilter")
+        self.assertNotEqual(query, None)
+        hr_id = table.insert(person_id=self.person_id,
+                             organisation_id=self.organisation_id)
+        rows = db(query).select(table.id)
+        self.assertEqual([row.id for row in rows], [hr_id])
+
+    def testNoLabelFields(self):
+        """ Test fallback for validators without referenced table """
+
+        from gluon.validators import IS_IN_SET
+
+        table = current.s3db.pr_person
+        field = table.gender
+        requires = IS_IN_SET({1: "unknown", 2: "female"})
+
+        self.assertEqual(S3CRUD.ssp_reference_query(field, requires, "x"),
+                         None)
+        options = S3CRUD.ssp_label_index(field, requires)
+        self.assertTrue((str(2), "female") in options or (2, "female") in options)
+
+    def tearDown(self):
+
+        current.db.rollback()
+
+# =============================================================================
+def run_suite(*test_classes):
+    """ Run the test suite """
+
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite()
+    for test_class in test_classes:
+        tests = loader.loadTestsFromTestCase(test_class)
+        suite.addTests(tests)
+    if suite is not None:
+        unittest.TextTestRunner(verbosity=2).run(suite)
+    return
+
+if __name__ == "__main__":
+
+    run_suite(
+        S3CRUDSSPFilterTests,
+    )
+
+# END ========================================================================
@@ -0,0 +1,33 @@
+
+s3gis_tests = load_module("tests.unit_tests.modules.s3.s3gis")
+s3gis = s3gis_tests.s3gis
+
+def test_insert_locations():
+    gis = s3gis.GIS()
+    table = s3db.gis_location
+    try:
+        parent = table.insert(name = "Test Bulk Parent", level = "L3")
+        gis.update_location_tree(parent)
+
+        records = [dict(name = "Test Bulk %s" % i,
+                        level = "L4",
+                        lat = float(i),
+                        lon = float(i),
+                        parent = parent)
+                   for i in xrange(5)]
+        gis._insert_locations(records)
+
+        query = (table.parent == parent)
+        rows = db(query).select(table.id, table.uuid, table.path)
+        assert len(rows) == 5
+        # Defaults are applied
+        assert len(set([row.uuid for row in rows])) == 5
+        assert all([row.path is None for row in rows])
+
+        # Paths are set from the parent paths
+        gis._update_location_paths("L4")
+        rows = db(query).select(table.id, table.path)
+        for row in rows:
+            assert row.path == "%s/%s" % (parent, row.id)
+    finally:
+        db.rollback()
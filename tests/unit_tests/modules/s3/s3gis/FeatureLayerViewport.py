@@ -0,0 +1,77 @@
+
+s3gis_tests = load_module("tests.unit_tests.modules.s3.s3gis")
+s3gis = s3gis_tests.s3gis
+
+def test_parse_bbox():
+    GIS = s3gis.GIS
+    assert GIS.parse_bbox("-10,-5.5,10,5.5") == (-10.0, -5.5, 10.0, 5.5)
+    assert GIS.parse_bbox("10,0,-10,5") is None
+    assert GIS.parse_bbox("1,2,3") is None
+    assert GIS.parse_bbox("a,b,c,d") is None
+    assert GIS.parse_bbox(None) is None
+
+def test_feature_layer_query_date_line():
+    gis = s3gis.GIS()
+    ltable = s3db.gis_location
+    otable = s3db.org_organisation
+    ftable = s3db.org_office
+    try:
+        organisation_id = otable.insert(name = "Test Date Line Organisation")
+        office_ids = []
+        for lon in (179.5, -179.5, 0.0):
+            location_id = ltable.insert(name = "Test Date Line %s" % lon,
+                                        lat = 0.0,
+                                        lon = lon)
+            office_ids.append(ftable.insert(name = "Test Date Line %s" % lon,
+                                            organisation_id = organisation_id,
+                                            location_id = location_id))
+
+        # Viewport across the Date Line, from either side
+        for bbox in ((179.0, -1.0, 181.0, 1.0),
+                     (-181.0, -1.0, -179.0, 1.0),
+                     (539.0, -1.0, 541.0, 1.0)):
+            resource = s3mgr.define_resource("org", "office", id=office_ids)
+            resource.add_filter(gis.get_feature_layer_query(resource, None, bbox))
+            ids = [row.id for row in resource.select(ftable.id)]
+            assert sorted(ids) == sorted(office_ids[:2])
+    finally:
+        db.rollback()
+
+def test_feature_clusters():
+    gis = s3gis.GIS()
+    ltable = s3db.gis_location
+    otable = s3db.org_organisation
+    ftable = s3db.org_office
+    settings = current.deployment_settings
+    try:
+        organisation_id = otable.insert(name = "Test Cluster Organisation")
+        office_ids = []
+        # Two groups of offices, far apart
+        for i in xrange(10):
+            lat = i < 5 and 10.0 or -10.0
+            location_id = ltable.insert(name = "Test Cluster Location %s" % i,
+                                        lat = lat + i * 0.001,
+                                        lon = 20.0)
+            office_ids.append(ftable.insert(name = "Test Cluster Office %s" % i,
+                                            organisation_id = organisation_id,
+                                            location_id = location_id))
+
+        resource = s3mgr.define_resource("org", "office", id=office_ids)
+        query = gis.get_feature_layer_query(resource, None,
+                                            (0.0, 0.0, 30.0, 30.0))
+        assert query is not None
+        resource.add_filter(query)
+        assert resource.count() == 5
+
+        resource = s3mgr.define_resource("org", "office", id=office_ids)
+        with s3gis_tests.Change(settings.gis, {"cluster_zoom": 8,
+                                               "cluster_threshold": 1}):
+            clusters = gis.get_feature_clusters(resource, None, 2)
+            assert clusters is not None
+            assert len(clusters) == 2
+            assert sorted([c.count for c in clusters]) == [5, 5]
+
+            # No clustering when zoomed in
+            assert gis.get_feature_clusters(resource, None, 12) is None
+    finally:
+        db.rollback()
@@ -0,0 +1,109 @@
+
+s3gis_tests = load_module("tests.unit_tests.modules.s3.s3gis")
+s3gis = s3gis_tests.s3gis
+
+import os
+import shutil
+import tempfile
+import time
+
+from gluon.storage import Storage
+
+def layer_request(folder, layer_id, **get_vars):
+    get_vars["layer"] = layer_id
+    return Storage(folder = folder,
+                   resource = s3mgr.define_resource("org", "office"),
+                   get_vars = Storage(get_vars),
+                   representation = "geojson",
+                   component_name = None,
+                   id = None,
+                   http = "GET")
+
+def test_layer_cache():
+    folder = tempfile.mkdtemp()
+    ltable = s3db.gis_location
+    otable = s3db.org_organisation
+    ftable = s3db.org_office
+    try:
+        r = layer_request(folder, 1, bbox="0,0,10,10")
+        cache = s3gis.S3LayerCache(r)
+
+        # Cache busters don't change the key, other variables do
+        assert s3gis.S3LayerCache(layer_request(folder, 1, bbox="0,0,10,10",
+                                                _dc="123")).key == cache.key
+        assert s3gis.S3LayerCache(layer_request(folder, 2, bbox="0,0,10,10")).key != cache.key
+
+        # Viewports are snapped to tiles
+        assert s3gis.S3LayerCache(layer_request(folder, 1, bbox="1,1,11,11")).key == cache.key
+        assert s3gis.S3LayerCache(layer_request(folder, 1, bbox="0,0,5,5")).key != cache.key
+        assert s3gis.S3LayerCache(layer_request(folder, 1, bbox="20,0,30,10")).key != cache.key
+
+        # The zoom level only counts where the layer gets clustered
+        cluster_zoom = current.deployment_settings.get_gis_cluster_zoom()
+        if cluster_zoom is not None:
+            zoomed_in = [s3gis.S3LayerCache(layer_request(folder, 1,
+                                                          bbox="0,0,10,10",
+                                                          zoom=zoom)).key
+                         for zoom in (cluster_zoom, cluster_zoom + 2)]
+            assert zoomed_in == [cache.key, cache.key]
+            assert s3gis.S3LayerCache(layer_request(folder, 1,
+                                                    bbox="0,0,10,10",
+                                                    zoom=cluster_zoom - 1)).key != cache.key
+
+        assert cache.get() is None
+        cache.store("{}")
+        assert cache.get() == "{}"
+        version = cache.version()[0]
+
+        # Same data => same version, still cached
+        cache = s3gis.S3LayerCache(r)
+        assert cache.version()[0] == version
+        assert cache.get() == "{}"
+
+        # New record => new version, old entry gets replaced
+        organisation_id = otable.insert(name = "Test Layer Cache Organisation")
+        location_id = ltable.insert(name = "Test Layer Cache Location",
+                                    lat = 5.0, lon = 5.0)
+        ftable.insert(name = "Test Layer Cache Office",
+                      organisation_id = organisation_id,
+                      location_id = location_id)
+        cache = s3gis.S3LayerCache(r)
+        assert cache.version()[0] != version
+        assert cache.get() is None
+        cache.store("{\"type\": \"FeatureCollection\"}")
+        files = os.listdir(os.path.join(folder, "cache", "layers"))
+        assert len(files) == 1
+    finally:
+        db.rollback()
+        shutil.rmtree(folder)
+
+def test_snap_bbox():
+    GIS = s3gis.GIS
+    assert GIS.snap_bbox((0.0, 0.0, 10.0, 10.0)) == (0.0, 0.0, 16.0, 16.0)
+    assert GIS.snap_bbox((1.0, 1.0, 11.0, 11.0)) == (0.0, 0.0, 16.0, 16.0)
+    assert GIS.snap_bbox((-3.0, 85.0, 3.0, 89.0)) == (-4.0, 84.0, 4.0, 90.0)
+
+def test_layer_cache_eviction():
+    folder = tempfile.mkdtemp()
+    max_size = s3gis.S3LayerCache.MAX_SIZE
+    try:
+        s3gis.S3LayerCache.MAX_SIZE = 25
+        layers = os.path.join(folder, "cache", "layers")
+        for i in xrange(3):
+            cache = s3gis.S3LayerCache(layer_request(folder, i + 1,
+                                                     bbox="0,0,10,10"))
+            cache.store("x" * 10)
+        # Only the most recent entries within MAX_SIZE are kept
+        assert len(os.listdir(layers)) == 2
+        assert cache.get() == "x" * 10
+
+        # Entries which haven't been used for MAX_AGE get removed
+        old = os.path.join(layers, "old-entry.geojson")
+        open(old, "wb").write("{}")
+        expired = time.time() - s3gis.S3LayerCache.MAX_AGE - 60
+        os.utime(old, (expired, expired))
+        cache.store("x" * 10)
+        assert not os.path.exists(old)
+    finally:
+        s3gis.S3LayerCache.MAX_SIZE = max_size
+        shutil.rmtree(folder)
@@ -0,0 +1,108 @@
+
+s3gis_tests = load_module("tests.unit_tests.modules.s3.s3gis")
+s3gis = s3gis_tests.s3gis
+
+def test_point_grid():
+    points = [(1, 10.0, 179.99, "A"),
+              (2, 10.0, -179.99, "B"),  # across the date line
+              (3, 10.3, 179.99, "C"),   # ~33km north of 1
+              (4, 89.9, 0.0, "D"),
+              (5, 89.9, 180.0, "E")]    # ~22km across the pole
+    grid = s3gis.S3PointGrid(points)
+    assert len(grid) == 5
+
+    pairs = dict([((id1, id2), dist) for id1, id2, dist in grid.pairs(50)])
+    assert set(pairs.keys()) == set([(1, 2), (1, 3), (2, 3), (4, 5)])
+    assert 2.0 < pairs[(1, 2)] < 2.5
+    assert 33.0 < pairs[(1, 3)] < 34.0
+
+    near = dict(grid.near(10.0, 179.99, 10))
+    assert set(near.keys()) == set([1, 2])
+    assert near[1] == 0.0
+
+def test_location_duplicates():
+    gis = s3gis.GIS()
+    table = s3db.gis_location
+    try:
+        l1 = table.insert(name = "Test Duplicate Village",
+                          lat = -45.123, lon = 100.456)
+        l2 = table.insert(name = "Test Duplicate Vilage",
+                          lat = -45.124, lon = 100.457)
+        l3 = table.insert(name = "Test Other Place",
+                          lat = -45.2, lon = 100.4)
+
+        count, pairs = gis.get_location_duplicates(distance = 50)
+        ids = (l1, l2, l3)
+        pairs = [(id1, id2) for id1, name1, id2, name2, dist in pairs
+                 if id1 in ids or id2 in ids]
+        assert len(pairs) == 3
+        # Most similar names first
+        assert pairs[0] == (l1, l2)
+
+        assert gis.get_location_duplicate("test duplicate village",
+                                          -45.1235, 100.4565) == l1
+        assert gis.get_location_duplicate("Test Other Place",
+                                          -45.123, 100.456) is None
+    finally:
+        db.rollback()
+        gis.invalidate_spatial_index()
+
+def test_point_grid_update():
+    grid = s3gis.S3PointGrid([(1, 10.0, 20.0, "A"),
+                              (2, 10.1, 20.1, "B")])
+    grid.add(3, 10.05, 20.05, "C")
+    assert set(dict(grid.near(10.0, 20.0, 20)).keys()) == set([1, 2, 3])
+
+    # Moved points get removed from their old cell
+    grid.remove(2)
+    grid.add(2, -10.0, -20.0, "B")
+    assert set(dict(grid.near(10.0, 20.0, 20)).keys()) == set([1, 3])
+    assert dict(grid.near(-10.0, -20.0, 1)).keys() == [2]
+
+    grid.remove(2)
+    grid.remove(4)
+    assert len(grid) == 2
+    assert grid.near(-10.0, -20.0, 1) == []
+
+def test_location_grid_update():
+    gis = s3gis.GIS()
+    table = s3db.gis_location
+    try:
+        grid = gis.get_location_grid()
+
+        # Own inserts update the grid in-place rather than rebuilding it
+        l1 = table.insert(name = "Test Grid Village",
+                          lat = -45.123, lon = 100.456)
+        gis.update_spatial_index(l1)
+        assert gis.get_location_grid() is grid
+        assert gis.get_location_duplicate("test grid village",
+                                          -45.1235, 100.4565) == l1
+
+        # Other changes make the grid rebuild
+        l2 = table.insert(name = "Test Grid Town",
+                          lat = -45.3, lon = 100.3)
+        assert gis.get_location_grid() is not grid
+        assert gis.get_location_duplicate("test grid town",
+                                          -45.3, 100.3) == l2
+    finally:
+        db.rollback()
+        gis.invalidate_spatial_index()
+
+def test_location_duplicates_limit():
+    gis = s3gis.GIS()
+    table = s3db.gis_location
+    size = s3gis.GIS.LOCATION_DUPLICATES
+    try:
+        s3gis.GIS.LOCATION_DUPLICATES = 2
+        for i in xrange(4):
+            table.insert(name = "Test Limit Village %s" % i,
+                         lat = -60.0 + i * 0.001, lon = 10.0)
+        count, pairs = gis.get_location_duplicates(distance = 50)
+        assert count == 2
+        assert len(pairs) == 2
+        # The closest pairs (of the same similarity) come first
+        assert max([pair[4] for pair in pairs]) < 0.2
+    finally:
+        s3gis.GIS.LOCATION_DUPLICATES = size
+        db.rollback()
+        gis.invalidate_spatial_index()
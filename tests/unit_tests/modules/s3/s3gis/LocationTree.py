@@ -0,0 +1,35 @@
+
+s3gis_tests = load_module("tests.unit_tests.modules.s3.s3gis")
+s3gis = s3gis_tests.s3gis
+
+def test_rebuild_location_tree():
+    gis = s3gis.GIS()
+    table = s3db.gis_location
+    try:
+        l0 = table.insert(name = "Test Tree L0", level = "L0")
+        l1 = table.insert(name = "Test Tree L1", level = "L1", parent = l0)
+        l2 = table.insert(name = "Test Tree L2", level = "L2", parent = l1,
+                          lat = 10.0, lon = 20.0)
+        orphan = table.insert(name = "Test Tree Orphan", parent = 999999999)
+        # Cycle
+        c1 = table.insert(name = "Test Tree C1")
+        c2 = table.insert(name = "Test Tree C2", parent = c1)
+        db(table.id == c1).update(parent = c2)
+
+        updated = gis.rebuild_location_tree()
+        assert updated >= 5
+
+        query = table.id.belongs((l0, l1, l2, orphan, c1, c2))
+        rows = db(query).select(table.ALL).as_dict()
+        assert rows[l0]["path"] == str(l0)
+        assert rows[l1]["path"] == "%s/%s" % (l0, l1)
+        assert rows[l2]["path"] == "%s/%s/%s" % (l0, l1, l2)
+        assert rows[orphan]["path"] == str(orphan)
+        assert rows[c2]["path"] in ("%s/%s" % (c1, c2), str(c2))
+
+        # Point WKT and bounds from lat/lon
+        assert rows[l2]["wkt"] == "POINT(20.0 10.0)"
+        assert rows[l2]["lat_min"] == rows[l2]["lat_max"] == 10.0
+        assert rows[l2]["lon_min"] == rows[l2]["lon_max"] == 20.0
+    finally:
+        db.rollback()
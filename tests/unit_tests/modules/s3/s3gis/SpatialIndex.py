@@ -0,0 +1,95 @@
+
+s3gis_tests = load_module("tests.unit_tests.modules.s3.s3gis")
+s3gis = s3gis_tests.s3gis
+
+import random
+
+def intersecting(items, box):
+    lon_min, lat_min, lon_max, lat_max = box
+    return sorted([item[4] for item in items
+                   if item[0] <= lon_max and item[2] >= lon_min and
+                      item[1] <= lat_max and item[3] >= lat_min])
+
+def test_empty_index():
+    index = s3gis.S3SpatialIndex([])
+    assert len(index) == 0
+    assert index.query(-180, -90, 180, 90) == []
+
+def test_index_query():
+    random.seed(1)
+    items = []
+    for i in xrange(2000):
+        lon = random.uniform(-180, 170)
+        lat = random.uniform(-90, 80)
+        # Mix of points and boxes
+        size = random.choice((0, random.uniform(0, 10)))
+        items.append((lon, lat, lon + size, lat + size, i))
+    index = s3gis.S3SpatialIndex(items, node_capacity=4)
+    assert len(index) == len(items)
+
+    for i in xrange(50):
+        lon = random.uniform(-180, 170)
+        lat = random.uniform(-90, 80)
+        size = random.uniform(0, 20)
+        box = (lon, lat, lon + size, lat + size)
+        assert sorted(index.query(*box)) == intersecting(items, box)
+
+    # Points on the edge of the box are included
+    index = s3gis.S3SpatialIndex([(1, 1, 1, 1, "edge")])
+    assert index.query(0, 0, 1, 1) == ["edge"]
+    assert index.query(1.5, 1.5, 2, 2) == []
+
+def test_get_location_ids_by_shape():
+    if not s3gis.SHAPELY:
+        return
+    gis = s3gis.GIS()
+    table = s3db.gis_location
+    try:
+        square = table.insert(name = "Test Square",
+                              wkt = "POLYGON((0 0,10 0,10 10,0 10,0 0))",
+                              lon_min = 0, lat_min = 0,
+                              lon_max = 10, lat_max = 10)
+        inside = table.insert(name = "Test Inside", lat = 5, lon = 5)
+        outside = table.insert(name = "Test Outside", lat = 15, lon = 5)
+        gis.invalidate_spatial_index()
+
+        shape = s3gis.wkt_loads("POLYGON((1 1,9 1,9 9,1 9,1 1))")
+        location_ids = gis.get_location_ids_by_shape(shape)
+        assert square in location_ids
+        assert inside in location_ids
+        assert outside not in location_ids
+
+        # Points without WKT can be excluded
+        location_ids = gis.get_location_ids_by_shape(shape, points=False)
+        assert square in location_ids
+        assert inside not in location_ids
+
+        # Index gets rebuilt after invalidation (as in onaccept)
+        table[outside] = dict(lat = 5)
+        gis.invalidate_spatial_index()
+        location_ids = gis.get_location_ids_by_shape(shape)
+        assert outside in location_ids
+
+        # Point lookup
+        location_ids = [row.id for row in gis.get_features_by_latlon(2, 2)]
+        assert square in location_ids
+    finally:
+        db.rollback()
+        gis.invalidate_spatial_index()
+
+def test_spatial_index_check():
+    gis = s3gis.GIS()
+    table = s3db.gis_location
+    try:
+        index = gis.get_spatial_index()
+
+        # Changes which bypass the onaccept (e.g. by other processes)...
+        table.insert(name = "Test Point", lat = 5, lon = 5)
+        assert gis.get_spatial_index() is index
+
+        # ...are picked up with the next check
+        s3gis.GIS.SPATIAL_INDEX.checked -= s3gis.GIS.SPATIAL_INDEX_CHECK
+        assert gis.get_spatial_index() is not index
+    finally:
+        db.rollback()
+        gis.invalidate_spatial_index()
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+#
+# Import Job Unit Tests
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/tests/unit_tests/modules/s3/s3import.py
+#
+import unittest
+
+from lxml import etree
+
+# =============================================================================
+class S3ImportJobTests(unittest.TestCase):
+
+    TREE = """<?xml version="1.0"?>
+<s3xml>
+    <resource name="org_office" uuid="TESTIMPORTOFFICE1">
+        <data field="name">Test Office 1</data>
+        <reference field="organisation_id" resource="org_organisation" uuid="TESTIMPORTORG1"/>
+    </resource>
+    <resource name="org_office" uuid="TESTIMPORTOFFICE2">
+        <data field="name">Test Office 2</data>
+        <reference field="organisation_id" resource="org_organisation" tuid="TESTIMPORTORG2"/>
+    </resource>
+    <resource name="org_organisation" uuid="TESTIMPORTORG1">
+        <data field="name">Test Organisation 1</data>
+    </resource>
+    <resource name="org_organisation" tuid="TESTIMPORTORG2">
+        <data field="name">Test Organisation 2</data>
+    </resource>
+</s3xml>"""
+
+    def setUp(self):
+
+        self.tree = etree.ElementTree(etree.fromstring(self.TREE))
+        self.table = s3db.org_office
+
+    def testUIDMap(self):
+
+        xml = s3mgr.xml
+        job = s3base.S3ImportJob(s3mgr, self.table, tree=self.tree)
+        uidmap = job.uidmap
+
+        self.assertNotEqual(uidmap, None)
+        self.assertEqual(len(uidmap), 4)
+        key = ("org_organisation", xml.UID, "TESTIMPORTORG1")
+        self.assertTrue(key in uidmap)
+        self.assertEqual(uidmap[key].get(xml.UID), "TESTIMPORTORG1")
+        key = ("org_organisation", xml.ATTRIBUTE.tuid, "TESTIMPORTORG2")
+        self.assertTrue(key in uidmap)
+
+    def testLookahead(self):
+
+        xml = s3mgr.xml
+        table = self.table
+        job = s3base.S3ImportJob(s3mgr, table, tree=self.tree)
+
+        elements = xml.select_resources(self.tree, "org_office")
+        self.assertEqual(len(elements), 2)
+
+        # Reference by UID
+        references = job.lookahead(elements[0],
+                                   table=table,
+                                   fields=["organisation_id"],
+                                   tree=self.tree,
+                                   directory=job.directory)
+        self.assertEqual(len(references), 1)
+        entry = references[0].entry
+        self.assertEqual(entry.tablename, "org_organisation")
+        self.assertEqual(entry.uid, "TESTIMPORTORG1")
+        self.assertNotEqual(entry.element, None)
+
+        # Reference by TUID
+        references = job.lookahead(elements[1],
+                                   table=table,
+                                   fields=["organisation_id"],
+                                   tree=self.tree,
+                                   directory=job.directory)
+        self.assertEqual(len(references), 1)
+        entry = references[0].entry
+        self.assertEqual(entry.uid, "TESTIMPORTORG2")
+        self.assertNotEqual(entry.element, None)
+
+    def testAddItem(self):
+
+        xml = s3mgr.xml
+        job = s3base.S3ImportJob(s3mgr, self.table, tree=self.tree)
+
+        elements = xml.select_resources(self.tree, "org_office")
+        for element in elements:
+            job.add_item(element=element)
+
+        # Referenced organisations are added as items too
+        tablenames = [item.tablename for item in job.items.values()]
+        self.assertEqual(tablenames.count("org_office"), 2)
+        self.assertEqual(tablenames.count("org_organisation"), 2)
+
+    def testBulkCommit(self):
+
+        xml = s3mgr.xml
+        job = s3base.S3ImportJob(s3mgr, self.table, tree=self.tree)
+
+        elements = xml.select_resources(self.tree, "org_office")
+        for element in elements:
+            job.add_item(element=element)
+
+        auth.override = True
+        try:
+            success = job.commit(bulk=True)
+            self.assertTrue(success)
+            self.assertEqual(job.error, None)
+
+            # All items written, with their references resolved
+            for item in job.items.values():
+                self.assertTrue(item.committed)
+                self.assertTrue(item.id)
+                self.assertEqual(item.deferred, None)
+
+            otable = s3db.org_organisation
+            ftable = s3db.org_office
+            query = (ftable.uuid == "TESTIMPORTOFFICE1") & \
+                    (otable.id == ftable.organisation_id)
+            row = db(query).select(otable.uuid, limitby=(0, 1)).first()
+            self.assertNotEqual(row, None)
+            self.assertEqual(row.uuid, "TESTIMPORTORG1")
+            query = (ftable.name == "Test Office 2") & \
+                    (otable.id == ftable.organisation_id)
+            row = db(query).select(otable.name, limitby=(0, 1)).first()
+            self.assertNotEqual(row, None)
+            self.assertEqual(row.name, "Test Organisation 2")
+        finally:
+            auth.override = False
+            db.rollback()
+
+# =============================================================================
+def run_suite(*test_classes):
+    """ Run the test suite """
+
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite()
+    for test_class in test_classes:
+        tests = loader.loadTestsFromTestCase(test_class)
+        suite.addTests(tests)
+    if suite is not None:
+        unittest.TextTestRunner(verbosity=2).run(suite)
+    return
+
+if __name__ == "__main__":
+
+    run_suite(
+        S3ImportJobTests,
+    )
+
+# END ========================================================================
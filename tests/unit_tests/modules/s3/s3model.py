@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+#
+# Model Loader Unit Tests
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/tests/unit_tests/modules/s3/s3model.py
+#
+import unittest
+
+from s3.s3model import S3Model
+
+# =============================================================================
+class S3ModelIndexTests(unittest.TestCase):
+
+    def testIndex(self):
+
+        index = S3Model.index("org")
+        self.assertNotEqual(index, None)
+        self.assertEqual(index.names["org_office"], "S3OfficeModel")
+        self.assertEqual(index.names["org_site_id"], "S3SiteModel")
+        self.assertTrue("org_organisation_represent" in index.exports)
+
+        # Built only once
+        self.assertTrue(S3Model.index("org") is index)
+
+    def testIndexUndefinedModule(self):
+
+        self.assertEqual(S3Model.index("nonexistent"), None)
+
+    def testTable(self):
+
+        table = S3Model.table("org_office")
+        self.assertNotEqual(table, None)
+        self.assertEqual(table._tablename, "org_office")
+        self.assertTrue(s3db.org_office is table)
+
+        self.assertEqual(S3Model.table("org_nonexistent"), None)
+        self.assertRaises(AttributeError, s3db.__getitem__, "org_nonexistent")
+
+    def testGet(self):
+
+        represent = S3Model.get("org_organisation_represent")
+        self.assertTrue(callable(represent))
+        self.assertEqual(S3Model.get("org_nonexistent"), None)
+
+# =============================================================================
+def run_suite(*test_classes):
+    """ Run the test suite """
+
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite()
+    for test_class in test_classes:
+        tests = loader.loadTestsFromTestCase(test_class)
+        suite.addTests(tests)
+    if suite is not None:
+        unittest.TextTestRunner(verbosity=2).run(suite)
+    return
+
+if __name__ == "__main__":
+
+    run_suite(
+        S3ModelIndexTests,
+    )
+
+# END ========================================================================
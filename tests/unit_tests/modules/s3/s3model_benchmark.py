@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+#
+# Model Loader Benchmarks
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/tests/unit_tests/modules/s3/s3model_benchmark.py
+#
+# Measures the one-time cost of indexing the model modules (startup),
+# and the cost of finding the model class for a name with the index
+# compared to scanning the module (request time), for the names which
+# a cold request to a controller with many tables has to resolve.
+#
+import time
+
+from gluon import current
+
+from s3.s3model import S3Model
+
+# =============================================================================
+class S3ModelBenchmark(object):
+    """ Benchmark for the model class lookup in S3Model.table/get """
+
+    def __init__(self, prefixes=("org", "pr", "gis", "hrm", "inv", "req",
+                                 "supply", "project", "msg", "doc"),
+                 repeat=100):
+        """
+            Constructor
+
+            @param prefixes: the model modules to use
+            @param repeat: how often to repeat the lookups
+        """
+
+        self.prefixes = prefixes
+        self.repeat = repeat
+
+    # -------------------------------------------------------------------------
+    def names(self):
+        """ All names defined by model classes in the modules """
+
+        names = []
+        for prefix in self.prefixes:
+            index = S3Model.index(prefix)
+            if index is not None:
+                names.extend(sorted(index.names.keys()))
+        return names
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def scan(name):
+        """
+            Find the model class for a name by scanning the module,
+            as S3Model.table/get used to do for every lookup
+
+            @param name: the table name or response.s3 name
+        """
+
+        prefix = name.split("_", 1)[0]
+        models = current.models
+        if hasattr(models, prefix):
+            module = models.__dict__[prefix]
+            for n in module.__all__:
+                model = module.__dict__[n]
+                if type(model).__name__ == "type" and \
+                   hasattr(model, "names") and name in model.names:
+                    return n
+        return None
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def lookup(name):
+        """
+            Find the model class for a name in the index
+
+            @param name: the table name or response.s3 name
+        """
+
+        index = S3Model.index(name.split("_", 1)[0])
+        if index is not None:
+            return index.names.get(name)
+        return None
+
+    # -------------------------------------------------------------------------
+    def run(self):
+        """ Run the benchmark """
+
+        # Startup: index all modules
+        S3Model.INDEX.clear()
+        start = time.time()
+        for prefix in self.prefixes:
+            S3Model.index(prefix)
+        startup = time.time() - start
+
+        names = self.names()
+        print "Indexed %s modules with %s names in %.3f ms" % \
+              (len(self.prefixes), len(names), startup * 1000)
+
+        # Request time: resolve all names
+        results = []
+        for label, find in (("scan", self.scan), ("index", self.lookup)):
+            start = time.time()
+            for i in xrange(self.repeat):
+                for name in names:
+                    find(name)
+            duration = (time.time() - start) / self.repeat
+            results.append((label, duration))
+
+        print "%8s %16s %16s" % ("lookup", "ms/request", "us/name")
+        for label, duration in results:
+            print "%8s %16.3f %16.3f" % (label,
+                                         duration * 1000,
+                                         duration * 1000000 / len(names))
+
+        # Cold request: define the tables of the request
+        tables = [name for name in names if name not in response.s3][:40]
+        start = time.time()
+        for tablename in tables:
+            s3db.table(tablename)
+        duration = time.time() - start
+        print "Loaded %s tables in %.3f ms" % (len(tables), duration * 1000)
+
+# =============================================================================
+if __name__ == "__main__":
+
+    benchmark = S3ModelBenchmark()
+    benchmark.run()
+
+# END ========================================================================
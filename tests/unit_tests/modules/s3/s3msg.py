@@ -0,0 +1,569 @@
+# -*- coding: utf-8 -*-
+#
+# S3Msg Unit Tests
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/tests/unit_tests/modules/s3/s3msg.py
+#
+import asyncore
+import smtpd
+import threading
+import unittest
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+from gluon import current
+
+from s3.s3msg import S3Msg, S3MsgDispatcher
+
+# =============================================================================
+class S3MsgNameKeyTests(unittest.TestCase):
+    """ Test the phonetic name keys for the message parser """
+
+    def setUp(self):
+
+        s3db = current.s3db
+
+        table = s3db.pr_person
+        self.person_id = table.insert(first_name="Pfonetyk",
+                                      last_name="Testperson")
+        S3Msg.update_name_keys("pr_person", self.person_id)
+
+        table = s3db.org_organisation
+        self.organisation_id = table.insert(name="Qwertzuiop Relief",
+                                            acronym="QZR")
+        S3Msg.update_name_keys("org_organisation", self.organisation_id)
+
+    def testPhoneticKey(self):
+        """ Test phonetic keys """
+
+        phonetic_key = S3Msg.phonetic_key
+        self.assertEqual(phonetic_key("Robert"), phonetic_key("Rupert"))
+        self.assertEqual(phonetic_key(u"Jos\xe9"), phonetic_key("Jose"))
+        self.assertEqual(phonetic_key("1234"), None)
+        self.assertEqual(phonetic_key(None), None)
+
+    def testFindByName(self):
+        """ Test lookup of records by name """
+
+        s3db = current.s3db
+        table = s3db.pr_person
+
+        row = S3Msg.find_by_name("pr_person", "pfonetik", [table.pe_id])
+        self.assertNotEqual(row, None)
+        self.assertEqual(row.id, self.person_id)
+        self.assertTrue("pe_id" in row)
+
+        row = S3Msg.find_by_name("org_organisation", "qwertzuiop")
+        self.assertEqual(row.id, self.organisation_id)
+
+        # Renamed => old key does not match any more
+        table[self.person_id] = dict(first_name="Renamed")
+        S3Msg.update_name_keys("pr_person", self.person_id)
+        row = S3Msg.find_by_name("pr_person", "pfonetik")
+        self.assertTrue(row is None or row.id != self.person_id)
+
+    def testBackfill(self):
+        """ Test that records without keys get them with the first lookup """
+
+        db = current.db
+        s3db = current.s3db
+        ktable = s3db.msg_name_key
+
+        # An existing database: one record got keys onaccept, the other
+        # one has been created before the keys were introduced
+        table = s3db.pr_person
+        old_id = table.insert(first_name="Backfil",
+                              last_name="Testperson")
+        query = (ktable.tablename == "pr_person") & \
+                ((ktable.record_id == old_id) | (ktable.record_id == None))
+        db(query).delete()
+        S3Msg.NAME_KEYS = {}
+
+        row = S3Msg.find_by_name("pr_person", "backfill")
+        self.assertNotEqual(row, None)
+        self.assertEqual(row.id, old_id)
+
+        # Only once
+        query = (ktable.tablename == "pr_person") & \
+                (ktable.record_id == None)
+        self.assertEqual(db(query).count(), 1)
+        S3Msg.NAME_KEYS = {}
+        S3Msg.find_by_name("pr_person", "backfill")
+        self.assertEqual(db(query).count(), 1)
+
+    def testParseMessage(self):
+        """ Test the person search in the parser """
+
+        reply = S3Msg.parse_message("get pfonetik person")
+        self.assertEqual(reply, "Pfonetyk")
+
+    def tearDown(self):
+
+        current.db.rollback()
+        S3Msg.NAME_KEYS = {}
+
+# =============================================================================
+class S3MsgOutboxTests(unittest.TestCase):
+    """ Test the Outbox processing """
+
+    class TestMsg(S3Msg):
+        """ Records the messages instead of sending them """
+
+        def dispatch(self, contact_method, recipient, subject, message,
+                     **attr):
+            self.sent.append((recipient, message))
+            return True
+
+    def setUp(self):
+
+        s3db = current.s3db
+
+        # The Outbox processing commits after each batch
+        db = current.db
+        self.commit = db.commit
+        db.commit = lambda: None
+
+        def add(tablename, **record):
+            table = s3db[tablename]
+            record_id = table.insert(**record)
+            record["id"] = record_id
+            s3db.update_super(table, record)
+            return current.db(table.id == record_id).select(table.id,
+                                                            table.pe_id,
+                                                            limitby=(0, 1)
+                                                            ).first()
+
+        persons = self.persons = [add("pr_person",
+                                      first_name="Outbox",
+                                      last_name="Testperson %s" % i)
+                                  for i in xrange(4)]
+
+        ctable = s3db.pr_contact
+        for i, person in enumerate(persons[:3]):
+            ctable.insert(pe_id=person.pe_id,
+                          contact_method="EMAIL",
+                          value="outbox%s@example.com" % i,
+                          priority=2)
+        ctable.insert(pe_id=persons[0].pe_id,
+                      contact_method="EMAIL",
+                      value="preferred@example.com",
+                      priority=1)
+
+        self.group = add("pr_group", name="Outbox Test Group", group_type=1)
+        mtable = s3db.pr_group_membership
+        for person in persons[:2]:
+            mtable.insert(group_id=self.group.id, person_id=person.id)
+
+        self.organisation = add("org_organisation",
+                                name="Outbox Test Organisation")
+        htable = s3db.hrm_human_resource
+        for person in persons[1:]:
+            htable.insert(organisation_id=self.organisation.id,
+                          person_id=person.id)
+
+    def testExpandOutbox(self):
+        """ Test the expansion of group and organisation recipients """
+
+        db = current.db
+        s3db = current.s3db
+        table = s3db.msg_outbox
+
+        S3Msg.send_by_pe_id([self.group.pe_id, self.organisation.pe_id],
+                            subject="Test",
+                            message="Outbox Test Message")
+        added = S3Msg.expand_outbox("EMAIL")
+
+        # Person 1 is in both the group and the organisation, but
+        # gets the message only once
+        self.assertEqual(added, 4)
+        query = (table.status == 1) & \
+                (table.pe_id.belongs([p.pe_id for p in self.persons]))
+        rows = db(query).select(table.pe_id, table.system_generated)
+        self.assertEqual(sorted([row.pe_id for row in rows]),
+                         sorted([p.pe_id for p in self.persons]))
+        self.assertTrue(all([row.system_generated for row in rows]))
+
+        query = (table.pe_id.belongs((self.group.pe_id,
+                                      self.organisation.pe_id)))
+        rows = db(query).select(table.status)
+        self.assertEqual([row.status for row in rows], [2, 2])
+
+    def testProcessOutbox(self):
+        """ Test sending the messages in batches """
+
+        db = current.db
+        s3db = current.s3db
+        table = s3db.msg_outbox
+
+        msg = self.TestMsg()
+        msg.sent = []
+        msg.OUTBOX_BATCH_SIZE = 2
+
+        S3Msg.send_by_pe_id(self.group.pe_id,
+                            subject="Test",
+                            message="Outbox Test Group Message")
+        S3Msg.send_by_pe_id([p.pe_id for p in self.persons],
+                            subject="Test",
+                            message="Outbox Test Person Message")
+        msg.process_outbox("EMAIL")
+
+        sent = [m for m in msg.sent if m[1].startswith("Outbox Test")]
+        self.assertEqual(sorted(sent),
+                         sorted([("preferred@example.com",
+                                  "Outbox Test Group Message"),
+                                 ("outbox1@example.com",
+                                  "Outbox Test Group Message"),
+                                 ("preferred@example.com",
+                                  "Outbox Test Person Message"),
+                                 ("outbox1@example.com",
+                                  "Outbox Test Person Message"),
+                                 ("outbox2@example.com",
+                                  "Outbox Test Person Message"),
+                                 ]))
+
+        # Person 3 has no email address, so the message stays pending
+        query = (table.status == 1) & \
+                (table.pe_id.belongs([p.pe_id for p in self.persons]))
+        rows = db(query).select(table.pe_id)
+        self.assertEqual([row.pe_id for row in rows],
+                         [self.persons[3].pe_id])
+        self.assertEqual(msg.batch, None)
+
+    def tearDown(self):
+
+        db = current.db
+        db.rollback()
+        db.commit = self.commit
+
+# =============================================================================
+class FakeSMTPServer(smtpd.SMTPServer):
+    """ Local SMTP server which collects the messages """
+
+    def __init__(self):
+
+        smtpd.SMTPServer.__init__(self, ("127.0.0.1", 0), None)
+        self.port = self.socket.getsockname()[1]
+        self.messages = []
+        self.peers = set()
+        self.thread = threading.Thread(target=asyncore.loop,
+                                       kwargs={"timeout": 0.05})
+        self.thread.start()
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+
+        self.peers.add(peer)
+        self.messages.extend(rcpttos)
+
+    def stop(self):
+
+        asyncore.close_all()
+        self.thread.join()
+
+# =============================================================================
+class FakeSMSHandler(BaseHTTPRequestHandler):
+    """
+        SMS Web API, failing the first server.failures requests, and
+        closing the connection without response (server.drop) or after
+        each response (server.close)
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+
+        server = self.server
+        length = int(self.headers["Content-Length"])
+        data = dict([p.split("=", 1) for p in self.rfile.read(length).split("&")])
+        with server.lock:
+            server.requests += 1
+            if server.drop:
+                # Received, but no response
+                server.messages.append(data["to"])
+                self.close_connection = 1
+                return
+            if server.failures:
+                server.failures -= 1
+                status = 500
+            else:
+                server.messages.append(data["to"])
+                server.peers.add(self.client_address)
+                status = 200
+        self.send_response(status)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write("OK")
+        if server.close:
+            # Close the kept-alive connection without telling the client
+            self.close_connection = 1
+
+    def log_message(self, *args):
+        pass
+
+class FakeSMSServer(ThreadingMixIn, HTTPServer):
+    """ Local HTTP server for the FakeSMSHandler """
+
+    daemon_threads = True
+
+    def __init__(self, failures=0):
+
+        HTTPServer.__init__(self, ("127.0.0.1", 0), FakeSMSHandler)
+        self.url = "http://127.0.0.1:%s/sms" % self.server_port
+        self.failures = failures
+        self.drop = False
+        self.close = False
+        self.requests = 0
+        self.messages = []
+        self.peers = set()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.start()
+
+    def stop(self):
+
+        self.shutdown()
+        self.server_close()
+        self.thread.join()
+
+# =============================================================================
+class S3MsgDispatcherTests(unittest.TestCase):
+    """ Test the Outbox dispatcher against local fake gateways """
+
+    def setUp(self):
+
+        db = current.db
+        s3db = current.s3db
+
+        # The dispatcher commits after each batch
+        self.commit = db.commit
+        db.commit = lambda: None
+
+        ptable = s3db.pr_person
+        ctable = s3db.pr_contact
+        self.persons = []
+        for i in xrange(12):
+            person = dict(first_name="Dispatcher",
+                          last_name="Testperson %s" % i)
+            person["id"] = ptable.insert(**person)
+            s3db.update_super(ptable, person)
+            pe_id = db(ptable.id == person["id"]).select(ptable.pe_id,
+                                                         limitby=(0, 1)
+                                                         ).first().pe_id
+            ctable.insert(pe_id=pe_id,
+                          contact_method="EMAIL",
+                          value="dispatcher%s@example.com" % i)
+            ctable.insert(pe_id=pe_id,
+                          contact_method="SMS",
+                          value="555%04d" % i)
+            self.persons.append(pe_id)
+
+        self.settings = current.mail.settings.server
+        self.smtp = FakeSMTPServer()
+        current.mail.settings.server = "127.0.0.1:%s" % self.smtp.port
+        self.api = None
+
+    def testDispatchEmail(self):
+        """ Test sending emails with several threads """
+
+        S3Msg.send_by_pe_id(self.persons,
+                            subject="Test",
+                            message="Dispatcher Test Message")
+        dispatcher = S3MsgDispatcher(workers={"EMAIL": 3}, retries=0)
+        metrics = dispatcher.run(["EMAIL"])
+
+        addresses = ["dispatcher%s@example.com" % i for i in xrange(12)]
+        messages = [m for m in self.smtp.messages if m in addresses]
+        self.assertEqual(sorted(messages), sorted(addresses))
+        # Each thread keeps its connection
+        self.assertTrue(len(self.smtp.peers) <= 3)
+
+        metrics = metrics["EMAIL"]
+        self.assertEqual(metrics["workers"], 3)
+        self.assertTrue(metrics["sent"] >= 12)
+        self.assertEqual(metrics["failed"], 0)
+        self.assertTrue(metrics["throughput"] > 0)
+        self.assertTrue(metrics["latency_max"] >= metrics["latency_avg"])
+
+        table = current.s3db.msg_outbox
+        query = (table.pe_id.belongs(self.persons))
+        rows = current.db(query).select(table.status)
+        self.assertEqual(set([row.status for row in rows]), set([2]))
+
+    def testDispatchSMS(self):
+        """ Test sending SMS via Web API, with retries """
+
+        db = current.db
+        s3db = current.s3db
+
+        self.api = FakeSMSServer(failures=2)
+        table = s3db.msg_setting
+        if not db(table.id > 0).update(outgoing_sms_handler="WEB_API"):
+            table.insert(outgoing_sms_handler="WEB_API")
+        table = s3db.msg_api_settings
+        db(table.enabled == True).update(enabled=False)
+        table.insert(url=self.api.url,
+                     parameters="from=Sahana",
+                     message_variable="text",
+                     to_variable="to",
+                     enabled=True)
+
+        S3Msg.send_by_pe_id(self.persons,
+                            message="Dispatcher Test Message",
+                            pr_message_method="SMS")
+        dispatcher = S3MsgDispatcher(workers={"SMS": 2},
+                                     rate={"SMS": 100},
+                                     retries=2,
+                                     backoff=0.01)
+        metrics = dispatcher.run(["SMS"])
+
+        numbers = [S3Msg.sanitise_phone("555%04d" % i) for i in xrange(12)]
+        messages = [m for m in self.api.messages if m in numbers]
+        self.assertEqual(sorted(messages), sorted(numbers))
+        self.assertTrue(len(self.api.peers) <= 2)
+
+        metrics = metrics["SMS"]
+        self.assertEqual(metrics["retries"], 2)
+        self.assertEqual(metrics["failed"], 0)
+
+    def testClaim(self):
+        """ Test that claimed messages are not sent twice """
+
+        s3db = current.s3db
+        table = s3db.msg_outbox
+
+        S3Msg.send_by_pe_id(self.persons,
+                            subject="Test",
+                            message="Dispatcher Test Message")
+
+        first = S3MsgDispatcher()
+        channel = first.channel("EMAIL", None)
+        jobs = first.claim(channel)
+        claimed = set([job.outbox_id for job in jobs])
+        self.assertTrue(claimed)
+
+        # Another dispatcher doesn't get the claimed messages...
+        second = S3MsgDispatcher()
+        channel = second.channel("EMAIL", None)
+        jobs = second.claim(channel) or []
+        self.assertFalse(claimed & set([job.outbox_id for job in jobs]))
+
+        # ...until the claims have expired
+        third = S3MsgDispatcher(claim_timeout=-1)
+        channel = third.channel("EMAIL", None)
+        jobs = third.claim(channel)
+        self.assertTrue(claimed & set([job.outbox_id for job in jobs]))
+
+    def testTropoHandover(self):
+        """ Test that messages handed over to Tropo are not sent twice """
+
+        db = current.db
+        s3db = current.s3db
+
+        table = s3db.msg_setting
+        if not db(table.id > 0).update(outgoing_sms_handler="TROPO"):
+            table.insert(outgoing_sms_handler="TROPO")
+
+        S3Msg.send_by_pe_id(self.persons,
+                            message="Dispatcher Test Message",
+                            pr_message_method="SMS")
+
+        first = S3MsgDispatcher()
+        channel = first.channel("SMS", None)
+        jobs = first.claim(channel)
+        outbox_ids = [job.outbox_id for job in jobs]
+        self.assertTrue(outbox_ids)
+
+        # Tropo has accepted the requests
+        first.update([(channel, job, True) for job in jobs])
+        table = s3db.msg_outbox
+        rows = db(table.id.belongs(outbox_ids)).select(table.status)
+        self.assertEqual(set([row.status for row in rows]),
+                         set([S3MsgDispatcher.HANDED_OVER]))
+
+        # Not claimed again, even after the claim would have expired
+        second = S3MsgDispatcher(claim_timeout=-1)
+        channel = second.channel("SMS", None)
+        jobs = second.claim(channel) or []
+        self.assertFalse(set(outbox_ids) & set([job.outbox_id for job in jobs]))
+
+    def tearDown(self):
+
+        db = current.db
+        db.rollback()
+        db.commit = self.commit
+
+        self.smtp.stop()
+        current.mail.settings.server = self.settings
+        if self.api:
+            self.api.stop()
+
+# =============================================================================
+class S3HTTPSessionTests(unittest.TestCase):
+    """ Test the retries of the persistent HTTP connections """
+
+    def setUp(self):
+
+        self.api = FakeSMSServer()
+
+    def testUnconfirmed(self):
+        """ Test that a POST is not repeated once it has been sent """
+
+        from s3.s3msg import S3HTTPSession, S3MsgUnconfirmed
+
+        api = self.api
+        api.drop = True
+        session = S3HTTPSession()
+        try:
+            self.assertRaises(S3MsgUnconfirmed,
+                              session.request, api.url, "to=5550001")
+        finally:
+            session.close()
+        self.assertEqual(api.requests, 1)
+
+    def testStaleConnection(self):
+        """ Test reconnecting if the server has closed the connection """
+
+        import time
+        from s3.s3msg import S3HTTPSession
+
+        api = self.api
+        api.close = True
+        session = S3HTTPSession()
+        try:
+            status, body = session.request(api.url, "to=5550001")
+            self.assertEqual(status, 200)
+            # Let the server close the connection
+            time.sleep(0.2)
+            status, body = session.request(api.url, "to=5550002")
+            self.assertEqual(status, 200)
+        finally:
+            session.close()
+        self.assertEqual(api.messages, ["5550001", "5550002"])
+
+    def tearDown(self):
+
+        self.api.stop()
+
+# =============================================================================
+def run_suite(*test_classes):
+    """ Run the test suite """
+
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite()
+    for test_class in test_classes:
+        tests = loader.loadTestsFromTestCase(test_class)
+        suite.addTests(tests)
+    if suite is not None:
+        unittest.TextTestRunner(verbosity=2).run(suite)
+    return
+
+if __name__ == "__main__":
+
+    run_suite(
+        S3MsgNameKeyTests,
+        S3MsgOutboxTests,
+        S3MsgDispatcherTests,
+        S3HTTPSessionTests,
+    )
+
+# END ========================================================================
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+#
+# Report Unit Tests
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/tests/unit_tests/modules/s3/s3report.py
+#
+import unittest
+
+from s3.s3report import S3PivotTable, S3Report
+
+# =============================================================================
+class S3PivotTableTests(unittest.TestCase):
+
+    NONE = S3PivotTable.NONE
+
+    ITEMS = [{"id": 1, "type": "A", "status": 1},
+             {"id": 2, "type": "A", "status": 2},
+             {"id": 3, "type": "B", "status": 1},
+             # list:type value expanded into two items
+             {"id": 4, "type": "B", "status": 1},
+             {"id": 4, "type": "C", "status": 1},
+             {"id": 5, "type": NONE, "status": 2},
+             # duplicate item
+             {"id": 1, "type": "A", "status": 1}]
+
+    VALUES = {1: 10, 2: 20, 3: 5, 4: 7, 5: None}
+
+    def setUp(self):
+
+        self.pt = S3PivotTable(self.ITEMS, "id", rows="type", cols="status")
+
+    def testGroups(self):
+
+        pt = self.pt
+        self.assertEqual(pt.rvalues, ["A", "B", "C", self.NONE])
+        self.assertEqual(pt.cvalues, [1, 2])
+        self.assertEqual(pt.numrows, 4)
+        self.assertEqual(pt.numcols, 2)
+
+        cells = pt.cells
+        self.assertEqual(cells[0], [[1], [2]])
+        self.assertEqual(cells[1], [[3, 4], []])
+        self.assertEqual(cells[2], [[4], []])
+        self.assertEqual(cells[3], [[], [5]])
+
+        self.assertEqual(pt.row_records(1), [3, 4])
+        self.assertEqual(pt.col_records(0), [1, 3, 4, 4])
+
+    def testSingleRow(self):
+
+        pt = S3PivotTable(self.ITEMS, "id", cols="status")
+        self.assertEqual(pt.rvalues, [None])
+        self.assertEqual(pt.cvalues, [1, 2])
+        self.assertEqual(sorted(pt.cells[0][0]), [1, 3, 4])
+
+    def testSum(self):
+
+        cells, rows, cols, total = self.pt.aggregate(self.VALUES, "sum")
+        self.assertEqual(cells[1], [12, 0])
+        self.assertEqual(rows, [30, 12, 7, 0])
+        self.assertEqual(cols, [29, 20])
+        self.assertEqual(total, 49)
+
+    def testAvg(self):
+
+        cells, rows, cols, total = self.pt.aggregate(self.VALUES, "avg")
+        self.assertEqual(cells[3], [0.0, 0.0])
+        self.assertEqual(cells[1], [6.0, 0.0])
+        self.assertEqual(rows[0], 15.0)
+        self.assertEqual(total, 49 / 5.0)
+
+    def testMinMax(self):
+
+        cells, rows, cols, total = self.pt.aggregate(self.VALUES, "min")
+        self.assertEqual(cells[3], [None, None])
+        self.assertEqual(rows, [10, 5, 7, None])
+        self.assertEqual(total, 5)
+
+        cells, rows, cols, total = self.pt.aggregate(self.VALUES, "max")
+        self.assertEqual(cols, [10, 20])
+        self.assertEqual(total, 20)
+
+    def testCountAndList(self):
+
+        values = {1: "x", 2: "x", 3: "y", 4: "y", 5: "z"}
+        cells, rows, cols, total = self.pt.aggregate(values, "count")
+        # Distinct values per cell
+        self.assertEqual(cells[1], [1, 0])
+        self.assertEqual(rows, [2, 1, 1, 1])
+        self.assertEqual(total, 5)
+
+        cells, rows, cols, total = self.pt.aggregate(values, "list")
+        self.assertEqual(cells[1], [["y"], None])
+        self.assertEqual(sorted(rows[0]), ["x", "x"])
+        self.assertEqual(len(total), 5)
+
+    def testNonNumeric(self):
+
+        values = {1: "x", 2: "y", 3: "z", 4: "z", 5: None}
+        cells, rows, cols, total = self.pt.aggregate(values, "sum")
+        self.assertEqual(cells[0], [None, None])
+        self.assertEqual(total, None)
+
+# =============================================================================
+class S3ReportSQLTests(unittest.TestCase):
+    """ Tests for the GROUP BY query path of S3Report """
+
+    class InMemoryReport(S3Report):
+        """ Report which never aggregates in the database """
+
+        def _sql_report(self):
+            return False
+
+    LAYERS = [("id", "count"), ("type", "sum"), ("type", "avg"),
+              ("type", "min"), ("type", "max")]
+
+    def setUp(self):
+
+        auth.override = True
+
+    def testSQLField(self):
+
+        resource = s3mgr.define_resource("org", "office")
+        report = S3Report(resource, "organisation_id", "type", self.LAYERS)
+        sql_field = report._sql_field
+
+        self.assertNotEqual(sql_field("type", method="sum"), None)
+        self.assertNotEqual(sql_field("organisation_id"), None)
+        # No sum of strings
+        self.assertEqual(sql_field("name", method="sum"), None)
+        # Not in the report fields
+        self.assertEqual(sql_field("nonexistent"), None)
+
+    def testSameResults(self):
+
+        rows, cols = "organisation_id", "type"
+        resource = s3mgr.define_resource("org", "office")
+        sql = S3Report(resource, rows, cols, self.LAYERS)
+        resource = s3mgr.define_resource("org", "office")
+        python = self.InMemoryReport(resource, rows, cols, self.LAYERS)
+
+        # Aggregated in the database
+        self.assertEqual(sql.records, None)
+        self.assertEqual(sql.empty, python.empty)
+        if sql.empty:
+            return
+        self.assertEqual(len(sql), len(python))
+        self.assertEqual([r.value for r in sql.row],
+                         [r.value for r in python.row])
+        self.assertEqual([c.value for c in sql.col],
+                         [c.value for c in python.col])
+        for layer in self.LAYERS:
+            self.assertEqual(sql.totals[layer], python.totals[layer])
+            for i in xrange(sql.numrows):
+                self.assertEqual(sql.row[i][layer], python.row[i][layer])
+                for j in xrange(sql.numcols):
+                    self.assertEqual(sql.cell[i][j][layer],
+                                     python.cell[i][j][layer])
+
+    def tearDown(self):
+
+        auth.override = False
+
+# =============================================================================
+def run_suite(*test_classes):
+    """ Run the test suite """
+
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite()
+    for test_class in test_classes:
+        tests = loader.loadTestsFromTestCase(test_class)
+        suite.addTests(tests)
+    if suite is not None:
+        unittest.TextTestRunner(verbosity=2).run(suite)
+    return
+
+if __name__ == "__main__":
+
+    run_suite(
+        S3PivotTableTests,
+        S3ReportSQLTests,
+    )
+
+# END ========================================================================
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+#
+# Pivot Table Benchmarks
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/tests/unit_tests/modules/s3/s3report_benchmark.py
+#
+# Compares the S3PivotTable engine with the former pyvttbl DataFrame
+# based implementation of S3Report, using generated report items (no
+# database access).
+#
+import random
+import time
+
+from s3.s3report import NUMPY, S3PivotTable, S3Report
+
+# =============================================================================
+class S3PivotBenchmark(object):
+    """ Measures how pivoting and aggregation scale with the items """
+
+    def __init__(self, sizes=(1000, 2500, 5000, 10000, 50000),
+                 rows=20, cols=10, legacy_limit=10000):
+        """
+            Constructor
+
+            @param sizes: numbers of records to report on
+            @param rows: number of distinct rows values
+            @param cols: number of distinct columns values
+            @param legacy_limit: maximum number of records to run the
+                                 legacy implementation for (it is O(n²))
+        """
+
+        self.sizes = sizes
+        self.rows = rows
+        self.cols = cols
+        self.legacy_limit = legacy_limit
+
+    # -------------------------------------------------------------------------
+    def items(self, size):
+        """
+            Generate report items and fact values
+
+            @param size: the number of records
+            @returns: tuple (items, values)
+        """
+
+        rows = ["Row %s" % i for i in xrange(self.rows)]
+        cols = ["Col %s" % i for i in xrange(self.cols)]
+        rows.append(S3PivotTable.NONE)
+
+        random.seed(size)
+        choice = random.choice
+        items = []
+        values = {}
+        for i in xrange(size):
+            # Some records have a list:type rows value
+            for j in xrange(i % 7 and 1 or 2):
+                items.append({"id": i, "row": choice(rows), "col": choice(cols)})
+            values[i] = random.randint(0, 1000)
+        return items, values
+
+    # -------------------------------------------------------------------------
+    def legacy(self, items, values, method):
+        """
+            The former implementation: pyvttbl pivot, then aggregate
+            the values cell by cell
+
+            @param items: the report items
+            @param values: the fact values {id: value}
+            @param method: the aggregation method
+        """
+
+        from s3.pyvttbl import DataFrame
+
+        df = DataFrame()
+        item_list = []
+        for i in items:
+            if i not in item_list:
+                item_list.append(i)
+                df.insert(i)
+        pt = df.pivot("id", ["row"], ["col"], aggregate="tolist")
+
+        aggregate = S3Report._aggregate
+        for r in xrange(len(pt.rnames)):
+            for c in xrange(len(pt.cnames)):
+                ids = [i for i in pt[r][c] if i is not None]
+                cell_values = [values[i] for i in ids]
+                aggregate(cell_values, method)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def engine(items, values, method):
+        """
+            The S3PivotTable engine
+
+            @param items: the report items
+            @param values: the fact values {id: value}
+            @param method: the aggregation method
+        """
+
+        pt = S3PivotTable(items, "id", rows="row", cols="col")
+        pt.aggregate(values, method)
+
+    # -------------------------------------------------------------------------
+    def run(self, method="sum"):
+        """
+            Run the benchmark for all sizes
+
+            @param method: the aggregation method
+        """
+
+        print "%8s %8s %12s %12s" % ("records", "items", "legacy (s)",
+                                     "engine (s)")
+        for size in self.sizes:
+            items, values = self.items(size)
+
+            if size <= self.legacy_limit:
+                start = time.time()
+                self.legacy(items, values, method)
+                legacy = "%12.3f" % (time.time() - start)
+            else:
+                legacy = "%12s" % "-"
+
+            start = time.time()
+            self.engine(items, values, method)
+            engine = time.time() - start
+
+            print "%8s %8s %s %12.3f" % (size, len(items), legacy, engine)
+
+# =============================================================================
+if __name__ == "__main__":
+
+    benchmark = S3PivotBenchmark()
+
+    print "Pivot with sum layer (NumPy %s):" % (NUMPY and "on" or "off")
+    benchmark.run(method="sum")
+
+# END ========================================================================
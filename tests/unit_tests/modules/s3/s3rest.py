@@ -714,6 +714,106 @@ class S3ResourceFilterTests(unittest.TestCase):
     def tearDown(self):
         auth.s3_impersonate(None)
 
+# =============================================================================
+class S3ExportTests(unittest.TestCase):
+
+    def setUp(self):
+        auth.s3_impersonate("admin@example.com")
+
+    def testReferenceLookup(self):
+
+        xml = s3mgr.xml
+
+        resource = s3mgr.define_resource("org", "office")
+        table = resource.table
+        rfields, dfields = resource.split_fields()
+        rows = resource.load(limit=20)
+
+        # Pre-fetched references must give the same reference map
+        lookup = xml.lookup(table, rows, rfields)
+        self.assertTrue(isinstance(lookup, dict))
+        for row in rows:
+            rmap = xml.rmap(table, row, rfields)
+            lmap = xml.rmap(table, row, rfields, lookup=lookup)
+            self.assertEqual(len(rmap), len(lmap))
+            for i in xrange(len(rmap)):
+                self.assertEqual(rmap[i], lmap[i])
+
+    def testReferenceLookupEmpty(self):
+
+        xml = s3mgr.xml
+
+        resource = s3mgr.define_resource("org", "office")
+        rfields, dfields = resource.split_fields()
+        self.assertEqual(xml.lookup(resource.table, [], rfields), {})
+
+    def testExportStream(self):
+
+        from lxml import etree
+
+        # Same records as the element tree export, in pages
+        resource = s3mgr.define_resource("org", "office")
+        tree = resource.export_tree(start=0, limit=10, dereference=True)
+        resource = s3mgr.define_resource("org", "office")
+        output = "".join(resource.export_stream(start=0, limit=10,
+                                                page_size=3))
+        root = etree.fromstring(output)
+        self.assertEqual(root.tag, tree.getroot().tag)
+
+        elements = lambda root: sorted((e.get("name"), e.get("uuid"))
+                                       for e in root)
+        self.assertEqual(elements(root), elements(tree.getroot()))
+
+    def testExportStreamJSON(self):
+
+        import gluon.contrib.simplejson as json
+
+        resource = s3mgr.define_resource("org", "office")
+        output = "".join(resource.export_stream(start=0, limit=10,
+                                                dereference=False,
+                                                as_json=True,
+                                                page_size=3))
+        data = json.loads(output)
+        self.assertTrue("@success" in data)
+        count = resource.count()
+        if count:
+            self.assertEqual(len(data["$_org_office"]), min(count, 10))
+
+    def testExportStreamComponentFilter(self):
+
+        from lxml import etree
+
+        ptable = s3db.pr_person
+        ctable = s3db.pr_contact
+        try:
+            person = dict(first_name="Export", last_name="Streamtest")
+            person["id"] = ptable.insert(**person)
+            s3db.update_super(ptable, person)
+            pe_id = ptable[person["id"]].pe_id
+            contacts = [ctable.insert(pe_id=pe_id,
+                                      contact_method="EMAIL",
+                                      value="stream%s@example.com" % i)
+                        for i in xrange(3)]
+
+            # Like /pr/person/<id>/contact/<id>.xml
+            resource = s3mgr.define_resource("pr", "person",
+                                             id=person["id"],
+                                             components=["contact"],
+                                             vars={"contact.id": contacts[1]})
+            output = "".join(resource.export_stream(dereference=False,
+                                                    mcomponents=["pr_contact"],
+                                                    page_size=1))
+            root = etree.fromstring(output)
+            values = [e.text for e in root.xpath(
+                        "resource[@name='pr_person']/"
+                        "resource[@name='pr_contact']/data[@field='value']")]
+            self.assertEqual(values, ["stream1@example.com"])
+        finally:
+            db.rollback()
+
+    def tearDown(self):
+        auth.s3_impersonate(None)
+
 # =============================================================================
 def run_suite(*test_classes):
     """ Run the test suite """
@@ -732,6 +832,7 @@ if __name__ == "__main__":
     run_suite(
         S3ResourceTests,
         S3ResourceFilterTests,
+        S3ExportTests,
     )
 
 # END ========================================================================
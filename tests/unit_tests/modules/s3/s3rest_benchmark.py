@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+#
+# XML Export Benchmarks
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/tests/unit_tests/modules/s3/s3rest_benchmark.py
+#
+# All test records are created inside the current transaction and
+# rolled back at the end, so this can be run against a live database.
+#
+import time
+import uuid
+
+from gluon.storage import Storage
+
+# =============================================================================
+class S3ExportBenchmark(object):
+    """ Measures how export_tree scales with records and references """
+
+    # The master resource
+    prefix = "org"
+    name = "office"
+
+    def __init__(self, sizes=(250, 500, 1000, 2000), locations=50):
+        """
+            Constructor
+
+            @param sizes: numbers of master records to export
+            @param locations: number of distinct gis_location records
+                              shared by all master records
+        """
+
+        self.sizes = sizes
+        self.locations = locations
+
+    # -------------------------------------------------------------------------
+    def populate(self, size):
+        """
+            Create the test records
+
+            @param size: the number of org_office records to create
+            @returns: list of the org_office record IDs
+        """
+
+        ltable = s3db.gis_location
+        otable = s3db.org_organisation
+        ftable = s3db.org_office
+
+        prefix = "BENCHMARK-%s" % uuid.uuid4()
+
+        location_ids = [ltable.insert(name="%s-L%s" % (prefix, i),
+                                      lat=float(i % 90),
+                                      lon=float(i % 180))
+                        for i in xrange(self.locations)]
+        organisation_id = otable.insert(name="%s-O" % prefix)
+
+        num_locations = len(location_ids)
+        office_ids = [ftable.insert(name="%s-F%s" % (prefix, i),
+                                    organisation_id=organisation_id,
+                                    location_id=location_ids[i % num_locations])
+                      for i in xrange(size)]
+        return office_ids
+
+    # -------------------------------------------------------------------------
+    def export(self, ids, mcomponents=[]):
+        """
+            Export the records and measure time and number of queries
+
+            @param ids: the master record IDs
+            @param mcomponents: the components to include (None for none)
+            @returns: tuple (seconds, number of queries, elements)
+        """
+
+        timings = getattr(db, "_timings", None)
+        queries = len(timings) if timings is not None else 0
+
+        resource = s3mgr.define_resource(self.prefix, self.name, id=ids)
+        start = time.time()
+        tree = resource.export_tree(mcomponents=mcomponents,
+                                    dereference=True)
+        duration = time.time() - start
+
+        if timings is not None:
+            queries = len(timings) - queries
+        else:
+            queries = None
+        elements = len(tree.getroot())
+        return duration, queries, elements
+
+    # -------------------------------------------------------------------------
+    def run(self, mcomponents=[]):
+        """
+            Run the benchmark for all sizes
+
+            @param mcomponents: the components to include (None for none)
+        """
+
+        auth.override = True
+        print "%8s %8s %10s %10s %12s" % ("records", "elements",
+                                          "seconds", "queries",
+                                          "ms/record")
+        try:
+            for size in self.sizes:
+                ids = self.populate(size)
+                duration, queries, elements = self.export(ids, mcomponents)
+                print "%8s %8s %10.3f %10s %12.3f" % \
+                      (size, elements, duration, queries,
+                       1000.0 * duration / size)
+                db.rollback()
+        finally:
+            db.rollback()
+            auth.override = False
+
+# =============================================================================
+class S3ComponentExportBenchmark(S3ExportBenchmark):
+    """ Measures how export_tree scales with component records """
+
+    prefix = "pr"
+    name = "person"
+
+    def __init__(self, sizes=(250, 500, 1000, 2000), components=3):
+        """
+            Constructor
+
+            @param sizes: numbers of master records to export
+            @param components: number of records per component
+                               and master record
+        """
+
+        self.sizes = sizes
+        self.components = components
+
+    # -------------------------------------------------------------------------
+    def populate(self, size):
+        """
+            Create the test records
+
+            @param size: the number of pr_person records to create
+            @returns: list of the pr_person record IDs
+        """
+
+        ptable = s3db.pr_person
+        ctable = s3db.pr_contact
+        atable = s3db.pr_address
+        itable = s3db.pr_identity
+        update_super = s3mgr.model.update_super
+
+        prefix = "BENCHMARK-%s" % uuid.uuid4()
+
+        person_ids = []
+        for i in xrange(size):
+            person_id = ptable.insert(first_name="%s-P%s" % (prefix, i))
+            update_super(ptable, Storage(id=person_id))
+            pe_id = s3db.pr_get_pe_id(ptable, person_id)
+            for j in xrange(self.components):
+                ctable.insert(pe_id=pe_id,
+                              contact_method="EMAIL",
+                              value="%s-%s@example.com" % (i, j))
+                atable.insert(pe_id=pe_id,
+                              address="%s-A%s-%s" % (prefix, i, j))
+                itable.insert(person_id=person_id,
+                              value="%s-I%s-%s" % (prefix, i, j))
+            person_ids.append(person_id)
+        return person_ids
+
+# =============================================================================
+if __name__ == "__main__":
+
+    benchmark = S3ExportBenchmark()
+
+    print "org_office with shared gis_location references:"
+    benchmark.run(mcomponents=None)
+
+    benchmark = S3ComponentExportBenchmark()
+
+    print
+    print "pr_person with contacts, addresses and identities:"
+    benchmark.run(mcomponents=["contact", "address", "identity"])
+
+# END ========================================================================
@@ -6,7 +6,8 @@
 import unittest
 
 from gluon import current
-from s3.s3search import S3SearchSimpleWidget, S3SearchOptionsWidget
+from s3.s3search import S3SearchSimpleWidget, S3SearchOptionsWidget, \
+                        S3NameIndex
 
 # =============================================================================
 class TestS3SearchSimpleWidget(unittest.TestCase):
@@ -82,7 +83,105 @@ class TestS3SearchOptionsWidget(unittest.TestCase):
                                    _id="None_human_resource_search_select_virtual_field",
                                    _name="human_resource_search_select_virtual_field")))
 
+# =============================================================================
+class TestS3NameIndex(unittest.TestCase):
+    """
+        Test the S3NameIndex for autocompletes
+    """
+
+    def setUp(self):
 
+        table = current.s3db.gis_location
+        self.l0 = table.insert(name="Test Index Country", level="L0")
+        self.l1 = table.insert(name="Test Index Province", level="L1",
+                               parent=self.l0)
+        self.l2 = table.insert(name="Tes District", level="L2",
+                               parent=self.l1)
+        self.index = S3NameIndex("gis_location")
+        self.index.sync()
+
+    def testLookup(self):
+        """ Test prefix lookup """
+
+        index = self.index
+        ids = (self.l0, self.l1, self.l2)
+
+        result = [i for i in index.lookup("test index") if i in ids]
+        self.assertEqual(set(result), set([self.l0, self.l1]))
+
+        # Shorter than the n-gram
+        result = [i for i in index.lookup("te") if i in ids]
+        self.assertEqual(set(result), set(ids))
+
+        # Case-insensitive, prefix only
+        result = [i for i in index.lookup("TEST INDEX P") if i in ids]
+        self.assertEqual(result, [self.l1])
+        self.assertFalse(self.l1 in index.lookup("province"))
+
+    def testFilter(self):
+        """ Test attribute filters and descendants """
+
+        index = self.index
+
+        result = index.filter(index.lookup("tes"), "level", ["L1", "L2"])
+        self.assertTrue(self.l1 in result and self.l2 in result)
+        self.assertFalse(self.l0 in result)
+
+        result = index.descendants(self.l0)
+        self.assertEqual(set(result), set([self.l1, self.l2]))
+        result = index.filter(result, "name", "district", contains=True)
+        self.assertEqual(result, [self.l2])
+
+    def testUpdate(self):
+        """ Test index update """
+
+        index = self.index
+        table = current.s3db.gis_location
+        table[self.l2] = dict(name="Test Index Renamed")
+        index.load(table.id == self.l2)
+        self.assertTrue(self.l2 in index.lookup("test index ren"))
+        self.assertFalse(self.l2 in index.lookup("tes dis"))
+
+        table[self.l2] = dict(deleted=True)
+        index.load(table.id == self.l2)
+        self.assertFalse(self.l2 in index.lookup("tes"))
+        self.assertFalse(self.l2 in index.descendants(self.l0))
+
+    def testConcurrentUpdate(self):
+        """ Test lookups while the index gets updated by another request """
+
+        import threading
+
+        index = self.index
+        table = current.s3db.gis_location
+        errors = []
+        done = threading.Event()
+
+        def lookup():
+            try:
+                while not done.is_set():
+                    index.lookup("te")
+                    index.descendants(self.l0)
+            except Exception, e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=lookup) for i in xrange(4)]
+        for thread in threads:
+            thread.start()
+        try:
+            for i in xrange(200):
+                table[self.l2] = dict(name="Test Index %s" % i,
+                                      deleted=bool(i % 2))
+                index.load(table.id == self.l2)
+        finally:
+            done.set()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(errors, [])
+
+    def tearDown(self):
+
+        current.db.rollback()
 
 # =============================================================================
 def run_suite(*test_classes):
@@ -102,6 +201,7 @@ if __name__ == "__main__":
     run_suite(
         TestS3SearchSimpleWidget,
         TestS3SearchOptionsWidget,
+        TestS3NameIndex,
     )
 
 # END ========================================================================
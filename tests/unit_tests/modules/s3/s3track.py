@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+#
+# Location Tracking Unit Tests
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/tests/unit_tests/modules/s3/s3track.py
+#
+import datetime
+import unittest
+
+from gluon import current
+
+from s3.s3track import S3Trackable
+
+# =============================================================================
+class S3TrackableGetLocationTests(unittest.TestCase):
+
+    def setUp(self):
+
+        s3db = current.s3db
+
+        ltable = s3db.gis_location
+        self.locations = [ltable.insert(name="Test Track Location %s" % i,
+                                        lat=float(i), lon=float(i))
+                          for i in xrange(4)]
+
+        table = s3db.asset_asset
+        self.assets = []
+        for i in xrange(4):
+            asset_id = table.insert(number="TEST-TRACK-%s" % i,
+                                    location_id=self.locations[0])
+            s3db.update_super(table, dict(id=asset_id))
+            self.assets.append(asset_id)
+
+    def testGetLocation(self):
+
+        s3db = current.s3db
+        ids = self.assets
+        locations = self.locations
+        now = datetime.datetime.utcnow()
+        before = now - datetime.timedelta(hours=1)
+        later = now + datetime.timedelta(minutes=1)
+
+        # Asset 1 has an old and a new presence
+        S3Trackable("asset_asset", ids[1]).set_location(locations[2],
+                                                        timestmp=before)
+        S3Trackable("asset_asset", ids[1]).set_location(locations[1],
+                                                        timestmp=now)
+        # Asset 2 is checked-in to asset 1
+        S3Trackable("asset_asset", ids[2]).check_in("asset_asset", ids[1],
+                                                    timestmp=now)
+        # Asset 0 and 3 are checked-in to each other
+        table = s3db.asset_asset
+        table[ids[3]] = dict(location_id=locations[3])
+        S3Trackable("asset_asset", ids[0]).check_in("asset_asset", ids[3],
+                                                    timestmp=now)
+        S3Trackable("asset_asset", ids[3]).check_in("asset_asset", ids[0],
+                                                    timestmp=later)
+
+        # Circular check-ins resolve to the base location of the last
+        # instance before the loop
+        expected = {ids[0]: locations[3],
+                    ids[1]: locations[1],
+                    ids[2]: locations[1],
+                    ids[3]: locations[0]}
+        rows = current.db(table.id.belongs(ids)).select(table.id,
+                                                        table.track_id)
+        expected = dict([(row.track_id, expected[row.id]) for row in rows])
+
+        gtable = s3db.gis_location
+        tracker = S3Trackable("asset_asset", ids)
+        result = tracker.get_location(timestmp=later,
+                                      _fields=[gtable.id],
+                                      as_rows=True)
+        self.assertEqual(len(result), len(ids))
+        # Same order as the records
+        for record, location in zip(tracker.records, result):
+            self.assertEqual(location.id, expected[record.track_id])
+
+        # Presence before the latest one
+        location = S3Trackable("asset_asset", ids[1]).get_location(
+                        timestmp=before + datetime.timedelta(minutes=1))
+        self.assertEqual(location.id, locations[2])
+
+    def testGetBaseLocation(self):
+
+        tracker = S3Trackable("asset_asset", self.assets)
+        result = tracker.get_base_location(as_rows=True)
+        self.assertEqual(len(result), len(self.assets))
+        for location in result:
+            self.assertEqual(location.id, self.locations[0])
+
+    def tearDown(self):
+
+        current.db.rollback()
+
+# =============================================================================
+def run_suite(*test_classes):
+    """ Run the test suite """
+
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite()
+    for test_class in test_classes:
+        tests = loader.loadTestsFromTestCase(test_class)
+        suite.addTests(tests)
+    if suite is not None:
+        unittest.TextTestRunner(verbosity=2).run(suite)
+    return
+
+if __name__ == "__main__":
+
+    run_suite(
+        S3TrackableGetLocationTests,
+    )
+
+# END ========================================================================
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+#
+# S3XML Unit Tests
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/tests/unit_tests/modules/s3/s3xml.py
+#
+import os
+import tempfile
+import unittest
+
+from lxml import etree
+
+import gluon.contrib.simplejson as json
+
+from s3.s3xml import S3XMLWriter, S3XSLTCache
+
+# =============================================================================
+class S3XSLTCacheTests(unittest.TestCase):
+
+    STYLESHEET = """<?xml version="1.0"?>
+<xsl:stylesheet version="1.0" xmlns:xsl="http://www.w3.org/1999/XSL/Transform">
+    <xsl:template match="/">
+        <result><xsl:value-of select="'%s'"/></result>
+    </xsl:template>
+</xsl:stylesheet>"""
+
+    def setUp(self):
+
+        fd, self.path = tempfile.mkstemp(suffix=".xsl")
+        os.close(fd)
+        self.write("first")
+        self.cache = S3XSLTCache(size=2)
+
+    def write(self, text):
+
+        f = open(self.path, "w")
+        f.write(self.STYLESHEET % text)
+        f.close()
+
+    def testHitsAndMisses(self):
+
+        cache = self.cache
+
+        self.assertEqual(cache.get(self.path), None)
+        transformer = etree.XSLT(etree.parse(self.path))
+        cache.store(self.path, transformer)
+        self.assertTrue(cache.get(self.path) is transformer)
+
+        stats = cache.stats()
+        self.assertEqual(stats.hits, 1)
+        self.assertEqual(stats.misses, 1)
+        self.assertEqual(stats.size, 1)
+
+    def testInvalidateOnModification(self):
+
+        cache = self.cache
+        transformer = etree.XSLT(etree.parse(self.path))
+        cache.store(self.path, transformer)
+
+        # Make sure the mtime changes
+        mtime = os.path.getmtime(self.path) + 10
+        self.write("second")
+        os.utime(self.path, (mtime, mtime))
+        self.assertEqual(cache.get(self.path), None)
+
+    def testSizeLimit(self):
+
+        cache = self.cache
+        transformer = etree.XSLT(etree.parse(self.path))
+
+        paths = []
+        for i in xrange(3):
+            fd, path = tempfile.mkstemp(suffix=".xsl")
+            os.close(fd)
+            paths.append(path)
+            cache.store(path, transformer)
+        try:
+            self.assertEqual(cache.stats().size, 2)
+            # Least recently used one has been dropped
+            self.assertEqual(cache.get(paths[0]), None)
+            self.assertTrue(cache.get(paths[2]) is transformer)
+        finally:
+            for path in paths:
+                os.remove(path)
+
+    def testTransformUsesCache(self):
+
+        xml = s3mgr.xml
+        cache = xml.xslt_cache
+        cache.clear()
+
+        tree = etree.ElementTree(etree.Element("test"))
+        result = xml.transform(tree, self.path)
+        self.assertEqual(result.getroot().text, "first")
+        result = xml.transform(tree, self.path)
+        self.assertEqual(result.getroot().text, "first")
+        stats = cache.stats()
+        self.assertEqual(stats.hits, 1)
+        self.assertEqual(stats.misses, 1)
+
+        # Modified stylesheet gets recompiled
+        mtime = os.path.getmtime(self.path) + 10
+        self.write("second")
+        os.utime(self.path, (mtime, mtime))
+        result = xml.transform(tree, self.path)
+        self.assertEqual(result.getroot().text, "second")
+
+    def tearDown(self):
+
+        os.remove(self.path)
+        s3mgr.xml.xslt_cache.clear()
+
+# =============================================================================
+class S3XMLWriterTests(unittest.TestCase):
+
+    def setUp(self):
+
+        xml = s3mgr.xml
+        root = etree.Element(xml.TAG.root)
+        root.set(xml.ATTRIBUTE.success, "true")
+        self.root = root
+
+    def resources(self, *names):
+
+        xml = s3mgr.xml
+        elements = []
+        for name in names:
+            element = etree.Element(xml.TAG.resource)
+            element.set(xml.ATTRIBUTE.name, name)
+            data = etree.SubElement(element, xml.TAG.data)
+            data.set(xml.ATTRIBUTE.field, "name")
+            data.text = name
+            elements.append(element)
+        return elements
+
+    def testXML(self):
+
+        writer = S3XMLWriter(self.root)
+        output = [writer.head()]
+        output.append(writer.write(self.resources("org_office")))
+        output.append(writer.write(self.resources("gis_location",
+                                                  "org_office")))
+        output.extend(writer.tail())
+
+        root = etree.fromstring("".join(output))
+        self.assertEqual(root.tag, s3mgr.xml.TAG.root)
+        self.assertEqual(root.get(s3mgr.xml.ATTRIBUTE.success), "true")
+        self.assertEqual(len(root), 3)
+
+    def testJSON(self):
+
+        writer = S3XMLWriter(self.root, as_json=True)
+        output = [writer.head()]
+        output.append(writer.write(self.resources("org_office")))
+        output.append(writer.write(self.resources("gis_location",
+                                                  "org_office",
+                                                  "gis_location",
+                                                  "org_organisation")))
+        output.extend(writer.tail())
+
+        data = json.loads("".join(output))
+        self.assertEqual(len(data["$_org_office"]), 2)
+        self.assertEqual(len(data["$_gis_location"]), 2)
+        self.assertEqual(len(data["$_org_organisation"]), 1)
+        self.assertEqual(data["@success"], "true")
+
+        # Same representation as tree2json
+        tree = etree.ElementTree(self.root)
+        self.root.extend(self.resources("org_office"))
+        expected = json.loads(s3mgr.xml.tree2json(tree))
+        self.assertEqual(data["$_org_office"][0],
+                         expected["$_org_office"][0])
+
+    def testJSONEmpty(self):
+
+        writer = S3XMLWriter(self.root, as_json=True)
+        output = [writer.head()]
+        output.extend(writer.tail())
+
+        data = json.loads("".join(output))
+        self.assertEqual(data["@success"], "false")
+
+# =============================================================================
+def run_suite(*test_classes):
+    """ Run the test suite """
+
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite()
+    for test_class in test_classes:
+        tests = loader.loadTestsFromTestCase(test_class)
+        suite.addTests(tests)
+    if suite is not None:
+        unittest.TextTestRunner(verbosity=2).run(suite)
+    return
+
+if __name__ == "__main__":
+
+    run_suite(
+        S3XSLTCacheTests,
+        S3XMLWriterTests,
+    )
+
+# END ========================================================================